@@ -1,21 +1,25 @@
 import cmd
+import sys
 from .src.core.database import SimpleDB
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 class LikObShell(cmd.Cmd):
     intro = 'Welcome to LikOb Database Shell. Type help or ? to list commands.\n'
     prompt = 'LikOb> '
 
-    def __init__(self):
+    def __init__(self, path: Optional[str] = None):
         super().__init__()
+        self.path = path
         try:
-            self.db = SimpleDB()
+            self.db = SimpleDB(path)
         except Exception as e:
             print(f"初始化数据库失败: {str(e)}")
             self.db = None
 
     def do_exit(self, arg):
         """退出程序"""
+        if self.db:
+            self.db.close()
         print("\nGoodbye!")
         return True
 
@@ -30,7 +34,7 @@ class LikObShell(cmd.Cmd):
 
         try:
             if not self.db:
-                self.db = SimpleDB()
+                self.db = SimpleDB(self.path)
             
             result = self.db.execute(line)
             if result is not None:
@@ -133,8 +137,10 @@ class LikObShell(cmd.Cmd):
             print(f"错误: {str(e)}")
 
 def main():
+    # 可选参数: 数据目录，不指定时使用内存数据库
+    path = sys.argv[1] if len(sys.argv) > 1 else None
     try:
-        LikObShell().cmdloop()
+        LikObShell(path).cmdloop()
     except KeyboardInterrupt:
         print("\nGoodbye!")
     except Exception as e:
@@ -0,0 +1,78 @@
+"""多线程读写吞吐量测试
+
+每个线程使用自己的会话，分别测量按索引点查、全表聚合和并发更新在 1/2/4/8 个线程下的吞吐量。
+查询读取快照不加锁，更新只在修改同一行时等待行锁。
+CPython 的 GIL 使纯 Python 的计算不能在多个核上同时进行，读吞吐量主要受益于等待 I/O 时释放 GIL；
+结果说明多个线程共享一个数据库是安全的，吞吐量随线程数的变化取决于解释器和负载。
+
+用法: python -m likob.examples.concurrency_benchmark [行数] [每个线程的操作数]
+"""
+import random
+import sys
+import threading
+import time
+
+from likob.src.core.database import SimpleDB
+from likob.src.utils.config import DBConfig
+
+THREADS = (1, 2, 4, 8)
+
+
+def run(db: SimpleDB, threads: int, operations: int, work) -> float:
+    """启动 threads 个线程各执行 operations 次 work(session, rng)，返回每秒完成的操作数"""
+    barrier = threading.Barrier(threads + 1)
+    errors = []
+
+    def worker(seed: int) -> None:
+        session = db.connect()
+        rng = random.Random(seed)
+        barrier.wait()
+        try:
+            for _ in range(operations):
+                work(session, rng)
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return threads * operations / elapsed
+
+
+def main(rows: int = 100000, operations: int = 2000) -> None:
+    db = SimpleDB(config=DBConfig(autovacuum_interval=0))
+    db.create_table('accounts', [('id', 'INT'), ('owner', 'TEXT'), ('balance', 'FLOAT')])
+    db.insert_many('accounts', ((i, f'user{i}', 100.0) for i in range(rows)))
+    db.execute('CREATE INDEX accounts_id ON accounts (id)')
+
+    lookup = db.prepare('SELECT balance FROM accounts WHERE id = ?')
+    update = db.prepare('UPDATE accounts SET balance = ? WHERE id = ?')
+
+    def point_lookup(session, rng):
+        lookup.execute([rng.randrange(rows)], session=session)
+
+    def aggregate(session, rng):
+        session.execute('SELECT COUNT(*), SUM(balance) FROM accounts WHERE id < 1000')
+
+    def point_update(session, rng):
+        update.execute([rng.random() * 100, rng.randrange(rows)], session=session)
+
+    workloads = [('点查', point_lookup, operations), ('范围聚合', aggregate, max(1, operations // 10)),
+                 ('更新', point_update, operations)]
+    print(f"{'负载':<8}" + ''.join(f"{f'{n} 线程':>14}" for n in THREADS))
+    for name, work, count in workloads:
+        results = [run(db, n, count, work) for n in THREADS]
+        print(f"{name:<8}" + ''.join(f"{ops:>12.0f}/s" for ops in results))
+    print('行锁:', db.lock_stats())
+    db.close()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,30 @@
+import argparse
+import asyncio
+import logging
+from .src.core.database import SimpleDB
+from .src.net.server import Server, DEFAULT_PORT
+from .src.utils.config import DBConfig
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='likob-server', description='LikOb 数据库服务器')
+    parser.add_argument('path', nargs='?', help='数据目录，不指定时使用内存数据库')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址（默认 127.0.0.1）')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'监听端口（默认 {DEFAULT_PORT}）')
+    parser.add_argument('--config', help='JSON 配置文件，见 DBConfig')
+    parser.add_argument('--file-dir', help='允许客户端用 SAVE/LOAD/COPY 读写的目录，不指定时禁止这些语句')
+    args = parser.parse_args()
+
+    config = DBConfig.load_from_file(args.config) if args.config else DBConfig()
+    logging.basicConfig(level=config.log_level, format='%(asctime)s %(levelname)s %(message)s')
+    db = SimpleDB(args.path, config)
+    try:
+        asyncio.run(Server(db, args.host, args.port, file_directory=args.file_dir).serve_forever())
+    except KeyboardInterrupt:
+        print("\nGoodbye!")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
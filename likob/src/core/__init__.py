@@ -1,4 +1,6 @@
 from .database import SimpleDB
 from .table import Table
+from .cursor import Cursor
+from .statement import PreparedStatement
 
-__all__ = ['SimpleDB', 'Table'] 
\ No newline at end of file
+__all__ = ['SimpleDB', 'Table', 'Cursor', 'PreparedStatement'] 
\ No newline at end of file
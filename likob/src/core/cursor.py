@@ -0,0 +1,72 @@
+from itertools import islice
+from typing import Dict, Any, Optional, List, Iterator, Sequence
+from .result_cache import ResultCache
+
+
+class Cursor:
+    """查询游标
+
+    SELECT 的结果由执行计划逐行产生，fetchone/fetchmany 只计算需要的行，
+    内存占用与结果集大小无关；其他语句的结果直接保存在游标中。
+    """
+
+    def __init__(self, db, session=None):
+        self.db = db
+        # 语句在所属会话的事务中执行，未指定时使用数据库的默认会话
+        self.session = session or db.default_session
+        self.arraysize = 100
+        self.columns: Optional[List[str]] = None
+        self.rowcount = -1
+        self._rows: Iterator[Dict[str, Any]] = iter(())
+
+    def execute(self, sql: str, params: Optional[Sequence[Any]] = None) -> "Cursor":
+        """执行SQL语句，返回游标本身以便链式调用；传入 params 时语句中的 ? 按顺序替换为参数"""
+        self.close()
+        if params is not None:
+            statement = self.db.prepare(sql)
+            if statement.command == 'SELECT':
+                self.columns, self._rows = statement.stream(params, self.session)
+                self.rowcount = -1
+                return self
+            result = statement.execute(params, self.session) or []
+        else:
+            parsed, text, values = self.db.parser.parse_normalized(sql)
+            if parsed['command'] == 'SELECT':
+                self.columns, self._rows = self.db.executor.stream(parsed, self.session,
+                                                                   ResultCache.key(text, values))
+                self.rowcount = -1
+                return self
+            result = self.session.execute_parsed(parsed) or []
+        self.columns = list(result[0].keys()) if result else None
+        self.rowcount = len(result)
+        self._rows = iter(result)
+        return self
+
+    def fetchone(self) -> Optional[Dict[str, Any]]:
+        """读取下一行，没有更多行时返回None"""
+        return next(self._rows, None)
+
+    def fetchmany(self, size: Optional[int] = None) -> List[Dict[str, Any]]:
+        """最多读取 size 行（默认 arraysize 行）"""
+        size = self.arraysize if size is None else size
+        return list(islice(self._rows, max(size, 0)))
+
+    def fetchall(self) -> List[Dict[str, Any]]:
+        """读取剩余的所有行"""
+        return list(self._rows)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self._rows
+
+    def close(self) -> None:
+        """放弃未读取的结果，释放扫描占用的页"""
+        close = getattr(self._rows, 'close', None)
+        if close is not None:
+            close()
+        self._rows = iter(())
+
+    def __enter__(self) -> "Cursor":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
@@ -1,48 +1,302 @@
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterable, Sequence
+import csv
+import logging
+import threading
+import weakref
 from .table import Table
 from ..sql.parser import SQLParser
 from ..sql.executor import QueryExecutor
+from ..sql import parallel
+from ..storage.engine import StorageEngine
+from ..storage.dump import DumpReader, DumpWriter
+from ..utils.config import DBConfig
+from ..utils.lru import LRUCache
 import json
-from .transaction import Transaction
+from .transaction import Transaction, TransactionManager
+from .session import Session, parse_isolation_level
+from .cursor import Cursor
+from .statement import PreparedStatement
+from .result_cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+
+def _autovacuum(ref: "weakref.ref", stop: threading.Event, interval: float) -> None:
+    """后台清理线程，只持有数据库的弱引用，数据库被回收或关闭后退出"""
+    while not stop.wait(interval):
+        db = ref()
+        if db is None:
+            return
+        db.autovacuum()
+        del db
+
+
+def _checkpointer(ref: "weakref.ref", stop: threading.Event, wake: threading.Event, interval: float) -> None:
+    """后台检查点线程，每隔 interval 秒或被唤醒（日志过大）时做一次检查点，数据库被回收或关闭后退出"""
+    while True:
+        wake.wait(interval)
+        wake.clear()
+        if stop.is_set():
+            return
+        db = ref()
+        if db is None:
+            return
+        try:
+            db.storage.checkpoint()
+        except Exception:
+            logger.exception("后台检查点失败")
+        del db
+
 
 class SimpleDB:
-    def __init__(self):
+    """数据库入口
+
+    同一个 SimpleDB 可以被多个线程同时使用：每个线程用 connect() 创建自己的会话，
+    或直接调用 execute() 等方法使用本线程的默认会话。查询读取快照不加锁；修改同一行的事务
+    在行锁上排队，形成死锁时其中一个事务收到 DeadlockError。建表、建索引等修改目录的操作串行执行。
+    """
+
+    def __init__(self, path: Optional[str] = None, config: Optional[DBConfig] = None):
+        """path 为数据目录，为 None 时创建内存数据库"""
+        self.config = config or DBConfig()
+        self.storage = StorageEngine(path, self.config)
         self.tables: Dict[str, Table] = {}
-        self.parser = SQLParser()
+        self.parser = SQLParser(self.config.statement_cache_size)
         self.executor = QueryExecutor(self)
-        self.current_transaction: Transaction = None
+        # 预编译语句按SQL文本缓存，表结构、索引或统计信息变化时 schema_version 增加，缓存的计划随之失效
+        self.statements = LRUCache(self.config.statement_cache_size)
+        self.schema_version = 0
+        # 查询结果缓存（DBConfig.result_cache_size 为 0 时不启用），按表的版本号失效
+        self.result_cache = ResultCache(self.config.result_cache_size, self.config.result_cache_bytes)
+        # 多版本并发控制：每个会话有自己的事务，读取事务快照中的版本
+        self.transactions = TransactionManager(parse_isolation_level(self.config.isolation_level),
+                                               self.config.lock_timeout or None)
+        self.storage.active_lsn = self.transactions.oldest_lsn
+        # 每个线程有自己的默认会话
+        self._local = threading.local()
+        self.catalog_lock = threading.RLock()
+
+        # 只读取目录文件，数据页和索引按需加载
+        for name, columns in self.storage.table_definitions().items():
+            table = Table(name, columns, heap=self.storage.open_heap(name),
+                          constraints=self.storage.table_constraints(name), build_indexes=False)
+            for index_name, column in self.storage.index_definitions(name).items():
+                table.create_index(index_name, column, build=False)
+            self.tables[name] = table
+
+        self._vacuum_stop = threading.Event()
+        self._vacuum_thread = None
+        if self.config.autovacuum_interval > 0:
+            self._vacuum_thread = threading.Thread(
+                target=_autovacuum, args=(weakref.ref(self), self._vacuum_stop, self.config.autovacuum_interval),
+                name='likob-autovacuum', daemon=True)
+            self._vacuum_thread.start()
+
+        # 持久化数据库由后台线程定期做检查点，日志过大时提交的事务只唤醒它、不等待写回
+        self._checkpoint_stop = threading.Event()
+        self._checkpoint_wake = threading.Event()
+        self._checkpoint_thread = None
+        if self.storage.wal is not None and self.config.checkpoint_interval > 0:
+            self._checkpoint_thread = threading.Thread(
+                target=_checkpointer,
+                args=(weakref.ref(self), self._checkpoint_stop, self._checkpoint_wake, self.config.checkpoint_interval),
+                name='likob-checkpoint', daemon=True)
+            self._checkpoint_thread.start()
+
+    def connect(self, isolation_level: Optional[str] = None) -> Session:
+        """创建一个新会话，每个会话有自己的当前事务，可以在不同线程中并发使用"""
+        return Session(self, isolation_level)
+
+    @property
+    def default_session(self) -> Session:
+        """当前线程的默认会话，第一次使用时创建"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = Session(self)
+        return session
+
+    @property
+    def current_transaction(self) -> Optional[Transaction]:
+        """默认会话的当前事务"""
+        return self.default_session.transaction
+
+    def new_transaction(self) -> Transaction:
+        """开始一个带新事务ID和快照的事务"""
+        return self.transactions.begin()
+
+    def begin_transaction(self, isolation_level: Optional[str] = None):
+        """在默认会话中开始一个新事务"""
+        self.default_session.begin(isolation_level)
+
+    def commit_transaction(self) -> None:
+        """提交默认会话的当前事务"""
+        self.default_session.commit()
+
+    def rollback_transaction(self) -> None:
+        """回滚默认会话的当前事务"""
+        self.default_session.rollback()
+
+    def commit(self, txn: Transaction) -> None:
+        """提交事务：写入提交日志并等待持久化，再分配提交时间戳使修改对新快照可见
+
+        日志过大时做检查点（有后台检查点线程时交给它做）。
+        """
+        wal = self.storage.wal
+        if wal is not None and txn.undo_log:
+            wal.commit(txn.txid)
+        written = {heap.name for heap, _, _ in txn.undo_log}
+        txn.undo_log.clear()
+        self.transactions.commit(txn)
+        txn.commit()
+        # 修改对新快照可见之后再增加版本号，在此之前记录版本号的查询结果都会失效
+        for name in written:
+            table = self.tables.get(name)
+            if table is not None:
+                table.bump_version()
+        self._prune_versions()
+        if wal is not None and wal.size > self.config.wal_max_size:
+            if self._checkpoint_thread is not None:
+                self._checkpoint_wake.set()
+            else:
+                self.storage.checkpoint()
+
+    def undo_transaction(self, txn: Transaction, savepoint: int = 0) -> None:
+        """撤销事务在 savepoint 之后的修改，撤销操作同样写入日志"""
+        for heap, rid, before in reversed(txn.undo_log[savepoint:]):
+            self.tables[heap.name].restore(rid, before, txn)
+        del txn.undo_log[savepoint:]
+
+    def abort_transaction(self, txn: Transaction) -> None:
+        """回滚事务的全部修改"""
+        self.undo_transaction(txn)
+        if self.storage.wal is not None:
+            self.storage.wal.abort(txn.txid)
+        self.transactions.finish(txn)
+        txn.rollback()
+        self._prune_versions(force=True)
+
+    def _prune_versions(self, force: bool = False) -> None:
+        """最早的活动快照前进后，回收所有事务都不再需要的旧版本"""
+        horizon = self.transactions.advanced_horizon()
+        if horizon is None:
+            if not force:
+                return
+            horizon = self.transactions.horizon()
+        for table in list(self.tables.values()):
+            if table.heap.versions:
+                table.prune_versions(horizon)
 
-    def begin_transaction(self):
-        """开始一个新事务"""
-        if self.current_transaction is not None:
-            raise Exception("已有活动事务，请先提交或回滚。")
-        self.current_transaction = Transaction()
+    def vacuum(self, table_name: Optional[str] = None) -> Dict[str, int]:
+        """清理表中不再需要的旧版本和已删除的行，返回各项回收的数量之和；table_name 为 None 时清理所有表
+
+        有其他活动事务时只做不移动行的清理；没有活动事务时还会压缩列式表、截掉行存储文件末尾的空页，
+        期间新事务等待清理完成。
+        """
+        tables = [self.get_table(table_name)] if table_name else list(self.tables.values())
+        totals = {'tables': len(tables), 'versions': 0, 'rows': 0, 'slots': 0, 'pages': 0}
+        for table in tables:
+            with self.transactions.quiesced() as clock:
+                if clock is not None:
+                    stats = table.vacuum(clock, shrink=True)
+            if clock is None:
+                stats = table.vacuum(self.transactions.horizon())
+            for key, value in stats.items():
+                totals[key] += value
+        return totals
+
+    def autovacuum(self) -> None:
+        """清理删除的行较多的表，由后台清理线程定期调用"""
+        for name, table in list(self.tables.items()):
+            if table.needs_vacuum():
+                try:
+                    self.vacuum(name)
+                except Exception:
+                    # 表可能在清理期间被删除，下次检查时再处理
+                    logger.exception("自动清理表 %s 失败", name)
+
+    def write_transaction(self):
+        """默认会话中修改语句所在的事务，见 Session.write_transaction"""
+        return self.default_session.write_transaction()
 
     def execute(self, sql: str) -> Optional[List[Dict[str, Any]]]:
-        """执行SQL语句"""
-        parsed = self.parser.parse(sql)
-        command = parsed['command']
-        
-        if command == 'BEGIN':
-            self.begin_transaction()
-            return [{'message': '事务已开始。'}]
-        elif command == 'SAVE':
-            self.save(parsed['filename'])
-            return [{'message': f"数据库已保存到 {parsed['filename']}。"}]
-        elif command == 'END':
-            return self.end_transaction()
-        elif command == 'LOAD':
-            self.load(parsed['filename'])
-            return [{'message': f"数据库已从 {parsed['filename']} 加载。"}]
-        else:
-            return self.executor.execute(parsed)
-        # 其他命令处理...
-
-    def create_table(self, name: str, columns: list) -> None:
-        """创建表"""
-        if name in self.tables:
-            raise Exception(f"表 {name} 已存在")
-        self.tables[name] = Table(name, columns)
+        """在默认会话中执行SQL语句"""
+        return self.default_session.execute(sql)
+
+    def prepare(self, sql: str) -> PreparedStatement:
+        """预编译带 ? 参数的语句，之后用 execute(params) 执行"""
+        statement = self.statements.get(sql)
+        if statement is None:
+            statement = PreparedStatement(self, sql)
+            self.statements.put(sql, statement)
+        return statement
+
+    def statement_cache_stats(self) -> Dict[str, Any]:
+        """解析树缓存和预编译语句缓存的命中计数"""
+        return {'parse': self.parser.cache.stats(), 'prepared': self.statements.stats()}
+
+    def cursor(self) -> Cursor:
+        """创建游标，查询结果逐行读取，不会一次性生成全部结果"""
+        return Cursor(self)
+
+    def execute_parsed(self, parsed: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """在默认会话中执行解析后的语句"""
+        return self.default_session.execute_parsed(parsed)
+
+    def create_table(self, name: str, columns: list, layout: str = 'row',
+                     constraints: Optional[Dict[str, Any]] = None) -> None:
+        """创建表，layout 为 row（行存储）或 columnar（列存储）
+
+        constraints 为 {'primary_key': 列名, 'unique': [列名], 'not_null': [列名]}，主键和 UNIQUE 列上自动建立哈希索引。
+        """
+        with self.catalog_lock:
+            if name in self.tables:
+                raise Exception(f"表 {name} 已存在")
+            constraints = {key: value for key, value in (constraints or {}).items() if value}
+            # 先检查约束中的列，再登记存储
+            names = {col for col, _ in columns}
+            for col in [constraints.get('primary_key')] + constraints.get('unique', []) + constraints.get('not_null', []):
+                if col is not None and col not in names:
+                    raise Exception(f"未知的列名: {col}")
+            heap = self.storage.create_heap(name, columns, layout, constraints)
+            self.tables[name] = Table(name, columns, heap=heap, constraints=constraints)
+            self.schema_version += 1
+
+    def create_index(self, name: str, table_name: str, column: str) -> None:
+        """在表的列上创建索引"""
+        with self.catalog_lock:
+            for table in list(self.tables.values()):
+                if name in table.index_names:
+                    raise Exception(f"索引 {name} 已存在")
+            self.get_table(table_name).create_index(name, column)
+            self.storage.add_index_definition(table_name, name, column)
+            self.schema_version += 1
+
+    def drop_index(self, name: str, table_name: Optional[str] = None) -> str:
+        """删除索引，返回索引所在的表名"""
+        with self.catalog_lock:
+            tables = [self.get_table(table_name)] if table_name else list(self.tables.values())
+            for table in tables:
+                if name in table.index_names:
+                    table.drop_index(name)
+                    self.storage.drop_index_definition(table.name, name)
+                    self.schema_version += 1
+                    return table.name
+        raise Exception(f"索引 {name} 不存在")
+
+    def insert_many(self, table_name: str, rows: Iterable[Sequence[Any]], session: Optional[Session] = None) -> int:
+        """批量插入多行，返回插入的行数；全部行在同一个事务中，只提交一次"""
+        table = self.get_table(table_name)
+        with (session or self.default_session).write_transaction() as txn:
+            return table.insert_many(rows, txn)
+
+    def copy_from(self, table_name: str, filename: str, header: bool = False, delimiter: str = ',',
+                  session: Optional[Session] = None) -> int:
+        """从 CSV 文件批量导入行，返回导入的行数；header 为 True 时跳过第一行"""
+        with open(filename, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f, delimiter=delimiter)
+            if header:
+                next(reader, None)
+            return self.insert_many(table_name, (row for row in reader if row), session)
 
     def get_table(self, name: str) -> Table:
         """获取表"""
@@ -50,26 +304,98 @@ class SimpleDB:
             raise Exception(f"表 {name} 不存在")
         return self.tables[name]
 
-    def save(self, filename: str):
-        """保存数据库到文件"""
-        with open(filename, 'w') as f:
-            json.dump({table_name: table.data for table_name, table in self.tables.items()}, f)
+    def save(self, filename: str, session: Optional[Session] = None, compression: Optional[str] = None):
+        """保存数据库到文件，所有表读取同一个快照
+
+        文件名以 .json 结尾时保存为 JSON；否则保存为按列编码、分块压缩的二进制格式（storage.dump），
+        逐块读出、编码、写入，内存占用与表的大小无关。compression 为 none、zlib 或 lzma，默认为 DBConfig.dump_compression。
+        """
+        if filename.lower().endswith('.json'):
+            with (session or self.default_session).read_transaction() as txn:
+                data = {table_name: [dict(zip(table.columns, row)) for _, row in table.scan(txn)]
+                        for table_name, table in list(self.tables.items())}
+            with open(filename, 'w') as f:
+                json.dump(data, f)
+            return
+        with (session or self.default_session).read_transaction() as txn, open(filename, 'wb') as f:
+            writer = DumpWriter(f, compression or self.config.dump_compression)
+            for table_name, table in list(self.tables.items()):
+                writer.write_table(table_name, list(table.columns.items()), (row for _, row in table.scan(txn)))
+            writer.close()
 
-    def load(self, filename: str):
-        """从文件加载数据库"""
+    def load(self, filename: str, session: Optional[Session] = None):
+        """从文件加载数据库，文件可以是 save 写出的二进制格式或 JSON；二进制格式逐块读取和插入"""
+        if DumpReader.is_dump(filename):
+            with open(filename, 'rb') as f, (session or self.default_session).write_transaction() as txn:
+                for table_name, columns, rows in DumpReader(f).tables():
+                    if table_name not in self.tables:
+                        raise Exception(f"表 {table_name} 不存在")
+                    table = self.tables[table_name]
+                    names = [col for col, _ in columns]
+                    if names != list(table.columns):
+                        # 按列名对应到表的列
+                        missing = [col for col in table.columns if col not in names]
+                        if missing:
+                            raise Exception(f"导出文件中表 {table_name} 缺少列 {', '.join(missing)}")
+                        positions = [names.index(col) for col in table.columns]
+                        rows = (tuple(row[i] for i in positions) for row in rows)
+                    table.insert_many(rows, txn)
+            return
         with open(filename, 'r') as f:
             data = json.load(f)
+        with (session or self.default_session).write_transaction() as txn:
             for table_name, rows in data.items():
                 if table_name not in self.tables:
                     raise Exception(f"表 {table_name} 不存在")
                 table = self.tables[table_name]
-                for row in rows:
-                    table.insert(row)
+                table.insert_many(([row[col] for col in table.columns] if isinstance(row, dict) else row
+                                   for row in rows), txn)
+
+    def flush(self) -> int:
+        """把修改过的页写回磁盘，返回写出的页数"""
+        return self.storage.flush()
+
+    def checkpoint(self) -> Dict[str, Any]:
+        """立即做一次检查点，返回检查点统计（见 StorageEngine.checkpoint_stats）"""
+        self.storage.checkpoint()
+        return self.storage.checkpoint_stats()
+
+    def wal_stats(self) -> Optional[Dict[str, Any]]:
+        """预写日志的提交和 fsync 次数，内存数据库返回 None"""
+        return self.storage.wal.stats() if self.storage.wal is not None else None
+
+    def result_cache_stats(self) -> Dict[str, Any]:
+        """查询结果缓存的命中率、失效和淘汰计数"""
+        return self.result_cache.stats()
+
+    def buffer_pool_stats(self) -> Dict[str, Any]:
+        """缓冲池的命中、未命中和置换计数"""
+        return self.storage.pool.stats()
+
+    def lock_stats(self) -> Dict[str, Any]:
+        """行锁的持有数、等待次数和死锁次数"""
+        return self.transactions.locks.stats()
+
+    def close(self) -> None:
+        """停止后台清理和检查点线程，写回脏页并关闭数据文件"""
+        self._vacuum_stop.set()
+        if self._vacuum_thread is not None and self._vacuum_thread is not threading.current_thread():
+            self._vacuum_thread.join()
+        self._checkpoint_stop.set()
+        self._checkpoint_wake.set()
+        if self._checkpoint_thread is not None and self._checkpoint_thread is not threading.current_thread():
+            self._checkpoint_thread.join()
+        for table in self.tables.values():
+            parallel.discard(table.heap)
+        self.storage.close()
+
+    def __enter__(self) -> "SimpleDB":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
 
     def end_transaction(self):
-        """结束当前事务"""
-        if self.current_transaction is None:
-            raise Exception("没有活动事务。")
-        self.current_transaction.commit()  # 提交事务
-        self.current_transaction = None
+        """结束默认会话的当前事务"""
+        self.default_session.commit()
         return [{'message': '事务已结束。'}]
\ No newline at end of file
@@ -16,4 +16,16 @@ class StorageError(SimpleDBError):
 
 class TypeError(SimpleDBError):
     """数据类型错误"""
-    pass
\ No newline at end of file
+    pass
+
+class SerializationError(SimpleDBError):
+    """并发事务写冲突，事务需要回滚后重试"""
+    pass
+
+class DeadlockError(SerializationError):
+    """事务之间互相等待行锁，被选为牺牲者的事务需要回滚后重试"""
+    pass
+
+class ProtocolError(SimpleDBError):
+    """网络协议错误：收到的数据不符合协议或连接意外断开"""
+    pass
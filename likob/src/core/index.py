@@ -1,40 +1,325 @@
-from typing import Dict, List, Any, Set
+from typing import Dict, List, Any, Set, Optional, Tuple, Iterator
 from collections import defaultdict
+from operator import itemgetter
+from bisect import bisect_left, bisect_right
+from ..storage.latch import RWLatch
+
+# 批量建立 B+ 树时叶子和内部节点的填充比例，留出的空位让之后的插入不会马上分裂
+BULK_LOAD_FILL = 0.9
 
 class Index:
+    """哈希索引，等值查找 O(1)，用于主键和 UNIQUE 约束
+
+    与 B+ 树索引的接口相同，但键没有顺序：只用于等值条件，范围查询要遍历全部键。NULL 值不进入索引。
+    索引中还保留着旧版本的键（同一个键可能对应已删除或已修改的行），唯一性由表在写入前检查，
+    is_unique 只表示该索引用于唯一约束。
+    """
+
     def __init__(self, table_name: str, column_name: str, is_unique: bool = False):
         self.table_name = table_name
         self.column_name = column_name
         self.is_unique = is_unique
         # 使用字典存储索引，键是列值，值是行的集合
         self.index_map: Dict[Any, Set[int]] = defaultdict(set)
+        self.size = 0
+        self.latch = RWLatch()
+
+    def __len__(self) -> int:
+        return self.size
 
     def add(self, value: Any, row_id: int) -> None:
         """添加索引项"""
-        if self.is_unique and value in self.index_map:
-            raise Exception(f"唯一索引冲突: {self.column_name} = {value}")
-        self.index_map[value].add(row_id)
+        if value is None:
+            return
+        with self.latch.exclusive():
+            self._add(value, row_id)
+
+    def _add(self, value: Any, row_id: int) -> None:
+        """添加索引项，调用者持有排他闩"""
+        row_ids = self.index_map[value]
+        if row_id not in row_ids:
+            row_ids.add(row_id)
+            self.size += 1
+
+    def _load(self, entries: List[Tuple[Any, int]]) -> None:
+        """加入一批 (键, 行ID)，调用者持有排他闩"""
+        for value, row_id in entries:
+            if value is not None:
+                self._add(value, row_id)
 
     def remove(self, value: Any, row_id: int) -> None:
         """删除索引项"""
-        if value in self.index_map:
-            self.index_map[value].discard(row_id)
-            if not self.index_map[value]:
-                del self.index_map[value]
+        if value is None:
+            return
+        with self.latch.exclusive():
+            row_ids = self.index_map.get(value)
+            if row_ids is not None and row_id in row_ids:
+                row_ids.discard(row_id)
+                self.size -= 1
+                if not row_ids:
+                    del self.index_map[value]
 
     def find(self, value: Any) -> Set[int]:
         """查找指定值的所有行ID"""
-        return self.index_map.get(value, set())
+        if value is None:
+            return set()
+        with self.latch.shared():
+            row_ids = self.index_map.get(value)
+            return set(row_ids) if row_ids else set()
+
+    def items(self, start: Any = None, end: Any = None, include_start: bool = True,
+              include_end: bool = True) -> Iterator[Tuple[Any, Tuple[int, ...]]]:
+        """[start, end] 范围内的 (键, 行ID元组)，None 表示不限；上下界相同时直接查找，否则遍历全部键，结果无序"""
+        if start is not None and start == end:
+            if include_start and include_end:
+                row_ids = self.find(start)
+                if row_ids:
+                    yield start, tuple(row_ids)
+            return
+        with self.latch.shared():
+            entries = [(key, tuple(row_ids)) for key, row_ids in self.index_map.items()]
+        for key, row_ids in entries:
+            try:
+                if start is not None and (key < start or (key == start and not include_start)):
+                    continue
+                if end is not None and (key > end or (key == end and not include_end)):
+                    continue
+            except TypeError:
+                continue
+            yield key, row_ids
+
+    def find_range(self, start: Any = None, end: Any = None, include_start: bool = True,
+                   include_end: bool = True) -> Iterator[int]:
+        """范围查询，产生行ID（无序）"""
+        for _, row_ids in self.items(start, end, include_start, include_end):
+            yield from row_ids
+
+    def clear(self) -> None:
+        """清空索引"""
+        with self.latch.exclusive():
+            self.index_map.clear()
+            self.size = 0
+
+
+class _Leaf:
+    """B+树叶子节点: 有序的键和对应的行ID集合，叶子之间按键顺序链接"""
+
+    __slots__ = ('keys', 'values', 'next')
+
+    def __init__(self):
+        self.keys: List[Any] = []
+        self.values: List[Set[int]] = []
+        self.next: Optional["_Leaf"] = None
+
+
+class _Inner:
+    """B+树内部节点: children[i] 中的键都小于 keys[i]"""
+
+    __slots__ = ('keys', 'children')
+
+    def __init__(self):
+        self.keys: List[Any] = []
+        self.children: List[Any] = []
+
+
+class BTreeIndex:
+    """有序的 B+ 树索引
+
+    点查询和定位范围起点都是 O(log n)，范围扫描沿叶子链表按键顺序进行。
+    NULL 值不进入索引。删除只从叶子中移除键，不做节点合并。
+    修改时持有排他闩，查找时持有共享闩；范围扫描每次只在闩内复制一个叶子，索引可以在扫描期间被修改。
+    """
+
+    def __init__(self, table_name: str, column_name: str, order: int = 64):
+        self.table_name = table_name
+        self.column_name = column_name
+        self.order = order
+        self.root: Any = _Leaf()
+        self.size = 0
+        self.latch = RWLatch()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _find_leaf(self, value: Any) -> _Leaf:
+        """找到应当包含 value 的叶子"""
+        node = self.root
+        while isinstance(node, _Inner):
+            node = node.children[bisect_right(node.keys, value)]
+        return node
+
+    def add(self, value: Any, row_id: int) -> None:
+        """添加索引项"""
+        if value is None:
+            return
+        with self.latch.exclusive():
+            self._add(value, row_id)
+
+    def _add(self, value: Any, row_id: int) -> None:
+        """添加索引项，调用者持有排他闩"""
+        split = self._insert(self.root, value, row_id)
+        if split is not None:
+            key, right = split
+            root = _Inner()
+            root.keys = [key]
+            root.children = [self.root, right]
+            self.root = root
+
+    def _load(self, entries: List[Tuple[Any, int]]) -> None:
+        """由一批 (键, 行ID) 建立空索引，调用者持有排他闩
+
+        先按键排序，再自底向上建树：依次填满叶子，每层节点按 BULK_LOAD_FILL 分组成为上一层，
+        共 O(n log n) 次比较，没有逐个插入时的节点分裂和列表移动。键的类型不能互相比较时改为逐个插入。
+        """
+        entries = [entry for entry in entries if entry[0] is not None]
+        try:
+            entries.sort(key=itemgetter(0))
+        except TypeError:
+            for value, row_id in entries:
+                self._add(value, row_id)
+            return
+        if not entries:
+            return
+        fill = max(2, int(self.order * BULK_LOAD_FILL))
+        leaves = [_Leaf()]
+        size = 0
+        for value, row_id in entries:
+            leaf = leaves[-1]
+            if leaf.keys and leaf.keys[-1] == value:
+                if row_id not in leaf.values[-1]:
+                    leaf.values[-1].add(row_id)
+                    size += 1
+                continue
+            if len(leaf.keys) >= fill:
+                leaf.next = _Leaf()
+                leaf = leaf.next
+                leaves.append(leaf)
+            leaf.keys.append(value)
+            leaf.values.append({row_id})
+            size += 1
+        # (子树中最小的键, 节点)，内部节点的 keys[i] 为 children[i + 1] 中最小的键
+        level: List[Tuple[Any, Any]] = [(leaf.keys[0], leaf) for leaf in leaves]
+        while len(level) > 1:
+            groups = [level[i:i + fill + 1] for i in range(0, len(level), fill + 1)]
+            if len(groups) > 1 and len(groups[-1]) == 1:
+                # 最后一组只有一个子节点时并入前一组，前一组最多 fill + 1 个键，不超过 order
+                groups[-2].extend(groups.pop())
+            parents = []
+            for group in groups:
+                node = _Inner()
+                node.children = [child for _, child in group]
+                node.keys = [key for key, _ in group[1:]]
+                parents.append((group[0][0], node))
+            level = parents
+        self.root = level[0][1]
+        self.size = size
+
+    def _insert(self, node: Any, value: Any, row_id: int) -> Optional[Tuple[Any, Any]]:
+        """递归插入，节点分裂时返回 (分隔键, 新的右兄弟)"""
+        if isinstance(node, _Leaf):
+            pos = bisect_left(node.keys, value)
+            if pos < len(node.keys) and node.keys[pos] == value:
+                if row_id not in node.values[pos]:
+                    node.values[pos].add(row_id)
+                    self.size += 1
+                return None
+            node.keys.insert(pos, value)
+            node.values.insert(pos, {row_id})
+            self.size += 1
+            if len(node.keys) <= self.order:
+                return None
+            mid = len(node.keys) // 2
+            right = _Leaf()
+            right.keys, node.keys = node.keys[mid:], node.keys[:mid]
+            right.values, node.values = node.values[mid:], node.values[:mid]
+            right.next, node.next = node.next, right
+            return right.keys[0], right
+
+        pos = bisect_right(node.keys, value)
+        split = self._insert(node.children[pos], value, row_id)
+        if split is None:
+            return None
+        key, child = split
+        node.keys.insert(pos, key)
+        node.children.insert(pos + 1, child)
+        if len(node.keys) <= self.order:
+            return None
+        mid = len(node.keys) // 2
+        right = _Inner()
+        up_key = node.keys[mid]
+        right.keys, node.keys = node.keys[mid + 1:], node.keys[:mid]
+        right.children, node.children = node.children[mid + 1:], node.children[:mid + 1]
+        return up_key, right
+
+    def remove(self, value: Any, row_id: int) -> None:
+        """删除索引项"""
+        if value is None:
+            return
+        with self.latch.exclusive():
+            leaf = self._find_leaf(value)
+            pos = bisect_left(leaf.keys, value)
+            if pos < len(leaf.keys) and leaf.keys[pos] == value and row_id in leaf.values[pos]:
+                leaf.values[pos].discard(row_id)
+                self.size -= 1
+                if not leaf.values[pos]:
+                    del leaf.keys[pos]
+                    del leaf.values[pos]
+
+    def find(self, value: Any) -> Set[int]:
+        """查找指定值的所有行ID"""
+        if value is None:
+            return set()
+        with self.latch.shared():
+            leaf = self._find_leaf(value)
+            pos = bisect_left(leaf.keys, value)
+            if pos < len(leaf.keys) and leaf.keys[pos] == value:
+                return set(leaf.values[pos])
+        return set()
+
+    def items(self, start: Any = None, end: Any = None, include_start: bool = True,
+              include_end: bool = True) -> Iterator[Tuple[Any, Tuple[int, ...]]]:
+        """按键顺序遍历 [start, end] 范围内的 (键, 行ID元组)，None 表示不限
+
+        每次在共享闩内复制一个叶子中的项，下一次从已产生的最后一个键之后重新查找，
+        两次之间索引被修改（包括叶子分裂）也不会漏掉或重复产生仍在索引中的键。
+        """
+        while True:
+            chunk = []
+            with self.latch.shared():
+                if start is None:
+                    leaf = self.root
+                    while isinstance(leaf, _Inner):
+                        leaf = leaf.children[0]
+                    pos = 0
+                else:
+                    leaf = self._find_leaf(start)
+                    pos = (bisect_left if include_start else bisect_right)(leaf.keys, start)
+                finished = False
+                while leaf is not None and not chunk:
+                    keys = leaf.keys
+                    for i in range(pos, len(keys)):
+                        key = keys[i]
+                        if end is not None and (key > end or (key == end and not include_end)):
+                            finished = True
+                            break
+                        chunk.append((key, tuple(leaf.values[i])))
+                    if finished:
+                        break
+                    leaf, pos = leaf.next, 0
+                finished = finished or leaf is None
+            yield from chunk
+            if finished or not chunk:
+                return
+            start, include_start = chunk[-1][0], False
 
-    def find_range(self, start: Any = None, end: Any = None) -> Set[int]:
-        """范围查询"""
-        result = set()
-        for value, row_ids in self.index_map.items():
-            if ((start is None or value >= start) and 
-                (end is None or value <= end)):
-                result.update(row_ids)
-        return result
+    def find_range(self, start: Any = None, end: Any = None, include_start: bool = True,
+                   include_end: bool = True) -> Iterator[int]:
+        """范围查询，按键顺序产生行ID"""
+        for _, row_ids in self.items(start, end, include_start, include_end):
+            yield from row_ids
 
     def clear(self) -> None:
         """清空索引"""
-        self.index_map.clear()
\ No newline at end of file
+        with self.latch.exclusive():
+            self.root = _Leaf()
+            self.size = 0
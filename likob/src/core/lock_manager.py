@@ -0,0 +1,87 @@
+import threading
+import time
+from typing import Dict, Hashable, Any, Set, Optional
+from .exceptions import DeadlockError
+
+
+class LockManager:
+    """行级写锁管理器
+
+    事务修改一行之前对 (表名, 行ID) 加排他锁，锁一直持有到事务提交或回滚（严格两阶段锁）。
+    读取快照不加锁，所以读者从不等待。锁被其他事务持有时等待，等待前在等待图中记录
+    “本事务等待持有者”；沿等待图能走回本事务说明出现了死锁，本事务作为牺牲者抛出 DeadlockError。
+    每个事务同一时刻最多等待一个锁，等待图中每个节点只有一条出边，检测只需沿链走一遍。
+    事务第一次写入时还对以事务自身为键的锁加锁，其他事务用 wait 在这个锁上等待它结束。
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        # 锁 -> 持有者事务
+        self.owners: Dict[Hashable, Any] = {}
+        # 事务ID -> 持有的锁
+        self.held: Dict[int, Set[Hashable]] = {}
+        # 等待中的事务 -> 它等待的锁的持有者
+        self.waits_for: Dict[Any, Any] = {}
+        self.waits = 0
+        self.deadlocks = 0
+
+    def acquire(self, txn, key: Hashable) -> None:
+        """对 key 加排他锁，已经持有时直接返回"""
+        with self._cond:
+            self._wait_free(txn, key)
+            self._grant(txn, key)
+
+    def wait(self, txn, key: Hashable) -> None:
+        """等待 key 上的锁被其他事务释放，但不获取它"""
+        with self._cond:
+            self._wait_free(txn, key)
+
+    def _wait_free(self, txn, key: Hashable) -> None:
+        """在 self._cond 内等待 key 没有被其他事务持有"""
+        owner = self.owners.get(key)
+        if owner is None or owner is txn:
+            return
+        self.waits += 1
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        try:
+            while owner is not None and owner is not txn:
+                self._check_deadlock(txn, owner)
+                self.waits_for[txn] = owner
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise Exception(f"等待行锁超时（{self.timeout} 秒）")
+                self._cond.wait(remaining)
+                owner = self.owners.get(key)
+        finally:
+            self.waits_for.pop(txn, None)
+
+    def _grant(self, txn, key: Hashable) -> None:
+        self.owners[key] = txn
+        self.held.setdefault(txn.txid, set()).add(key)
+
+    def _check_deadlock(self, txn, owner) -> None:
+        """txn 将要等待 owner，沿等待图检查是否会形成环"""
+        node = owner
+        while node is not None:
+            if node is txn:
+                self.deadlocks += 1
+                raise DeadlockError(f"检测到死锁: 事务 {txn.txid} 被选为牺牲者，请回滚后重试")
+            node = self.waits_for.get(node)
+
+    def release_all(self, txn) -> None:
+        """事务结束时释放它持有的所有锁，唤醒等待者"""
+        with self._cond:
+            keys = self.held.pop(txn.txid, None)
+            if not keys:
+                return
+            for key in keys:
+                if self.owners.get(key) is txn:
+                    del self.owners[key]
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """持有的锁数、等待次数和死锁次数"""
+        with self._cond:
+            return {'locks': len(self.owners), 'waiting': len(self.waits_for),
+                    'waits': self.waits, 'deadlocks': self.deadlocks}
@@ -0,0 +1,133 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+# 每个缓存项除结果行以外的固定开销（估算的字节数）
+ENTRY_OVERHEAD = 200
+
+
+def _row_size(row: tuple) -> int:
+    getsizeof = sys.getsizeof
+    return getsizeof(row) + sum(getsizeof(value) for value in row)
+
+
+class _Entry:
+    __slots__ = ('versions', 'columns', 'rows', 'size')
+
+    def __init__(self, versions: Tuple[Tuple[str, int], ...], columns: List[str], rows: List[tuple], size: int):
+        self.versions = versions
+        self.columns = columns
+        self.rows = rows
+        self.size = size
+
+
+class ResultCache:
+    """SELECT 结果缓存
+
+    键为规范化的语句文本加上字面量和参数的值，缓存项记录计算结果之前各个被查询表的版本号，
+    表的数据被修改或修改它的事务提交时版本号增加，查找时版本号不一致的项即失效（只影响读过这张表的结果）。
+    缓存按项数和估算的字节数两个上限做 LRU 淘汰，capacity 为 0 时不缓存。
+
+    只有不在显式事务中的查询使用缓存：显式事务可能读到自己未提交的修改或者较早的快照，它的结果不能给其他会话使用。
+    """
+
+    def __init__(self, capacity: int, max_bytes: int):
+        self.capacity = max(capacity, 0)
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    @staticmethod
+    def key(text: str, values: Sequence[Any]) -> Optional[Hashable]:
+        """由规范化的语句文本和各个 ? 位置的值组成缓存键，值不可哈希时返回 None（不缓存）"""
+        key = (text, tuple((type(value), value) for value in values))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key: Hashable, tables: Dict[str, Any]) -> Optional[Tuple[List[str], List[tuple]]]:
+        """查找结果，返回 (列名, 结果行)；不存在或已失效时返回 None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            for name, version in entry.versions:
+                table = tables.get(name)
+                if table is None or table.version != version:
+                    self._remove(key)
+                    self.invalidations += 1
+                    self.misses += 1
+                    return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.columns, entry.rows
+
+    @staticmethod
+    def versions(tables: Dict[str, Any], names: Sequence[str]) -> Tuple[Tuple[str, int], ...]:
+        """执行查询之前（取快照之前）记录各表的版本号"""
+        return tuple((name, tables[name].version) for name in dict.fromkeys(names))
+
+    def collect(self, key: Hashable, versions: Tuple[Tuple[str, int], ...], columns: List[str],
+                rows: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """逐行转发查询结果，读完时把结果加入缓存；中途停止读取或结果超过字节上限时不缓存"""
+        collected: Optional[List[tuple]] = []
+        size = ENTRY_OVERHEAD
+        for row in rows:
+            if collected is not None:
+                values = tuple(row.values())
+                size += _row_size(values)
+                if size > self.max_bytes:
+                    collected = None
+                else:
+                    collected.append(values)
+            yield row
+        if collected is not None:
+            self.put(key, _Entry(versions, list(columns), collected, size))
+
+    def put(self, key: Hashable, entry: _Entry) -> None:
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.bytes += entry.size
+            while len(self.entries) > self.capacity or self.bytes > self.max_bytes:
+                old_key = next(iter(self.entries))
+                self._remove(old_key)
+                self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        self.bytes -= self.entries.pop(key).size
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """命中、未命中、失效和淘汰计数"""
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'capacity': self.capacity,
+                'size': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.0,
+            }
@@ -0,0 +1,166 @@
+import os
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Iterator, Union, Hashable
+from .transaction import Transaction, IsolationLevel
+from .cursor import Cursor
+from .result_cache import ResultCache
+
+
+def parse_isolation_level(value: Union[str, IsolationLevel, None]) -> Optional[IsolationLevel]:
+    """把隔离级别的名字（如 'repeatable read'）转换为 IsolationLevel"""
+    if value is None or isinstance(value, IsolationLevel):
+        return value
+    try:
+        return IsolationLevel(' '.join(value.upper().replace('_', ' ').split()))
+    except ValueError:
+        raise Exception(f"不支持的隔离级别: {value}")
+
+
+class Session:
+    """数据库会话
+
+    每个会话有自己的当前事务，不同线程中的会话可以并发执行语句。
+    查询读取事务快照中的数据：不会读到其他事务未提交的修改，也不会阻塞写者；
+    没有活动事务时每条语句自动在一个单独的事务中执行。
+
+    SAVE/LOAD/COPY 读写数据库所在机器上的文件。本地会话不限制路径；网络连接的会话由服务器设置
+    file_access 和 file_directory，禁止这些语句或者只允许访问 file_directory 之下的文件。
+    """
+
+    def __init__(self, db, isolation_level: Union[str, IsolationLevel, None] = None):
+        self.db = db
+        self.isolation_level = parse_isolation_level(isolation_level)
+        self.transaction: Optional[Transaction] = None
+        self.file_access = True
+        self.file_directory: Optional[str] = None
+
+    def begin(self, isolation_level: Union[str, IsolationLevel, None] = None) -> Transaction:
+        """开始一个新事务，未指定隔离级别时使用会话的隔离级别"""
+        if self.transaction is not None:
+            raise Exception("已有活动事务，请先提交或回滚。")
+        level = parse_isolation_level(isolation_level) or self.isolation_level
+        self.transaction = self.db.transactions.begin(level)
+        return self.transaction
+
+    def commit(self) -> None:
+        """提交当前事务"""
+        if self.transaction is None:
+            raise Exception("没有活动事务。")
+        txn, self.transaction = self.transaction, None
+        self.db.commit(txn)
+
+    def rollback(self) -> None:
+        """回滚当前事务的全部修改"""
+        if self.transaction is None:
+            raise Exception("没有活动事务。")
+        txn, self.transaction = self.transaction, None
+        self.db.abort_transaction(txn)
+
+    @contextmanager
+    def write_transaction(self) -> Iterator[Transaction]:
+        """修改语句所在的事务
+
+        有活动事务时加入该事务，语句失败只撤销本语句的修改；
+        否则为本语句开启一个自动提交事务，成功时提交（写入日志并等待组提交），失败时回滚。
+        修改在写入预写日志之后才作用到表上。
+        """
+        txn = self.transaction
+        if txn is not None:
+            self.db.transactions.refresh(txn)
+            savepoint = len(txn.undo_log)
+            try:
+                yield txn
+            except Exception:
+                self.db.undo_transaction(txn, savepoint)
+                raise
+            return
+
+        txn = self.db.transactions.begin(self.isolation_level)
+        try:
+            yield txn
+        except Exception:
+            self.db.abort_transaction(txn)
+            raise
+        self.db.commit(txn)
+
+    @contextmanager
+    def read_transaction(self) -> Iterator[Transaction]:
+        """查询所在的事务：有活动事务时使用它的快照，否则取一个只在本次查询期间有效的快照
+
+        READ COMMITTED 的事务每条语句开始时取新快照，看到语句开始前已提交的数据。
+        """
+        txn = self.transaction
+        if txn is not None:
+            self.db.transactions.refresh(txn)
+            yield txn
+            return
+        txn = self.db.transactions.begin(self.isolation_level)
+        try:
+            yield txn
+        finally:
+            self.db.commit(txn)
+
+    def resolve_path(self, filename: str) -> str:
+        """SAVE/LOAD/COPY 实际使用的文件路径
+
+        限制了目录时相对路径相对于该目录，解析 .. 和符号链接后仍须在目录之内。
+        """
+        if not self.file_access:
+            raise Exception("此连接不允许执行读写服务器文件的语句 (SAVE/LOAD/COPY)")
+        if self.file_directory is None:
+            return filename
+        root = os.path.realpath(self.file_directory)
+        path = os.path.realpath(os.path.join(root, filename))
+        if os.path.commonpath([root, path]) != root:
+            raise Exception(f"文件 {filename} 不在允许访问的目录中")
+        return path
+
+    def stream(self, plan) -> Iterator[Dict[str, Any]]:
+        """在读事务中逐行执行计划；快照在读取第一行时建立，读完或关闭迭代器时释放"""
+        with self.read_transaction() as txn:
+            yield from plan.set_transaction(txn).stream()
+
+    def execute(self, sql: str) -> Optional[List[Dict[str, Any]]]:
+        """执行SQL语句"""
+        parsed, text, values = self.db.parser.parse_normalized(sql)
+        return self.execute_parsed(parsed, ResultCache.key(text, values))
+
+    def execute_parsed(self, parsed: Dict[str, Any],
+                       cache_key: Optional[Hashable] = None) -> Optional[List[Dict[str, Any]]]:
+        """执行解析后的语句，cache_key 为 SELECT 结果缓存的键"""
+        command = parsed['command']
+
+        if command == 'BEGIN':
+            self.begin(parsed.get('isolation_level'))
+            return [{'message': '事务已开始。'}]
+        elif command == 'END':
+            self.commit()
+            return [{'message': '事务已结束。'}]
+        elif command == 'COMMIT':
+            self.commit()
+            return [{'message': '事务已提交。'}]
+        elif command == 'ROLLBACK':
+            self.rollback()
+            return [{'message': '事务已回滚。'}]
+        elif command == 'SAVE':
+            self.db.save(self.resolve_path(parsed['filename']), self, parsed.get('compression'))
+            return [{'message': f"数据库已保存到 {parsed['filename']}。"}]
+        elif command == 'LOAD':
+            self.db.load(self.resolve_path(parsed['filename']), self)
+            return [{'message': f"数据库已从 {parsed['filename']} 加载。"}]
+        return self.db.executor.execute(parsed, self, cache_key)
+
+    def cursor(self) -> Cursor:
+        """创建在本会话中执行语句的游标"""
+        return Cursor(self.db, self)
+
+    def close(self) -> None:
+        """关闭会话，未提交的事务被回滚"""
+        if self.transaction is not None:
+            self.rollback()
+
+    def __enter__(self) -> "Session":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
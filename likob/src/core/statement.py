@@ -0,0 +1,56 @@
+from typing import Dict, Any, Optional, List, Iterator, Sequence, Tuple
+from ..sql.parser import bind_parameters
+from .result_cache import ResultCache
+
+
+class PreparedStatement:
+    """预编译语句
+
+    SQL 只解析一次，? 占位符在执行时按顺序替换为参数。
+    SELECT 的计划在第一次执行时生成并缓存（参数值未知，按通用的选择率估算），
+    之后每次执行只把参数绑定到计划的副本上；表结构、索引或统计信息变化后重新生成计划。
+    LIMIT/OFFSET 的参数决定计划的形状（如排序只保留前 N 行），它们的值变化时也重新生成计划。
+    """
+
+    def __init__(self, db, sql: str):
+        self.db = db
+        self.sql = sql
+        self.parsed, self.param_count, self._text, self._slots = db.parser.parse_prepared(sql)
+        self.command = self.parsed['command']
+        self._tables = [self.parsed['table']] + [join['table'] for join in self.parsed.get('joins') or []] \
+            if self.command == 'SELECT' else []
+        self._plan = None
+        self._plan_key = None
+
+    def _check(self, params: Sequence[Any]) -> List[Any]:
+        params = list(params)
+        if len(params) != self.param_count:
+            raise Exception(f"语句需要 {self.param_count} 个参数，实际传入 {len(params)} 个")
+        return params
+
+    def plan(self, params: Sequence[Any] = ()):
+        """返回绑定了参数的 SELECT 计划"""
+        if self.command != 'SELECT':
+            raise Exception("只有 SELECT 语句有执行计划")
+        params = self._check(params)
+        limit, offset = bind_parameters((self.parsed['limit'], self.parsed['offset']), params)
+        key = (self.db.schema_version, type(limit), limit, type(offset), offset)
+        if self._plan is None or self._plan_key != key:
+            self._plan = self.db.executor.plan(dict(self.parsed, limit=limit, offset=offset))
+            self._plan_key = key
+        return self._plan.bind(params)
+
+    def execute(self, params: Sequence[Any] = (), session=None) -> Optional[List[Dict[str, Any]]]:
+        """在会话中用给定的参数执行语句，未指定会话时使用数据库的默认会话"""
+        session = session or self.db.default_session
+        if self.command == 'SELECT':
+            return list(self.stream(params, session)[1])
+        return session.execute_parsed(bind_parameters(self.parsed, self._check(params)))
+
+    def stream(self, params: Sequence[Any] = (), session=None) -> Tuple[List[str], Iterator[Dict[str, Any]]]:
+        """以流水线方式执行 SELECT，返回 (列名, 逐行产生结果的迭代器)"""
+        params = self._check(params)
+        remaining = iter(params)
+        # 字面量和参数按位置组成结果缓存的键，与直接执行同样的语句文本时的键相同
+        key = ResultCache.key(self._text, [value if literal else next(remaining) for literal, value in self._slots])
+        return self.db.executor.stream_plan(lambda: self.plan(params), self._tables, session, key)
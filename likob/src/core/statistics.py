@@ -0,0 +1,126 @@
+import random
+from typing import Dict, Any, Optional, List
+
+# 默认选择率，统计信息缺失或无法估算时使用
+DEFAULT_EQ_SELECTIVITY = 0.005
+DEFAULT_RANGE_SELECTIVITY = 0.33
+
+# 自动收集统计信息时最多抽样的页数
+AUTO_ANALYZE_SAMPLE_PAGES = 64
+
+
+class ColumnStatistics:
+    """单列的统计信息"""
+
+    def __init__(self, distinct: int = 0, min_value: Any = None, max_value: Any = None, nulls: int = 0):
+        self.distinct = distinct
+        self.min = min_value
+        self.max = max_value
+        self.nulls = nulls
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'distinct': self.distinct, 'min': self.min, 'max': self.max, 'nulls': self.nulls}
+
+
+class TableStatistics:
+    """表的统计信息: 行数、页数和每列的不同值个数、最小值、最大值"""
+
+    def __init__(self, row_count: int, page_count: int, columns: Dict[str, ColumnStatistics],
+                 sampled: bool = False):
+        self.row_count = row_count
+        self.page_count = page_count
+        self.columns = columns
+        self.sampled = sampled
+
+    def distinct(self, column: str) -> int:
+        """列的不同值个数估计"""
+        stats = self.columns.get(column)
+        if stats is None or stats.distinct <= 0:
+            return max(1, self.row_count // 10)
+        return stats.distinct
+
+    def selectivity(self, column: str, operator: str, value: Any) -> float:
+        """估算条件 column operator value 的选择率"""
+        stats = self.columns.get(column)
+        if operator in ('=', '!='):
+            equal = 1.0 / stats.distinct if stats and stats.distinct else DEFAULT_EQ_SELECTIVITY
+            return equal if operator == '=' else 1.0 - equal
+        return self.range_selectivity(column,
+                                      value if operator in ('>', '>=') else None,
+                                      value if operator in ('<', '<=') else None)
+
+    def range_selectivity(self, column: str, low: Any, high: Any) -> float:
+        """用最小值、最大值线性插值估算 [low, high] 区间的选择率"""
+        stats = self.columns.get(column)
+        if stats is None or stats.min is None or stats.max is None:
+            return DEFAULT_RANGE_SELECTIVITY
+        lo, hi = stats.min, stats.max
+        if not all(isinstance(v, (int, float)) for v in (lo, hi)) or \
+                not all(v is None or isinstance(v, (int, float)) for v in (low, high)):
+            return DEFAULT_RANGE_SELECTIVITY
+        if hi <= lo:
+            inside = (low is None or low <= lo) and (high is None or high >= hi)
+            return 1.0 if inside else 0.0
+        start = lo if low is None else max(lo, low)
+        end = hi if high is None else min(hi, high)
+        if end < start:
+            return 0.0
+        # 至少保留一个值的选择率
+        return max((end - start) / (hi - lo), 1.0 / max(stats.distinct, 1))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'row_count': self.row_count,
+            'page_count': self.page_count,
+            'sampled': self.sampled,
+            'columns': {name: stats.to_dict() for name, stats in self.columns.items()},
+        }
+
+
+def collect_statistics(table, sample_pages: Optional[int] = None) -> TableStatistics:
+    """扫描表（或抽样部分页）收集统计信息
+
+    抽样时不同值个数按样本中只出现一次的值所占比例放大到全表。
+    """
+    heap = table.heap
+    column_names = list(table.columns.keys())
+    page_count = heap.num_pages
+    sampled = sample_pages is not None and page_count > sample_pages
+    if sampled:
+        page_nos: List[int] = sorted(random.sample(range(page_count), sample_pages))
+    else:
+        page_nos = list(range(page_count))
+
+    values: List[Dict[Any, int]] = [dict() for _ in column_names]
+    mins: List[Any] = [None] * len(column_names)
+    maxs: List[Any] = [None] * len(column_names)
+    nulls = [0] * len(column_names)
+    sample_rows = 0
+    for page_no in page_nos:
+        for _, row in heap.scan(page_no, page_no + 1):
+            sample_rows += 1
+            for i, value in enumerate(row):
+                if value is None:
+                    nulls[i] += 1
+                    continue
+                counts = values[i]
+                counts[value] = counts.get(value, 0) + 1
+                try:
+                    if mins[i] is None or value < mins[i]:
+                        mins[i] = value
+                    if maxs[i] is None or value > maxs[i]:
+                        maxs[i] = value
+                except TypeError:
+                    pass
+
+    row_count = heap.row_count
+    scale = row_count / sample_rows if sample_rows else 1.0
+    columns = {}
+    for i, name in enumerate(column_names):
+        distinct = len(values[i])
+        if sampled and sample_rows:
+            singletons = sum(1 for count in values[i].values() if count == 1)
+            # 只出现一次的值越多，说明全表中的不同值越多
+            distinct = min(row_count, int(distinct + singletons * (scale - 1)))
+        columns[name] = ColumnStatistics(distinct, mins[i], maxs[i], int(nulls[i] * scale))
+    return TableStatistics(row_count, page_count, columns, sampled)
@@ -1,24 +1,305 @@
-from typing import List, Dict, Any, Tuple, Optional, Union
-import operator
-from collections import defaultdict
+from typing import List, Dict, Any, Tuple, Optional, Iterator, Iterable, Sequence, Union, Callable
 import threading
+from ..storage.engine import HeapFile, StorageEngine
+from ..storage.column_store import ColumnStore
+from ..storage.latch import RWLatch
+from .index import BTreeIndex, Index
+from ..sql.planner import Planner, OPERATORS, compile_predicates
+from ..sql.parser import Parameter
+from .statistics import TableStatistics, collect_statistics, AUTO_ANALYZE_SAMPLE_PAGES
+from .transaction import MAX_TIMESTAMP, visible_row
+from .exceptions import SerializationError
+
+# 修改的行数超过 ANALYZE_THRESHOLD + ANALYZE_SCALE_FACTOR * 行数 时自动重新收集统计信息
+ANALYZE_THRESHOLD = 50
+ANALYZE_SCALE_FACTOR = 0.1
+# 删除的行数超过 VACUUM_THRESHOLD + VACUUM_SCALE_FACTOR * 行数 时后台清理线程清理这张表
+VACUUM_THRESHOLD = 50
+VACUUM_SCALE_FACTOR = 0.2
+# 批量插入时每批的行数，每批做一次类型转换、写一次存储、更新一次索引
+BULK_INSERT_BATCH = 10000
+
+CONVERTERS = {'INT': int, 'FLOAT': float, 'TEXT': str}
 
 class Table:
-    def __init__(self, name: str, columns: List[Tuple[str, str]]):
+    """表：行保存在堆文件（或列存储）中，索引和统计信息在内存中
+
+    并发控制：查询读取事务快照，不加任何表级锁；修改语句持有表的共享闩，
+    逐行加行锁（由事务的锁管理器分配），页和索引各自的闩保护它们的内部结构。
+    清空表、压缩列存储等改变行ID的操作持有表的排他闩。
+
+    主键和 UNIQUE 列上各有一个哈希索引（名为 表名_pkey、表名_列名_key），插入和更新时用它 O(1) 检查唯一性；
+    constraints 为 {'primary_key': 列名, 'unique': [列名], 'not_null': [列名]}，主键隐含 UNIQUE 和 NOT NULL。
+    """
+
+    def __init__(self, name: str, columns: List[Tuple[str, str]], heap: Optional[HeapFile] = None,
+                 constraints: Optional[Dict[str, Any]] = None, build_indexes: bool = True):
         self.name = name
         self.columns = {}
-        self.data = []
-        self.indexes: Dict[str, Union[BTreeIndex, HashIndex]] = {}
-        self.primary_key = None
-        self.lock = threading.Lock()  # 添加锁
+        self.indexes: Dict[str, Union[BTreeIndex, Index]] = {}
+        # 索引名 -> 列名；尚未建立的索引在第一次使用时才扫描表建立
+        self.index_names: Dict[str, str] = {}
+        self._unbuilt_indexes: Dict[str, str] = {}
+        self.lock = RWLatch()
+        self._build_lock = threading.Lock()
+        # 累计修改的行数，用于判断统计信息是否过期
+        self.modifications = 0
+        # 表的数据每次被修改（以及修改它的事务提交）时加一，缓存的查询结果据此判断是否过期
+        self.version = 0
+        self._version_lock = threading.Lock()
+        self._statistics: Optional[TableStatistics] = None
+        self._statistics_modifications = 0
+        # 上次清理后删除（或移动）的行数，这些行的空间等待清理回收
+        self.dead_rows = 0
         
         # 处理列定义
         for col_name, col_type in columns:
             self.columns[col_name] = col_type.upper()
 
-    def insert(self, values: List[Any]) -> None:
-        """插入数据"""
-        with self.lock:  # 使用锁
+        # 行通过页存储读写，未指定堆文件时使用内存页
+        self.heap = heap if heap is not None else StorageEngine().create_heap(name, columns)
+
+        constraints = constraints or {}
+        self.primary_key: Optional[str] = constraints.get('primary_key')
+        self.unique_columns: List[str] = list(dict.fromkeys(
+            ([self.primary_key] if self.primary_key else []) + list(constraints.get('unique', []))))
+        self.not_null: List[str] = list(dict.fromkeys(
+            ([self.primary_key] if self.primary_key else []) + list(constraints.get('not_null', []))))
+        for col in self.unique_columns + self.not_null:
+            if col not in self.columns:
+                raise Exception(f"未知的列名: {col}")
+        # 检查唯一性到写入存储和索引之间持有，并发写入同一个键时只有一个成功
+        self._unique_lock = threading.Lock()
+        for col in self.unique_columns:
+            self.create_index(self.constraint_index_name(col), col, build_indexes)
+
+    @property
+    def constraints(self) -> Dict[str, Any]:
+        """表的约束，格式与构造参数 constraints 相同"""
+        return {'primary_key': self.primary_key,
+                'unique': [col for col in self.unique_columns if col != self.primary_key],
+                'not_null': [col for col in self.not_null if col != self.primary_key]}
+
+    def constraint_index_name(self, column: str) -> str:
+        """主键或 UNIQUE 约束使用的索引名"""
+        return f"{self.name}_pkey" if column == self.primary_key else f"{self.name}_{column}_key"
+
+    def ordered_index(self, column: str) -> bool:
+        """列上是否有可以做范围查询和按键顺序扫描的 B+ 树索引（约束的哈希索引只能等值查找）"""
+        return column in self.index_names.values() and column not in self.unique_columns
+
+    @property
+    def data(self) -> List[Dict[str, Any]]:
+        """按存储顺序返回所有行"""
+        return [row for _, row in self._scan()]
+
+    def create_index(self, name: str, column: str, build: bool = True) -> None:
+        """在列上创建 B+ 树索引；build 为 False 时推迟到第一次使用时再建立"""
+        if column not in self.columns:
+            raise Exception(f"未知的列名: {column}")
+        if name in self.index_names:
+            raise Exception(f"索引 {name} 已存在")
+        if column in self.index_names.values():
+            raise Exception(f"列 {column} 上已有索引")
+        self.index_names[name] = column
+        if build:
+            with self._build_lock:
+                self._build_index(column)
+        else:
+            self._unbuilt_indexes[column] = name
+
+    def drop_index(self, name: str) -> None:
+        """删除索引"""
+        if name not in self.index_names:
+            raise Exception(f"索引 {name} 不存在")
+        if self.index_names[name] in self.unique_columns:
+            raise Exception(f"索引 {name} 用于表 {self.name} 的约束，不能删除")
+        column = self.index_names.pop(name)
+        # 索引字典整体替换，并发的修改语句遍历的总是一个完整的字典
+        self.indexes = {col: index for col, index in self.indexes.items() if col != column}
+        self._unbuilt_indexes.pop(column, None)
+
+    def _build_index(self, column: str) -> Union[BTreeIndex, Index]:
+        """扫描整张表建立索引，版本链中的旧版本也加入索引；唯一列建立哈希索引，其他列建立 B+ 树索引
+
+        索引先登记再在排他闩内扫描，并发插入的行要等建立完成才能加入索引，不会漏掉。
+        扫描到的 (键, 行ID) 一次交给索引批量建立（B+ 树排序后自底向上建树）。
+        """
+        if column in self.unique_columns:
+            index = Index(self.name, column, is_unique=True)
+        else:
+            index = BTreeIndex(self.name, column)
+        position = list(self.columns.keys()).index(column)
+        with index.latch.exclusive():
+            self.indexes = {**self.indexes, column: index}
+            self._unbuilt_indexes.pop(column, None)
+            entries = [(values[position], rid) for rid, values in self.heap.scan()]
+            for rid, chain in list(self.heap.versions.items()):
+                entries.extend((version.row[position], rid) for version in chain)
+            index._load(entries)
+        return index
+
+    def get_index(self, column: str) -> Optional[Union[BTreeIndex, Index]]:
+        """获取列上的索引，必要时先建立"""
+        if column in self._unbuilt_indexes:
+            with self._build_lock:
+                if column in self._unbuilt_indexes:
+                    return self._build_index(column)
+        return self.indexes.get(column)
+
+    def _index_add(self, row: Dict[str, Any], rid: int) -> None:
+        for col, index in self.indexes.items():
+            index.add(row[col], rid)
+
+    def _index_remove(self, row: Dict[str, Any], rid: int) -> None:
+        for col, index in self.indexes.items():
+            index.remove(row[col], rid)
+
+    def _index_update(self, old: Dict[str, Any], new: Dict[str, Any], rid: int, new_rid: int,
+                      remove_old: bool) -> None:
+        """更新一行后维护索引，只修改键变化或行被移动的索引；remove_old 为 False 时保留旧键给旧版本使用"""
+        for col, index in self.indexes.items():
+            if new_rid == rid and old[col] == new[col]:
+                continue
+            if remove_old:
+                index.remove(old[col], rid)
+            index.add(new[col], new_rid)
+
+    def _unique_write(self, check: Callable[[], Any], write: Callable[[], Any], txn) -> Any:
+        """在唯一性检查锁内先检查再写入，返回 write() 的结果
+
+        check() 在值已被使用时抛出异常，值只被其他未提交事务的修改占用时返回那个事务：
+        这时释放锁等它提交或回滚（与等待行锁一样检测死锁），再重新检查。
+        不在事务中的写入不能等待，抛出 SerializationError 由调用者重试。
+        """
+        while True:
+            with self._unique_lock:
+                holder = check()
+                if holder is None:
+                    return write()
+            if txn is None:
+                raise SerializationError("唯一键正被未提交的事务使用，请稍后重试")
+            txn.wait_for(holder)
+
+    def _check_not_null(self, column: str, value: Any) -> None:
+        """列的值不能为 NULL：NOT NULL 列按约束报错；其他列暂不支持 NULL（比较、排序和聚合还不处理 NULL）"""
+        if value is None:
+            if column in self.not_null:
+                raise Exception(f"列 {column} 不能为 NULL")
+            raise Exception(f"列 {column} 的值为 NULL: 暂不支持 NULL 值")
+
+    def _check_unique(self, values: Tuple[Any, ...], txn=None, rid: Optional[int] = None,
+                      columns: Optional[Iterable[str]] = None) -> Any:
+        """检查一行在唯一列（columns 为 None 时检查所有唯一列）上的值没有被其他行使用，rid 为这一行自己
+
+        值已被使用时抛出异常；只被其他未提交事务的修改占用时返回那个事务（见 _unique_write），否则返回 None。
+        """
+        column_names = list(self.columns.keys())
+        waiting = None
+        for col in self.unique_columns if columns is None else columns:
+            position = column_names.index(col)
+            value = values[position]
+            if value is None:
+                continue
+            holder = self._key_holder(col, position, value, txn, rid)
+            if holder is True:
+                self._unique_violation(col, value)
+            waiting = waiting or holder
+        return waiting
+
+    def _unique_violation(self, column: str, value: Any) -> None:
+        raise Exception(f"违反唯一约束 {self.constraint_index_name(column)}: {column} = {value!r} 已存在")
+
+    def _key_holder(self, column: str, position: int, value: Any, txn, rid: Optional[int] = None) -> Any:
+        """唯一列上的值被谁使用：没有其他行使用时返回 None，被已提交的行（或本事务、不在事务中的写入）
+        使用时返回 True，只被其他未提交事务的修改占用时返回那个事务
+
+        索引中还有旧版本的键，逐个检查命中的行：存储中的最新行值相同时看它是谁写入的；
+        其他未提交的事务删除或修改了值相同的版本时，它回滚后这个值会恢复，也要等它结束。
+        先读存储中的行再读版本链：写者总是先建版本链再修改存储。
+        """
+        heap = self.heap
+        holder = None
+        for other in self.get_index(column).find(value):
+            if other == rid:
+                continue
+            current = heap.get(other)
+            chain = heap.versions.get(other)
+            if current is not None and current[position] == value:
+                writer = chain[-1].begin if chain else None
+                if writer is None or type(writer) is int or writer is txn:
+                    return True
+                holder = writer
+            elif chain is not None:
+                for version in list(chain):
+                    end = version.end
+                    if type(end) is not int and end is not txn and version.row[position] == value:
+                        holder = end
+        return holder
+
+    def _index_release(self, values: Tuple[Any, ...], rid: int, keep: List[Tuple[Any, ...]]) -> None:
+        """删除一个行版本的索引项，keep 中的版本仍在使用的键保留"""
+        column_names = list(self.columns.keys())
+        for col, index in self.indexes.items():
+            position = column_names.index(col)
+            key = values[position]
+            if all(other[position] != key for other in keep):
+                index.remove(key, rid)
+
+    def scan(self, txn=None, read: Optional[List[int]] = None, start_page: int = 0,
+             end_page: Optional[int] = None, predicates: Optional[List[Tuple[int, Any, Any]]] = None
+             ) -> Iterator[Tuple[int, Tuple[Any, ...]]]:
+        """按存储顺序遍历事务快照可见的行，产生 (行ID, 行)
+
+        read 为列存储需要解码的列位置，行由这些列组成；行存储总是返回整行。
+        有版本链的行从版本链中取可见的版本，其余的行对所有快照可见。txn 为 None 时读取最新数据。
+        predicates 为 (表中的列位置, 比较函数, 值) 条件时，按页的最小值和最大值跳过没有行能满足条件的页，
+        产生的行仍要由调用者检查条件。
+        """
+        heap = self.heap
+        if txn is None:
+            if read is not None and isinstance(heap, ColumnStore):
+                return heap.scan_columns(read, start_page, end_page, predicates=predicates)
+            return heap.scan(start_page, end_page, predicates=predicates)
+        if read is not None and isinstance(heap, ColumnStore):
+            rows = heap.scan_columns(read, start_page, end_page, deleted=True, predicates=predicates)
+        else:
+            rows, read = heap.scan(start_page, end_page, deleted=True, predicates=predicates), None
+        return self._visible(rows, heap.versions, txn, read)
+
+    @staticmethod
+    def _visible(rows: Iterator[Tuple[int, Optional[Tuple[Any, ...]]]], versions: Dict[int, List[Any]], txn,
+                 read: Optional[List[int]]) -> Iterator[Tuple[int, Tuple[Any, ...]]]:
+        # 存储中的行先读出，再查版本链：写者总是先建版本链再修改存储
+        for rid, values in rows:
+            if versions:
+                chain = versions.get(rid)
+                if chain is not None:
+                    values = visible_row(chain, txn)
+                    if values is not None and read is not None:
+                        values = tuple(values[i] for i in read)
+            if values is not None:
+                yield rid, values
+
+    def fetch(self, rid: int, txn=None) -> Optional[Tuple[Any, ...]]:
+        """按行ID读取事务快照可见的行，不可见时返回 None"""
+        values = self.heap.get(rid)
+        if txn is not None:
+            chain = self.heap.versions.get(rid)
+            if chain is not None:
+                return visible_row(chain, txn)
+        return values
+
+    def _scan(self, txn=None, conditions: Optional[Dict] = None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """遍历所有行，产生 (行ID, 行字典)；有条件时跳过没有行能满足条件的页，其余的行仍要检查条件"""
+        column_names = list(self.columns.keys())
+        predicates = compile_predicates(conditions, column_names) if conditions else None
+        for rid, values in self.scan(txn, predicates=predicates):
+            yield rid, dict(zip(column_names, values))
+
+    def insert(self, values: List[Any], txn=None) -> int:
+        """插入数据，返回行ID"""
+        with self.lock.shared():
             column_names = list(self.columns.keys())
             if len(values) != len(column_names):
                 raise Exception(f"值的数量 ({len(values)}) 与列的数量 ({len(column_names)}) 不匹配")
@@ -26,6 +307,7 @@ class Table:
             # 类型转换和验证
             row_data = {}
             for col_name, value in zip(column_names, values):
+                self._check_not_null(col_name, value)
                 col_type = self.columns[col_name]
                 try:
                     if col_type == 'INT':
@@ -34,175 +316,355 @@ class Table:
                         value = float(value)
                     elif col_type == 'TEXT':
                         value = str(value)
-                except ValueError:
-                    raise Exception(f"列 {col_name} 的值 {value} 不能转换为 {col_type} 类型")
+                except (ValueError, TypeError):
+                    raise Exception(f"列 {col_name} 的值 {value!r} 不能转换为 {col_type} 类型")
                 row_data[col_name] = value
             
-            self.data.append(row_data)
-            # 更新索引
-            for col, index in self.indexes.items():
-                index.insert(row_data[col], row_index)
+            row = tuple(row_data.values())
+
+            def write() -> int:
+                rid = self.heap.insert(row, txn)
+                # 更新索引
+                self._index_add(row_data, rid)
+                return rid
+
+            if self.unique_columns:
+                row_index = self._unique_write(lambda: self._check_unique(row, txn), write, txn)
+            else:
+                row_index = write()
+            self.modifications += 1
+            self.bump_version()
+            return row_index
+
+    def insert_many(self, rows: Iterable[Sequence[Any]], txn=None) -> int:
+        """批量插入多行，返回插入的行数
+
+        行按 BULK_INSERT_BATCH 分批：每批逐列做一次类型转换，一次写入存储（每页一条日志），
+        再把新键排序后加入索引。rows 可以是任意可迭代对象，不会一次读入内存。
+        """
+        count = 0
+        batch: List[Sequence[Any]] = []
+        for values in rows:
+            batch.append(values)
+            if len(batch) == BULK_INSERT_BATCH:
+                count += self._insert_batch(batch, txn)
+                batch = []
+        if batch:
+            count += self._insert_batch(batch, txn)
+        return count
+
+    def _insert_batch(self, rows: List[Sequence[Any]], txn) -> int:
+        with self.lock.shared():
+            converted = self._convert_rows(rows)
+            column_names = list(self.columns.keys())
+
+            def write() -> List[int]:
+                rids = self.heap.insert_many(converted, txn)
+                for col, index in self.indexes.items():
+                    position = column_names.index(col)
+                    entries = list(zip((row[position] for row in converted), rids))
+                    try:
+                        entries.sort()
+                    except TypeError:
+                        pass
+                    for key, rid in entries:
+                        index.add(key, rid)
+                return rids
+
+            if self.unique_columns:
+                rids = self._unique_write(lambda: self._check_unique_batch(converted, txn), write, txn)
+            else:
+                rids = write()
+            self.modifications += len(rids)
+            self.bump_version()
+            return len(rids)
+
+    def _check_unique_batch(self, rows: List[Tuple[Any, ...]], txn) -> Any:
+        """检查一批新行在唯一列上的值互不相同，也没有被表中已有的行使用，返回值同 _check_unique"""
+        column_names = list(self.columns.keys())
+        waiting = None
+        for col in self.unique_columns:
+            position = column_names.index(col)
+            seen = set()
+            for row in rows:
+                value = row[position]
+                if value is None:
+                    continue
+                holder = True if value in seen else self._key_holder(col, position, value, txn)
+                if holder is True:
+                    self._unique_violation(col, value)
+                waiting = waiting or holder
+                seen.add(value)
+        return waiting
+
+    def _convert_rows(self, rows: List[Sequence[Any]]) -> List[Tuple[Any, ...]]:
+        """按列转换一批行的类型"""
+        width = len(self.columns)
+        for values in rows:
+            if len(values) != width:
+                raise Exception(f"值的数量 ({len(values)}) 与列的数量 ({width}) 不匹配")
+        columns = []
+        for (col_name, col_type), values in zip(self.columns.items(), zip(*rows)):
+            if None in values:
+                self._check_not_null(col_name, None)
+            convert = CONVERTERS.get(col_type)
+            if convert is None:
+                columns.append(values)
+                continue
+            try:
+                columns.append(list(map(convert, values)))
+            except (ValueError, TypeError):
+                for value in values:
+                    try:
+                        convert(value)
+                    except (ValueError, TypeError):
+                        raise Exception(f"列 {col_name} 的值 {value!r} 不能转换为 {col_type} 类型")
+                raise
+        return list(zip(*columns))
 
     def select(self, columns: Optional[List[str]] = None, conditions: Optional[Dict] = None,
               group_by: Optional[List[str]] = None, having: Optional[Dict] = None,
               order_by: Optional[List[Tuple[str, str]]] = None,
               aggregates: Optional[List[Dict]] = None) -> List[Dict[str, Any]]:
-        """查询数据"""
-        # 筛选数据
-        result = self.data
-        if conditions:
-            result = self._filter_data(result, conditions)
+        """查询数据，由查询规划器选择访问路径和聚合方式"""
+        parsed = {
+            'columns': columns,
+            'where': conditions,
+            'group_by': group_by,
+            'having': having,
+            'order_by': order_by,
+            'aggregates': aggregates or [],
+        }
+        return Planner().plan_select(parsed, self).run()
 
-        # 处理 GROUP BY
-        if group_by or aggregates:
-            return self._process_aggregates(result, columns, group_by, having, aggregates)
+    def statistics(self) -> TableStatistics:
+        """返回表的统计信息
 
-        # 如果没有 GROUP BY，但有聚合函数
-        if aggregates and not group_by:
-            return self._process_aggregates(result, columns, None, having, aggregates)
+        从未收集过或上次收集后修改的行数超过阈值时自动抽样重新收集。
+        """
+        stats = self._statistics
+        changed = self.modifications - self._statistics_modifications
+        if stats is None or changed > ANALYZE_THRESHOLD + ANALYZE_SCALE_FACTOR * stats.row_count:
+            stats = self._set_statistics(collect_statistics(self, AUTO_ANALYZE_SAMPLE_PAGES))
+        return stats
 
-        # 处理普通查询
-        if columns is None:
-            columns = list(self.columns.keys())
+    def analyze(self) -> TableStatistics:
+        """扫描全表收集统计信息"""
+        return self._set_statistics(collect_statistics(self))
 
-        # 验证列名
-        for col in columns:
-            if col not in self.columns:
-                raise Exception(f"未知的列名: {col}")
+    def _set_statistics(self, stats: TableStatistics) -> TableStatistics:
+        self._statistics = stats
+        self._statistics_modifications = self.modifications
+        return stats
 
-        # 排序
-        if order_by:
-            for col, direction in reversed(order_by):
-                result = sorted(
-                    result,
-                    key=lambda x: x[col],
-                    reverse=(direction == 'DESC')
-                )
-
-        # 投影列
-        return [{col: row[col] for col in columns} for row in result]
-
-    def _process_aggregates(self, data: List[Dict[str, Any]], columns: Optional[List[str]],
-                          group_by: Optional[List[str]], having: Optional[Dict],
-                          aggregates: List[Dict]) -> List[Dict[str, Any]]:
-        """处理聚合函数和分组"""
-        if not group_by:
-            # 不分组，直接计算聚合
-            result = self._calculate_aggregates(data, aggregates)
-            if columns:
-                result.update({col: data[0][col] for col in columns if col in data[0]})
-            return [result]
-
-        # 按组分类数据
-        groups = defaultdict(list)
-        for row in data:
-            key = tuple(row[col] for col in group_by)
-            groups[key].append(row)
-
-        # 计算每个组的结果
-        result = []
-        for key, group_data in groups.items():
-            group_result = dict(zip(group_by, key))
-            agg_results = self._calculate_aggregates(group_data, aggregates)
-            group_result.update(agg_results)
-            
-            # 应用 HAVING 条件
-            if having:
-                if not self._match_having_conditions(group_result, having):
-                    continue
-            
-            result.append(group_result)
-
-        # 返回结果
-        return result
-
-    def _calculate_aggregates(self, data: List[Dict[str, Any]], 
-                            aggregates: List[Dict]) -> Dict[str, Any]:
-        """计算聚合函数"""
-        result = {}
-        for agg in aggregates:
-            func = agg['function']
-            arg = agg['argument']
-            alias = agg['alias']
-            
-            if arg == '*':
-                values = [1] * len(data)  # 用于 COUNT(*)
-            else:
-                values = [row[arg] for row in data]
-            
-            if func == 'COUNT':
-                result[alias] = len(values)
-            elif func == 'SUM':
-                result[alias] = sum(values)
-            elif func == 'AVG':
-                result[alias] = sum(values) / len(values) if values else 0
-            elif func == 'MAX':
-                result[alias] = max(values) if values else None
-            elif func == 'MIN':
-                result[alias] = min(values) if values else None
-            
-        return result
-
-    def _match_having_conditions(self, group_result: Dict[str, Any], 
-                               having: Dict[str, Any]) -> bool:
-        """检查是否满足 HAVING 条件"""
-        ops = {
-            '=': operator.eq,
-            '!=': operator.ne,
-            '>': operator.gt,
-            '>=': operator.ge,
-            '<': operator.lt,
-            '<=': operator.le
-        }
-        
-        for condition in having['conditions']:
-            if condition['type'] == 'aggregate':
-                col_name = f"{condition['function'].lower()}_{condition['argument']}"
-                if col_name not in group_result:
-                    return False
-                if not ops[condition['operator']](group_result[col_name], condition['value']):
-                    return False
-            else:
-                col = condition['column']
-                if col not in group_result:
-                    return False
-                if not ops[condition['operator']](group_result[col], condition['value']):
-                    return False
-        
-        return True
+    def update(self, updates: Dict[str, Any], conditions: Optional[Dict] = None, txn=None) -> int:
+        """更新数据
 
-    def update(self, updates: Dict[str, Any], conditions: Optional[Dict] = None) -> int:
-        """更新数据"""
+        在事务中更新时，条件按事务的快照匹配；旧版本的索引项保留到旧版本被回收为止。
+        """
         # 验证列名
         for col in updates:
             if col not in self.columns:
                 raise Exception(f"未知的列名: {col}")
+            self._check_not_null(col, updates[col])
+        unique = [col for col in self.unique_columns if col in updates]
         
-        # 找到匹配的行
-        if conditions:
-            rows = self._filter_data(self.data, conditions)
-        else:
-            rows = self.data
-        
-        # 更新数据
-        count = 0
-        for row in rows:
-            for col, value in updates.items():
-                row[col] = self._convert_value(value, self.columns[col])
-            count += 1
+        with self.lock.shared():
+            # 找到匹配的行
+            rows = self._filter_data(conditions, txn)
+            
+            # 更新数据
+            count = 0
+            for rid, row in rows:
+                if txn is not None:
+                    row = self._lock_row(rid, row, txn, conditions)
+                    if row is None:
+                        continue
+                new_row = dict(row)
+                for col, value in updates.items():
+                    new_row[col] = self._convert_value(value, self.columns[col])
+                values = tuple(new_row.values())
+
+                def write() -> int:
+                    new_rid = self.heap.update(rid, values, txn)
+                    self._index_update(row, new_row, rid, new_rid, txn is None)
+                    return new_rid
+
+                if unique:
+                    # 每行单独检查和写入，等待行锁或其他事务期间不持有唯一性检查锁
+                    new_rid = self._unique_write(lambda: self._check_unique(values, txn, rid, unique), write, txn)
+                else:
+                    new_rid = write()
+                if new_rid != rid:
+                    self.dead_rows += 1
+                count += 1
+            self.modifications += count
+            self.bump_version()
         
         return count
 
-    def delete(self, conditions: Optional[Dict] = None) -> int:
-        """删除数据"""
-        if conditions is None:
-            count = len(self.data)
-            self.data = []
+    def delete(self, conditions: Optional[Dict] = None, txn=None) -> int:
+        """删除数据
+
+        在事务中删除时，条件按事务的快照匹配；索引项保留到被删除的版本被回收为止。
+        """
+        if conditions is None and txn is None:
+            with self.lock.exclusive():
+                count = self.heap.row_count
+                self.heap.truncate()
+                for index in self.indexes.values():
+                    index.clear()
+                self.modifications += count
+                self.bump_version()
+                self.dead_rows = 0
+                return count
+
+        with self.lock.shared():
+            rows = self._filter_data(conditions, txn)
+            count = 0
+            for rid, row in rows:
+                if txn is not None:
+                    row = self._lock_row(rid, row, txn, conditions)
+                    if row is None:
+                        continue
+                self.heap.delete(rid, txn)
+                if txn is None:
+                    self._index_remove(row, rid)
+                count += 1
+            self.modifications += count
+            self.bump_version()
+            self.dead_rows += count
             return count
-        
-        original_length = len(self.data)
-        self.data = [row for row in self.data if not self._match_conditions(row, conditions)]
-        return original_length - len(self.data)
+
+    def _lock_row(self, rid: int, row: Dict[str, Any], txn, conditions: Optional[Dict]) -> Optional[Dict[str, Any]]:
+        """事务修改一行之前加行锁并检查写冲突，返回要修改的行，行已不满足条件时返回 None
+
+        行正被其他事务修改时在行锁上等待。等到锁之后，REPEATABLE READ 及以上的级别发现行在快照之后
+        被修改过就失败（先提交者获胜）；READ COMMITTED 改为读取行的最新提交版本并重新检查条件，
+        行已被删除或不再满足条件时跳过它。
+        """
+        txn.lock((self.name, rid))
+        chain = self.heap.versions.get(rid)
+        try:
+            txn.check_writable(chain)
+        except SerializationError:
+            if not txn.isolation_level.statement_snapshot:
+                raise
+            latest = chain[-1]
+            if latest.end is not MAX_TIMESTAMP:
+                return None
+            current = dict(zip(self.columns, latest.row))
+            if conditions and not self._match_conditions(current, conditions):
+                return None
+            return current
+        return row
+
+    def restore(self, rid: int, before: Optional[Tuple[Any, ...]], txn=None) -> None:
+        """回滚时把行恢复为修改前的值，同时撤销版本链上的修改并维护索引"""
+        with self.lock.shared():
+            heap = self.heap
+            current = heap.get(rid)
+            heap.restore(rid, before, txn)
+            keep = [before] if before is not None else []
+            with heap.versions_lock:
+                chain = heap.versions.get(rid)
+                if txn is not None and chain is not None:
+                    if current is not None and chain[-1].begin is txn:
+                        # 撤销本事务写入的版本
+                        chain = chain[:-1]
+                    if chain and chain[-1].end is txn:
+                        chain[-1].end = MAX_TIMESTAMP
+                    if chain:
+                        heap.versions[rid] = chain
+                        keep.extend(version.row for version in chain)
+                    else:
+                        del heap.versions[rid]
+            if current is not None:
+                self._index_release(current, rid, keep)
+                if before is None:
+                    self.dead_rows += 1
+            if before is not None:
+                self._index_add(dict(zip(self.columns, before)), rid)
+            self.modifications += 1
+            self.bump_version()
+
+    def bump_version(self) -> None:
+        with self._version_lock:
+            self.version += 1
+
+    def prune_versions(self, horizon: int) -> int:
+        """回收所有快照都不再需要的旧版本，返回删除的版本链数
+
+        结束时间戳不大于 horizon 的版本对任何事务都不可见，丢弃并删除其索引项；
+        剩下的唯一版本对所有事务可见时整条链删除，此后直接读取存储中的行。
+        """
+        versions = self.heap.versions
+        if not versions:
+            return 0
+        removed = 0
+        releases = []
+        with self.lock.shared():
+            # 持有版本链锁时不能去拿索引闩，索引项在释放版本链锁之后再删除
+            with self.heap.versions_lock:
+                for rid, chain in list(versions.items()):
+                    live = []
+                    dead = []
+                    for version in chain:
+                        end = version.end
+                        (dead if type(end) is int and end <= horizon else live).append(version)
+                    # 链上总有存储中的当前行（最新版本未被删除时就是它），它的索引项要保留
+                    keep = [version.row for version in live]
+                    if len(live) == 1:
+                        version = live[0]
+                        if type(version.begin) is int and version.begin <= horizon and version.end is MAX_TIMESTAMP:
+                            live = []
+                    if len(live) == len(chain):
+                        continue
+                    if live:
+                        versions[rid] = live
+                    else:
+                        del versions[rid]
+                        removed += 1
+                    releases.extend((version.row, rid, keep) for version in dead)
+            for values, rid, keep in releases:
+                self._index_release(values, rid, keep)
+        return removed
+
+    def needs_vacuum(self) -> bool:
+        """删除的行是否多到需要清理"""
+        return self.dead_rows > VACUUM_THRESHOLD + VACUUM_SCALE_FACTOR * self.heap.row_count
+
+    def vacuum(self, horizon: int, shrink: bool = False) -> Dict[str, int]:
+        """清理表，返回 {'versions': 回收的版本链数, 'rows': 去掉的已删除行数, 'slots': 去掉的空槽数, 'pages': 截掉的页数}
+
+        先回收 horizon 之前的旧版本，再回收已删除行的空间。shrink 为 True 时调用者保证没有其他事务，
+        此时列式表去掉已删除的行（行ID改变，索引只更新被移动的行），行存储截掉文件末尾的空页。
+        """
+        stats = {'versions': self.prune_versions(horizon), 'rows': 0, 'slots': 0, 'pages': 0}
+        with (self.lock.exclusive() if shrink else self.lock.shared()):
+            heap = self.heap
+            if isinstance(heap, ColumnStore):
+                if not shrink or heap.versions:
+                    return stats
+                stats['rows'] = heap.deleted_count
+                self._index_move(heap.compact())
+            else:
+                stats.update(heap.vacuum(shrink))
+            self.dead_rows = 0
+        return stats
+
+    def _index_move(self, moved: List[Tuple[int, int]]) -> None:
+        """行ID改变后更新索引：先删除所有被移动行的旧索引项，再按新行ID加入"""
+        if not moved or not self.indexes:
+            return
+        column_names = list(self.columns.keys())
+        rows = [(old, new, self.heap.get(new)) for old, new in moved]
+        for col, index in self.indexes.items():
+            position = column_names.index(col)
+            for old, _, values in rows:
+                index.remove(values[position], old)
+            for _, new, values in rows:
+                index.add(values[position], new)
 
     def _convert_value(self, value: Any, col_type: str) -> Any:
         """转换值的类型"""
@@ -214,33 +676,102 @@ class Table:
             elif col_type == 'TEXT':
                 return str(value)
             return value
-        except ValueError:
-            raise Exception(f"值 {value} 不能转换为 {col_type} 类型")
+        except (ValueError, TypeError):
+            raise Exception(f"值 {value!r} 不能转换为 {col_type} 类型")
 
     def _match_conditions(self, row: Dict[str, Any], conditions: Dict) -> bool:
         """检查行是否匹配条件"""
-        ops = {
-            '=': operator.eq,
-            '!=': operator.ne,
-            '>': operator.gt,
-            '>=': operator.ge,
-            '<': operator.lt,
-            '<=': operator.le
-        }
-        
         for condition in conditions['conditions']:
             col = condition['column']
-            op = condition['operator']
-            val = condition['value']
-            
             if col not in row:
                 raise Exception(f"未知的列名: {col}")
             
-            if not ops[op](row[col], val):
+            if not OPERATORS[condition['operator']](row[col], condition['value']):
                 return False
         
         return True
 
-    def _filter_data(self, data: List[Dict[str, Any]], conditions: Dict) -> List[Dict[str, Any]]:
-        """根据条件筛选数据"""
-        return [row for row in data if self._match_conditions(row, conditions)]
\ No newline at end of file
+    def index_value_ok(self, column: str, value: Any) -> bool:
+        """值能否直接在列的索引上比较（类型转换不会改变比较结果），None 表示没有边界"""
+        if value is None:
+            return True
+        try:
+            return self._convert_value(value, self.columns[column]) == value
+        except Exception:
+            return False
+
+    def index_ranges(self, conditions: Optional[Dict]) -> Dict[str, Tuple[Any, bool, Any, bool]]:
+        """从条件中找出每个带索引的列上的范围 {列: (下界, 含下界, 上界, 含上界)}
+
+        同一列上的多个范围条件合并为一个区间，等值条件的上下界相同。
+        值为参数时执行时才知道，参数不与其他边界合并。
+        """
+        if not conditions:
+            return {}
+        bounds: Dict[str, Tuple[Any, bool, Any, bool]] = {}
+        equal = set()
+        for condition in conditions['conditions']:
+            col = condition.get('column')
+            op = condition['operator']
+            if col not in self.index_names.values() or op not in ('=', '<', '<=', '>', '>=') or col in equal:
+                continue
+            if op != '=' and not self.ordered_index(col):
+                # 哈希索引只能用于等值条件
+                continue
+            value = condition['value']
+            if not isinstance(value, Parameter) and not self.index_value_ok(col, value):
+                # 类型转换会改变比较结果时不能使用索引
+                continue
+            lo, lo_inc, hi, hi_inc = bounds.get(col, (None, True, None, True))
+            if op == '=':
+                equal.add(col)
+                lo, lo_inc, hi, hi_inc = value, True, value, True
+            elif isinstance(value, Parameter) or isinstance(lo if op in ('>', '>=') else hi, Parameter):
+                if (lo if op in ('>', '>=') else hi) is not None:
+                    continue
+                if op in ('>', '>='):
+                    lo, lo_inc = value, op == '>='
+                else:
+                    hi, hi_inc = value, op == '<='
+            elif op in ('>', '>=') and (lo is None or value > lo or (value == lo and op == '>')):
+                lo, lo_inc = value, op == '>='
+            elif op in ('<', '<=') and (hi is None or value < hi or (value == hi and op == '<')):
+                hi, hi_inc = value, op == '<='
+            bounds[col] = (lo, lo_inc, hi, hi_inc)
+        return bounds
+
+    def _index_range(self, conditions: Optional[Dict]) -> Optional[Tuple[str, Any, bool, Any, bool]]:
+        """选一个可用索引的列和范围 (列, 下界, 含下界, 上界, 含上界)，等值条件优先"""
+        ranges = self.index_ranges(conditions)
+        if not ranges:
+            return None
+        col = next((c for c, (lo, _, hi, _) in ranges.items() if lo is not None and lo == hi), None)
+        if col is None:
+            col = next(iter(ranges))
+        return (col,) + ranges[col]
+
+    def _fetch_rows(self, rids: List[int], txn=None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """按行ID读取行"""
+        column_names = list(self.columns.keys())
+        for rid in rids:
+            values = self.fetch(rid, txn)
+            if values is not None:
+                yield rid, dict(zip(column_names, values))
+
+    def _filter_data(self, conditions: Optional[Dict], txn=None) -> List[Tuple[int, Dict[str, Any]]]:
+        """根据条件筛选事务快照可见的数据，返回 (行ID, 行)
+
+        条件中的 =, <, <=, >, >= 列上有索引时只读取索引命中的行，否则扫描全表。
+        索引中可能还有同一行旧版本的键，读出的行会用全部条件重新检查。
+        结果按行ID排序，与全表扫描的顺序一致。
+        """
+        if not conditions:
+            return list(self._scan(txn))
+        index_range = self._index_range(conditions)
+        if index_range is None:
+            candidates = self._scan(txn, conditions)
+        else:
+            col, lo, lo_inc, hi, hi_inc = index_range
+            rids = sorted(set(self.get_index(col).find_range(lo, hi, lo_inc, hi_inc)))
+            candidates = self._fetch_rows(rids, txn)
+        return [(rid, row) for rid, row in candidates if self._match_conditions(row, conditions)]
\ No newline at end of file
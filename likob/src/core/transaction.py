@@ -1,5 +1,14 @@
-from typing import List, Dict, Any
+import sys
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Tuple, Optional, Iterator
 from enum import Enum
+from .exceptions import SerializationError
+from .lock_manager import LockManager
+
+# 版本的结束时间戳为 MAX_TIMESTAMP 表示还没有被删除或更新
+MAX_TIMESTAMP = sys.maxsize
+
 
 class IsolationLevel(Enum):
     READ_UNCOMMITTED = "READ UNCOMMITTED"
@@ -7,16 +16,150 @@ class IsolationLevel(Enum):
     REPEATABLE_READ = "REPEATABLE READ"
     SERIALIZABLE = "SERIALIZABLE"
 
+    @property
+    def statement_snapshot(self) -> bool:
+        """是否每条语句开始时取新快照（否则整个事务使用开始时的快照）
+
+        READ UNCOMMITTED 按 READ COMMITTED 处理，不会读到未提交的数据；
+        SERIALIZABLE 按快照隔离处理，与 REPEATABLE READ 相同。
+        """
+        return self in (IsolationLevel.READ_UNCOMMITTED, IsolationLevel.READ_COMMITTED)
+
+
+class RowVersion:
+    """行的一个版本
+
+    begin/end 为创建和删除该版本的事务的提交时间戳；事务提交前保存事务对象本身，
+    提交时统一改为提交时间戳。end 为 MAX_TIMESTAMP 表示版本仍然有效。
+    """
+
+    __slots__ = ('row', 'begin', 'end')
+
+    def __init__(self, row: Tuple[Any, ...], begin: Any, end: Any = MAX_TIMESTAMP):
+        self.row = row
+        self.begin = begin
+        self.end = end
+
+    def __repr__(self) -> str:
+        return f"RowVersion({self.row!r}, {self.begin!r}, {self.end!r})"
+
+
+def _timestamp(value: Any, txn: "Transaction") -> Optional[int]:
+    """版本时间戳的实际值：本事务的修改为 -1，未提交的其他事务为 None"""
+    if type(value) is int:
+        return value
+    if value is txn:
+        return -1
+    return value.commit_ts
+
+
+def visible_row(chain: List[RowVersion], txn: "Transaction") -> Optional[Tuple[Any, ...]]:
+    """从版本链中找出事务快照可见的版本，没有可见版本时返回 None"""
+    snapshot = txn.snapshot
+    for version in reversed(chain):
+        begin = _timestamp(version.begin, txn)
+        if begin is None or begin > snapshot:
+            continue
+        end = version.end
+        if end is MAX_TIMESTAMP:
+            return version.row
+        end = _timestamp(end, txn)
+        if end == -1:
+            return None
+        if end is None or end > snapshot:
+            return version.row
+        return None
+    return None
+
+
 class Transaction:
-    def __init__(self, isolation_level: IsolationLevel = IsolationLevel.READ_COMMITTED):
+    def __init__(self, isolation_level: IsolationLevel = IsolationLevel.READ_COMMITTED, txid: int = 0,
+                 snapshot: int = 0, locks: Optional[LockManager] = None):
+        self.txid = txid
         self.operations: List[Dict[str, Any]] = []
+        # 回滚信息: (堆文件, 行ID, 修改前的行)，按修改顺序排列
+        self.undo_log: List[Tuple[Any, int, Optional[tuple]]] = []
         self.is_active = True
         self.isolation_level = isolation_level
+        # 快照时间戳：提交时间戳不大于它的版本可见
+        self.snapshot = snapshot
+        self.commit_ts: Optional[int] = None
+        # 本事务创建的版本和结束的版本，提交时写入提交时间戳
+        self.created: List[RowVersion] = []
+        self.ended: List[RowVersion] = []
+        # 行锁由锁管理器分配；first_lsn 为本事务第一条日志记录的 LSN（不小于它），检查点不能删除它之后的日志
+        self.locks = locks
+        self.first_lsn: Optional[int] = None
+        # 是否已经持有以本事务为键的锁
+        self._holding = False
 
     def add_operation(self, operation: Dict[str, Any]):
         if self.is_active:
             self.operations.append(operation)
 
+    def lock(self, key) -> None:
+        """对 key（通常是 (表名, 行ID)）加排他锁，持有到事务结束"""
+        if self.locks is not None:
+            self.locks.acquire(self, key)
+
+    def hold(self) -> None:
+        """第一次写入时对本事务自身加锁，持有到事务结束；其他事务用 wait_for 等待本事务结束"""
+        if not self._holding and self.locks is not None:
+            self.locks.acquire(self, self)
+            self._holding = True
+
+    def wait_for(self, other: "Transaction") -> None:
+        """等待另一个事务提交或回滚，与等待行锁一样检测死锁、受超时限制"""
+        if self.locks is None:
+            raise SerializationError(f"事务 {other.txid} 尚未结束，请回滚后重试")
+        self.locks.wait(self, other)
+
+    def record_write(self, heap, rid: int, before: Optional[tuple], after: Optional[tuple]) -> None:
+        """在修改行之前登记回滚信息，并在堆的版本链上追加新版本
+
+        先有版本链再修改存储，并发的读者看到新数据时一定也能看到版本链。
+        """
+        self.hold()
+        self.undo_log.append((heap, rid, before))
+        versions = heap.versions
+        with heap.versions_lock:
+            chain = versions.get(rid)
+            if before is not None:
+                if chain is None:
+                    # 没有版本链的行对所有快照可见
+                    chain = [RowVersion(before, 0)]
+                chain[-1].end = self
+                self.ended.append(chain[-1])
+            if after is not None:
+                version = RowVersion(after, self)
+                chain = chain + [version] if chain is not None else [version]
+                self.created.append(version)
+            if chain is not None:
+                versions[rid] = chain
+
+    def record_inserts(self, heap, rids: List[int], rows: List[tuple]) -> None:
+        """登记批量插入的行"""
+        self.hold()
+        self.undo_log.extend((heap, rid, None) for rid in rids)
+        created = [RowVersion(row, self) for row in rows]
+        # 新行所在的槽不会有版本链：有版本链的空槽不会被复用
+        with heap.versions_lock:
+            heap.versions.update(zip(rids, ([version] for version in created)))
+        self.created.extend(created)
+
+    def check_writable(self, chain: Optional[List[RowVersion]]) -> None:
+        """修改一行之前检查写冲突
+
+        行的最新版本在本事务的快照之后由其他事务提交，或者正被其他未提交的事务修改时，
+        先提交（先修改）的事务获胜，本事务的修改失败。
+        """
+        if chain is None:
+            return
+        latest = chain[-1]
+        begin = _timestamp(latest.begin, self)
+        if latest.end is not MAX_TIMESTAMP or begin is None or begin > self.snapshot:
+            raise SerializationError("写冲突: 行已被并发事务修改，请回滚后重试")
+
     def commit(self):
         if not self.is_active:
             raise Exception("Transaction is already committed or rolled back.")
@@ -28,3 +171,96 @@ class Transaction:
             raise Exception("Transaction is already committed or rolled back.")
         self.is_active = False
         self.operations.clear()  # 清空操作
+
+
+class TransactionManager:
+    """分配事务ID和时间戳，记录活动事务
+
+    每次有修改的事务提交时逻辑时钟加一，事务的快照为开始时（或语句开始时）的时钟值。
+    所有活动事务中最小的快照是回收旧版本的界限：结束时间戳不大于它的版本对任何事务都不可见。
+    事务结束时释放它在锁管理器中持有的行锁。
+    """
+
+    def __init__(self, default_level: IsolationLevel = IsolationLevel.READ_COMMITTED,
+                 lock_timeout: Optional[float] = None):
+        self.default_level = default_level
+        self.locks = LockManager(lock_timeout)
+        self.lock = threading.Lock()
+        self.clock = 0
+        self.active: Dict[int, Transaction] = {}
+        self._next_txid = 1
+        self._horizon = 0
+
+    def begin(self, isolation_level: Optional[IsolationLevel] = None) -> Transaction:
+        """开始一个事务并取快照"""
+        with self.lock:
+            txn = Transaction(isolation_level or self.default_level, self._next_txid, self.clock, self.locks)
+            self._next_txid += 1
+            self.active[txn.txid] = txn
+            return txn
+
+    def refresh(self, txn: Transaction) -> None:
+        """语句级快照的隔离级别在每条语句开始时取新快照"""
+        if txn.isolation_level.statement_snapshot:
+            with self.lock:
+                txn.snapshot = self.clock
+
+    def commit(self, txn: Transaction) -> None:
+        """分配提交时间戳并写入本事务创建和结束的版本"""
+        if txn.created or txn.ended:
+            with self.lock:
+                self.clock += 1
+                txn.commit_ts = self.clock
+            # 提交时间戳分配之后，新快照通过事务对象就能看到这些版本
+            for version in txn.created:
+                if version.begin is txn:
+                    version.begin = txn.commit_ts
+            for version in txn.ended:
+                if version.end is txn:
+                    version.end = txn.commit_ts
+            txn.created.clear()
+            txn.ended.clear()
+        self.finish(txn)
+
+    def finish(self, txn: Transaction) -> None:
+        """事务结束，不再持有快照和行锁"""
+        with self.lock:
+            self.active.pop(txn.txid, None)
+        self.locks.release_all(txn)
+
+    def oldest_lsn(self) -> Optional[int]:
+        """活动事务写过的最早的日志 LSN，检查点必须保留它之后的日志，事务才能在崩溃后被撤销"""
+        with self.lock:
+            lsns = [txn.first_lsn for txn in self.active.values() if txn.first_lsn is not None]
+        return min(lsns) if lsns else None
+
+    def horizon(self) -> int:
+        """所有活动事务都能看到的时间戳"""
+        with self.lock:
+            if self.active:
+                return min(txn.snapshot for txn in self.active.values())
+            return self.clock
+
+    @contextmanager
+    def quiesced(self) -> Iterator[Optional[int]]:
+        """没有活动事务时在 with 块内持有锁并产生当前时钟，期间不能开始新事务；
+        有活动事务时立即释放锁并产生 None
+        """
+        self.lock.acquire()
+        if self.active:
+            self.lock.release()
+            yield None
+            return
+        try:
+            yield self.clock
+        finally:
+            self.lock.release()
+
+    def advanced_horizon(self) -> Optional[int]:
+        """界限比上次调用时前进了则返回新界限，否则返回 None"""
+        horizon = self.horizon()
+        with self.lock:
+            if horizon <= self._horizon:
+                return None
+            self._horizon = horizon
+            return horizon
@@ -0,0 +1,4 @@
+from .server import Server, DEFAULT_PORT
+from .client import Client, AsyncConnection, ConnectionPool
+
+__all__ = ['Server', 'DEFAULT_PORT', 'Client', 'AsyncConnection', 'ConnectionPool']
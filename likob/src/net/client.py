@@ -0,0 +1,290 @@
+import asyncio
+import socket
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from ..core.exceptions import ProtocolError
+from . import protocol
+from .server import DEFAULT_PORT
+
+Statement = Tuple[str, Optional[Sequence[Any]]]
+
+
+class _Result:
+    """按帧组装一个请求的结果"""
+
+    __slots__ = ('columns', 'rowcount', 'in_transaction')
+
+    def __init__(self):
+        self.columns: List[str] = []
+        self.rowcount = -1
+        self.in_transaction = False
+
+    def feed(self, kind: bytes, payload: bytes) -> Optional[List[Dict[str, Any]]]:
+        """处理一帧，返回这一帧中的行；收到 DONE 返回 None，收到 ERROR 抛出服务器端的异常"""
+        if kind == protocol.BATCH:
+            columns = self.columns
+            return [dict(zip(columns, row)) for row in protocol.decode_batch(payload, len(columns))]
+        if kind == protocol.COLUMNS:
+            self.columns = protocol.decode_columns(payload)
+            return []
+        if kind == protocol.DONE:
+            self.rowcount, self.in_transaction = protocol.decode_done(payload)
+            return None
+        if kind == protocol.ERROR:
+            raise protocol.decode_error(payload)
+        raise ProtocolError(f"未知的回复类型: {kind!r}")
+
+
+class Client:
+    """同步客户端，一个连接对应服务器上的一个会话
+
+    execute 返回与 SimpleDB.execute 相同格式的结果；stream 边接收边产生行；
+    pipeline 一次发送多条语句再依次读取结果，只需要一次网络往返。
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT, timeout: Optional[float] = None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile('rb')
+        self.in_transaction = False
+        self._next_id = 0
+        # 已发送但还没有读完结果的请求数，读完之前不能发送新的 stream
+        self._pending = 0
+
+    def _send(self, statements: Sequence[Statement]) -> None:
+        frames = []
+        for sql, params in statements:
+            self._next_id += 1
+            frames.append(protocol.encode_frame(protocol.QUERY, self._next_id,
+                                                protocol.encode_query(sql, params)))
+        self.sock.sendall(b''.join(frames))
+        self._pending += len(statements)
+
+    def _read_frame(self) -> Tuple[bytes, bytes]:
+        header = self.file.read(protocol.FRAME_HEADER.size)
+        if len(header) < protocol.FRAME_HEADER.size:
+            raise ProtocolError("服务器关闭了连接")
+        size, kind, _ = protocol.decode_header(header)
+        payload = self.file.read(size)
+        if len(payload) < size:
+            raise ProtocolError("服务器关闭了连接")
+        return kind, payload
+
+    def _results(self) -> Iterator[Dict[str, Any]]:
+        """读取下一个请求的结果，逐行产生"""
+        result = _Result()
+        try:
+            while True:
+                rows = result.feed(*self._read_frame())
+                if rows is None:
+                    break
+                yield from rows
+        except GeneratorExit:
+            self._skip(result)
+            raise
+        finally:
+            self._pending -= 1
+            self.in_transaction = result.in_transaction
+
+    def _skip(self, result: _Result) -> None:
+        """丢弃没有读完的结果（调用者提前关闭了迭代器），连接上的下一帧属于下一个请求"""
+        kind = None
+        while kind not in (protocol.DONE, protocol.ERROR):
+            kind, payload = self._read_frame()
+            if kind == protocol.DONE:
+                result.feed(kind, payload)
+
+    def execute(self, sql: str, params: Optional[Sequence[Any]] = None) -> List[Dict[str, Any]]:
+        """执行一条语句，语句中的 ? 按顺序替换为 params"""
+        return list(self.stream(sql, params))
+
+    def stream(self, sql: str, params: Optional[Sequence[Any]] = None) -> Iterator[Dict[str, Any]]:
+        """执行查询，边接收边产生结果行；读完或关闭迭代器之后才能执行下一条语句"""
+        self._check_idle()
+        self._send([(sql, params)])
+        return self._results()
+
+    def _check_idle(self) -> None:
+        if self._pending:
+            raise Exception("上一个查询的结果还没有读完")
+
+    def pipeline(self, statements: Sequence[Statement]) -> List[Any]:
+        """连续发送多条语句，返回每条语句的结果；失败的语句对应的位置是异常对象，不影响后面的语句
+
+        未收到结果的语句最多 protocol.MAX_PENDING 条，每读完一条的结果再发送下一条：
+        服务器的请求队列满时暂停读取连接，一次发送全部语句会和等待客户端读取结果的服务器互相等待。
+        """
+        self._check_idle()
+        statements = list(statements)
+        window = protocol.MAX_PENDING
+        self._send(statements[:window])
+        results: List[Any] = []
+        for i in range(len(statements)):
+            try:
+                results.append(list(self._results()))
+            except ProtocolError:
+                raise
+            except Exception as e:
+                results.append(e)
+            if i + window < len(statements):
+                self._send([statements[i + window]])
+        return results
+
+    def close(self) -> None:
+        """关闭连接，服务器回滚未提交的事务"""
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+class AsyncConnection:
+    """asyncio 客户端连接
+
+    多个协程可以在同一个连接上同时发出请求，请求按发送顺序流水线执行，结果按请求号分发给各自的协程。
+    这些请求共用服务器上的一个会话，需要独立事务时从 ConnectionPool 取得各自的连接。
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.in_transaction = False
+        self._next_id = 0
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._error: Optional[Exception] = None
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    @classmethod
+    async def connect(cls, host: str = '127.0.0.1', port: int = DEFAULT_PORT) -> "AsyncConnection":
+        reader, writer = await asyncio.open_connection(host, port)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(reader, writer)
+
+    @property
+    def closed(self) -> bool:
+        return self._dispatcher.done()
+
+    async def _dispatch(self) -> None:
+        """读取服务器的回复，按请求号放入对应的队列"""
+        try:
+            while True:
+                header = await self.reader.readexactly(protocol.FRAME_HEADER.size)
+                size, kind, request_id = protocol.decode_header(header)
+                payload = await self.reader.readexactly(size)
+                queue = self._queues.get(request_id)
+                if queue is not None:
+                    queue.put_nowait((kind, payload))
+        except (asyncio.IncompleteReadError, ConnectionError, ProtocolError) as e:
+            self._error = e if isinstance(e, ProtocolError) else ProtocolError("服务器关闭了连接")
+        finally:
+            for queue in self._queues.values():
+                queue.put_nowait(None)
+
+    async def stream(self, sql: str, params: Optional[Sequence[Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """执行语句，边接收边产生结果行"""
+        if self.closed:
+            raise self._error or ProtocolError("连接已关闭")
+        self._next_id += 1
+        request_id = self._next_id
+        queue = self._queues[request_id] = asyncio.Queue()
+        try:
+            self.writer.write(protocol.encode_frame(protocol.QUERY, request_id,
+                                                    protocol.encode_query(sql, params)))
+            await self.writer.drain()
+            result = _Result()
+            while True:
+                frame = await queue.get()
+                if frame is None:
+                    raise self._error or ProtocolError("连接已关闭")
+                rows = result.feed(*frame)
+                if rows is None:
+                    self.in_transaction = result.in_transaction
+                    return
+                for row in rows:
+                    yield row
+        finally:
+            del self._queues[request_id]
+
+    async def execute(self, sql: str, params: Optional[Sequence[Any]] = None) -> List[Dict[str, Any]]:
+        """执行一条语句，返回全部结果行"""
+        return [row async for row in self.stream(sql, params)]
+
+    async def close(self) -> None:
+        self.writer.close()
+        self._dispatcher.cancel()
+        try:
+            await self._dispatcher
+        except asyncio.CancelledError:
+            pass
+
+
+class ConnectionPool:
+    """asyncio 连接池
+
+    acquire 取得一个独占的连接（没有空闲连接且未达到 size 时新建，否则等待归还）；
+    归还时连接上还有未结束的事务就先回滚，下一个使用者总是拿到干净的会话。
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT, size: int = 10):
+        self.host = host
+        self.port = port
+        self.size = size
+        self._idle: List[AsyncConnection] = []
+        self._opened = 0
+        self._available = asyncio.Condition()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[AsyncConnection]:
+        connection = await self._get()
+        try:
+            yield connection
+        finally:
+            await self._release(connection)
+
+    async def _get(self) -> AsyncConnection:
+        async with self._available:
+            while not self._idle and self._opened >= self.size:
+                await self._available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._opened += 1
+        try:
+            return await AsyncConnection.connect(self.host, self.port)
+        except Exception:
+            async with self._available:
+                self._opened -= 1
+                self._available.notify()
+            raise
+
+    async def _release(self, connection: AsyncConnection) -> None:
+        if not connection.closed and connection.in_transaction:
+            try:
+                await connection.execute('ROLLBACK')
+            except Exception:
+                await connection.close()
+        async with self._available:
+            if connection.closed:
+                self._opened -= 1
+            else:
+                self._idle.append(connection)
+            self._available.notify()
+
+    async def execute(self, sql: str, params: Optional[Sequence[Any]] = None) -> List[Dict[str, Any]]:
+        """取一个连接执行一条语句后归还"""
+        async with self.acquire() as connection:
+            return await connection.execute(sql, params)
+
+    async def close(self) -> None:
+        """关闭所有空闲连接"""
+        async with self._available:
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+        for connection in idle:
+            await connection.close()
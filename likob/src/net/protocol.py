@@ -0,0 +1,184 @@
+import struct
+from typing import Any, List, Optional, Sequence, Tuple
+
+from ..core.exceptions import SerializationError, DeadlockError, StorageError, ProtocolError
+
+# 帧: 长度(4字节，不含长度本身) | 类型(1字节) | 请求号(4字节) | 内容
+FRAME_HEADER = struct.Struct('<IcI')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+# 服务器为每个连接缓存的未执行请求数，队列满时暂停读取这个连接；同步客户端流水线发送时未收到结果的请求也不超过这个数
+MAX_PENDING = 64
+
+# 客户端发送的请求
+QUERY = b'Q'      # SQL文本和参数
+# 服务器对每个请求依次回复 COLUMNS、零个或多个 BATCH，最后是 DONE 或 ERROR
+COLUMNS = b'C'    # 结果的列名
+BATCH = b'B'      # 一批结果行
+DONE = b'D'       # 结果结束：行数、会话是否在事务中
+ERROR = b'E'      # 错误类型和消息
+
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_I64 = struct.Struct('<q')
+_F64 = struct.Struct('<d')
+_DONE = struct.Struct('<q?')
+
+# 值的类型标记
+_NULL, _TRUE, _FALSE, _INT, _BIGINT, _FLOAT, _TEXT = b'N', b'T', b'F', b'i', b'I', b'd', b's'
+
+# 可以在客户端按原类型重新抛出的异常
+ERRORS = {cls.__name__: cls for cls in (SerializationError, DeadlockError, StorageError)}
+
+
+def encode_frame(kind: bytes, request_id: int, payload: bytes = b'') -> bytes:
+    return FRAME_HEADER.pack(len(payload) + FRAME_HEADER.size - 4, kind, request_id) + payload
+
+
+def decode_header(header: bytes) -> Tuple[int, bytes, int]:
+    """解析帧头，返回 (内容长度, 类型, 请求号)"""
+    length, kind, request_id = FRAME_HEADER.unpack(header)
+    size = length - (FRAME_HEADER.size - 4)
+    if size < 0 or size > MAX_FRAME_SIZE:
+        raise ProtocolError(f"帧长度不合法: {length}")
+    return size, kind, request_id
+
+
+def _encode_text(parts: List[bytes], text: str) -> None:
+    data = text.encode('utf-8')
+    parts.append(_U32.pack(len(data)))
+    parts.append(data)
+
+
+def _encode_value(parts: List[bytes], value: Any) -> None:
+    if value is None:
+        parts.append(_NULL)
+    elif value is True or value is False:
+        parts.append(_TRUE if value else _FALSE)
+    elif isinstance(value, int):
+        if -(1 << 63) <= value < (1 << 63):
+            parts.append(_INT + _I64.pack(value))
+        else:
+            parts.append(_BIGINT)
+            _encode_text(parts, str(value))
+    elif isinstance(value, float):
+        parts.append(_FLOAT + _F64.pack(value))
+    else:
+        parts.append(_TEXT)
+        _encode_text(parts, str(value))
+
+
+class _Reader:
+    """按顺序读取内容中的各个字段"""
+
+    __slots__ = ('data', 'pos')
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def unpack(self, fmt: struct.Struct) -> Any:
+        try:
+            values = fmt.unpack_from(self.data, self.pos)
+        except struct.error:
+            raise ProtocolError("内容被截断")
+        self.pos += fmt.size
+        return values[0] if len(values) == 1 else values
+
+    def text(self) -> str:
+        length = self.unpack(_U32)
+        end = self.pos + length
+        if end > len(self.data):
+            raise ProtocolError("内容被截断")
+        text = self.data[self.pos:end].decode('utf-8')
+        self.pos = end
+        return text
+
+    def value(self) -> Any:
+        if self.pos >= len(self.data):
+            raise ProtocolError("内容被截断")
+        tag = self.data[self.pos:self.pos + 1]
+        self.pos += 1
+        if tag == _NULL:
+            return None
+        if tag == _INT:
+            return self.unpack(_I64)
+        if tag == _FLOAT:
+            return self.unpack(_F64)
+        if tag == _TEXT:
+            return self.text()
+        if tag == _TRUE or tag == _FALSE:
+            return tag == _TRUE
+        if tag == _BIGINT:
+            return int(self.text())
+        raise ProtocolError(f"未知的值类型: {tag!r}")
+
+
+def encode_query(sql: str, params: Optional[Sequence[Any]]) -> bytes:
+    """QUERY 的内容: SQL文本 | 参数个数(4字节，无参数时为 0xFFFFFFFF) | 参数值"""
+    parts: List[bytes] = []
+    _encode_text(parts, sql)
+    if params is None:
+        parts.append(_U32.pack(0xFFFFFFFF))
+    else:
+        parts.append(_U32.pack(len(params)))
+        for value in params:
+            _encode_value(parts, value)
+    return b''.join(parts)
+
+
+def decode_query(payload: bytes) -> Tuple[str, Optional[List[Any]]]:
+    reader = _Reader(payload)
+    sql = reader.text()
+    count = reader.unpack(_U32)
+    if count == 0xFFFFFFFF:
+        return sql, None
+    return sql, [reader.value() for _ in range(count)]
+
+
+def encode_columns(columns: Sequence[str]) -> bytes:
+    parts = [_U16.pack(len(columns))]
+    for column in columns:
+        _encode_text(parts, column)
+    return b''.join(parts)
+
+
+def decode_columns(payload: bytes) -> List[str]:
+    reader = _Reader(payload)
+    return [reader.text() for _ in range(reader.unpack(_U16))]
+
+
+def encode_batch(rows: Sequence[Sequence[Any]]) -> bytes:
+    """BATCH 的内容: 行数(4字节) | 逐行逐列的值；列数由之前的 COLUMNS 决定"""
+    parts = [_U32.pack(len(rows))]
+    for row in rows:
+        for value in row:
+            _encode_value(parts, value)
+    return b''.join(parts)
+
+
+def decode_batch(payload: bytes, width: int) -> List[Tuple[Any, ...]]:
+    reader = _Reader(payload)
+    value = reader.value
+    return [tuple(value() for _ in range(width)) for _ in range(reader.unpack(_U32))]
+
+
+def encode_done(rowcount: int, in_transaction: bool) -> bytes:
+    return _DONE.pack(rowcount, in_transaction)
+
+
+def decode_done(payload: bytes) -> Tuple[int, bool]:
+    return _Reader(payload).unpack(_DONE)
+
+
+def encode_error(error: BaseException) -> bytes:
+    parts: List[bytes] = []
+    _encode_text(parts, type(error).__name__)
+    _encode_text(parts, str(error))
+    return b''.join(parts)
+
+
+def decode_error(payload: bytes) -> Exception:
+    """把 ERROR 的内容还原为异常，未知的类型还原为 Exception"""
+    reader = _Reader(payload)
+    name, message = reader.text(), reader.text()
+    return ERRORS.get(name, Exception)(message)
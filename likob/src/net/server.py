@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from ..core.database import SimpleDB
+from ..core.exceptions import ProtocolError
+from . import protocol
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 6390
+# 每个 BATCH 帧最多携带的行数
+BATCH_ROWS = 1000
+
+
+class _Connection:
+    """一个客户端连接，对应数据库中的一个会话
+
+    读取任务不断接收请求放入队列（客户端可以不等回复连续发送多个请求），执行任务按顺序逐个执行。
+    队列最多缓存 max_pending 个请求，满了之后读取任务暂停读取连接，由 TCP 流量控制让客户端等待，
+    不停发送请求的客户端不会让服务器的内存无限增长。
+    语句在连接专用的线程中执行：数据库的调用是阻塞的，等待行锁或磁盘时不能占用事件循环，
+    专用线程也保证一个连接的语句不会因为其他连接占满线程池而无法提交、释放行锁。
+    查询结果分批发送，客户端读得慢时 drain 会暂停产生结果，服务器不需要缓存整个结果集。
+    """
+
+    def __init__(self, server: "Server", reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.session = server.db.connect()
+        self.session.file_access = server.file_directory is not None
+        self.session.file_directory = server.file_directory
+        self.thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='likob-session')
+        self.requests: asyncio.Queue = asyncio.Queue(maxsize=server.max_pending)
+
+    async def _call(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.thread, func, *args)
+
+    async def run(self) -> None:
+        worker = asyncio.ensure_future(self._execute_requests())
+        try:
+            while True:
+                try:
+                    header = await self.reader.readexactly(protocol.FRAME_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                size, kind, request_id = protocol.decode_header(header)
+                payload = await self.reader.readexactly(size)
+                if kind != protocol.QUERY:
+                    raise ProtocolError(f"未知的请求类型: {kind!r}")
+                await self._enqueue((request_id, payload), worker)
+            # 客户端关闭发送方向后，把已经收到的请求执行完
+            await self._enqueue(None, worker)
+            await worker
+        except (ProtocolError, ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.warning("连接 %s 异常断开: %s", self.writer.get_extra_info('peername'), e)
+        finally:
+            worker.cancel()
+            # 未提交的事务回滚，释放行锁
+            await self._call(self.session.close)
+            self.thread.shutdown(wait=False)
+            self.writer.close()
+
+    async def _enqueue(self, request, worker: asyncio.Future) -> None:
+        """把请求放入队列，队列满时等待执行任务取走请求；执行任务出错结束时抛出它的异常，不再等待"""
+        if not self.requests.full():
+            self.requests.put_nowait(request)
+            return
+        put = asyncio.ensure_future(self.requests.put(request))
+        await asyncio.wait([put, worker], return_when=asyncio.FIRST_COMPLETED)
+        if put.done():
+            return
+        put.cancel()
+        worker.result()
+        raise ProtocolError("执行任务已结束")
+
+    async def _execute_requests(self) -> None:
+        while True:
+            request = await self.requests.get()
+            if request is None:
+                return
+            request_id, payload = request
+            await self._execute(request_id, payload)
+
+    async def _execute(self, request_id: int, payload: bytes) -> None:
+        write = self.writer.write
+        cursor = self.session.cursor()
+        try:
+            sql, params = protocol.decode_query(payload)
+            await self._call(cursor.execute, sql, params)
+            columns = cursor.columns or []
+            write(protocol.encode_frame(protocol.COLUMNS, request_id, protocol.encode_columns(columns)))
+            count = 0
+            while True:
+                rows = await self._call(cursor.fetchmany, self.server.batch_rows)
+                if not rows:
+                    break
+                count += len(rows)
+                write(protocol.encode_frame(protocol.BATCH, request_id,
+                                            protocol.encode_batch([tuple(row.values()) for row in rows])))
+                await self.writer.drain()
+            rowcount = cursor.rowcount if cursor.rowcount >= 0 else count
+            write(protocol.encode_frame(protocol.DONE, request_id,
+                                        protocol.encode_done(rowcount, self.session.transaction is not None)))
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            write(protocol.encode_frame(protocol.ERROR, request_id, protocol.encode_error(e)))
+        finally:
+            await self._call(cursor.close)
+        await self.writer.drain()
+
+
+class Server:
+    """asyncio TCP 服务器，多个进程通过它共享一个数据库
+
+    每个连接有自己的会话，可以在连接上开始事务；连接断开时未提交的事务回滚。
+    协议没有身份验证，能连上端口的客户端都可以执行任意语句。SAVE/LOAD/COPY 以服务器进程的权限读写文件，
+    默认禁止；指定 file_directory 后只能访问该目录之下的文件（相对路径相对于该目录）。
+    """
+
+    def __init__(self, db: SimpleDB, host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                 batch_rows: int = BATCH_ROWS, file_directory: Optional[str] = None,
+                 max_pending: int = protocol.MAX_PENDING):
+        self.db = db
+        self.host = host
+        self.port = port
+        self.batch_rows = batch_rows
+        self.max_pending = max_pending
+        self.file_directory = file_directory
+        self.connections = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        """开始监听；port 为 0 时由系统分配端口，start 之后 self.port 为实际端口"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("LikOb 服务器监听 %s:%s", self.host, self.port)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            await _Connection(self, reader, writer).run()
+        finally:
+            self.connections -= 1
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        """停止接受新连接"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
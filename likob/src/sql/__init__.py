@@ -1,4 +1,5 @@
-from .parser import SQLParser
+from .parser import SQLParser, Parameter
 from .executor import QueryExecutor
+from .lexer import tokenize
 
-__all__ = ['SQLParser', 'QueryExecutor'] 
\ No newline at end of file
+__all__ = ['SQLParser', 'Parameter', 'QueryExecutor', 'tokenize'] 
\ No newline at end of file
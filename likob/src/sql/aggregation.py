@@ -0,0 +1,139 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .sorting import SpillFile
+from .vectorized import Vector, group_reduce
+
+# 分组数超过内存预算时，哈希表中的组按键的哈希值分散写入的分区个数
+SPILL_PARTITIONS = 16
+# 读回的分区仍然放不下时最多再分区的层数，超过后不再限制内存
+MAX_SPILL_DEPTH = 4
+
+
+def initial(function: str) -> Any:
+    """一组还没有行时的部分结果，AVG 的部分结果为 (总和, 行数)"""
+    if function in ('COUNT', 'SUM'):
+        return 0
+    if function == 'AVG':
+        return 0, 0
+    return None
+
+
+def accumulate(function: str, partial: Any, value: Any) -> Any:
+    """把一行的值加入部分结果"""
+    if function == 'COUNT':
+        return partial + 1
+    if function == 'SUM':
+        return partial + value
+    if function == 'AVG':
+        return partial[0] + value, partial[1] + 1
+    if partial is None:
+        return value
+    # 相等时保留先出现的值，与对整组调用 min/max 的结果相同
+    if function == 'MIN':
+        return value if value < partial else partial
+    return value if value > partial else partial
+
+
+def combine(function: str, a: Any, b: Any) -> Any:
+    """合并同一组在两部分数据上的部分结果"""
+    if function in ('COUNT', 'SUM'):
+        return a + b
+    if function == 'AVG':
+        return a[0] + b[0], a[1] + b[1]
+    if a is None or b is None:
+        return b if a is None else a
+    return min(a, b) if function == 'MIN' else max(a, b)
+
+
+def finish(function: str, partial: Any) -> Any:
+    """部分结果转换为聚合函数的值"""
+    if function == 'AVG':
+        total, count = partial
+        return total / count if count else 0
+    return partial
+
+
+def batch_partials(function: str, ids, groups: int, vector: Optional[Vector]) -> List[Any]:
+    """一批行按组号计算每组的部分结果"""
+    if function == 'AVG':
+        return list(zip(group_reduce('SUM', ids, groups, vector), group_reduce('COUNT', ids, groups, vector)))
+    return group_reduce(function, ids, groups, vector)
+
+
+class HashAggregation:
+    """哈希分组聚合，每组只保存各聚合函数的部分结果，内存与组数而不是行数成正比
+
+    组数达到 memory_groups 时，把哈希表中的组按键的哈希值写入 SPILL_PARTITIONS 个临时文件后清空，之后的行重新在内存中聚合；
+    输入结束后逐个读回分区，合并同一组在各次写出中的部分结果，放不下的分区再按另一个哈希值分区。
+    没有写出时组按第一次出现的顺序输出，写出后按分区输出。memory_groups 为 None 时不限制组数。
+    """
+
+    def __init__(self, functions: List[str], memory_groups: Optional[int] = None, depth: int = 0):
+        self.functions = functions
+        self.memory_groups = memory_groups
+        self.depth = depth
+        self.groups: Dict[tuple, List[Any]] = {}
+        self.partitions: Optional[List[SpillFile]] = None
+        # 把哈希表写入临时文件的次数（包括读回分区时再次写出）
+        self.spills = 0
+
+    def add(self, key: tuple, values: List[Any]) -> None:
+        """加入一行，values 为各聚合函数的参数值（COUNT(*) 为 None）"""
+        state = self.groups.get(key)
+        if state is None:
+            self._reserve()
+            state = self.groups[key] = [initial(function) for function in self.functions]
+        for i, function in enumerate(self.functions):
+            state[i] = accumulate(function, state[i], values[i])
+
+    def merge(self, key: tuple, partials: List[Any]) -> None:
+        """加入一组在另一部分数据上的部分结果"""
+        state = self.groups.get(key)
+        if state is None:
+            self._reserve()
+            self.groups[key] = list(partials)
+            return
+        for i, function in enumerate(self.functions):
+            state[i] = combine(function, state[i], partials[i])
+
+    def _reserve(self) -> None:
+        if self.memory_groups is not None and len(self.groups) >= self.memory_groups:
+            self._spill()
+
+    def _spill(self) -> None:
+        if self.partitions is None:
+            self.partitions = [SpillFile() for _ in range(SPILL_PARTITIONS)]
+        buckets: List[List[Tuple[tuple, List[Any]]]] = [[] for _ in range(SPILL_PARTITIONS)]
+        depth = self.depth
+        for item in self.groups.items():
+            buckets[hash((depth, item[0])) % SPILL_PARTITIONS].append(item)
+        for partition, bucket in zip(self.partitions, buckets):
+            partition.write(bucket)
+        self.groups = {}
+        self.spills += 1
+
+    def partials(self) -> Iterator[Tuple[tuple, List[Any]]]:
+        """产生 (组键, 各聚合函数的部分结果)"""
+        if self.partitions is None:
+            yield from self.groups.items()
+            return
+        self._spill()
+        partitions, self.partitions = self.partitions, None
+        limit = self.memory_groups if self.depth + 1 < MAX_SPILL_DEPTH else None
+        try:
+            for partition in partitions:
+                sub = HashAggregation(self.functions, limit, self.depth + 1)
+                for key, partials in partition:
+                    sub.merge(key, partials)
+                partition.close()
+                yield from sub.partials()
+                self.spills += sub.spills
+        finally:
+            for partition in partitions:
+                partition.close()
+
+    def results(self) -> Iterator[Tuple[tuple, List[Any]]]:
+        """产生 (组键, 各聚合函数的值)"""
+        functions = self.functions
+        for key, partials in self.partials():
+            yield key, [finish(function, partial) for function, partial in zip(functions, partials)]
@@ -1,57 +1,135 @@
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterator, Tuple, Callable, Hashable
+from .planner import Planner, PlanNode
 
 class QueryExecutor:
     def __init__(self, db):
         self.db = db
 
-    def execute(self, parsed_sql: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
-        """执行解析后的SQL语句"""
+    def execute(self, parsed_sql: Dict[str, Any], session=None,
+                cache_key: Optional[Hashable] = None) -> Optional[List[Dict[str, Any]]]:
+        """在会话中执行解析后的SQL语句，未指定会话时使用数据库的默认会话；cache_key 为 SELECT 结果缓存的键"""
+        session = session or self.db.default_session
         command = parsed_sql['command']
         
         if command == 'CREATE':
             operation = {'command': 'CREATE', 'table': parsed_sql['table'], 'columns': parsed_sql['columns']}
-            self._add_to_transaction(operation)
-            self.db.create_table(parsed_sql['table'], parsed_sql['columns'])
+            self._add_to_transaction(operation, session)
+            self.db.create_table(parsed_sql['table'], parsed_sql['columns'], parsed_sql.get('layout', 'row'),
+                                 parsed_sql.get('constraints'))
             return [{'message': f"Table '{parsed_sql['table']}' created successfully"}]
         
+        elif command == 'CREATE_INDEX':
+            self.db.create_index(parsed_sql['index'], parsed_sql['table'], parsed_sql['column'])
+            return [{'message': f"Index '{parsed_sql['index']}' created successfully"}]
+        
+        elif command == 'DROP_INDEX':
+            self.db.drop_index(parsed_sql['index'], parsed_sql.get('table'))
+            return [{'message': f"Index '{parsed_sql['index']}' dropped"}]
+        
         elif command == 'INSERT':
-            operation = {'command': 'INSERT', 'table': parsed_sql['table'], 'values': parsed_sql['values']}
-            self._add_to_transaction(operation)
+            rows = parsed_sql['rows']
+            operation = {'command': 'INSERT', 'table': parsed_sql['table'], 'rows': rows}
+            self._add_to_transaction(operation, session)
             table = self.db.get_table(parsed_sql['table'])
-            table.insert(parsed_sql['values'])
-            return [{'message': '1 row inserted'}]
+            with session.write_transaction() as txn:
+                if len(rows) == 1:
+                    table.insert(rows[0], txn)
+                else:
+                    table.insert_many(rows, txn)
+            return [{'message': '1 row inserted' if len(rows) == 1 else f"{len(rows)} rows inserted"}]
+        
+        elif command == 'COPY':
+            operation = {'command': 'COPY', 'table': parsed_sql['table'], 'filename': parsed_sql['filename']}
+            self._add_to_transaction(operation, session)
+            count = self.db.copy_from(parsed_sql['table'], session.resolve_path(parsed_sql['filename']),
+                                      parsed_sql['header'], parsed_sql['delimiter'], session)
+            return [{'message': f"{count} rows copied"}]
         
         elif command == 'SELECT':
-            table = self.db.get_table(parsed_sql['table'])
-            return table.select(
-                columns=parsed_sql['columns'],
-                conditions=parsed_sql.get('where'),
-                group_by=parsed_sql.get('group_by'),
-                having=parsed_sql.get('having'),
-                order_by=parsed_sql.get('order_by'),
-                aggregates=parsed_sql.get('aggregates', [])
-            )
+            return list(self.stream(parsed_sql, session, cache_key)[1])
+        
+        elif command == 'EXPLAIN':
+            plan = self.plan(parsed_sql['statement'])
+            if parsed_sql['analyze']:
+                plan.set_instrument()
+                with session.read_transaction() as txn:
+                    for _ in plan.set_transaction(txn).iterate():
+                        pass
+            return [{'QUERY PLAN': line} for line in plan.explain(parsed_sql['analyze'])]
+        
+        elif command == 'ANALYZE':
+            names = [parsed_sql['table']] if parsed_sql.get('table') else list(self.db.tables)
+            for name in names:
+                self.db.get_table(name).analyze()
+            # 统计信息变化后缓存的计划需要重新生成
+            self.db.schema_version += 1
+            return [{'message': f"{len(names)} tables analyzed"}]
+        
+        elif command == 'VACUUM':
+            if session.transaction is not None:
+                raise Exception("VACUUM 不能在事务中执行")
+            stats = self.db.vacuum(parsed_sql.get('table'))
+            return [{'message': f"{stats['tables']} tables vacuumed: {stats['versions']} version chains, "
+                                f"{stats['rows']} deleted rows, {stats['slots']} slots, {stats['pages']} pages reclaimed"}]
+        
+        elif command == 'CHECKPOINT':
+            stats = self.db.checkpoint()
+            return [{'message': f"checkpoint complete: {stats['pages']} pages in {stats['tables']} tables written"}]
         
         elif command == 'UPDATE':
             operation = {'command': 'UPDATE', 'table': parsed_sql['table'], 'updates': parsed_sql['updates'], 'where': parsed_sql.get('where')}
-            self._add_to_transaction(operation)
+            self._add_to_transaction(operation, session)
             table = self.db.get_table(parsed_sql['table'])
-            count = table.update(
-                updates=parsed_sql['updates'],
-                conditions=parsed_sql.get('where')
-            )
+            with session.write_transaction() as txn:
+                count = table.update(
+                    updates=parsed_sql['updates'],
+                    conditions=parsed_sql.get('where'),
+                    txn=txn
+                )
             return [{'message': f"{count} rows updated"}]
         
         elif command == 'DELETE':
             operation = {'command': 'DELETE', 'table': parsed_sql['table'], 'where': parsed_sql.get('where')}
-            self._add_to_transaction(operation)
+            self._add_to_transaction(operation, session)
             table = self.db.get_table(parsed_sql['table'])
-            count = table.delete(conditions=parsed_sql.get('where'))
+            with session.write_transaction() as txn:
+                count = table.delete(conditions=parsed_sql.get('where'), txn=txn)
             return [{'message': f"{count} rows deleted"}]
         
         raise Exception(f"不支持的命令: {command}")
 
-    def _add_to_transaction(self, operation: Dict[str, Any]):
-        """将操作添加到当前事务"""
-        if self.db.current_transaction is not None:
-            self.db.current_transaction.add_operation(operation)
\ No newline at end of file
+    def stream(self, parsed_sql: Dict[str, Any], session=None,
+               cache_key: Optional[Hashable] = None) -> Tuple[List[str], Iterator[Dict[str, Any]]]:
+        """以流水线方式执行 SELECT，返回 (列名, 逐行产生结果的迭代器)"""
+        tables = [parsed_sql['table']] + [join['table'] for join in parsed_sql.get('joins') or []]
+        return self.stream_plan(lambda: self.plan(parsed_sql), tables, session, cache_key)
+
+    def stream_plan(self, make_plan: Callable[[], PlanNode], tables: List[str], session=None,
+                    cache_key: Optional[Hashable] = None) -> Tuple[List[str], Iterator[Dict[str, Any]]]:
+        """执行 make_plan 生成的计划；启用了结果缓存且不在显式事务中时先查缓存，未命中时读完的结果加入缓存
+
+        tables 为查询读取的表。
+        """
+        session = session or self.db.default_session
+        cache = self.db.result_cache
+        if cache_key is None or not cache.enabled or session.transaction is not None:
+            plan = make_plan()
+            return plan.columns, session.stream(plan)
+        cached = cache.get(cache_key, self.db.tables)
+        if cached is not None:
+            columns, rows = cached
+            return list(columns), (dict(zip(columns, row)) for row in rows)
+        plan = make_plan()
+        # 版本号在读取快照之前记录，期间提交的修改会使这次的结果在下次查找时失效
+        versions = cache.versions(self.db.tables, tables)
+        return plan.columns, cache.collect(cache_key, versions, plan.columns, session.stream(plan))
+
+    def plan(self, parsed_sql: Dict[str, Any]):
+        """为 SELECT 生成物理计划"""
+        table = self.db.get_table(parsed_sql['table'])
+        return Planner(self.db.config).plan_select(parsed_sql, table, self.db.tables)
+
+    def _add_to_transaction(self, operation: Dict[str, Any], session):
+        """将操作添加到会话的当前事务"""
+        if session.transaction is not None:
+            session.transaction.add_operation(operation)
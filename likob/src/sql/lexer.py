@@ -0,0 +1,102 @@
+import re
+from typing import List, NamedTuple, Tuple, Any
+
+# 记号类型
+KEYWORD = 'KEYWORD'
+NAME = 'NAME'
+NUMBER = 'NUMBER'
+STRING = 'STRING'
+OPERATOR = 'OPERATOR'
+PUNCT = 'PUNCT'
+PARAM = 'PARAM'
+EOF = 'EOF'
+
+# 保留字不能直接用作表名或列名
+KEYWORDS = frozenset("""
+    SELECT FROM WHERE AND OR NOT GROUP BY HAVING ORDER ASC DESC LIMIT OFFSET
+    INSERT INTO VALUES UPDATE SET DELETE CREATE TABLE INDEX DROP ON USING AS
+    JOIN INNER LEFT RIGHT FULL OUTER CROSS NULL IN BETWEEN LIKE IS
+    BEGIN END COMMIT ROLLBACK SAVE LOAD EXPLAIN ANALYZE VACUUM CHECKPOINT COPY
+""".split())
+
+_TOKEN = re.compile(r"""
+    (?P<space>(?:\s+|--[^\n]*)+)
+  | (?P<number>-?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<name>[A-Za-z_]\w*(?:\.(?:[A-Za-z_]\w*|\*))?)
+  | (?P<operator><>|!=|>=|<=|=|<|>)
+  | (?P<punct>[(),;*])
+  | (?P<param>\?)
+""", re.VERBOSE)
+
+
+class Token(NamedTuple):
+    """一个记号；关键字的 value 为大写形式，字符串和数字的 value 为解析后的值"""
+    type: str
+    value: Any
+    text: str
+    position: int
+
+
+def tokenize(sql: str) -> List[Token]:
+    """把SQL文本一次扫描切分为记号，末尾附加 EOF 记号"""
+    tokens: List[Token] = []
+    append = tokens.append
+    match = _TOKEN.match
+    pos = 0
+    length = len(sql)
+    while pos < length:
+        m = match(sql, pos)
+        if m is None:
+            raise Exception(f"无法识别的字符 {sql[pos]!r}（位置 {pos}）")
+        kind = m.lastgroup
+        text = m.group()
+        if kind == 'name':
+            upper = text.upper()
+            if upper in KEYWORDS:
+                append(Token(KEYWORD, upper, text, pos))
+            else:
+                append(Token(NAME, text, text, pos))
+        elif kind == 'number':
+            is_float = '.' in text or 'e' in text or 'E' in text
+            append(Token(NUMBER, float(text) if is_float else int(text), text, pos))
+        elif kind == 'string':
+            append(Token(STRING, text[1:-1].replace("''", "'"), text, pos))
+        elif kind == 'operator':
+            append(Token(OPERATOR, '!=' if text == '<>' else text, text, pos))
+        elif kind == 'punct':
+            append(Token(PUNCT, text, text, pos))
+        elif kind == 'param':
+            append(Token(PARAM, text, text, pos))
+        pos = m.end()
+    append(Token(EOF, None, '', length))
+    return tokens
+
+
+def normalize(tokens: List[Token]) -> Tuple[str, List[Tuple[bool, Any]]]:
+    """生成语句的规范化文本，作为解析缓存的键
+
+    空白、注释和关键字大小写不影响结果；字面量和 ? 占位符都替换为 ?，
+    这样只有值不同的语句共用同一棵解析树。LIMIT/OFFSET 后的数字决定计划的形状，保留在文本中。
+    返回 (规范化文本, 每个 ? 位置的 (是否为字面量, 字面量的值))。
+    """
+    parts = []
+    slots: List[Tuple[bool, Any]] = []
+    previous = None
+    for token in tokens:
+        kind = token.type
+        if kind in (NUMBER, STRING) and not (previous is not None and previous.type == KEYWORD
+                                             and previous.value in ('LIMIT', 'OFFSET')):
+            parts.append('?')
+            slots.append((True, token.value))
+        elif kind == PARAM:
+            parts.append('?')
+            slots.append((False, None))
+        elif kind == KEYWORD:
+            parts.append(token.value)
+        elif kind == EOF or (kind == PUNCT and token.value == ';'):
+            continue
+        else:
+            parts.append(token.text)
+        previous = token
+    return ' '.join(parts), slots
@@ -0,0 +1,445 @@
+import multiprocessing
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional, List, Tuple, Iterator
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # 没有共享内存时不能并行扫描
+    shared_memory = None
+
+from ..storage.column_store import ColumnStore, KIND_INT, KIND_FLOAT, KIND_TEXT, KIND_OBJECT
+from ..storage.page import Page, make_rid, SLOT_BITS
+from ..core.transaction import visible_row
+from .aggregation import HashAggregation, batch_partials
+from .sorting import sort_rows
+from .vectorized import Vector, Batch, AggregateState, BATCH_SIZE, DTYPES, filter_batch, factorize, \
+    _transpose, np
+
+# 列数组在共享内存中的元素类型（没有 NumPy 时用 memoryview.cast 读取）
+TYPECODES = {KIND_INT: 'q', KIND_FLOAT: 'd', KIND_TEXT: 'i'}
+
+Task = Dict[str, Any]
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def executor(workers: int) -> ProcessPoolExecutor:
+    """进程池在第一次并行查询时创建，之后同一进程中的所有数据库共用
+
+    工作进程用 spawn 方式启动：数据库有后台线程，fork 可能把其他线程持有的锁带进子进程。
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            _executor_workers = workers
+        return _executor
+
+
+def _discard_executor(broken: ProcessPoolExecutor) -> None:
+    """工作进程异常退出后进程池不能再用，下次并行查询时重新创建"""
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+
+
+def supported(table) -> bool:
+    """表能否并行扫描：需要共享内存，列存储中不能有按 Python 对象保存的列，
+    行存储中不能有保存在溢出文件中的值（工作进程只能读到共享内存中的页）"""
+    if shared_memory is None:
+        return False
+    heap = table.heap
+    if isinstance(heap, ColumnStore):
+        return all(column.kind != KIND_OBJECT for column in heap.columns)
+    return not heap.has_overflow()
+
+
+class _Segment:
+    """表的存储在共享内存中的副本，changes 为复制时存储的修改计数
+
+    users 为正在使用它的查询数；被新副本替换（stale）后，最后一个使用者结束时释放。
+    对象被回收或进程退出时也会释放共享内存。
+    """
+
+    def __init__(self, changes: int):
+        self.changes = changes
+        self.shm = None
+        self.info: Dict[str, Any] = {}
+        self.users = 1
+        self.stale = False
+        self._finalizer = None
+
+    def allocate(self, size: int):
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self._finalizer = weakref.finalize(self, _free_memory, self.shm)
+        return self.shm.buf
+
+    def free(self) -> None:
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+def _free_memory(shm) -> None:
+    shm.close()
+    shm.unlink()
+
+
+# 存储（HeapFile 或 ColumnStore）-> 最近一次复制的副本
+_segments: "weakref.WeakKeyDictionary[Any, _Segment]" = weakref.WeakKeyDictionary()
+_segments_lock = threading.Lock()
+
+
+def _cached_segment(heap) -> Optional[_Segment]:
+    """存储在复制之后没有修改过时返回已有的副本并登记一个使用者，调用者持有阻止修改的锁"""
+    with _segments_lock:
+        segment = _segments.get(heap)
+        if segment is None or segment.changes != heap.changes:
+            return None
+        segment.users += 1
+        return segment
+
+
+def _install(heap, segment: _Segment) -> None:
+    with _segments_lock:
+        old = _segments.get(heap)
+        _segments[heap] = segment
+    if old is not None:
+        _release(old, retire=True)
+
+
+def _release(segment: _Segment, retire: bool = False) -> None:
+    """结束一次使用（retire 为 True 时改为标记副本已被替换），没有使用者的旧副本立即释放"""
+    with _segments_lock:
+        if retire:
+            segment.stale = True
+        else:
+            segment.users -= 1
+        free = segment.stale and segment.users == 0
+    if free:
+        segment.free()
+
+
+def discard(heap) -> None:
+    """释放存储在共享内存中的副本，关闭数据库时调用"""
+    with _segments_lock:
+        segment = _segments.pop(heap, None)
+    if segment is not None:
+        _release(segment, retire=True)
+
+
+class ParallelScan:
+    """把一张表分成若干段交给工作进程扫描
+
+    行不经过 pickle 传给工作进程：行存储表写回脏页后把页原样复制到一块共享内存，
+    列存储表把各列数组、空值位图和删除位图复制到共享内存，工作进程直接从共享内存解码。
+    复制时持有表的排他闩（列存储为存储的锁）。副本按存储的修改计数缓存，表没有被修改时之后的并行查询
+    直接复用，只在持有同样的锁时取出版本链，不再复制；只读或很少修改的表只在修改后的第一次并行查询时复制一次。
+    版本链只在本进程中：有版本链的行按事务快照取出可见的版本，随任务发给扫描到它的工作进程，
+    工作进程在原来的位置用它代替存储中的行，结果的顺序与串行扫描相同。
+    """
+
+    def __init__(self, table, txn, read: List[int], types: List[str], workers: int):
+        self.table = table
+        self.txn = txn
+        self.read = read
+        self.types = types
+        self.workers = workers
+        self.tasks: List[Task] = []
+
+    def _capture_versions(self) -> Dict[int, Optional[Tuple[Any, ...]]]:
+        """有版本链的行ID -> 快照中可见的版本（整行，不可见时为 None）"""
+        heap = self.table.heap
+        if self.txn is None or not heap.versions:
+            return {}
+        with heap.versions_lock:
+            chains = list(heap.versions.items())
+        return {rid: visible_row(chain, self.txn) for rid, chain in chains}
+
+    def _split(self, total: int, unit: int) -> List[Tuple[int, int]]:
+        """把 [0, total) 按 unit 对齐分成最多 workers 段"""
+        units = -(-total // unit)
+        step = max(1, -(-units // self.workers))
+        return [(start * unit, min((start + step) * unit, total)) for start in range(0, units, step)]
+
+    def _segment(self, copy) -> _Segment:
+        """取得存储的副本：存储没有修改过时复用缓存的副本，否则调用 copy(副本) 复制一份，调用者持有阻止修改的锁"""
+        heap = self.table.heap
+        segment = _cached_segment(heap)
+        if segment is None:
+            segment = _Segment(heap.changes)
+            try:
+                copy(segment)
+            except BaseException:
+                segment.free()
+                raise
+            _install(heap, segment)
+        return segment
+
+    def _share_pages(self) -> _Segment:
+        table = self.table
+        heap = table.heap
+
+        def copy(segment: _Segment) -> None:
+            segment.info['pages'] = heap.copy_pages(segment.allocate)
+
+        with table.lock.exclusive():
+            segment = self._segment(copy)
+            versions = self._capture_versions()
+        for start, end in self._split(segment.info['pages'], 1):
+            self.tasks.append({
+                'layout': 'row', 'shm': segment.shm.name, 'page_size': heap.page_size, 'start': start, 'end': end,
+                'read': self.read, 'types': self.types,
+                'versions': {rid: row for rid, row in versions.items() if start <= rid >> SLOT_BITS < end},
+            })
+        return segment
+
+    def _share_columns(self) -> _Segment:
+        heap = self.table.heap
+        with heap.lock:
+            segment = self._segment(self._copy_columns)
+            versions = self._capture_versions()
+        size = segment.info['size']
+        columns = [segment.info['columns'][position] for position in self.read]
+        for start, end in self._split(size, BATCH_SIZE):
+            self.tasks.append({
+                'layout': 'columnar', 'shm': segment.shm.name, 'start': start, 'end': end,
+                'columns': columns, 'deleted': segment.info['deleted'], 'read': self.read, 'types': self.types,
+                'versions': {rid: row for rid, row in versions.items() if start <= rid < end},
+            })
+        return segment
+
+    def _copy_columns(self, segment: _Segment) -> None:
+        """把所有列复制到副本中（不同查询用到的列不同，都可以复用同一个副本）"""
+        heap = self.table.heap
+        size = heap.size
+        columns = heap.columns
+        bitmap_size = (size + 7) >> 3
+        buffers = []
+        for column in columns:
+            buffers.append(memoryview(column.values).cast('B')[:size * column.values.itemsize])
+            buffers.append(memoryview(column.nulls)[:bitmap_size] if column.null_count else None)
+        buffers.append(memoryview(heap.deleted)[:bitmap_size] if heap.deleted_count else None)
+        buffer = segment.allocate(sum(len(data) for data in buffers if data is not None))
+        offsets: List[Optional[int]] = []
+        offset = 0
+        for data in buffers:
+            if data is None:
+                offsets.append(None)
+                continue
+            buffer[offset:offset + len(data)] = data
+            offsets.append(offset)
+            offset += len(data)
+            data.release()
+        segment.info.update(size=size, deleted=offsets[-1], columns=[
+            (column.kind, offsets[2 * i], offsets[2 * i + 1],
+             list(column.dictionary) if column.kind == KIND_TEXT else None)
+            for i, column in enumerate(columns)])
+
+    def run(self, predicates, operation: Tuple) -> Optional[List[Any]]:
+        """扫描各段并执行 operation，按段的顺序返回各段的结果；表不能并行扫描时返回 None
+
+        predicates 和 operation 中的列位置都是在 read 中的位置。
+        """
+        if not supported(self.table):
+            return None
+        if not isinstance(self.table.heap, ColumnStore) and self.txn is not None and self.txn.undo_log:
+            # 本事务持有行锁，等待表的排他闩可能与持有共享闩、等待这些行锁的写者互相等待
+            return None
+        segment = self._share_columns() if isinstance(self.table.heap, ColumnStore) else self._share_pages()
+        try:
+            tasks = [dict(task, predicates=predicates, operation=operation) for task in self.tasks]
+            pool = executor(self.workers)
+            try:
+                results = list(pool.map(run_task, tasks)) if tasks else []
+            except BrokenProcessPool:
+                _discard_executor(pool)
+                raise
+        finally:
+            _release(segment)
+        return results
+
+
+def run_task(task: Task) -> Any:
+    """工作进程的入口：扫描共享内存中的一段数据，过滤后执行 operation"""
+    memory = shared_memory.SharedMemory(name=task['shm'])
+    try:
+        if task['layout'] == 'row':
+            batches = _page_batches(task, memory.buf)
+        elif np is None:
+            batches = _column_batches_python(task, memory.buf)
+        else:
+            batches = _column_batches(task, memory.buf)
+        predicates = task['predicates']
+        operation = task['operation']
+        return OPERATIONS[operation[0]](operation, (filter_batch(batch, predicates) for batch in batches))
+    finally:
+        batches = None
+        try:
+            memory.close()
+        except BufferError:
+            # 出错时异常的回溯还引用着共享内存上的数组，映射在它们被回收时释放
+            pass
+
+
+def _page_batches(task: Task, buffer) -> Iterator[Batch]:
+    page_size = task['page_size']
+    versions = task['versions']
+    read, types = task['read'], task['types']
+    rows: List[Tuple[Any, ...]] = []
+    for page_no in range(task['start'], task['end']):
+        offset = page_no * page_size
+        page = Page.from_bytes(page_no, page_size, bytes(buffer[offset:offset + page_size]))
+        if versions:
+            for slot, row in enumerate(page.rows):
+                row = versions.get(make_rid(page_no, slot), row)
+                if row is not None:
+                    rows.append(row)
+        else:
+            rows.extend(row for row in page.rows if row is not None)
+        if len(rows) >= BATCH_SIZE:
+            yield _transpose(rows, read, types)
+            rows = []
+    if rows:
+        yield _transpose(rows, read, types)
+
+
+def _column_batches(task: Task, buffer) -> Iterator[Batch]:
+    """从共享内存中的列数组按批产生 [start, end) 中未删除的行，有版本链的行换成可见的版本
+
+    每批的数据都复制出来，结果中不保留对共享内存的引用。
+    """
+    start, end = task['start'], task['end']
+    versions = task['versions']
+
+    def bits(offset: Optional[int]):
+        if offset is None:
+            return None
+        lo, hi = start >> 3, (end + 7) >> 3
+        unpacked = np.unpackbits(np.frombuffer(buffer, dtype=np.uint8, count=hi - lo, offset=offset + lo),
+                                 bitorder='little')
+        return unpacked[start - (lo << 3):end - (lo << 3)].astype(bool)
+
+    columns = []
+    for kind, offset, nulls, dictionary in task['columns']:
+        itemsize = np.dtype(DTYPES[kind]).itemsize
+        array = np.frombuffer(buffer, dtype=DTYPES[kind], count=end - start, offset=offset + start * itemsize)
+        columns.append((array, bits(nulls), dictionary))
+    dead = bits(task['deleted'])
+    for lo in range(0, end - start, BATCH_SIZE):
+        hi = min(lo + BATCH_SIZE, end - start)
+        vectors = []
+        for array, nulls, dictionary in columns:
+            if nulls is not None and nulls[lo:hi].any():
+                values = Vector(array[lo:hi], dictionary).decode()
+                vectors.append(Vector(np.array([None if null else value
+                                                for value, null in zip(values, nulls[lo:hi].tolist())],
+                                               dtype=object)))
+            else:
+                vectors.append(Vector(array[lo:hi].copy(), dictionary))
+        if versions and any(start + lo <= rid < start + hi for rid in versions):
+            live = [True] * (hi - lo) if dead is None else (~dead[lo:hi]).tolist()
+            yield _substitute(task, vectors, live, range(start + lo, start + hi))
+        elif dead is not None:
+            live = ~dead[lo:hi]
+            yield int(live.sum()), [vector.take(live) for vector in vectors]
+        else:
+            yield hi - lo, vectors
+
+
+def _column_batches_python(task: Task, buffer) -> Iterator[Batch]:
+    start, end = task['start'], task['end']
+    versions = task['versions']
+    deleted = task['deleted']
+
+    def bit(offset: Optional[int], i: int) -> bool:
+        return offset is not None and bool(buffer[offset + (i >> 3)] & (1 << (i & 7)))
+
+    for lo in range(start, end, BATCH_SIZE):
+        hi = min(lo + BATCH_SIZE, end)
+        live = [not bit(deleted, i) for i in range(lo, hi)]
+        vectors = []
+        for kind, offset, nulls, dictionary in task['columns']:
+            itemsize = 4 if kind == KIND_TEXT else 8
+            view = buffer[offset + lo * itemsize:offset + hi * itemsize]
+            values = view.cast(TYPECODES[kind]).tolist()
+            view.release()
+            if dictionary is not None:
+                values = [dictionary[v] for v in values]
+            if nulls is not None:
+                values = [None if bit(nulls, i) else v for i, v in enumerate(values, lo)]
+            vectors.append(Vector(values))
+        if versions and any(lo <= rid < hi for rid in versions):
+            yield _substitute(task, vectors, live, range(lo, hi))
+        else:
+            yield sum(live), [vector.take(live) for vector in vectors]
+
+
+def _substitute(task: Task, vectors: List[Vector], live: List[bool], rids: range) -> Batch:
+    """逐行组装一批：有版本链的行取可见的版本，其余行按 live 过滤"""
+    versions = task['versions']
+    read = task['read']
+    values = [vector.decode() for vector in vectors]
+    rows = []
+    for i, rid in enumerate(rids):
+        if rid in versions:
+            row = versions[rid]
+            if row is not None:
+                rows.append(tuple(row[p] for p in read))
+        elif live[i]:
+            rows.append(tuple(column[i] for column in values))
+    return _transpose(rows, list(range(len(read))), [task['types'][p] for p in read])
+
+
+def _aggregate(operation: Tuple, batches: Iterator[Batch]) -> Any:
+    """部分聚合
+
+    operation 为 ('aggregate', 分组列的位置, [(聚合函数, 参数列的位置或 None)], 内存中最多保存的组数)。
+    不分组时返回 (第一行, 各聚合函数的 AggregateState)；
+    分组时返回 (各组的键, 各聚合函数每组的部分结果)，AVG 的部分结果为 (总和, 行数)。
+    """
+    _, group, aggregates, memory_groups = operation
+    if not group:
+        states = [AggregateState(function) for function, _ in aggregates]
+        first = None
+        for length, vectors in batches:
+            if length and first is None:
+                first = [vector.take(slice(0, 1)).decode()[0] if np is not None else vector.values[0]
+                         for vector in vectors]
+            for state, (_, position) in zip(states, aggregates):
+                state.update(length, vectors[position] if position is not None else None)
+        return first, states
+
+    table = HashAggregation([function for function, _ in aggregates], memory_groups)
+    for length, vectors in batches:
+        if not length:
+            continue
+        ids, keys = factorize([vectors[position] for position in group])
+        partials = [batch_partials(function, ids, len(keys), vectors[position] if position is not None else None)
+                    for function, position in aggregates]
+        for g, key in enumerate(keys):
+            table.merge(key, [partial[g] for partial in partials])
+    groups = list(table.partials())
+    return [key for key, _ in groups], [[partials[i] for _, partials in groups] for i in range(len(aggregates))]
+
+
+def _rows(operation: Tuple, batches: Iterator[Batch]) -> List[tuple]:
+    """operation 为 ('rows', 输出列的位置, 排序键)，返回过滤后的输出行，有排序键时排好序"""
+    _, positions, keys = operation
+    rows: List[tuple] = []
+    for length, vectors in batches:
+        if length:
+            rows.extend(zip(*[vectors[i].decode() for i in positions]))
+    if keys:
+        sort_rows(rows, keys)
+    return rows
+
+
+OPERATIONS = {'aggregate': _aggregate, 'rows': _rows}
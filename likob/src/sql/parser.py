@@ -1,137 +1,408 @@
-import re
 from typing import Tuple, List, Dict, Any, Optional
+from .lexer import Token, tokenize, normalize, KEYWORD, NAME, NUMBER, STRING, OPERATOR, PUNCT, PARAM, EOF
+from ..utils.lru import LRUCache
+
+AGGREGATE_FUNCTIONS = ('COUNT', 'SUM', 'AVG', 'MAX', 'MIN')
+LAYOUT_DEFAULT = 'row'
+
+
+class Parameter:
+    """解析树中的参数占位符，执行时替换为第 index 个参数的值"""
+
+    __slots__ = ('index',)
+
+    def __init__(self, index: int):
+        self.index = index
+
+    def __repr__(self) -> str:
+        return f"${self.index + 1}"
+
+
+def bind_parameters(node: Any, values: List[Any]) -> Any:
+    """复制解析树（或计划中的条件），把其中的参数替换为 values 中对应的值"""
+    if isinstance(node, Parameter):
+        return values[node.index]
+    if isinstance(node, dict):
+        return {key: bind_parameters(value, values) for key, value in node.items()}
+    if isinstance(node, list):
+        return [bind_parameters(value, values) for value in node]
+    if isinstance(node, tuple):
+        return tuple(bind_parameters(value, values) for value in node)
+    return node
+
+
+def check_count(clause: str, value: Any) -> int:
+    """LIMIT/OFFSET 的值（字面量或绑定的参数）必须是非负整数"""
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise Exception(f"{clause} 需要非负整数")
+    return value
+
 
 class SQLParser:
+    """SQL 解析器
+
+    词法分析一次扫描得到记号，再由递归下降分析生成解析树。
+    解析树按规范化的语句文本缓存在 LRU 中，只有字面量不同的语句不必重新解析。
+    """
+
+    def __init__(self, cache_size: int = 256):
+        self.cache = LRUCache(cache_size)
+
     def parse(self, sql: str) -> Dict[str, Any]:
         """解析SQL语句"""
-        # 移除末尾的分号和空白字符
-        sql = sql.strip().rstrip(';').strip()
-        
-        if sql.upper().startswith('BEGIN'):
-            return {'command': 'BEGIN'}
-        elif sql.upper().startswith('SAVE'):
-            match = re.match(r"SAVE\s+'(.+)'", sql, re.IGNORECASE)
-            if match:
-                return {'command': 'SAVE', 'filename': match.group(1)}
-            raise Exception("无效的SAVE语句")
-        elif sql.upper().startswith('END'):
-            return {'command': 'END'}
-        elif sql.upper().startswith('LOAD'):
-            match = re.match(r"LOAD\s+'(.+)'", sql, re.IGNORECASE)
-            if match:
-                return {'command': 'LOAD', 'filename': match.group(1)}
-            raise Exception("无效的LOAD语句")
-        elif sql.upper().startswith('CREATE TABLE'):
-            return self._parse_create(sql)
-        elif sql.upper().startswith('INSERT INTO'):
-            return self._parse_insert(sql)
-        elif sql.upper().startswith('SELECT'):
-            return self._parse_select(sql)
-        elif sql.upper().startswith('UPDATE'):
-            return self._parse_update(sql)
-        elif sql.upper().startswith('DELETE'):
-            return self._parse_delete(sql)
-        
-        raise Exception("不支持的SQL语句")
-
-    def _parse_create(self, sql: str) -> Dict[str, Any]:
-        """解析CREATE TABLE语句"""
-        match = re.match(r'CREATE\s+TABLE\s+(\w+)\s*\((.*)\)', sql, re.IGNORECASE)
-        if not match:
-            raise Exception("无效的CREATE TABLE语句")
-        
-        table_name = match.group(1)
-        columns_str = match.group(2)
-        
-        columns = []
-        for col in columns_str.split(','):
-            col = col.strip()
-            parts = col.split()
-            if len(parts) < 2:
-                raise Exception(f"无效的列定义: {col}")
-            
-            col_name = parts[0]
-            col_type = parts[1]
-            columns.append((col_name, col_type))
-        
-        return {
-            'command': 'CREATE',
-            'table': table_name,
-            'columns': columns
-        }
+        return self.parse_normalized(sql)[0]
+
+    def parse_normalized(self, sql: str) -> Tuple[Dict[str, Any], str, List[Any]]:
+        """解析SQL语句，同时返回规范化的语句文本和其中各个字面量的值（用作查询结果缓存的键）"""
+        key, tree, slots = self._template(sql)
+        if any(not literal for literal, _ in slots):
+            raise Exception("语句中有 ? 参数，请使用 prepare 后传入参数执行")
+        values = [value for _, value in slots]
+        return bind_parameters(tree, values), key, values
+
+    def parse_prepared(self, sql: str) -> Tuple[Dict[str, Any], int, str, List[Tuple[bool, Any]]]:
+        """解析带 ? 参数的语句，返回 (解析树, 参数个数, 规范化的语句文本, 各个 ? 位置的 (是否为字面量, 字面量的值))
 
-    def _parse_insert(self, sql: str) -> Dict[str, Any]:
-        """解析INSERT INTO语句"""
-        match = re.match(r'INSERT\s+INTO\s+(\w+)\s+VALUES\s*\((.*)\)', sql, re.IGNORECASE)
-        if not match:
-            raise Exception("无效的INSERT INTO语句")
-        
-        table_name = match.group(1)
-        values_str = match.group(2)
-        
-        values = []
-        for val in values_str.split(','):
-            val = val.strip()
-            if val.startswith("'") and val.endswith("'"):
-                values.append(val[1:-1])  # 字符串
+        解析树中的参数依次编号。
+        """
+        key, tree, slots = self._template(sql)
+        values: List[Any] = []
+        count = 0
+        for literal, value in slots:
+            if literal:
+                values.append(value)
             else:
-                try:
-                    values.append(float(val) if '.' in val else int(val))  # 数字
-                except ValueError:
-                    values.append(val)  # 其他类型
-        
-        return {
-            'command': 'INSERT',
-            'table': table_name,
-            'values': values
-        }
+                values.append(Parameter(count))
+                count += 1
+        return bind_parameters(tree, values), count, key, slots
 
-    def _parse_conditions(self, clause: str) -> Dict[str, Any]:
-        """解析条件子句"""
-        conditions = {
-            'operator': 'AND',
-            'conditions': []
-        }
-        
-        # 处理AND条件
-        for condition in clause.split('AND'):
-            condition = condition.strip()
-            # 检查聚合函数
-            agg_match = re.match(r'(COUNT|SUM|AVG|MAX|MIN)\((.*?)\)\s*(=|!=|>|>=|<|<=)\s*(.*)', condition)
-            if agg_match:
-                func, arg, op, val = agg_match.groups()
-                conditions['conditions'].append({
-                    'type': 'aggregate',
-                    'function': func.upper(),
-                    'argument': arg.strip(),
-                    'operator': op,
-                    'value': self._parse_value(val.strip())
-                })
+    def _template(self, sql: str) -> Tuple[str, Dict[str, Any], List[Tuple[bool, Any]]]:
+        """取出（或解析并缓存）语句的模板，返回 (规范化文本, 模板, 各个 ? 位置)，模板中每个字面量和 ? 都是参数"""
+        tokens = tokenize(sql)
+        key, slots = normalize(tokens)
+        tree = self.cache.get(key)
+        if tree is None:
+            tree = _Parser(_parameterize(tokens)).statement()
+            self.cache.put(key, tree)
+        return key, tree, slots
+
+
+def _parameterize(tokens: List[Token]) -> List[Token]:
+    """按 normalize 的规则把字面量和 ? 换成带序号的参数记号"""
+    result = []
+    slot = 0
+    previous = None
+    for token in tokens:
+        if token.type == PARAM or (token.type in (NUMBER, STRING) and not (
+                previous is not None and previous.type == KEYWORD and previous.value in ('LIMIT', 'OFFSET'))):
+            result.append(Token(PARAM, slot, token.text, token.position))
+            slot += 1
+        else:
+            result.append(token)
+        previous = token
+    return result
+
+
+class _Parser:
+    """对记号序列做递归下降分析，生成与执行器约定的解析树"""
+
+    def __init__(self, tokens: List[Token]):
+        self.tokens = tokens
+        self.pos = 0
+
+    # ---- 记号操作 ----
+
+    @property
+    def current(self) -> Token:
+        return self.tokens[self.pos]
+
+    def _advance(self) -> Token:
+        token = self.tokens[self.pos]
+        if token.type != EOF:
+            self.pos += 1
+        return token
+
+    def _at(self, kind: str, value: Any = None) -> bool:
+        token = self.tokens[self.pos]
+        return token.type == kind and (value is None or token.value == value)
+
+    def _accept(self, kind: str, value: Any = None) -> Optional[Token]:
+        if self._at(kind, value):
+            return self._advance()
+        return None
+
+    def _accept_keyword(self, *keywords: str) -> Optional[str]:
+        token = self.tokens[self.pos]
+        if token.type == KEYWORD and token.value in keywords:
+            self.pos += 1
+            return token.value
+        return None
+
+    def _expect(self, kind: str, value: Any = None, what: Optional[str] = None) -> Token:
+        if self._at(kind, value):
+            return self._advance()
+        self._error(f"应为 {what or value or kind}")
+
+    def _expect_keyword(self, keyword: str) -> None:
+        self._expect(KEYWORD, keyword)
+
+    def _at_word(self, word: str) -> bool:
+        """当前记号是否为不区分大小写的 word（PRIMARY、KEY、UNIQUE 等不是保留字，可以用作列名）"""
+        return self.current.type == NAME and self.current.value.upper() == word
+
+    def _accept_word(self, word: str) -> bool:
+        if self._at_word(word):
+            self.pos += 1
+            return True
+        return False
+
+    def _expect_word(self, word: str) -> None:
+        if not self._accept_word(word):
+            self._error(f"应为 {word}")
+
+    def _name(self, what: str = '名称') -> str:
+        return self._expect(NAME, what=what).value
+
+    def _error(self, message: str):
+        token = self.current
+        near = f"'{token.text}'" if token.type != EOF else '语句末尾'
+        raise Exception(f"语法错误: {near} 处{message}")
+
+    # ---- 语句 ----
+
+    def statement(self) -> Dict[str, Any]:
+        token = self.current
+        if token.type != KEYWORD:
+            raise Exception("不支持的SQL语句")
+        handler = {
+            'BEGIN': self._begin,
+            'END': self._end,
+            'COMMIT': self._end,
+            'ROLLBACK': self._end,
+            'SAVE': self._save_load,
+            'LOAD': self._save_load,
+            'EXPLAIN': self._explain,
+            'ANALYZE': self._analyze,
+            'VACUUM': self._analyze,
+            'CHECKPOINT': self._checkpoint,
+            'CREATE': self._create,
+            'DROP': self._drop,
+            'INSERT': self._insert,
+            'COPY': self._copy,
+            'SELECT': self._select,
+            'UPDATE': self._update,
+            'DELETE': self._delete,
+        }.get(token.value)
+        if handler is None:
+            raise Exception("不支持的SQL语句")
+        result = handler()
+        self._accept(PUNCT, ';')
+        if not self._at(EOF):
+            self._error("应为语句结尾")
+        return result
+
+    def _begin(self) -> Dict[str, Any]:
+        """BEGIN [TRANSACTION | WORK] [ISOLATION LEVEL level]"""
+        self._advance()
+        if self._at(NAME) and self.current.value.upper() in ('TRANSACTION', 'WORK'):
+            self._advance()
+        result = {'command': 'BEGIN', 'isolation_level': None}
+        if self._at(NAME) and self.current.value.upper() == 'ISOLATION':
+            self._advance()
+            if not (self._at(NAME) and self.current.value.upper() == 'LEVEL'):
+                self._error("应为 LEVEL")
+            self._advance()
+            words = []
+            while self._at(NAME):
+                words.append(self._advance().value.upper())
+            if not words:
+                self._error("应为隔离级别")
+            result['isolation_level'] = ' '.join(words)
+        return result
+
+    def _end(self) -> Dict[str, Any]:
+        """END | COMMIT | ROLLBACK [TRANSACTION | WORK]"""
+        command = self._advance().value
+        if self._at(NAME) and self.current.value.upper() in ('TRANSACTION', 'WORK'):
+            self._advance()
+        return {'command': command}
+
+    def _save_load(self) -> Dict[str, Any]:
+        """SAVE 'file' [COMPRESSION none|zlib|lzma] | LOAD 'file'"""
+        command = self._advance().value
+        if not self._at(PARAM):
+            raise Exception(f"无效的{command}语句")
+        result = {'command': command, 'filename': Parameter(self._advance().value)}
+        if command == 'SAVE' and self._accept_word('COMPRESSION'):
+            result['compression'] = self._name('压缩方式').lower()
+        return result
+
+    def _explain(self) -> Dict[str, Any]:
+        """EXPLAIN [ANALYZE] SELECT ..."""
+        self._advance()
+        analyze = self._accept_keyword('ANALYZE') is not None
+        if not self._at(KEYWORD, 'SELECT'):
+            raise Exception("EXPLAIN 只支持 SELECT 语句")
+        return {'command': 'EXPLAIN', 'analyze': analyze, 'statement': self._select()}
+
+    def _analyze(self) -> Dict[str, Any]:
+        """ANALYZE [table] | VACUUM [table]"""
+        command = self._advance().value
+        table = self._advance().value if self._at(NAME) else None
+        return {'command': command, 'table': table}
+
+    def _checkpoint(self) -> Dict[str, Any]:
+        """CHECKPOINT"""
+        self._advance()
+        return {'command': 'CHECKPOINT'}
+
+    def _create(self) -> Dict[str, Any]:
+        self._advance()
+        if self._accept_keyword('INDEX'):
+            # CREATE INDEX name ON table (column)
+            index = self._name('索引名')
+            self._expect_keyword('ON')
+            table = self._name('表名')
+            self._expect(PUNCT, '(')
+            column = self._name('列名')
+            self._expect(PUNCT, ')')
+            return {'command': 'CREATE_INDEX', 'index': index, 'table': table, 'column': column}
+        if not self._accept_keyword('TABLE'):
+            raise Exception("不支持的SQL语句")
+
+        table = self._name('表名')
+        self._expect(PUNCT, '(')
+        columns = []
+        constraints: Dict[str, Any] = {'primary_key': None, 'unique': [], 'not_null': []}
+        while True:
+            if self._accept_word('PRIMARY'):
+                # 表级约束 PRIMARY KEY (column)
+                self._expect_word('KEY')
+                self._expect(PUNCT, '(')
+                self._set_primary_key(constraints, self._name('列名'))
+                self._expect(PUNCT, ')')
+            elif self._at_word('UNIQUE') and self.tokens[self.pos + 1].type == PUNCT:
+                # 表级约束 UNIQUE (column)
+                self._advance()
+                self._expect(PUNCT, '(')
+                constraints['unique'].append(self._name('列名'))
+                self._expect(PUNCT, ')')
             else:
-                for op in ['>=', '<=', '!=', '=', '>', '<']:
-                    if op in condition:
-                        col, val = condition.split(op)
-                        conditions['conditions'].append({
-                            'type': 'simple',
-                            'column': col.strip(),
-                            'operator': op,
-                            'value': self._parse_value(val.strip())
-                        })
-                        break
-        
-        return conditions
-
-    def _parse_value(self, val: str) -> Any:
-        """解析值"""
-        if val.startswith("'") and val.endswith("'"):
-            return val[1:-1]
-        try:
-            return float(val) if '.' in val else int(val)
-        except ValueError:
-            return val
-
-    def _parse_select(self, sql: str) -> Dict[str, Any]:
-        """解析SELECT语句"""
+                columns.append(self._column_definition(constraints))
+            if not self._accept(PUNCT, ','):
+                break
+        self._expect(PUNCT, ')')
+        layout = self._name('存储布局').lower() if self._accept_keyword('USING') else LAYOUT_DEFAULT
+        return {'command': 'CREATE', 'table': table, 'columns': columns, 'layout': layout,
+                'constraints': constraints}
+
+    def _column_definition(self, constraints: Dict[str, Any]) -> Tuple[str, str]:
+        """列名 类型 [PRIMARY KEY | UNIQUE | NOT NULL | NULL ...]，约束记入 constraints，类型参数和其他修饰跳过"""
+        col_name = self._name('列名')
+        if not self._at(NAME):
+            raise Exception(f"无效的列定义: {col_name}")
+        col_type = self._advance().value
+        depth = 0
+        while not (depth == 0 and self._at(PUNCT, ',') or depth == 0 and self._at(PUNCT, ')')):
+            if self._at(EOF):
+                self._error("应为 )")
+            if depth == 0 and self._accept_word('PRIMARY'):
+                self._expect_word('KEY')
+                self._set_primary_key(constraints, col_name)
+                continue
+            if depth == 0 and self._accept_word('UNIQUE'):
+                constraints['unique'].append(col_name)
+                continue
+            if depth == 0 and self._accept_keyword('NOT'):
+                self._expect_keyword('NULL')
+                constraints['not_null'].append(col_name)
+                continue
+            if self._at(PUNCT, '('):
+                depth += 1
+            elif self._at(PUNCT, ')'):
+                depth -= 1
+            self._advance()
+        return col_name, col_type
+
+    def _set_primary_key(self, constraints: Dict[str, Any], column: str) -> None:
+        if constraints['primary_key'] is not None:
+            raise Exception("一张表只能有一个主键")
+        constraints['primary_key'] = column
+
+    def _drop(self) -> Dict[str, Any]:
+        """DROP INDEX name [ON table]"""
+        self._advance()
+        if not self._accept_keyword('INDEX'):
+            raise Exception("不支持的SQL语句")
+        index = self._name('索引名')
+        table = self._name('表名') if self._accept_keyword('ON') else None
+        return {'command': 'DROP_INDEX', 'index': index, 'table': table}
+
+    def _insert(self) -> Dict[str, Any]:
+        """INSERT INTO table VALUES (v1, v2, ...)[, (...), ...]"""
+        self._advance()
+        self._expect_keyword('INTO')
+        table = self._name('表名')
+        self._expect_keyword('VALUES')
+        rows = []
+        while True:
+            self._expect(PUNCT, '(')
+            values = [self._value()]
+            while self._accept(PUNCT, ','):
+                values.append(self._value())
+            self._expect(PUNCT, ')')
+            rows.append(values)
+            if not self._accept(PUNCT, ','):
+                break
+        return {'command': 'INSERT', 'table': table, 'rows': rows}
+
+    def _copy(self) -> Dict[str, Any]:
+        """COPY table FROM 'file' [WITH] [CSV] [HEADER] [DELIMITER 'c']"""
+        self._advance()
+        table = self._name('表名')
+        self._expect_keyword('FROM')
+        if not self._at(PARAM):
+            raise Exception("无效的COPY语句")
+        result = {'command': 'COPY', 'table': table, 'filename': Parameter(self._advance().value),
+                  'header': False, 'delimiter': ','}
+        while self._at(NAME):
+            option = self._advance().value.upper()
+            if option == 'HEADER':
+                result['header'] = True
+            elif option == 'DELIMITER':
+                if not self._at(PARAM):
+                    self._error("DELIMITER 后应为字符串")
+                result['delimiter'] = Parameter(self._advance().value)
+            elif option not in ('WITH', 'CSV'):
+                raise Exception(f"不支持的COPY选项: {option}")
+        return result
+
+    def _update(self) -> Dict[str, Any]:
+        """UPDATE table SET col1 = val1, col2 = val2 [WHERE conditions]"""
+        self._advance()
+        table = self._name('表名')
+        self._expect_keyword('SET')
+        updates = {}
+        while True:
+            col = self._name('列名')
+            self._expect(OPERATOR, '=')
+            updates[col] = self._value()
+            if not self._accept(PUNCT, ','):
+                break
+        where = self._conditions() if self._accept_keyword('WHERE') else None
+        return {'command': 'UPDATE', 'table': table, 'updates': updates, 'where': where}
+
+    def _delete(self) -> Dict[str, Any]:
+        """DELETE FROM table [WHERE conditions]"""
+        self._advance()
+        self._expect_keyword('FROM')
+        table = self._name('表名')
+        where = self._conditions() if self._accept_keyword('WHERE') else None
+        return {'command': 'DELETE', 'table': table, 'where': where}
+
+    def _select(self) -> Dict[str, Any]:
+        """SELECT ... FROM ... [JOIN ...] [WHERE] [GROUP BY] [HAVING] [ORDER BY] [LIMIT [OFFSET]]"""
+        self._expect_keyword('SELECT')
         result = {
             'command': 'SELECT',
             'columns': None,
@@ -140,140 +411,148 @@ class SQLParser:
             'group_by': None,
             'having': None,
             'order_by': None,
-            'aggregates': []
+            'aggregates': [],
+            'alias': None,
+            'joins': None,
+            'limit': None,
+            'offset': 0
         }
-        
-        # 解析列名和聚合函数
-        columns_end = sql.upper().find('FROM')
-        columns_str = sql[6:columns_end].strip()
-        
-        if columns_str == '*':
-            result['columns'] = None
-        else:
+
+        if not self._accept(PUNCT, '*'):
             result['columns'] = []
-            for col in columns_str.split(','):
-                col = col.strip()
-                # 检查是否是聚合函数
-                agg_match = re.match(r'(COUNT|SUM|AVG|MAX|MIN)\((.*?)\)(?:\s+[aA][sS]\s+(\w+))?', col)
-                if agg_match:
-                    func, arg, alias = agg_match.groups()
+            while True:
+                aggregate = self._aggregate()
+                if aggregate is not None:
+                    function, argument = aggregate
+                    alias = self._name('别名') if self._accept_keyword('AS') else None
                     result['aggregates'].append({
-                        'function': func.upper(),
-                        'argument': arg.strip(),
-                        'alias': alias if alias else f"{func.lower()}_{arg.strip()}"
+                        'function': function,
+                        'argument': argument,
+                        'alias': alias or f"{function.lower()}_{argument}"
                     })
                 else:
-                    result['columns'].append(col)
-        
-        # 解析表名
-        sql = sql[columns_end + 4:].strip()
-        table_end = sql.find(' ')
-        if table_end == -1:
-            result['table'] = sql
-            return result
-        result['table'] = sql[:table_end]
-        sql = sql[table_end:].strip()
-        
-        # 解析WHERE
-        where_idx = sql.upper().find('WHERE')
-        if where_idx != -1:
-            group_idx = sql.upper().find('GROUP BY')
-            having_idx = sql.upper().find('HAVING')
-            order_idx = sql.upper().find('ORDER BY')
-            
-            where_end = min(x for x in [group_idx, having_idx, order_idx, len(sql)] if x != -1)
-            where_clause = sql[where_idx + 5:where_end].strip()
-            result['where'] = self._parse_conditions(where_clause)
-            sql = sql[where_end:].strip()
-        
-        # 解析GROUP BY
-        group_idx = sql.upper().find('GROUP BY')
-        if group_idx != -1:
-            having_idx = sql.upper().find('HAVING')
-            order_idx = sql.upper().find('ORDER BY')
-            
-            group_end = min(x for x in [having_idx, order_idx, len(sql)] if x != -1)
-            group_clause = sql[group_idx + 8:group_end].strip()
-            result['group_by'] = [col.strip() for col in group_clause.split(',')]
-            sql = sql[group_end:].strip()
-        
-        # 解析HAVING
-        having_idx = sql.upper().find('HAVING')
-        if having_idx != -1:
-            order_idx = sql.upper().find('ORDER BY')
-            having_end = order_idx if order_idx != -1 else len(sql)
-            having_clause = sql[having_idx + 6:having_end].strip()
-            result['having'] = self._parse_conditions(having_clause)
-            sql = sql[having_end:].strip()
-        
-        # 解析ORDER BY
-        order_idx = sql.upper().find('ORDER BY')
-        if order_idx != -1:
-            order_clause = sql[order_idx + 8:].strip()
+                    result['columns'].append(self._name('列名'))
+                    if self._at(KEYWORD, 'AS'):
+                        self._error("不支持列别名")
+                if not self._accept(PUNCT, ','):
+                    break
+
+        self._expect_keyword('FROM')
+        result['table'] = self._name('表名')
+        result['alias'] = self._alias()
+        self._joins(result)
+
+        if self._accept_keyword('WHERE'):
+            result['where'] = self._conditions()
+        if self._accept_keyword('GROUP'):
+            self._expect_keyword('BY')
+            result['group_by'] = [self._name('列名')]
+            while self._accept(PUNCT, ','):
+                result['group_by'].append(self._name('列名'))
+        if self._accept_keyword('HAVING'):
+            result['having'] = self._conditions()
+        if self._accept_keyword('ORDER'):
+            self._expect_keyword('BY')
             orders = []
-            for item in order_clause.split(','):
-                item = item.strip()
-                if item.upper().endswith('DESC'):
-                    orders.append((item[:-4].strip(), 'DESC'))
-                else:
-                    orders.append((item.rstrip('ASC').strip(), 'ASC'))
+            while True:
+                col = self._name('列名')
+                orders.append((col, self._accept_keyword('ASC', 'DESC') or 'ASC'))
+                if not self._accept(PUNCT, ','):
+                    break
             result['order_by'] = orders
-        
+        if self._accept_keyword('LIMIT'):
+            result['limit'] = self._count('LIMIT')
+            if self._accept_keyword('OFFSET'):
+                result['offset'] = self._count('OFFSET')
         return result
 
-    def _parse_update(self, sql: str) -> Dict[str, Any]:
-        """解析UPDATE语句"""
-        # UPDATE table SET col1 = val1, col2 = val2 WHERE conditions
-        match = re.match(r'UPDATE\s+(\w+)\s+SET\s+(.*?)(?:\s+WHERE\s+(.*))?$', sql, re.IGNORECASE)
-        if not match:
-            raise Exception("无效的UPDATE语句")
-        
-        table_name = match.group(1)
-        set_clause = match.group(2)
-        where_clause = match.group(3)
-        
-        # 解析SET子句
-        updates = {}
-        for item in set_clause.split(','):
-            col, val = item.split('=')
-            col = col.strip()
-            val = val.strip()
-            if val.startswith("'") and val.endswith("'"):
-                val = val[1:-1]
-            else:
-                try:
-                    val = float(val) if '.' in val else int(val)
-                except ValueError:
-                    pass
-            updates[col] = val
-        
-        result = {
-            'command': 'UPDATE',
-            'table': table_name,
-            'updates': updates,
-        }
-        
-        if where_clause:
-            result['where'] = self._parse_conditions(where_clause)
-        
-        return result
+    def _alias(self) -> Optional[str]:
+        """表名后可选的 [AS] 别名"""
+        if self._accept_keyword('AS'):
+            return self._name('别名')
+        if self._at(NAME):
+            return self._advance().value
+        return None
 
-    def _parse_delete(self, sql: str) -> Dict[str, Any]:
-        """解析DELETE语句"""
-        # DELETE FROM table WHERE conditions
-        match = re.match(r'DELETE\s+FROM\s+(\w+)(?:\s+WHERE\s+(.*))?$', sql, re.IGNORECASE)
-        if not match:
-            raise Exception("无效的DELETE语句")
-        
-        table_name = match.group(1)
-        where_clause = match.group(2)
-        
-        result = {
-            'command': 'DELETE',
-            'table': table_name,
-        }
-        
-        if where_clause:
-            result['where'] = self._parse_conditions(where_clause)
-        
-        return result 
\ No newline at end of file
+    def _joins(self, result: Dict[str, Any]) -> None:
+        """[INNER] JOIN table [alias] ON a.x = b.y [AND ...]"""
+        while True:
+            if self._at(KEYWORD) and self.current.value in ('LEFT', 'RIGHT', 'FULL', 'OUTER', 'CROSS'):
+                raise Exception("只支持 INNER JOIN")
+            if self._accept_keyword('INNER'):
+                self._expect_keyword('JOIN')
+            elif not self._accept_keyword('JOIN'):
+                return
+            table = self._name('表名')
+            alias = self._alias()
+            self._expect_keyword('ON')
+            on = []
+            while True:
+                left = self._name('列名')
+                if not self._accept(OPERATOR, '='):
+                    raise Exception("JOIN 只支持等值连接条件")
+                on.append((left, self._name('列名')))
+                if not self._accept_keyword('AND'):
+                    break
+            if result['joins'] is None:
+                result['joins'] = []
+            result['joins'].append({'table': table, 'alias': alias, 'type': 'INNER', 'on': on})
+
+    def _aggregate(self) -> Optional[Tuple[str, str]]:
+        """聚合函数调用 FUNC(列) 或 COUNT(*)，不是聚合函数时返回 None"""
+        token = self.current
+        if token.type != NAME or token.value.upper() not in AGGREGATE_FUNCTIONS \
+                or not self.tokens[self.pos + 1].type == PUNCT or self.tokens[self.pos + 1].value != '(':
+            return None
+        self.pos += 2
+        argument = '*' if self._accept(PUNCT, '*') else self._name('列名')
+        self._expect(PUNCT, ')')
+        return token.value.upper(), argument
+
+    def _conditions(self) -> Dict[str, Any]:
+        """用 AND 连接的比较条件"""
+        conditions = [self._condition()]
+        while self._accept_keyword('AND'):
+            conditions.append(self._condition())
+        if self._at(KEYWORD, 'OR'):
+            self._error("不支持 OR 条件")
+        return {'operator': 'AND', 'conditions': conditions}
+
+    def _condition(self) -> Dict[str, Any]:
+        aggregate = self._aggregate()
+        if aggregate is None:
+            column = self._name('列名')
+        if not self._at(OPERATOR):
+            if self._at(KEYWORD) and self.current.value in ('IN', 'BETWEEN', 'LIKE', 'IS', 'NOT'):
+                self._error("不支持的条件运算符")
+            self._error("应为比较运算符")
+        op = self._advance().value
+        value = self._value()
+        if aggregate is not None:
+            return {'type': 'aggregate', 'function': aggregate[0], 'argument': aggregate[1],
+                    'operator': op, 'value': value}
+        return {'type': 'simple', 'column': column, 'operator': op, 'value': value}
+
+    def _value(self) -> Any:
+        """字面量（已换成参数）、? 参数，或不加引号的名称（按字符串处理）"""
+        token = self.current
+        if token.type == PARAM:
+            self.pos += 1
+            return Parameter(token.value)
+        if token.type == KEYWORD and token.value == 'NULL':
+            self._error("暂不支持 NULL 值")
+        if token.type == NAME:
+            self.pos += 1
+            return token.value
+        self._error("应为值")
+
+    def _count(self, clause: str) -> Any:
+        """LIMIT/OFFSET 后的非负整数，或执行时绑定的 ? 参数"""
+        token = self.current
+        if token.type == PARAM:
+            self.pos += 1
+            return Parameter(token.value)
+        if token.type != NUMBER:
+            raise Exception(f"{clause} 需要非负整数")
+        self.pos += 1
+        return check_count(clause, token.value)
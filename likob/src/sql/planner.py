@@ -0,0 +1,1379 @@
+import copy
+import math
+import operator
+import time
+from collections import defaultdict
+from itertools import islice
+from typing import Dict, Any, Optional, List, Tuple, Callable, Iterator
+from ..utils.config import DBConfig
+from ..storage.column_store import ColumnStore
+from .vectorized import (Vector, Batch, AggregateState, column_batches, filter_batch,
+                         factorize, np)
+from .parser import bind_parameters, check_count
+from . import parallel
+from .sorting import ExternalSort, merge_runs, top_n
+from .aggregation import HashAggregation, SPILL_PARTITIONS, initial, accumulate, finish, batch_partials
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le
+}
+
+Predicate = Tuple[int, Callable[[Any, Any], bool], Any]
+
+
+def compile_predicates(conditions: Optional[Dict], columns: List[str]) -> List[Predicate]:
+    """把 WHERE 条件编译为 (列位置, 比较函数, 值) 列表"""
+    if not conditions:
+        return []
+    predicates = []
+    for condition in conditions['conditions']:
+        col = condition['column']
+        if col not in columns:
+            raise Exception(f"未知的列名: {col}")
+        predicates.append((columns.index(col), OPERATORS[condition['operator']], condition['value']))
+    return predicates
+
+
+def format_conditions(conditions: Optional[Dict]) -> str:
+    """把条件格式化为可读字符串"""
+    if not conditions:
+        return ''
+    parts = []
+    for condition in conditions['conditions']:
+        value = condition['value']
+        value = f"'{value}'" if isinstance(value, str) else value
+        if condition.get('type') == 'aggregate':
+            target = f"{condition['function']}({condition['argument']})"
+        else:
+            target = condition['column']
+        parts.append(f"{target} {condition['operator']} {value}")
+    return ' AND '.join(parts)
+
+
+def match_having(group_result: Dict[str, Any], having: Dict[str, Any]) -> bool:
+    """检查分组结果是否满足 HAVING 条件"""
+    for condition in having['conditions']:
+        if condition['type'] == 'aggregate':
+            col = f"{condition['function'].lower()}_{condition['argument']}"
+        else:
+            col = condition['column']
+        if col not in group_result:
+            return False
+        if not OPERATORS[condition['operator']](group_result[col], condition['value']):
+            return False
+    return True
+
+
+class PlanNode:
+    """物理计划中的一个算子
+
+    columns 为输出行（元组）中各位置对应的列名。
+    算子以生成器的方式逐行向上层输出（火山模型），上层停止读取时下层的扫描也随之停止。
+    instrument 为 True 时记录实际输出行数和耗时（包括子算子），供 EXPLAIN ANALYZE 使用。
+    txn 为读取数据时使用的事务，扫描只返回其快照可见的行；为 None 时读取最新数据。
+    """
+
+    label = 'Node'
+
+    def __init__(self, columns: List[str], children: Optional[List["PlanNode"]] = None):
+        self.columns = list(columns)
+        self.children = children or []
+        self.est_rows = 0
+        self.cost = 0.0
+        self.actual_rows: Optional[int] = None
+        self.elapsed = 0.0
+        self.instrument = False
+        self.txn = None
+
+    def execute(self) -> List[tuple]:
+        """执行算子，返回全部输出行"""
+        return list(self.iterate())
+
+    def iterate(self) -> Iterator[tuple]:
+        """逐行产生输出"""
+        if self.instrument:
+            return self._instrumented()
+        return self._rows()
+
+    def _instrumented(self) -> Iterator[tuple]:
+        self.actual_rows = 0
+        self.elapsed = 0.0
+        rows = self._rows()
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            row = next(rows, None)
+            self.elapsed += clock() - start
+            if row is None:
+                return
+            self.actual_rows += 1
+            yield row
+
+    def _rows(self) -> Iterator[tuple]:
+        raise NotImplementedError
+
+    def bind(self, params: List[Any]) -> "PlanNode":
+        """复制计划树并把条件中的参数替换为实际值，缓存的计划每次执行都绑定出一个新副本"""
+        node = copy.copy(self)
+        node.children = [child.bind(params) for child in self.children]
+        node._bind(params)
+        return node
+
+    def _bind(self, params: List[Any]) -> None:
+        """替换本算子中的参数"""
+
+    def set_instrument(self, enabled: bool = True) -> None:
+        """为整棵计划树打开或关闭统计"""
+        self.instrument = enabled
+        for child in self.children:
+            child.set_instrument(enabled)
+
+    def set_transaction(self, txn) -> "PlanNode":
+        """设置整棵计划树读取数据时使用的事务，返回计划本身"""
+        self.txn = txn
+        for child in self.children:
+            child.set_transaction(txn)
+        return self
+
+    def details(self) -> str:
+        """EXPLAIN 中算子名后面的说明"""
+        return ''
+
+    def explain(self, analyze: bool = False, depth: int = 0) -> List[str]:
+        """生成计划树的文本描述"""
+        prefix = '  ' * depth + ('->  ' if depth else '')
+        line = f"{prefix}{self.label}{self.details()}  (cost={self.cost:.2f} rows={self.est_rows})"
+        if analyze and self.actual_rows is not None:
+            line += f" (actual rows={self.actual_rows} time={self.elapsed * 1000:.3f} ms)"
+        lines = [line]
+        for child in self.children:
+            lines.extend(child.explain(analyze, depth + 1))
+        return lines
+
+    def run(self) -> List[Dict[str, Any]]:
+        """执行计划并把结果转换为字典"""
+        return list(self.stream())
+
+    def stream(self) -> Iterator[Dict[str, Any]]:
+        """逐行产生字典形式的结果"""
+        columns = self.columns
+        for row in self.iterate():
+            yield dict(zip(columns, row))
+
+
+class SeqScan(PlanNode):
+    """顺序扫描全表，过滤条件和列投影在扫描时完成"""
+
+    label = 'Seq Scan'
+
+    def __init__(self, table, columns: List[str], conditions: Optional[Dict]):
+        super().__init__(columns)
+        self.table = table
+        self.conditions = conditions
+        table_columns = list(table.columns.keys())
+        self.predicates = compile_predicates(conditions, table_columns)
+        self.positions = [table_columns.index(col) for col in columns]
+
+    def _rows(self) -> Iterator[tuple]:
+        heap = self.table.heap
+        predicates = self.predicates
+        positions = self.positions
+        if isinstance(heap, ColumnStore):
+            # 列存储只解码用到的列，位置改为在这些列中的位置
+            read = sorted(set(positions) | {p for p, _, _ in predicates})
+            predicates = [(read.index(p), op, value) for p, op, value in predicates]
+            positions = [read.index(p) for p in positions]
+            rows = self.table.scan(self.txn, read, predicates=self.predicates)
+        else:
+            rows = self.table.scan(self.txn, predicates=predicates)
+        for _, values in rows:
+            for position, op, value in predicates:
+                if not op(values[position], value):
+                    break
+            else:
+                yield tuple(values[i] for i in positions)
+
+    def _bind(self, params: List[Any]) -> None:
+        self.conditions = bind_parameters(self.conditions, params)
+        self.predicates = bind_parameters(self.predicates, params)
+
+    def details(self) -> str:
+        text = f" on {self.table.name}"
+        if self.conditions:
+            text += f" [filter: {format_conditions(self.conditions)}]"
+        return text + f" [columns: {', '.join(self.columns)}]"
+
+
+class IndexScan(PlanNode):
+    """通过 B+ 树索引读取范围内的行
+
+    ordered 为 True 时按索引键顺序输出，否则按行ID排序后读取（访问页的顺序与存储顺序一致）。
+    """
+
+    label = 'Index Scan'
+
+    def __init__(self, table, column: str, bounds: Tuple[Any, bool, Any, bool],
+                 columns: List[str], conditions: Optional[Dict], ordered: bool = False):
+        super().__init__(columns)
+        self.table = table
+        self.column = column
+        self.bounds = bounds
+        self.conditions = conditions
+        self.ordered = ordered
+        table_columns = list(table.columns.keys())
+        self.predicates = compile_predicates(conditions, table_columns)
+        self.positions = [table_columns.index(col) for col in columns]
+
+    def _bind(self, params: List[Any]) -> None:
+        self.conditions = bind_parameters(self.conditions, params)
+        self.predicates = bind_parameters(self.predicates, params)
+        bounds = bind_parameters(self.bounds, params)
+        if not all(self.table.index_value_ok(self.column, bounds[i]) for i in (0, 2)):
+            # 参数的类型与列不一致，索引的比较结果不可靠，改为读取索引中的所有行再用条件过滤
+            bounds = (None, True, None, True)
+        self.bounds = bounds
+
+    def _rows(self) -> Iterator[tuple]:
+        lo, lo_inc, hi, hi_inc = self.bounds
+        entries = ((key, rid) for key, rids in self.table.get_index(self.column).items(lo, hi, lo_inc, hi_inc)
+                   for rid in tuple(rids))
+        if not self.ordered:
+            entries = sorted(entries, key=lambda entry: entry[1])
+        table = self.table
+        txn = self.txn
+        key_position = list(table.columns).index(self.column)
+        predicates = self.predicates
+        positions = self.positions
+        for key, rid in entries:
+            values = table.fetch(rid, txn)
+            # 索引中还保留着旧版本的键，只接受可见版本的键与索引项一致的行
+            if values is None or values[key_position] != key:
+                continue
+            for position, op, value in predicates:
+                if not op(values[position], value):
+                    break
+            else:
+                yield tuple(values[i] for i in positions)
+
+    def details(self) -> str:
+        lo, lo_inc, hi, hi_inc = self.bounds
+        if lo is not None and lo == hi:
+            condition = f"{self.column} = {lo!r}"
+        else:
+            parts = []
+            if lo is not None:
+                parts.append(f"{self.column} {'>=' if lo_inc else '>'} {lo!r}")
+            if hi is not None:
+                parts.append(f"{self.column} {'<=' if hi_inc else '<'} {hi!r}")
+            condition = ' AND '.join(parts) or 'full'
+        text = f" using {self.column} on {self.table.name} [range: {condition}]"
+        if self.ordered:
+            text += " [ordered]"
+        if self.conditions:
+            text += f" [filter: {format_conditions(self.conditions)}]"
+        return text + f" [columns: {', '.join(self.columns)}]"
+
+
+class VectorScan(PlanNode):
+    """按列批量扫描，条件以布尔掩码的形式对整批求值"""
+
+    label = 'Vector Scan'
+
+    def __init__(self, table, columns: List[str], conditions: Optional[Dict]):
+        super().__init__(columns)
+        self.table = table
+        self.conditions = conditions
+        table_columns = list(table.columns.keys())
+        predicates = compile_predicates(conditions, table_columns)
+        positions = [table_columns.index(col) for col in columns]
+        # 读取输出列和条件用到的列，条件和输出的位置改为在读取的列中的位置
+        self.read = sorted(set(positions) | {p for p, _, _ in predicates})
+        self.predicates = [(self.read.index(p), op, value) for p, op, value in predicates]
+        self.positions = [self.read.index(p) for p in positions]
+        self.types = [table.columns[col] for col in table_columns]
+
+    def _batches(self) -> Iterator[Batch]:
+        # 跳过页或块时用表中的列位置
+        predicates = [(self.read[p], op, value) for p, op, value in self.predicates]
+        for batch in column_batches(self.table, self.read, self.types, self.txn, predicates):
+            length, vectors = filter_batch(batch, self.predicates)
+            yield length, [vectors[i] for i in self.positions]
+
+    def batches(self) -> Iterator[Batch]:
+        """产生过滤后的批，每批只包含输出列；由上层按批读取时也记录行数和耗时"""
+        self.actual_rows = 0
+        self.elapsed = 0.0
+        source = self._batches()
+        while True:
+            start = time.perf_counter()
+            batch = next(source, None)
+            self.elapsed += time.perf_counter() - start
+            if batch is None:
+                return
+            self.actual_rows += batch[0]
+            yield batch
+
+    def _rows(self) -> Iterator[tuple]:
+        for length, vectors in self._batches():
+            if length:
+                yield from zip(*[vector.decode() for vector in vectors])
+
+    def _bind(self, params: List[Any]) -> None:
+        self.conditions = bind_parameters(self.conditions, params)
+        self.predicates = bind_parameters(self.predicates, params)
+
+    def details(self) -> str:
+        text = f" on {self.table.name}"
+        if self.conditions:
+            text += f" [filter: {format_conditions(self.conditions)}]"
+        return text + f" [columns: {', '.join(self.columns)}]"
+
+
+class VectorAggregate(PlanNode):
+    """对列批计算聚合
+
+    不分组时每批更新一次聚合状态；分组时每批把分组列编码为组号、按组号归约出部分结果，
+    再按组键合并到 HashAggregation 中（组数超过 memory_groups 时写入临时文件）。
+    """
+
+    label = 'Vector Aggregate'
+
+    def __init__(self, child: VectorScan, group_by: List[str], aggregates: List[Dict],
+                 having: Optional[Dict], extra_columns: List[str], memory_groups: Optional[int] = None):
+        aliases = [agg['alias'] for agg in aggregates]
+        if group_by:
+            columns = list(group_by) + [a for a in aliases if a not in group_by]
+        else:
+            columns = aliases + [col for col in extra_columns if col not in aliases]
+        super().__init__(columns, [child])
+        self.group_by = group_by
+        self.aggregates = aggregates
+        self.having = having
+        self.memory_groups = memory_groups
+        self.spills = 0
+
+    def _vector(self, vectors: List[Vector], argument: str) -> Optional[Vector]:
+        return None if argument == '*' else vectors[self.children[0].columns.index(argument)]
+
+    def _rows(self) -> Iterator[tuple]:
+        child = self.children[0]
+        if not self.group_by:
+            states = [AggregateState(agg['function']) for agg in self.aggregates]
+            first: Dict[str, Any] = {}
+            for length, vectors in child.batches():
+                if length and not first:
+                    # 非聚合列取第一行的值
+                    first = {col: vector.take(slice(0, 1)).decode()[0] if np is not None else vector.values[0]
+                             for col, vector in zip(child.columns, vectors)}
+                for state, agg in zip(states, self.aggregates):
+                    state.update(length, self._vector(vectors, agg['argument']))
+            result = {agg['alias']: state.result() for agg, state in zip(self.aggregates, states)}
+            yield tuple(result[col] if col in result else first.get(col) for col in self.columns)
+            return
+
+        table = HashAggregation([agg['function'] for agg in self.aggregates], self.memory_groups)
+        for length, vectors in child.batches():
+            if not length:
+                continue
+            ids, keys = factorize([self._vector(vectors, col) for col in self.group_by])
+            partials = [batch_partials(agg['function'], ids, len(keys), self._vector(vectors, agg['argument']))
+                        for agg in self.aggregates]
+            for g, key in enumerate(keys):
+                table.merge(key, [partial[g] for partial in partials])
+        try:
+            yield from _group_rows(self, table.results())
+        finally:
+            self.spills = table.spills
+
+    def _bind(self, params: List[Any]) -> None:
+        self.having = bind_parameters(self.having, params)
+
+    def details(self) -> str:
+        text = f" [group by: {', '.join(self.group_by)}]" if self.group_by else ''
+        if self.having:
+            text += f" [having: {format_conditions(self.having)}]"
+        if self.spills:
+            text += f" [spilled: {self.spills}]"
+        return text
+
+
+class ParallelNode(PlanNode):
+    """由多个工作进程扫描表的算子，唯一的子算子是提供列位置和过滤条件的 VectorScan
+
+    表不能并行扫描时（平台不支持共享内存、列存储中有按对象保存的列等）执行串行的 fallback 计划，
+    fallback 与本算子共用同一个子算子，输出相同的列。
+    """
+
+    def __init__(self, columns: List[str], child: VectorScan, fallback: PlanNode, workers: int):
+        super().__init__(columns, [child])
+        self.fallback = fallback
+        self.workers = workers
+
+    def bind(self, params: List[Any]) -> "PlanNode":
+        node = super().bind(params)
+        if self.fallback is self.children[0]:
+            node.fallback = node.children[0]
+        else:
+            node.fallback = copy.copy(self.fallback)
+            node.fallback.children = node.children
+            node.fallback._bind(params)
+        return node
+
+    def set_instrument(self, enabled: bool = True) -> None:
+        super().set_instrument(enabled)
+        self.fallback.instrument = enabled
+
+    def set_transaction(self, txn) -> "PlanNode":
+        super().set_transaction(txn)
+        self.fallback.txn = txn
+        return self
+
+    def _scan(self, operation: Tuple) -> Optional[List[Any]]:
+        """并行扫描并在各段上执行 operation，不能并行时返回 None"""
+        scan = self.children[0]
+        return parallel.ParallelScan(scan.table, self.txn, scan.read, scan.types, self.workers).run(
+            scan.predicates, operation)
+
+    def _position(self, column: str) -> Optional[int]:
+        """列在扫描读取的列中的位置，* 为 None"""
+        scan = self.children[0]
+        return None if column == '*' else scan.positions[scan.columns.index(column)]
+
+
+class ParallelAggregate(ParallelNode):
+    """各工作进程对表的一段做部分聚合，本进程合并
+
+    不分组时合并各段的聚合状态；分组时按组键合并各段的部分结果（AVG 分别合并总和与行数），
+    组的输出顺序与 VectorAggregate 相同。
+    """
+
+    label = 'Parallel Aggregate'
+
+    def __init__(self, child: VectorScan, fallback: VectorAggregate, workers: int):
+        super().__init__(fallback.columns, child, fallback, workers)
+
+    def _rows(self) -> Iterator[tuple]:
+        fallback = self.fallback
+        aggregates = fallback.aggregates
+        functions = [agg['function'] for agg in aggregates]
+        operation = ('aggregate', [self._position(col) for col in fallback.group_by],
+                     [(agg['function'], self._position(agg['argument'])) for agg in aggregates],
+                     fallback.memory_groups if fallback.group_by else None)
+        results = self._scan(operation)
+        if results is None:
+            yield from fallback.iterate()
+            return
+
+        if not fallback.group_by:
+            states = [AggregateState(function) for function in functions]
+            first = None
+            for part_first, part_states in results:
+                if first is None:
+                    first = part_first
+                for state, other in zip(states, part_states):
+                    state.merge(other)
+            result = {agg['alias']: state.result() for agg, state in zip(aggregates, states)}
+            yield tuple(result[col] if col in result else first[self._position(col)] if first else None
+                        for col in self.columns)
+            return
+
+        table = HashAggregation(functions, fallback.memory_groups)
+        for keys, partials in results:
+            for g, key in enumerate(keys):
+                table.merge(key, [partial[g] for partial in partials])
+        yield from _group_rows(fallback, table.results())
+
+    def details(self) -> str:
+        return self.fallback.details() + f" [workers: {self.workers}]"
+
+
+class Gather(ParallelNode):
+    """各工作进程过滤表的一段，本进程按段的顺序收集结果
+
+    有排序键时各段在工作进程中排好序，本进程归并各段（Gather Merge），结果与扫描后排序相同。
+    """
+
+    def __init__(self, child: VectorScan, keys: List[Tuple[str, str]], fallback: PlanNode, workers: int):
+        super().__init__(child.columns, child, fallback, workers)
+        self.keys = keys
+        self.label = 'Gather Merge' if keys else 'Gather'
+
+    def _rows(self) -> Iterator[tuple]:
+        keys = [(self.columns.index(col), direction == 'DESC') for col, direction in self.keys]
+        results = self._scan(('rows', self.children[0].positions, keys))
+        if results is None:
+            yield from self.fallback.iterate()
+        elif keys:
+            yield from merge_runs(results, keys)
+        else:
+            for rows in results:
+                yield from rows
+
+    def details(self) -> str:
+        text = f" [keys: {', '.join(f'{col} {direction}' for col, direction in self.keys)}]" if self.keys else ''
+        return text + f" [workers: {self.workers}]"
+
+
+class Sort(PlanNode):
+    """按多个列排序，所有键组成一个组合键只排一次
+
+    limit 不为 None 时只需要前 limit 行，用一个 limit 行的堆选出（Top-N）；
+    否则输入超过 memory_rows 行时把排好序的段写入临时文件，最后归并（外部排序）。
+    """
+
+    label = 'Sort'
+
+    def __init__(self, child: PlanNode, keys: List[Tuple[str, str]], memory_rows: int = 100000,
+                 limit: Optional[int] = None):
+        super().__init__(child.columns, [child])
+        for col, _ in keys:
+            if col not in child.columns:
+                raise Exception(f"未知的列名: {col}")
+        self.keys = keys
+        self.memory_rows = memory_rows
+        self.limit = limit
+        # 最近一次执行写入临时文件的段数
+        self.runs = 0
+
+    def _rows(self) -> Iterator[tuple]:
+        keys = [(self.columns.index(col), direction == 'DESC') for col, direction in self.keys]
+        rows = self.children[0].iterate()
+        if self.limit is not None and self.limit <= self.memory_rows:
+            yield from top_n(rows, keys, self.limit)
+            return
+        sort = ExternalSort(keys, self.memory_rows)
+        try:
+            yield from sort.sort(rows)
+        finally:
+            self.runs = sort.runs
+
+    def details(self) -> str:
+        text = f" [keys: {', '.join(f'{col} {direction}' for col, direction in self.keys)}]"
+        if self.limit is not None:
+            text += f" [top-N: {self.limit}]"
+        if self.runs:
+            text += f" [external: {self.runs} runs]"
+        return text
+
+
+class Aggregate(PlanNode):
+    """不分组的聚合，输出一行"""
+
+    label = 'Aggregate'
+
+    def __init__(self, child: PlanNode, aggregates: List[Dict], extra_columns: List[str]):
+        aliases = [agg['alias'] for agg in aggregates]
+        self.extra_columns = [col for col in extra_columns if col not in aliases]
+        super().__init__(aliases + self.extra_columns, [child])
+        self.aggregates = aggregates
+
+    def _rows(self) -> Iterator[tuple]:
+        child = self.children[0]
+        functions = [agg['function'] for agg in self.aggregates]
+        arguments = _argument_positions(self.aggregates, child.columns)
+        state = [initial(function) for function in functions]
+        first = None
+        for row in child.iterate():
+            if first is None:
+                first = row
+            for i, function in enumerate(functions):
+                position = arguments[i]
+                state[i] = accumulate(function, state[i], None if position is None else row[position])
+        result = {agg['alias']: finish(function, partial)
+                  for agg, function, partial in zip(self.aggregates, functions, state)}
+        # 非聚合列取第一行的值
+        first = dict(zip(child.columns, first)) if first is not None else {}
+        yield tuple(result[col] if col in result else first.get(col) for col in self.columns)
+
+
+def _argument_positions(aggregates: List[Dict], columns: List[str]) -> List[Optional[int]]:
+    """各聚合函数的参数在输入行中的位置，COUNT(*) 为 None"""
+    return [None if agg['argument'] == '*' else columns.index(agg['argument']) for agg in aggregates]
+
+
+def _check_argument_types(aggregates: List[Dict], types: Dict[str, str]) -> None:
+    """SUM 和 AVG 只能用于数值列，types 为参数列名到列类型的映射"""
+    for agg in aggregates:
+        if agg['function'] in ('SUM', 'AVG') and agg['argument'] != '*' \
+                and types[agg['argument']] not in ('INT', 'FLOAT'):
+            raise Exception(f"{agg['function']} 不能用于 {types[agg['argument']]} 类型的列 {agg['argument']}")
+
+
+def _group_rows(node, results: Iterator[Tuple[tuple, List[Any]]]) -> Iterator[tuple]:
+    """把 (组键, 各聚合函数的值) 组成输出行，过滤掉不满足 HAVING 的组"""
+    for key, values in results:
+        group_result = dict(zip(node.group_by, key))
+        group_result.update(zip([agg['alias'] for agg in node.aggregates], values))
+        if node.having and not match_having(group_result, node.having):
+            continue
+        yield tuple(group_result[col] for col in node.columns)
+
+
+class HashAggregate(PlanNode):
+    """用哈希表分组，每组只保存聚合函数的部分结果，每行更新一次
+
+    组数超过 memory_groups 时哈希表按分区写入临时文件（见 HashAggregation），spills 为最近一次执行写出的次数。
+    """
+
+    label = 'HashAggregate'
+
+    def __init__(self, child: PlanNode, group_by: List[str], aggregates: List[Dict], having: Optional[Dict],
+                 memory_groups: Optional[int] = None):
+        aliases = [agg['alias'] for agg in aggregates]
+        super().__init__(list(group_by) + [a for a in aliases if a not in group_by], [child])
+        self.group_by = group_by
+        self.aggregates = aggregates
+        self.having = having
+        self.memory_groups = memory_groups
+        self.spills = 0
+
+    def _results(self, rows: Iterator[tuple]) -> Iterator[Tuple[tuple, List[Any]]]:
+        child = self.children[0]
+        positions = [child.columns.index(col) for col in self.group_by]
+        arguments = _argument_positions(self.aggregates, child.columns)
+        table = HashAggregation([agg['function'] for agg in self.aggregates], self.memory_groups)
+        add = table.add
+        for row in rows:
+            add(tuple([row[i] for i in positions]), [None if p is None else row[p] for p in arguments])
+        try:
+            yield from table.results()
+        finally:
+            self.spills = table.spills
+
+    def _rows(self) -> Iterator[tuple]:
+        return _group_rows(self, self._results(self.children[0].iterate()))
+
+    def _bind(self, params: List[Any]) -> None:
+        self.having = bind_parameters(self.having, params)
+
+    def details(self) -> str:
+        text = f" [group by: {', '.join(self.group_by)}]"
+        if self.having:
+            text += f" [having: {format_conditions(self.having)}]"
+        if self.spills:
+            text += f" [spilled: {self.spills}]"
+        return text
+
+
+class SortAggregate(HashAggregate):
+    """输入已按分组列排序，相邻的相同键组成一组，不需要哈希表，每组结束即可输出"""
+
+    label = 'GroupAggregate'
+
+    def _results(self, rows: Iterator[tuple]) -> Iterator[Tuple[tuple, List[Any]]]:
+        child = self.children[0]
+        positions = [child.columns.index(col) for col in self.group_by]
+        arguments = _argument_positions(self.aggregates, child.columns)
+        functions = [agg['function'] for agg in self.aggregates]
+        current: Optional[tuple] = None
+        state: Optional[List[Any]] = None
+        for row in rows:
+            key = tuple([row[i] for i in positions])
+            if state is None or key != current:
+                if state is not None:
+                    yield current, [finish(function, partial) for function, partial in zip(functions, state)]
+                current = key
+                state = [initial(function) for function in functions]
+            for i, function in enumerate(functions):
+                position = arguments[i]
+                state[i] = accumulate(function, state[i], None if position is None else row[position])
+        if state is not None:
+            yield current, [finish(function, partial) for function, partial in zip(functions, state)]
+
+
+class Project(PlanNode):
+    """选择并重排输出列"""
+
+    label = 'Project'
+
+    def __init__(self, child: PlanNode, columns: List[str], names: Optional[List[str]] = None):
+        super().__init__(names or columns, [child])
+        self.positions = [child.columns.index(col) for col in columns]
+
+    def _rows(self) -> Iterator[tuple]:
+        positions = self.positions
+        for row in self.children[0].iterate():
+            yield tuple(row[i] for i in positions)
+
+    def details(self) -> str:
+        return f" [columns: {', '.join(self.columns)}]"
+
+
+class Limit(PlanNode):
+    """跳过前 offset 行后最多输出 count 行，读够后不再向下层取行"""
+
+    label = 'Limit'
+
+    def __init__(self, child: PlanNode, count: Optional[int], offset: int = 0):
+        super().__init__(child.columns, [child])
+        self.count = count
+        self.offset = offset
+
+    def _rows(self) -> Iterator[tuple]:
+        stop = None if self.count is None else self.offset + self.count
+        return islice(self.children[0].iterate(), self.offset, stop)
+
+    def details(self) -> str:
+        text = f" [count: {self.count}]" if self.count is not None else ''
+        return text + (f" [offset: {self.offset}]" if self.offset else '')
+
+
+def _join_key(row: tuple, positions: List[int]) -> Optional[tuple]:
+    """连接键，含 NULL 的键不与任何行匹配"""
+    key = tuple(row[i] for i in positions)
+    return None if None in key else key
+
+
+class HashJoin(PlanNode):
+    """哈希连接：用较小的一侧建立哈希表，另一侧逐行探测"""
+
+    label = 'Hash Join'
+
+    def __init__(self, left: PlanNode, right: PlanNode, left_keys: List[str], right_keys: List[str],
+                 build_left: bool = False):
+        super().__init__(left.columns + right.columns, [left, right])
+        self.left_keys = left_keys
+        self.right_keys = right_keys
+        self.build_left = build_left
+
+    def _rows(self) -> Iterator[tuple]:
+        left, right = self.children
+        left_positions = [left.columns.index(col) for col in self.left_keys]
+        right_positions = [right.columns.index(col) for col in self.right_keys]
+        if self.build_left:
+            build, build_positions, probe, probe_positions = left, left_positions, right, right_positions
+        else:
+            build, build_positions, probe, probe_positions = right, right_positions, left, left_positions
+        table: Dict[tuple, List[tuple]] = defaultdict(list)
+        for row in build.iterate():
+            key = _join_key(row, build_positions)
+            if key is not None:
+                table[key].append(row)
+        # 探测侧逐行流式输出
+        for row in probe.iterate():
+            matches = table.get(_join_key(row, probe_positions))
+            if matches:
+                if self.build_left:
+                    for match in matches:
+                        yield match + row
+                else:
+                    for match in matches:
+                        yield row + match
+
+    def details(self) -> str:
+        condition = ' AND '.join(f"{l} = {r}" for l, r in zip(self.left_keys, self.right_keys))
+        return f" [on: {condition}] [build: {'left' if self.build_left else 'right'}]"
+
+
+class MergeJoin(PlanNode):
+    """排序合并连接：两侧都按连接键有序，同时向前推进"""
+
+    label = 'Merge Join'
+
+    def __init__(self, left: PlanNode, right: PlanNode, left_keys: List[str], right_keys: List[str]):
+        super().__init__(left.columns + right.columns, [left, right])
+        self.left_keys = left_keys
+        self.right_keys = right_keys
+
+    def _rows(self) -> Iterator[tuple]:
+        left, right = self.children
+        left_positions = [left.columns.index(col) for col in self.left_keys]
+        right_positions = [right.columns.index(col) for col in self.right_keys]
+        left_rows = [(key, row) for row in left.iterate()
+                     for key in [_join_key(row, left_positions)] if key is not None]
+        right_rows = [(key, row) for row in right.iterate()
+                      for key in [_join_key(row, right_positions)] if key is not None]
+        i = j = 0
+        while i < len(left_rows) and j < len(right_rows):
+            key = left_rows[i][0]
+            other = right_rows[j][0]
+            if key < other:
+                i += 1
+            elif key > other:
+                j += 1
+            else:
+                # 两侧键相同的行两两组合
+                i_end = i
+                while i_end < len(left_rows) and left_rows[i_end][0] == key:
+                    i_end += 1
+                j_end = j
+                while j_end < len(right_rows) and right_rows[j_end][0] == key:
+                    j_end += 1
+                for _, row in left_rows[i:i_end]:
+                    for _, match in right_rows[j:j_end]:
+                        yield row + match
+                i, j = i_end, j_end
+
+    def details(self) -> str:
+        condition = ' AND '.join(f"{l} = {r}" for l, r in zip(self.left_keys, self.right_keys))
+        return f" [on: {condition}]"
+
+
+class IndexNestedLoopJoin(PlanNode):
+    """索引嵌套循环连接：左侧每行用连接键在右表的索引上查找匹配的行"""
+
+    label = 'Index Nested Loop'
+
+    def __init__(self, left: PlanNode, table, alias: str, columns: List[str], conditions: Optional[Dict],
+                 left_keys: List[str], right_keys: List[str]):
+        super().__init__(left.columns + [f"{alias}.{col}" for col in columns], [left])
+        self.table = table
+        self.alias = alias
+        self.conditions = conditions
+        self.left_keys = left_keys
+        self.right_keys = right_keys
+        table_columns = list(table.columns.keys())
+        self.predicates = compile_predicates(conditions, table_columns)
+        self.positions = [table_columns.index(col) for col in columns]
+        self.right_positions = [table_columns.index(col) for col in right_keys]
+
+    def _rows(self) -> Iterator[tuple]:
+        left = self.children[0]
+        left_positions = [left.columns.index(col) for col in self.left_keys]
+        index = self.table.get_index(self.right_keys[0])
+        table = self.table
+        txn = self.txn
+        predicates = self.predicates
+        positions = self.positions
+        for row in left.iterate():
+            key = _join_key(row, left_positions)
+            if key is None:
+                continue
+            try:
+                rids = index.find(key[0])
+            except TypeError:
+                # 键的类型与索引列不可比较，不会有匹配
+                continue
+            for rid in sorted(rids):
+                values = table.fetch(rid, txn)
+                if values is None or tuple(values[i] for i in self.right_positions) != key:
+                    continue
+                for position, op, value in predicates:
+                    if not op(values[position], value):
+                        break
+                else:
+                    yield row + tuple(values[i] for i in positions)
+
+    def _bind(self, params: List[Any]) -> None:
+        self.conditions = bind_parameters(self.conditions, params)
+        self.predicates = bind_parameters(self.predicates, params)
+
+    def details(self) -> str:
+        condition = ' AND '.join(f"{l} = {self.alias}.{r}" for l, r in zip(self.left_keys, self.right_keys))
+        text = f" using {self.right_keys[0]} on {self.table.name} {self.alias} [on: {condition}]"
+        if self.conditions:
+            text += f" [filter: {format_conditions(self.conditions)}]"
+        return text
+
+
+class JoinStatistics:
+    """连接结果的列统计，按限定列名 别名.列 查找所在表的统计信息"""
+
+    def __init__(self, scopes: Dict[str, Any]):
+        self.scopes = scopes
+
+    def distinct(self, column: str) -> int:
+        alias, col = column.split('.', 1)
+        return self.scopes[alias].statistics().distinct(col)
+
+
+class Planner:
+    """根据解析树和表统计信息生成物理计划
+
+    访问路径在顺序扫描和各个可用索引之间按代价选择；
+    只读取查询用到的列（投影下推）；
+    GROUP BY 根据估计的分组数和输入是否有序选择哈希聚合或排序聚合。
+    """
+
+    SEQ_PAGE_COST = 1.0
+    RANDOM_PAGE_COST = 4.0
+    CPU_TUPLE_COST = 0.01
+    CPU_INDEX_TUPLE_COST = 0.005
+    CPU_OPERATOR_COST = 0.0025
+    # 批处理时每行 CPU 代价的折扣（有 NumPy 的列存储 / 其他情况）
+    VECTOR_COST_FACTOR = 0.1
+    VECTOR_FALLBACK_COST_FACTOR = 0.7
+    # 行存储要先把行转置为列，扫描本身没有收益
+    VECTOR_ROW_SCAN_COST_FACTOR = 1.05
+    # 并行扫描：把表交给工作进程的固定代价（复制到共享内存、发送任务），每个结果行（或组）传回本进程的代价
+    PARALLEL_SETUP_COST = 1000.0
+    PARALLEL_TUPLE_COST = 0.1
+    # 外部排序写入、读回临时文件时每页的行数（估算）
+    SORT_ROWS_PER_PAGE = 100
+
+    def __init__(self, config: Optional[DBConfig] = None):
+        self.config = config or DBConfig()
+
+    def plan_select(self, parsed: Dict[str, Any], table, tables: Optional[Dict[str, Any]] = None) -> PlanNode:
+        """为 SELECT 生成物理计划，带 JOIN 的查询需要通过 tables 提供所有表"""
+        if parsed.get('limit') is not None:
+            check_count('LIMIT', parsed['limit'])
+        check_count('OFFSET', parsed.get('offset', 0))
+        if parsed.get('joins'):
+            node = self._plan_join(parsed, tables or {table.name: table})
+        else:
+            node = self._plan_table(parsed, table)
+        if parsed.get('limit') is not None or parsed.get('offset'):
+            node = self._limit(node, parsed.get('limit'), parsed.get('offset') or 0)
+        return node
+
+    def _plan_table(self, parsed: Dict[str, Any], table) -> PlanNode:
+        """单表查询的计划"""
+        table_columns = list(table.columns.keys())
+        columns = parsed.get('columns')
+        conditions = parsed.get('where')
+        group_by = parsed.get('group_by')
+        having = parsed.get('having')
+        order_by = parsed.get('order_by')
+        aggregates = parsed.get('aggregates') or []
+        is_aggregate = bool(group_by or aggregates)
+        limit, offset = parsed.get('limit'), parsed.get('offset') or 0
+        top = None if limit is None else offset + limit
+
+        if columns is None:
+            columns = [] if is_aggregate else table_columns
+        for col in columns + (group_by or []):
+            if col not in table.columns:
+                raise Exception(f"未知的列名: {col}")
+        for agg in aggregates:
+            if agg['argument'] != '*' and agg['argument'] not in table.columns:
+                raise Exception(f"未知的列名: {agg['argument']}")
+        _check_argument_types(aggregates, table.columns)
+
+        # 投影下推：扫描只输出后续算子需要的列
+        needed = set(columns) | set(group_by or [])
+        needed |= {agg['argument'] for agg in aggregates if agg['argument'] != '*'}
+        if not is_aggregate:
+            needed |= {col for col, _ in order_by or []}
+        scan_columns = [col for col in table_columns if col in needed] or table_columns[:1]
+
+        stats = table.statistics()
+        if group_by:
+            order_column = group_by[0] if len(group_by) == 1 else None
+        else:
+            order_column = order_by[0][0] if order_by and len(order_by) == 1 and order_by[0][1] == 'ASC' else None
+        paths = self._access_paths(table, stats, conditions, scan_columns, order_column)
+
+        if not is_aggregate:
+            # 按索引键有序的扫描可以省去排序；有 LIMIT 时按只读取前几行的代价比较
+            candidates = [path if not order_by or self._provides_order(path, order_by)
+                          else self._sort(path, order_by, top) for path in paths]
+            gather = self._gather(table, paths[0], order_by or [])
+            if gather is not None:
+                candidates.append(gather)
+            node = min(candidates, key=lambda n: self._limit(n, limit, offset).cost)
+            return self._project(node, columns)
+
+        if not group_by:
+            node = min((self._aggregate(path, aggregates, columns) for path in paths), key=lambda n: n.cost)
+        else:
+            node = min((self._group(path, stats, group_by, aggregates, having) for path in paths),
+                       key=lambda n: n.cost)
+        parallel_node = self._parallel_aggregate(table, paths[0], stats, group_by or [], aggregates, having, columns)
+        if parallel_node is not None and parallel_node.cost < node.cost:
+            node = parallel_node
+        if order_by:
+            node = self._sort(node, order_by, top)
+        return node
+
+    def _access_paths(self, table, stats, conditions: Optional[Dict], columns: List[str],
+                      order_column: Optional[str]) -> List[PlanNode]:
+        """列出所有可用的访问路径并估算代价"""
+        rows = max(stats.row_count, table.heap.row_count)
+        pages = max(table.heap.num_pages, 1)
+        condition_list = conditions['conditions'] if conditions else []
+
+        out_rows = max(1, int(rows * self._selectivity(stats, condition_list))) if rows else 0
+
+        seq = SeqScan(table, columns, conditions)
+        seq.est_rows = out_rows
+        seq.cost = pages * self.SEQ_PAGE_COST + rows * (
+            self.CPU_TUPLE_COST + len(condition_list) * self.CPU_OPERATOR_COST)
+        paths: List[PlanNode] = [seq]
+
+        if self.config.vectorized:
+            vector = VectorScan(table, columns, conditions)
+            vector.est_rows = out_rows
+            vector.cost = pages * self.SEQ_PAGE_COST + rows * (
+                self.CPU_TUPLE_COST + len(condition_list) * self.CPU_OPERATOR_COST) * (
+                self._vector_factor(table) if isinstance(table.heap, ColumnStore) else self.VECTOR_ROW_SCAN_COST_FACTOR)
+            paths.append(vector)
+
+        ranges = table.index_ranges(conditions)
+        if order_column is not None and table.ordered_index(order_column):
+            ranges.setdefault(order_column, (None, True, None, True))
+        for column, bounds in ranges.items():
+            lo, lo_inc, hi, hi_inc = bounds
+            if lo is not None and lo == hi:
+                index_sel = stats.selectivity(column, '=', lo)
+            else:
+                index_sel = stats.range_selectivity(column, lo, hi)
+            fetched = max(1, rows * index_sel) if rows else 0
+            # 哈希索引（主键、UNIQUE）只有等值查找，一次查找的代价与行数无关
+            ordered_index = table.ordered_index(column)
+            probe = math.log2(rows + 2) if ordered_index else 1
+            for ordered in ([False, True] if column == order_column and ordered_index else [False]):
+                path = IndexScan(table, column, bounds, columns, conditions, ordered)
+                path.est_rows = out_rows
+                # 无序时行ID排序后按页顺序读取，有序时每行都可能是一次随机读
+                pages_read = min(fetched, pages) if not ordered else fetched
+                path.cost = (probe * self.CPU_OPERATOR_COST
+                             + fetched * (self.CPU_INDEX_TUPLE_COST + self.CPU_TUPLE_COST
+                                          + len(condition_list) * self.CPU_OPERATOR_COST)
+                             + pages_read * self.RANDOM_PAGE_COST)
+                if not ordered and fetched > 1:
+                    path.cost += fetched * math.log2(fetched) * self.CPU_OPERATOR_COST
+                paths.append(path)
+        return paths
+
+    def _parallel_scan(self, table, seq: SeqScan) -> Optional[VectorScan]:
+        """并行扫描的子算子（与顺序扫描的列和条件相同），不能并行时返回 None"""
+        if self.config.parallel_workers < 2 or not parallel.supported(table):
+            return None
+        scan = VectorScan(table, seq.columns, seq.conditions)
+        scan.est_rows = seq.est_rows
+        scan.cost = seq.cost
+        return scan
+
+    def _parallel_aggregate(self, table, seq: SeqScan, stats, group_by: List[str], aggregates: List[Dict],
+                            having: Optional[Dict], columns: List[str]) -> Optional[PlanNode]:
+        """各工作进程做部分聚合：每个进程承担串行代价的 1/workers，合并的代价与组数乘进程数成正比"""
+        scan = self._parallel_scan(table, seq)
+        if scan is None:
+            return None
+        workers = self.config.parallel_workers
+        if group_by:
+            fallback = self._group(scan, stats, group_by, aggregates, having)
+        else:
+            fallback = self._aggregate(scan, aggregates, columns)
+        node = ParallelAggregate(scan, fallback, workers)
+        node.est_rows = fallback.est_rows
+        node.cost = (self.PARALLEL_SETUP_COST + fallback.cost / workers
+                     + fallback.est_rows * workers * self.PARALLEL_TUPLE_COST)
+        return node
+
+    def _gather(self, table, seq: SeqScan, order_by: List[Tuple[str, str]]) -> Optional[PlanNode]:
+        """各工作进程过滤（和排序）表的一段，结果行传回本进程，有序时再归并"""
+        scan = self._parallel_scan(table, seq)
+        if scan is None:
+            return None
+        workers = self.config.parallel_workers
+        fallback = self._sort(scan, order_by) if order_by else scan
+        node = Gather(scan, order_by, fallback, workers)
+        node.est_rows = scan.est_rows
+        node.cost = (self.PARALLEL_SETUP_COST + fallback.cost / workers
+                     + scan.est_rows * self.PARALLEL_TUPLE_COST)
+        if order_by:
+            node.cost += scan.est_rows * math.log2(workers) * self.CPU_OPERATOR_COST * len(order_by)
+        return node
+
+    def _vector_factor(self, table) -> float:
+        if np is not None and isinstance(table.heap, ColumnStore):
+            return self.VECTOR_COST_FACTOR
+        return self.VECTOR_FALLBACK_COST_FACTOR
+
+    @staticmethod
+    def _selectivity(stats, conditions: List[Dict]) -> float:
+        """估算条件组合的选择率，同一列上的范围条件合并为一个区间"""
+        selectivity = 1.0
+        ranges: Dict[str, List[Any]] = {}
+        for condition in conditions:
+            col, op, value = condition['column'], condition['operator'], condition['value']
+            if op in ('>', '>=', '<', '<='):
+                bounds = ranges.setdefault(col, [None, None])
+                try:
+                    if op in ('>', '>=') and (bounds[0] is None or value > bounds[0]):
+                        bounds[0] = value
+                    elif op in ('<', '<=') and (bounds[1] is None or value < bounds[1]):
+                        bounds[1] = value
+                    continue
+                except TypeError:
+                    pass
+            selectivity *= stats.selectivity(col, op, value)
+        for col, (low, high) in ranges.items():
+            selectivity *= stats.range_selectivity(col, low, high)
+        return selectivity
+
+    def _aggregate(self, path: PlanNode, aggregates: List[Dict], columns: List[str]) -> PlanNode:
+        """不分组的聚合"""
+        per_row = self.CPU_OPERATOR_COST * max(1, len(aggregates))
+        if isinstance(path, VectorScan):
+            node = VectorAggregate(path, [], aggregates, None, columns)
+            per_row *= self._vector_factor(path.table)
+        else:
+            node = Aggregate(path, aggregates, columns)
+        node.est_rows = 1
+        node.cost = path.cost + path.est_rows * per_row
+        return node
+
+    def _group(self, path: PlanNode, stats, group_by: List[str], aggregates: List[Dict],
+               having: Optional[Dict]) -> PlanNode:
+        """为一个访问路径选择哈希聚合或排序聚合"""
+        rows = max(path.est_rows, 1)
+        groups = 1
+        for col in group_by:
+            groups *= stats.distinct(col)
+        groups = max(1, min(groups, rows))
+        per_row = self.CPU_OPERATOR_COST * (len(group_by) + len(aggregates))
+
+        memory_groups = self.config.hash_agg_max_groups
+        # 组数超过内存预算时，哈希表中的组（多次写出时每次都可能包含同一组）写入临时文件再读回
+        spill_cost = 0.0
+        if groups > memory_groups:
+            spill_cost = 2 * groups * min(rows / memory_groups, SPILL_PARTITIONS) / self.SORT_ROWS_PER_PAGE \
+                * self.SEQ_PAGE_COST
+
+        if isinstance(path, VectorScan):
+            node = VectorAggregate(path, group_by, aggregates, having, [], memory_groups)
+            node.cost = path.cost + rows * per_row * self._vector_factor(path.table) + spill_cost
+            node.est_rows = groups
+            return node
+
+        presorted = isinstance(path, IndexScan) and path.ordered and path.column == group_by[0] \
+            and len(group_by) == 1
+        if presorted:
+            node = SortAggregate(path, group_by, aggregates, having)
+            node.cost = path.cost + rows * per_row
+        else:
+            node = HashAggregate(path, group_by, aggregates, having, memory_groups)
+            node.cost = path.cost + rows * (per_row + self.CPU_OPERATOR_COST) + spill_cost
+            # 分组数很多时也可以先排序（内存不够时外部排序），相邻的相同键组成一组
+            sort = self._sort(path, [(col, 'ASC') for col in group_by])
+            sorted_node = SortAggregate(sort, group_by, aggregates, having)
+            sorted_node.cost = sort.cost + rows * per_row
+            if sorted_node.cost < node.cost:
+                node = sorted_node
+        node.est_rows = groups
+        return node
+
+    def _sort(self, child: PlanNode, order_by: List[Tuple[str, str]], limit: Optional[int] = None) -> PlanNode:
+        """排序；limit 为只需要的前几行（LIMIT 加 OFFSET），这时用 Top-N 堆排序"""
+        memory_rows = self.config.sort_memory_rows
+        node = Sort(child, order_by, memory_rows, limit)
+        rows = max(child.est_rows, 1)
+        node.est_rows = child.est_rows
+        compare = self.CPU_OPERATOR_COST * len(order_by)
+        if limit is not None and limit <= memory_rows:
+            node.cost = child.cost + rows * math.log2(min(limit, rows) + 1) * compare
+            return node
+        node.cost = child.cost + rows * math.log2(rows + 1) * compare
+        if rows > memory_rows:
+            # 各段写入临时文件再读回
+            node.cost += 2 * rows / self.SORT_ROWS_PER_PAGE * self.SEQ_PAGE_COST
+        return node
+
+    @staticmethod
+    def _provides_order(path: PlanNode, order_by: List[Tuple[str, str]]) -> bool:
+        """访问路径的输出是否已经按 ORDER BY 排好序"""
+        return (isinstance(path, IndexScan) and path.ordered
+                and len(order_by) == 1 and order_by[0][0] == path.column and order_by[0][1] == 'ASC')
+
+    def _project(self, child: PlanNode, columns: List[str]) -> PlanNode:
+        if child.columns == columns:
+            return child
+        node = Project(child, columns)
+        node.est_rows = child.est_rows
+        node.cost = child.cost + child.est_rows * self.CPU_OPERATOR_COST
+        return node
+
+    @staticmethod
+    def _resolve(name: str, scopes: Dict[str, Any]) -> str:
+        """把列名解析为 别名.列 形式的限定列名"""
+        if '.' in name:
+            alias, col = name.split('.', 1)
+            if alias not in scopes or col not in scopes[alias].columns:
+                raise Exception(f"未知的列名: {name}")
+            return name
+        matches = [alias for alias, table in scopes.items() if name in table.columns]
+        if not matches:
+            raise Exception(f"未知的列名: {name}")
+        if len(matches) > 1:
+            raise Exception(f"列名 {name} 不明确，请使用 表名.列名")
+        return f"{matches[0]}.{name}"
+
+    def _join_input(self, table, alias: str, conditions: List[Dict], columns: List[str],
+                    key: Optional[str]) -> Tuple[PlanNode, Optional[PlanNode]]:
+        """一张表作为连接输入的最佳访问路径，以及按连接键有序的最佳路径"""
+        where = {'operator': 'AND', 'conditions': conditions} if conditions else None
+        paths = self._access_paths(table, table.statistics(), where, columns, key)
+        for path in paths:
+            path.columns = [f"{alias}.{col}" for col in path.columns]
+        best = min(paths, key=lambda p: p.cost)
+        ordered = [p for p in paths if isinstance(p, IndexScan) and p.ordered and p.column == key]
+        return best, min(ordered, key=lambda p: p.cost) if ordered else None
+
+    def _plan_join(self, parsed: Dict[str, Any], tables: Dict[str, Any]) -> PlanNode:
+        """为带 JOIN 的 SELECT 生成计划
+
+        WHERE 条件下推到各表的扫描；按书写顺序从左到右连接，
+        每次在哈希连接、排序合并连接和索引嵌套循环连接中选择代价最小的。
+        """
+        scopes: Dict[str, Any] = {}
+        for name, alias in [(parsed['table'], parsed.get('alias'))] + \
+                [(join['table'], join.get('alias')) for join in parsed['joins']]:
+            if name not in tables:
+                raise Exception(f"表 {name} 不存在")
+            alias = alias or name
+            if alias in scopes:
+                raise Exception(f"表名或别名 {alias} 重复，请使用别名区分")
+            scopes[alias] = tables[name]
+        resolve = lambda name: self._resolve(name, scopes)
+
+        group_by = [resolve(col) for col in parsed.get('group_by') or []]
+        aggregates = [dict(agg, argument=agg['argument'] if agg['argument'] == '*' else resolve(agg['argument']))
+                      for agg in parsed.get('aggregates') or []]
+        qualified = [agg['argument'] for agg in aggregates if agg['argument'] != '*']
+        _check_argument_types(aggregates, {name: scopes[name.split('.', 1)[0]].columns[name.split('.', 1)[1]]
+                                           for name in qualified})
+        is_aggregate = bool(group_by or aggregates)
+        columns = parsed.get('columns')
+        if columns is None:
+            columns = [] if is_aggregate else [f"{alias}.{col}" for alias, table in scopes.items()
+                                               for col in table.columns]
+        outputs = [(resolve(col), col) for col in columns]
+        having = parsed.get('having')
+        if having:
+            having = dict(having, conditions=[
+                condition if condition['type'] == 'aggregate' else dict(condition, column=resolve(condition['column']))
+                for condition in having['conditions']])
+        order_by = parsed.get('order_by')
+
+        # 单表条件下推到扫描
+        pushed: Dict[str, List[Dict]] = {alias: [] for alias in scopes}
+        for condition in (parsed.get('where') or {}).get('conditions', []):
+            alias, col = resolve(condition['column']).split('.', 1)
+            pushed[alias].append(dict(condition, column=col))
+
+        # 连接键
+        joins = []
+        for join in parsed['joins']:
+            alias = join.get('alias') or join['table']
+            left_keys, right_keys = [], []
+            for a, b in join['on']:
+                a, b = resolve(a), resolve(b)
+                if b.split('.', 1)[0] != alias:
+                    a, b = b, a
+                if b.split('.', 1)[0] != alias or a.split('.', 1)[0] == alias:
+                    raise Exception(f"JOIN {alias} 的 ON 条件必须连接 {alias} 和之前的表")
+                left_keys.append(a)
+                right_keys.append(b)
+            if not left_keys:
+                raise Exception("JOIN 需要等值连接条件")
+            joins.append((alias, left_keys, right_keys))
+
+        needed = {q for q, _ in outputs} | set(group_by)
+        needed |= {agg['argument'] for agg in aggregates if agg['argument'] != '*'}
+        if not is_aggregate:
+            needed |= {resolve(col) for col, _ in order_by or []}
+        for _, left_keys, right_keys in joins:
+            needed |= set(left_keys) | set(right_keys)
+        scan_columns = {alias: [col for col in table.columns if f"{alias}.{col}" in needed] or list(table.columns)[:1]
+                        for alias, table in scopes.items()}
+
+        first = next(iter(scopes))
+        first_key = joins[0][1][0].split('.', 1)[1] if joins and joins[0][1][0].startswith(first + '.') else None
+        node, node_ordered = self._join_input(scopes[first], first, pushed[first], scan_columns[first], first_key)
+        for alias, left_keys, right_keys in joins:
+            node = self._join(node, node_ordered, scopes, alias, pushed[alias], scan_columns[alias],
+                              left_keys, right_keys)
+            node_ordered = None
+
+        stats = JoinStatistics(scopes)
+        limit, offset = parsed.get('limit'), parsed.get('offset') or 0
+        top = None if limit is None else offset + limit
+        if not is_aggregate:
+            if order_by:
+                node = self._sort(node, [(resolve(col), direction) for col, direction in order_by], top)
+            return self._rename(node, [q for q, _ in outputs], [name for _, name in outputs])
+
+        if not group_by:
+            node = self._aggregate(node, aggregates, [q for q, _ in outputs])
+            extra = node.columns[len(aggregates):]
+            names = dict(outputs)
+            node = self._rename(node, node.columns, node.columns[:len(aggregates)] + [names[q] for q in extra])
+        else:
+            node = self._group(node, stats, group_by, aggregates, having)
+            node = self._rename(node, node.columns,
+                                list(parsed['group_by']) + node.columns[len(group_by):])
+        if order_by:
+            node = self._sort(node, order_by, top)
+        return node
+
+    def _join(self, left: PlanNode, left_ordered: Optional[PlanNode], scopes: Dict[str, Any], alias: str,
+              conditions: List[Dict], columns: List[str], left_keys: List[str], right_keys: List[str]) -> PlanNode:
+        """选择连接算法"""
+        table = scopes[alias]
+        stats = table.statistics()
+        keys = [key.split('.', 1)[1] for key in right_keys]
+        right, right_ordered = self._join_input(table, alias, conditions, columns, keys[0])
+
+        left_rows = max(left.est_rows, 1)
+        right_rows = max(right.est_rows, 1)
+        distinct = max(JoinStatistics(scopes).distinct(left_keys[0]), stats.distinct(keys[0]), 1)
+        out_rows = max(1, int(left_rows * right_rows / distinct))
+        output_cost = out_rows * self.CPU_TUPLE_COST
+        candidates = []
+
+        build_left = left_rows < right_rows
+        hash_join = HashJoin(left, right, left_keys, right_keys, build_left)
+        hash_join.cost = left.cost + right.cost + output_cost + \
+            (2 * min(left_rows, right_rows) + max(left_rows, right_rows)) * self.CPU_OPERATOR_COST
+        candidates.append(hash_join)
+
+        # 排序合并：能用按键有序的索引扫描时省去排序
+        def sorted_input(path: PlanNode, ordered: Optional[PlanNode], sort_keys: List[str]) -> PlanNode:
+            sort = self._sort(path, [(key, 'ASC') for key in sort_keys])
+            if ordered is not None and len(sort_keys) == 1 and ordered.cost < sort.cost:
+                return ordered
+            return sort
+
+        merge_left = sorted_input(left, left_ordered, left_keys)
+        merge_right = sorted_input(right, right_ordered, right_keys)
+        merge_join = MergeJoin(merge_left, merge_right, left_keys, right_keys)
+        merge_join.cost = merge_left.cost + merge_right.cost + output_cost + \
+            (left_rows + right_rows) * self.CPU_OPERATOR_COST
+        candidates.append(merge_join)
+
+        # 索引嵌套循环：右表的连接列上有索引
+        if keys[0] in table.index_names.values():
+            where = {'operator': 'AND', 'conditions': conditions} if conditions else None
+            nested = IndexNestedLoopJoin(left, table, alias, columns, where, left_keys, keys)
+            rows = max(stats.row_count, table.heap.row_count)
+            fetched = left_rows * max(rows / max(stats.distinct(keys[0]), 1), 1)
+            probe = math.log2(rows + 2) if table.ordered_index(keys[0]) else 1
+            nested.cost = left.cost + output_cost + left_rows * probe * self.CPU_OPERATOR_COST + \
+                fetched * self.CPU_TUPLE_COST + min(fetched, max(table.heap.num_pages, 1)) * self.RANDOM_PAGE_COST
+            candidates.append(nested)
+
+        node = min(candidates, key=lambda n: n.cost)
+        node.est_rows = out_rows
+        return node
+
+    def _rename(self, child: PlanNode, columns: List[str], names: List[str]) -> PlanNode:
+        """选择列并改为输出名"""
+        if child.columns == names:
+            return child
+        node = Project(child, columns, names)
+        node.est_rows = child.est_rows
+        node.cost = child.cost + child.est_rows * self.CPU_OPERATOR_COST
+        return node
+
+    def _limit(self, child: PlanNode, count: Optional[int], offset: int) -> PlanNode:
+        node = Limit(child, count, offset)
+        node.est_rows = child.est_rows if count is None else min(child.est_rows, count)
+        # 不需要排序等阻塞算子时只读取输出需要的那部分行
+        fraction = node.est_rows / child.est_rows if child.est_rows else 1.0
+        node.cost = child.cost * (fraction if self._pipelined(child) else 1.0)
+        return node
+
+    @staticmethod
+    def _pipelined(node: PlanNode) -> bool:
+        """计划是否能边读边输出（不含排序、聚合等需要读完输入的算子）"""
+        if isinstance(node, (Sort, Aggregate, HashAggregate, VectorAggregate, ParallelNode, MergeJoin)):
+            return False
+        return all(Planner._pipelined(child) for child in node.children)
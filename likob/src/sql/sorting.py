@@ -0,0 +1,144 @@
+import heapq
+import operator
+import pickle
+import tempfile
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, List, Tuple
+
+# 排序键: [(位置, 是否降序)]
+SortKeys = List[Tuple[int, bool]]
+
+# 临时文件中每次序列化的行数
+CHUNK_ROWS = 1024
+# 一次归并最多同时打开的段数，段更多时先分组归并为更长的段
+MERGE_FAN_IN = 64
+
+
+class Descending:
+    """包装降序列的值，比较结果与原值相反；各列方向不同时用它组成一个组合键"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __lt__(self, other: "Descending") -> bool:
+        return other.value < self.value
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Descending) and self.value == other.value
+
+
+def sort_key(keys: SortKeys) -> Tuple[Callable[[tuple], Any], bool]:
+    """返回 (组合键函数, 是否整体倒序)，一次排序即可按所有键排好
+
+    各键方向相同时直接比较值的元组，整体按该方向排序；否则降序的键用 Descending 包装后升序排序。
+    """
+    directions = {descending for _, descending in keys}
+    if len(directions) == 1:
+        return operator.itemgetter(*[position for position, _ in keys]), directions.pop()
+
+    def key(row: tuple) -> tuple:
+        return tuple(Descending(row[position]) if descending else row[position] for position, descending in keys)
+    return key, False
+
+
+def sort_rows(rows: List[tuple], keys: SortKeys) -> None:
+    """原地稳定排序"""
+    key, reverse = sort_key(keys)
+    rows.sort(key=key, reverse=reverse)
+
+
+def merge_runs(runs: List[Iterable[tuple]], keys: SortKeys) -> Iterator[tuple]:
+    """归并各段排好序的行，键相同时前面一段的行在前"""
+    key, reverse = sort_key(keys)
+    return heapq.merge(*runs, key=key, reverse=reverse)
+
+
+def top_n(rows: Iterable[tuple], keys: SortKeys, n: int) -> List[tuple]:
+    """排序后的前 n 行，只用一个 n 行的堆，结果与完整排序后取前 n 行相同"""
+    key, reverse = sort_key(keys)
+    return (heapq.nlargest if reverse else heapq.nsmallest)(n, rows, key=key)
+
+
+class SpillFile:
+    """写在临时文件中的一组行（排序的一段、聚合的一个分区），文件在 close 时删除"""
+
+    def __init__(self, rows: Iterable[tuple] = ()):
+        self.file = tempfile.TemporaryFile()
+        self.write(rows)
+
+    def write(self, rows: Iterable[tuple]) -> None:
+        """在文件末尾追加行"""
+        self.file.seek(0, 2)
+        dump = pickle.dump
+        chunk: List[tuple] = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= CHUNK_ROWS:
+                dump(chunk, self.file, pickle.HIGHEST_PROTOCOL)
+                chunk = []
+        if chunk:
+            dump(chunk, self.file, pickle.HIGHEST_PROTOCOL)
+        self.file.flush()
+
+    def __iter__(self) -> Iterator[tuple]:
+        self.file.seek(0)
+        while True:
+            try:
+                chunk = pickle.load(self.file)
+            except EOFError:
+                return
+            yield from chunk
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ExternalSort:
+    """外部归并排序
+
+    每读入 memory_rows 行排好序写入一个临时文件（一段），输入读完后归并各段；
+    输入不超过 memory_rows 行时完全在内存中排序。runs 为写入临时文件的段数。
+    """
+
+    def __init__(self, keys: SortKeys, memory_rows: int):
+        self.keys = keys
+        self.memory_rows = max(memory_rows, 1)
+        self.runs = 0
+
+    def sort(self, rows: Iterable[tuple]) -> Iterator[tuple]:
+        key, reverse = sort_key(self.keys)
+        rows = iter(rows)
+        runs: List[SpillFile] = []
+        try:
+            while True:
+                buffer = list(islice(rows, self.memory_rows))
+                buffer.sort(key=key, reverse=reverse)
+                if len(buffer) < self.memory_rows:
+                    break
+                runs.append(SpillFile(buffer))
+                self.runs += 1
+                # 先释放这一段，读下一段时内存中只有一段
+                buffer = None
+            if not runs:
+                yield from buffer
+                return
+            while len(runs) >= MERGE_FAN_IN:
+                # 相邻的段分组归并，段之间的先后顺序不变
+                merged = []
+                for i in range(0, len(runs), MERGE_FAN_IN):
+                    group = runs[i:i + MERGE_FAN_IN]
+                    if len(group) > 1:
+                        merged.append(SpillFile(merge_runs(group, self.keys)))
+                        self.runs += 1
+                        for run in group:
+                            run.close()
+                    else:
+                        merged.extend(group)
+                runs = merged
+            # 内存中的最后一段放在最后，键相同的行保持输入顺序
+            yield from merge_runs(runs + [buffer], self.keys)
+        finally:
+            for run in runs:
+                run.close()
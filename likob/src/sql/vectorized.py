@@ -0,0 +1,336 @@
+from itertools import compress
+from typing import Dict, Any, Optional, List, Tuple, Iterator, Callable
+from ..storage.column_store import ColumnStore, BLOCK_ROWS, KIND_INT, KIND_FLOAT, KIND_TEXT, KIND_OBJECT
+from ..core.transaction import visible_row
+
+try:
+    import numpy as np
+except ImportError:  # 没有 NumPy 时用 Python 列表完成同样的批处理
+    np = None
+
+# 每批处理的行数
+BATCH_SIZE = 4096
+
+DTYPES = {KIND_INT: 'int64', KIND_FLOAT: 'float64', KIND_TEXT: 'int32'}
+TYPE_DTYPES = {'INT': 'int64', 'FLOAT': 'float64'}
+
+
+class Vector:
+    """一批行中一列的值
+
+    有 NumPy 时 values 为 ndarray，否则为列表；
+    字典编码的 TEXT 列 values 保存编码，dictionary 保存编码对应的字符串。
+    """
+
+    __slots__ = ('values', 'dictionary')
+
+    def __init__(self, values, dictionary: Optional[List[str]] = None):
+        self.values = values
+        self.dictionary = dictionary
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def compare(self, op: Callable[[Any, Any], bool], value: Any):
+        """计算 op(列值, value) 的布尔掩码"""
+        if np is None:
+            return [op(v, value) for v in self.values]
+        if self.dictionary is not None:
+            # 先在字典上比较，再按编码查表
+            table = np.fromiter((op(s, value) for s in self.dictionary), dtype=bool, count=len(self.dictionary))
+            return table[self.values] if len(table) else np.zeros(len(self.values), dtype=bool)
+        return np.asarray(op(self.values, value), dtype=bool)
+
+    def take(self, mask) -> "Vector":
+        """按掩码选出行"""
+        if np is None:
+            return Vector(list(compress(self.values, mask)))
+        return Vector(self.values[mask], self.dictionary)
+
+    def decode(self) -> List[Any]:
+        """转换为 Python 值的列表"""
+        if np is None:
+            return self.values
+        values = self.values.tolist()
+        if self.dictionary is not None:
+            d = self.dictionary
+            return [d[v] for v in values]
+        return values
+
+    @staticmethod
+    def concat(vectors: List["Vector"]) -> "Vector":
+        """把多批的同一列连接起来"""
+        if np is None:
+            return Vector([v for vector in vectors for v in vector.values])
+        dictionary = vectors[0].dictionary if vectors else None
+        if any(vector.dictionary is not dictionary for vector in vectors):
+            return Vector(np.array([v for vector in vectors for v in vector.decode()], dtype=object))
+        if not vectors:
+            return Vector(np.array([], dtype=object))
+        return Vector(np.concatenate([vector.values for vector in vectors]), dictionary)
+
+
+Batch = Tuple[int, List[Vector]]
+
+
+def _bits(bitmap: bytearray):
+    return np.unpackbits(np.frombuffer(bytes(bitmap), dtype=np.uint8), bitorder='little')
+
+
+def column_batches(table, positions: List[int], types: List[str], txn=None,
+                   predicates: Optional[List[Tuple[int, Callable, Any]]] = None) -> Iterator[Batch]:
+    """按批读取表中指定位置的列，产生 (行数, 各列的 Vector)
+
+    列存储直接复制类型化数组的片段，批内有版本链的行再按事务快照替换为可见的版本；
+    行存储把一批可见的行转置为列。predicates 为 (表中的列位置, 比较函数, 值) 条件时跳过
+    最小值和最大值表明没有行能满足条件的页或块，产生的批仍要由调用者过滤。
+    """
+    heap = table.heap
+    if isinstance(heap, ColumnStore):
+        yield from _columnar_batches(heap, positions, types, txn, predicates)
+        return
+    rows = []
+    for _, row in table.scan(txn, predicates=predicates):
+        rows.append(row)
+        if len(rows) == BATCH_SIZE:
+            yield _transpose(rows, positions, types)
+            rows = []
+    if rows:
+        yield _transpose(rows, positions, types)
+
+
+def _transpose(rows: List[tuple], positions: List[int], types: List[str]) -> Batch:
+    vectors = []
+    for position in positions:
+        values = [row[position] for row in rows]
+        if np is None:
+            vectors.append(Vector(values))
+            continue
+        try:
+            array = np.array(values, dtype=TYPE_DTYPES.get(types[position], object))
+        except (TypeError, ValueError, OverflowError):
+            array = np.array(values, dtype=object)
+        vectors.append(Vector(array))
+    return len(rows), vectors
+
+
+def _chained(heap: ColumnStore, start: int, end: int, txn) -> bool:
+    """[start, end) 中是否有带版本链、需要按快照取版本的行
+
+    在复制出一批数据之后检查：写者先建版本链再修改列，复制时已被修改的行此时一定能看到版本链。
+    """
+    if txn is None or not heap.versions:
+        return False
+    return any(start <= rid < end for rid in list(heap.versions))
+
+
+def _visible_batch(heap: ColumnStore, positions: List[int], types: List[str], txn, start: int, end: int) -> Batch:
+    """逐行组装一批：有版本链的行取快照可见的版本，其余行按删除位图过滤"""
+    values = [heap.column(position).block(start, end) for position in positions]
+    versions = heap.versions
+    deleted = heap.deleted
+    rows = []
+    for rid, row in enumerate(zip(*values), start):
+        chain = versions.get(rid)
+        if chain is not None:
+            row = visible_row(chain, txn)
+            if row is not None:
+                rows.append(tuple(row[p] for p in positions))
+        elif not deleted[rid >> 3] & (1 << (rid & 7)):
+            rows.append(row)
+    return _transpose(rows, list(range(len(positions))), [types[p] for p in positions])
+
+
+def _batch_ranges(heap: ColumnStore, predicates: Optional[List[Tuple[int, Callable, Any]]]) -> Iterator[Tuple[int, int]]:
+    """每批的行ID范围 [start, end)，有条件时跳过统计表明没有行能满足条件的块（每批正好是一块）"""
+    size = heap.size
+    for start in range(0, size, BATCH_SIZE):
+        if predicates and not heap.may_match(start // BLOCK_ROWS, predicates):
+            continue
+        yield start, min(start + BATCH_SIZE, size)
+
+
+def _columnar_batches(heap: ColumnStore, positions: List[int], types: List[str], txn=None,
+                      predicates: Optional[List[Tuple[int, Callable, Any]]] = None) -> Iterator[Batch]:
+    columns = [heap.column(position) for position in positions]
+    if np is None:
+        for start, end in _batch_ranges(heap, predicates):
+            vectors = [Vector(column.block(start, end)) for column in columns]
+            if _chained(heap, start, end, txn):
+                yield _visible_batch(heap, positions, types, txn, start, end)
+            elif heap.deleted_count:
+                live = [not heap.deleted[i >> 3] & (1 << (i & 7)) for i in range(start, end)]
+                vectors = [vector.take(live) for vector in vectors]
+                yield sum(live), vectors
+            else:
+                yield end - start, vectors
+        return
+
+    deleted = _bits(heap.deleted) if heap.deleted_count else None
+    nulls = [_bits(column.nulls) if column.null_count else None for column in columns]
+    for start, end in _batch_ranges(heap, predicates):
+        vectors = []
+        for column, null_bits in zip(columns, nulls):
+            if column.kind == KIND_OBJECT or (null_bits is not None and null_bits[start:end].any()):
+                vectors.append(Vector(np.array(column.block(start, end), dtype=object)))
+            else:
+                # 复制出独立的缓冲区，不会妨碍之后向列数组追加，也不受之后原地修改的影响
+                array = np.frombuffer(column.raw(start, end), dtype=DTYPES[column.kind])
+                vectors.append(Vector(array, column.dictionary if column.kind == KIND_TEXT else None))
+        if _chained(heap, start, end, txn):
+            yield _visible_batch(heap, positions, types, txn, start, end)
+            continue
+        if deleted is not None:
+            live = deleted[start:end] == 0
+            yield int(live.sum()), [vector.take(live) for vector in vectors]
+        else:
+            yield end - start, vectors
+
+
+def filter_batch(batch: Batch, predicates: List[Tuple[int, Callable, Any]]) -> Batch:
+    """用条件的布尔掩码过滤一批行，predicates 中的位置是批内列的位置"""
+    length, vectors = batch
+    if not predicates or not length:
+        return batch
+    if np is None:
+        # 逐个条件过滤，后面的条件只比较剩下的行
+        for position, op, value in predicates:
+            mask = vectors[position].compare(op, value)
+            vectors = [vector.take(mask) for vector in vectors]
+        return (len(vectors[0]) if vectors else 0), vectors
+    mask = None
+    for position, op, value in predicates:
+        m = vectors[position].compare(op, value)
+        mask = m if mask is None else mask & m
+    return int(mask.sum()), [vector.take(mask) for vector in vectors]
+
+
+def _python(value: Any) -> Any:
+    """NumPy 标量转换为 Python 值"""
+    return value.item() if hasattr(value, 'item') else value
+
+
+class AggregateState:
+    """不分组聚合的增量状态，每批数据更新一次"""
+
+    def __init__(self, function: str):
+        self.function = function
+        self.count = 0
+        self.total: Any = 0
+        self.value: Any = None
+
+    def update(self, length: int, vector: Optional[Vector]) -> None:
+        self.count += length
+        if self.function == 'COUNT' or not length:
+            return
+        if self.function in ('SUM', 'AVG'):
+            if np is not None and vector.dictionary is None and vector.values.dtype != object:
+                self.total += _python(vector.values.sum())
+            else:
+                self.total += sum(vector.decode())
+            return
+        if np is not None and vector.dictionary is not None:
+            # 只比较这批中出现过的字典值
+            candidates = [vector.dictionary[c] for c in np.unique(vector.values).tolist()]
+        elif np is not None and vector.values.dtype != object:
+            candidates = [_python(vector.values.min() if self.function == 'MIN' else vector.values.max())]
+        else:
+            candidates = vector.decode()
+        best = min(candidates) if self.function == 'MIN' else max(candidates)
+        if self.value is None or (best < self.value if self.function == 'MIN' else best > self.value):
+            self.value = best
+
+    def merge(self, other: "AggregateState") -> None:
+        """合并另一部分数据上的状态（例如另一个工作进程扫描的一段）"""
+        self.count += other.count
+        self.total += other.total
+        if other.value is not None and (self.value is None or (
+                other.value < self.value if self.function == 'MIN' else other.value > self.value)):
+            self.value = other.value
+
+    def result(self) -> Any:
+        if self.function == 'COUNT':
+            return self.count
+        if self.function == 'SUM':
+            return self.total
+        if self.function == 'AVG':
+            return self.total / self.count if self.count else 0
+        return self.value
+
+
+def factorize(vectors: List[Vector]) -> Tuple[Any, List[tuple]]:
+    """把分组列的值编码为组号，组号按第一次出现的顺序分配
+
+    返回 (每行的组号, 每组的键)。
+    """
+    if np is None:
+        groups: Dict[tuple, int] = {}
+        ids = [groups.setdefault(key, len(groups)) for key in zip(*[v.values for v in vectors])]
+        return ids, list(groups)
+
+    length = len(vectors[0])
+    combined = np.zeros(length, dtype=np.int64)
+    columns = []
+    for vector in vectors:
+        try:
+            uniques, inverse = np.unique(vector.values, return_inverse=True)
+            keys = Vector(uniques, vector.dictionary).decode()
+        except TypeError:
+            # 无法排序的对象数组用字典编码
+            codes: Dict[Any, int] = {}
+            inverse = np.fromiter((codes.setdefault(v, len(codes)) for v in vector.values.tolist()),
+                                  dtype=np.int64, count=length)
+            keys = list(codes)
+        columns.append((inverse.reshape(-1), keys))
+        combined = combined * max(len(keys), 1) + inverse.reshape(-1)
+    _, first, inverse = np.unique(combined, return_index=True, return_inverse=True)
+    # 按第一次出现的位置重新编号
+    order = np.argsort(first, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    ids = rank[inverse.reshape(-1)]
+    firsts = first[order].tolist()
+    keys = [tuple(column_keys[column_ids[i]] for column_ids, column_keys in columns) for i in firsts]
+    return ids, keys
+
+
+def group_reduce(function: str, ids, groups: int, vector: Optional[Vector]) -> List[Any]:
+    """按组号计算聚合函数，返回每组的结果"""
+    if np is not None:
+        counts = np.bincount(ids, minlength=groups)
+        if function == 'COUNT':
+            return counts.tolist()
+        numeric = vector.dictionary is None and vector.values.dtype != object
+        if numeric and function in ('SUM', 'AVG'):
+            if vector.values.dtype.kind == 'f':
+                totals = np.bincount(ids, weights=vector.values, minlength=groups)
+            else:
+                totals = np.zeros(groups, dtype=vector.values.dtype)
+                np.add.at(totals, ids, vector.values)
+            if function == 'SUM':
+                return totals.tolist()
+            return [t / c if c else 0 for t, c in zip(totals.tolist(), counts.tolist())]
+        if numeric and function in ('MIN', 'MAX'):
+            order = np.argsort(ids, kind='stable')
+            starts = np.searchsorted(ids[order], np.arange(groups))
+            reduce = np.minimum if function == 'MIN' else np.maximum
+            return reduce.reduceat(vector.values[order], starts).tolist()
+        ids = ids.tolist()
+
+    if function == 'COUNT':
+        counts = [0] * groups
+        for g in ids:
+            counts[g] += 1
+        return counts
+    values = vector.decode()
+    totals: List[Any] = [0] * groups if function in ('SUM', 'AVG') else [None] * groups
+    counts = [0] * groups
+    for g, v in zip(ids, values):
+        counts[g] += 1
+        if function in ('SUM', 'AVG'):
+            totals[g] = totals[g] + v
+        elif totals[g] is None or (v < totals[g] if function == 'MIN' else v > totals[g]):
+            totals[g] = v
+    if function == 'AVG':
+        return [t / c if c else 0 for t, c in zip(totals, counts)]
+    return totals
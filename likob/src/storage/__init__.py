@@ -0,0 +1,7 @@
+from .engine import StorageEngine, HeapFile
+from .buffer_pool import BufferPool
+from .column_store import ColumnStore
+from .io_manager import IOManager, MemoryIOManager
+from .page import Page
+
+__all__ = ['StorageEngine', 'HeapFile', 'ColumnStore', 'BufferPool', 'IOManager', 'MemoryIOManager', 'Page']
@@ -0,0 +1,350 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple, Any, Optional, List, Iterator
+from .page import Page
+from ..core.exceptions import StorageError
+
+
+class Frame:
+    """缓冲池中的一个页框
+
+    未命中的页先以 page 为 None 的页框登记（并被固定），在锁外读入后设置 page 并通知 loaded，
+    同时访问这个页的其他线程等待 loaded，不会重复读取。
+    """
+
+    __slots__ = ('heap', 'page', 'slot', 'pin_count', 'referenced', 'history', 'loaded')
+
+    def __init__(self, heap, page: Optional[Page], slot: int):
+        self.heap = heap
+        self.page = page
+        self.slot = slot
+        self.pin_count = 0
+        self.referenced = True
+        # 最近 K 次访问时间，用于 LRU-K
+        self.history: List[float] = []
+        self.loaded: Optional[threading.Event] = None if page is not None else threading.Event()
+
+
+class BufferPool:
+    """在表和磁盘之间缓存页，最多驻留 capacity 个页
+
+    policy 为 'clock' 时使用 CLOCK 置换，为 'lru-k' 时使用 LRU-K 置换。
+    被固定(pin)的页不会被置换，脏页在置换时写回磁盘。
+    self.lock 只保护页表和计数，磁盘读写都在锁外进行：置换脏页时在锁内选出并固定牺牲页，
+    在锁外写回（写回期间页仍在缓冲池中，访问它的线程直接命中），之后回到锁内确认它没有再被固定或修改才移除；
+    未命中时同样在锁外读页。一个线程的磁盘读写不会让其他线程访问已缓存的页时等待。
+    """
+
+    POLICIES = ('clock', 'lru-k')
+
+    def __init__(self, capacity: int, policy: str = 'clock', k: int = 2):
+        if capacity < 1:
+            raise StorageError(f"缓冲池容量必须大于0: {capacity}")
+        policy = policy.lower()
+        if policy not in self.POLICIES:
+            raise StorageError(f"不支持的置换策略: {policy}")
+        self.capacity = capacity
+        self.policy = policy
+        self.k = k
+        self.frames: Dict[Tuple[str, int], Frame] = {}
+        # CLOCK 环形数组，元素为页的键，None 表示空闲位置
+        self._clock: List[Optional[Tuple[str, int]]] = []
+        self._free_slots: List[int] = []
+        self._hand = 0
+        self.lock = threading.RLock()
+        # 正在锁外写回的置换牺牲页，丢弃页之前等待它们写完
+        self._evicting: set = set()
+        # 置换写回和检查点临时固定的页数，缓冲池被占满时等待它们解除固定
+        self._busy = 0
+        self._evicted = threading.Condition(self.lock)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+
+    def _touch(self, frame: Frame) -> None:
+        """记录一次访问"""
+        frame.referenced = True
+        if self.policy == 'lru-k':
+            frame.history.append(time.monotonic())
+            if len(frame.history) > self.k:
+                del frame.history[0]
+
+    def _write_back(self, frame: Frame) -> bool:
+        """把脏页写回磁盘，返回是否写出
+
+        被固定的页可能正在被修改，持有页的共享闩写出，保证写出的是一次完整修改之后的内容。
+        修改页的线程持有排他闩期间不访问缓冲池，持有缓冲池锁时等待闩也不会死锁。
+        """
+        page = frame.page
+        if page is None or not page.dirty:
+            return False
+        with page.latch.shared():
+            frame.heap.write_page(page)
+            page.dirty = False
+        return True
+
+    def _choose_victim(self) -> Tuple[str, int]:
+        """选择一个未被固定的页进行置换"""
+        if self.policy == 'clock':
+            # 最多转两圈：第一圈清除访问位，第二圈必然找到
+            for _ in range(2 * len(self._clock)):
+                if self._hand >= len(self._clock):
+                    self._hand = 0
+                key = self._clock[self._hand]
+                self._hand += 1
+                if key is None:
+                    continue
+                frame = self.frames[key]
+                if frame.pin_count == 0:
+                    if not frame.referenced:
+                        return key
+                    frame.referenced = False
+        else:
+            # 倒数第 K 次访问最早的页最先被置换，访问不足 K 次的页优先
+            victim = None
+            victim_rank = None
+            for key, frame in self.frames.items():
+                if frame.pin_count > 0:
+                    continue
+                history = frame.history
+                rank = (len(history) >= self.k, history[0] if history else 0.0)
+                if victim_rank is None or rank < victim_rank:
+                    victim, victim_rank = key, rank
+            if victim is not None:
+                return victim
+        raise StorageError(f"缓冲池已满: {self.capacity} 个页都被固定")
+
+    def _release(self, key: Tuple[str, int]) -> Frame:
+        """从缓冲池移除一个页框，空出它在环中的位置"""
+        frame = self.frames.pop(key)
+        self._clock[frame.slot] = None
+        self._free_slots.append(frame.slot)
+        return frame
+
+    def _reserve(self) -> Optional[Frame]:
+        """为新页腾出页框，调用者持有 self.lock
+
+        干净的牺牲页直接移除；选中脏页时固定它并返回，由调用者在锁外调用 _evict_dirty 后重试。
+        有空位时返回 None。页都被固定、但其中有其他线程为写回临时固定的页时，等待它们解除固定。
+        """
+        while len(self.frames) >= self.capacity:
+            try:
+                key = self._choose_victim()
+            except StorageError:
+                if not self._busy:
+                    raise
+                self._evicted.wait()
+                continue
+            frame = self.frames[key]
+            if frame.page.dirty:
+                frame.pin_count += 1
+                self._busy += 1
+                self._evicting.add(key)
+                return frame
+            self._release(key)
+            self.evictions += 1
+        return None
+
+    def _unpin_busy(self, frame: Frame) -> None:
+        """解除写回时的临时固定，调用者持有 self.lock"""
+        frame.pin_count -= 1
+        self._busy -= 1
+        self._evicted.notify_all()
+
+    def _evict_dirty(self, frame: Frame) -> None:
+        """在锁外写回 _reserve 选中的脏页，写回之后没有被再次固定或修改时移除"""
+        key = (frame.heap.name, frame.page.page_no)
+        written = False
+        try:
+            written = self._write_back(frame)
+        finally:
+            with self.lock:
+                self._unpin_busy(frame)
+                self.writebacks += written
+                if self.frames.get(key) is frame and frame.pin_count == 0 and not frame.page.dirty:
+                    self._release(key)
+                    self.evictions += 1
+                self._evicting.discard(key)
+
+    def _insert(self, heap, page_no: int, page: Optional[Page]) -> Frame:
+        """登记一个固定的页框，调用者持有 self.lock 并已用 _reserve 腾出位置"""
+        key = (heap.name, page_no)
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._clock[slot] = key
+        else:
+            slot = len(self._clock)
+            self._clock.append(key)
+        frame = Frame(heap, page, slot)
+        self.frames[key] = frame
+        frame.pin_count += 1
+        self._touch(frame)
+        return frame
+
+    def fetch(self, heap, page_no: int) -> Page:
+        """获取并固定一个页，使用完后必须调用 unpin"""
+        key = (heap.name, page_no)
+        while True:
+            with self.lock:
+                frame = self.frames.get(key)
+                if frame is not None:
+                    self.hits += 1
+                    frame.pin_count += 1
+                    self._touch(frame)
+                    loaded = frame.loaded
+                    if loaded is None:
+                        return frame.page
+                    break
+                victim = self._reserve()
+                if victim is None:
+                    self.misses += 1
+                    frame = self._insert(heap, page_no, None)
+                    loaded = None
+                    break
+            self._evict_dirty(victim)
+        if loaded is not None:
+            # 其他线程正在读入这个页
+            loaded.wait()
+            if frame.page is None:
+                with self.lock:
+                    frame.pin_count -= 1
+                raise StorageError(f"读取页 {heap.name}:{page_no} 失败")
+            return frame.page
+        try:
+            page = heap.read_page(page_no)
+        except BaseException:
+            with self.lock:
+                frame.pin_count -= 1
+                self._release(key)
+            frame.loaded.set()
+            raise
+        with self.lock:
+            frame.page = page
+            event, frame.loaded = frame.loaded, None
+        event.set()
+        return page
+
+    def new_page(self, heap, page_no: int) -> Page:
+        """为新分配的页创建页框并固定"""
+        while True:
+            with self.lock:
+                victim = self._reserve()
+                if victim is None:
+                    page = Page(page_no, heap.page_size)
+                    page.dirty = True
+                    self._insert(heap, page_no, page)
+                    return page
+            self._evict_dirty(victim)
+
+    def unpin(self, heap, page_no: int) -> None:
+        """取消固定"""
+        with self.lock:
+            frame = self.frames.get((heap.name, page_no))
+            if frame is None or frame.pin_count == 0:
+                raise StorageError(f"页 {heap.name}:{page_no} 未被固定")
+            frame.pin_count -= 1
+
+    @contextmanager
+    def pinned(self, heap, page_no: int) -> Iterator[Page]:
+        """在 with 块内固定一个页"""
+        page = self.fetch(heap, page_no)
+        try:
+            yield page
+        finally:
+            self.unpin(heap, page_no)
+
+    def _frames_of(self, heap) -> List[Tuple[Tuple[str, int], Frame]]:
+        return sorted((key, frame) for key, frame in self.frames.items() if frame.heap is heap)
+
+    def _wait_evictions(self, heap) -> None:
+        """等待其他线程写回本堆文件被置换的页，调用者持有 self.lock"""
+        self._evicted.wait_for(lambda: all(name != heap.name for name, _ in self._evicting))
+
+    def flush_heap(self, heap) -> int:
+        """写回某个堆文件的所有脏页，返回写出的页数
+
+        检查点使用：在缓冲池的锁内固定当时的脏页，之后在锁外逐页写回并解除固定，期间其他线程照常读写和置换其他页；
+        每页只在复制页内容时持有共享闩，写者最多等待一次序列化。写出之后又被修改的页仍然是脏页，留给下一次检查点。
+        """
+        with self.lock:
+            frames = [frame for _, frame in self._frames_of(heap) if frame.page is not None and frame.page.dirty]
+            for frame in frames:
+                frame.pin_count += 1
+            self._busy += len(frames)
+        written = 0
+        pending = list(reversed(frames))
+        try:
+            while pending:
+                page = pending[-1].page
+                with page.latch.shared():
+                    dirty = page.dirty
+                    if dirty:
+                        data = page.to_bytes(heap.overflow)
+                        lsn = page.lsn
+                        page.dirty = False
+                if dirty:
+                    try:
+                        heap.write_image(page.page_no, data, lsn)
+                    except BaseException:
+                        page.dirty = True
+                        raise
+                    written += 1
+                with self.lock:
+                    self._unpin_busy(pending.pop())
+        finally:
+            with self.lock:
+                for frame in pending:
+                    self._unpin_busy(frame)
+                self.writebacks += written
+        return written
+
+    def flush_all(self) -> int:
+        """写回所有脏页"""
+        with self.lock:
+            written = sum(self._write_back(frame) for frame in list(self.frames.values()))
+            self.writebacks += written
+            return written
+
+    def drop_heap(self, heap) -> None:
+        """丢弃某个堆文件的所有页（不写回）"""
+        with self.lock:
+            self._wait_evictions(heap)
+            for key, frame in self._frames_of(heap):
+                if frame.pin_count > 0:
+                    raise StorageError(f"页 {key[0]}:{key[1]} 仍被固定，无法丢弃")
+                self._release(key)
+
+    def drop_pages(self, heap, start: int) -> bool:
+        """丢弃某个堆文件页号不小于 start 的页（不写回）；有页被固定时什么也不做，返回 False"""
+        with self.lock:
+            self._wait_evictions(heap)
+            frames = [(key, frame) for key, frame in self._frames_of(heap) if key[1] >= start]
+            if any(frame.pin_count > 0 for _, frame in frames):
+                return False
+            for key, _ in frames:
+                self._release(key)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        """命中、未命中和置换计数"""
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'capacity': self.capacity,
+                'policy': self.policy,
+                'resident': len(self.frames),
+                'dirty': sum(1 for frame in self.frames.values() if frame.page is not None and frame.page.dirty),
+                'pinned': sum(1 for frame in self.frames.values() if frame.pin_count > 0),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'writebacks': self.writebacks,
+                'hit_rate': self.hits / requests if requests else 0.0,
+            }
+
+    def reset_stats(self) -> None:
+        """清零计数器"""
+        with self.lock:
+            self.hits = self.misses = self.evictions = self.writebacks = 0
@@ -0,0 +1,705 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from array import array
+from contextlib import nullcontext
+from typing import Dict, List, Tuple, Any, Optional, Iterator
+from .zone_map import ZoneMap
+from ..core.exceptions import StorageError
+
+# 列式表按块扫描，每块的行数（相当于行存储的一个页）
+BLOCK_ROWS = 4096
+# 批量插入时每条日志记录包含的行数
+LOG_BATCH_ROWS = 1024
+# 检查点从旧文件复制没有修改过的列时每次读写的字节数
+COPY_CHUNK = 1 << 20
+
+# 列的存储方式
+KIND_INT = 0      # array('q')
+KIND_FLOAT = 1    # array('d')
+KIND_TEXT = 2     # 字典编码: array('i') 存编码，dictionary 存不同的字符串
+KIND_OBJECT = 3   # 其他类型或超出 64 位的整数，保存为 Python 列表
+
+
+def bit_get(bitmap: bytearray, i: int) -> bool:
+    return bool(bitmap[i >> 3] & (1 << (i & 7)))
+
+
+def bit_set(bitmap: bytearray, i: int, value: bool) -> None:
+    if value:
+        bitmap[i >> 3] |= 1 << (i & 7)
+    else:
+        bitmap[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+
+class Column:
+    """一列的数据: 类型化数组 + 空值位图，TEXT 列使用字典编码
+
+    从文件打开的列，values 和 nulls 是文件映射上的 memoryview，原地修改直接写在（写时复制的）映射上，
+    第一次追加时才复制为内存中的数组；字典在第一次使用时才从文件中的字符串区解码。
+    dirty 表示列在上次写出文件之后被修改过，检查点只复制这样的列。
+    """
+
+    TYPECODES = {KIND_INT: 'q', KIND_FLOAT: 'd', KIND_TEXT: 'i'}
+
+    def __init__(self, col_type: str):
+        self.type = col_type.upper()
+        if self.type == 'INT':
+            self.kind = KIND_INT
+        elif self.type == 'FLOAT':
+            self.kind = KIND_FLOAT
+        elif self.type == 'TEXT':
+            self.kind = KIND_TEXT
+        else:
+            self.kind = KIND_OBJECT
+        self.values = array(self.TYPECODES[self.kind]) if self.kind != KIND_OBJECT else []
+        self.nulls = bytearray()
+        self.null_count = 0
+        # 尚未解码的字典: (每个字符串的起始偏移, 字符串区)
+        self._strings = None
+        self._dictionary: List[str] = []
+        # 字符串 -> 编码，None 表示还没有由字典建立（只有写入时才需要）
+        self.codes: Optional[Dict[str, int]] = {}
+        self.dirty = True
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def dictionary(self) -> List[str]:
+        if self._strings is not None:
+            offsets, strings = self._strings
+            offsets = offsets.tolist()
+            data = bytes(strings)
+            self._dictionary = [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+            self._strings = None
+        return self._dictionary
+
+    @dictionary.setter
+    def dictionary(self, value: List[str]) -> None:
+        self._dictionary = value
+        self._strings = None
+
+    def _own(self) -> None:
+        """追加之前把映射在文件上的数据复制为内存中可以增长的数组"""
+        if isinstance(self.values, memoryview):
+            values = array(self.TYPECODES[self.kind])
+            values.frombytes(self.values.cast('B'))
+            self.values = values
+        if isinstance(self.nulls, memoryview):
+            self.nulls = bytearray(self.nulls)
+
+    def _widen(self) -> None:
+        """值放不进类型化数组时改为 Python 列表保存"""
+        self.values = [self.get(i) for i in range(len(self.values))]
+        self.kind = KIND_OBJECT
+        self.dictionary, self.codes = [], {}
+
+    def _encode(self, value: Any) -> Any:
+        if self.kind == KIND_TEXT:
+            codes = self.codes
+            if codes is None:
+                codes = self.codes = {text: code for code, text in enumerate(self.dictionary)}
+            code = codes.get(value)
+            if code is None:
+                if not isinstance(value, str):
+                    raise TypeError(value)
+                dictionary = self.dictionary
+                code = codes[value] = len(dictionary)
+                dictionary.append(value)
+            return code
+        return value
+
+    def append(self, value: Any) -> None:
+        self.dirty = True
+        self._own()
+        i = len(self.values)
+        if i >> 3 >= len(self.nulls):
+            self.nulls.append(0)
+        if value is None:
+            bit_set(self.nulls, i, True)
+            self.null_count += 1
+            self.values.append(0)
+            return
+        try:
+            self.values.append(self._encode(value))
+        except (TypeError, OverflowError):
+            self._widen()
+            self.values.append(value)
+
+    def extend(self, values: List[Any]) -> None:
+        """追加多个值，没有空值时整批编码后一次写入数组"""
+        self.dirty = True
+        if self.kind == KIND_OBJECT or None in values:
+            for value in values:
+                self.append(value)
+            return
+        self._own()
+        try:
+            if self.kind == KIND_TEXT:
+                encode = self._encode
+                encoded = array('i', [encode(value) for value in values])
+            else:
+                encoded = array(self.TYPECODES[self.kind], values)
+        except (TypeError, OverflowError):
+            for value in values:
+                self.append(value)
+            return
+        end = len(self.values) + len(encoded)
+        if (end + 7) >> 3 > len(self.nulls):
+            self.nulls.extend(bytes(((end + 7) >> 3) - len(self.nulls)))
+        self.values.extend(encoded)
+
+    def set(self, i: int, value: Any) -> None:
+        current = self.get(i)
+        if current is value or (type(current) is type(value) and current == value):
+            # 更新一行时没有改变的列保持干净，检查点不必复制
+            return
+        self.dirty = True
+        was_null = bit_get(self.nulls, i)
+        bit_set(self.nulls, i, value is None)
+        self.null_count += (value is None) - was_null
+        if value is None:
+            return
+        try:
+            self.values[i] = self._encode(value)
+        except (TypeError, OverflowError, ValueError):
+            # 映射在文件上的 memoryview 对放不下的值抛出 ValueError，先复制为数组，仍然放不下再改为列表
+            self._own()
+            try:
+                self.values[i] = self._encode(value)
+            except (TypeError, OverflowError):
+                self._widen()
+                self.values[i] = value
+
+    def get(self, i: int) -> Any:
+        if self.null_count and bit_get(self.nulls, i):
+            return None
+        value = self.values[i]
+        return self.dictionary[value] if self.kind == KIND_TEXT else value
+
+    def block(self, start: int, end: int) -> List[Any]:
+        """解码 [start, end) 范围内的值"""
+        values = self.values[start:end]
+        if self.null_count:
+            nulls = self.nulls
+            if self.kind == KIND_TEXT:
+                d = self.dictionary
+                return [None if nulls[i >> 3] & (1 << (i & 7)) else d[v]
+                        for i, v in enumerate(values, start)]
+            return [None if nulls[i >> 3] & (1 << (i & 7)) else v for i, v in enumerate(values, start)]
+        if self.kind == KIND_TEXT:
+            d = self.dictionary
+            return [d[v] for v in values]
+        return values if isinstance(values, list) else values.tolist()
+
+    def raw(self, start: int, end: int) -> Any:
+        """[start, end) 范围内编码后的值的副本（可以交给 np.frombuffer），之后对列的修改不影响它"""
+        values = self.values[start:end]
+        return values.tobytes() if isinstance(values, memoryview) else values
+
+    def clear(self) -> None:
+        self.__init__(self.type)
+
+    def memory_usage(self) -> int:
+        """估算列占用的字节数"""
+        if self.kind == KIND_OBJECT:
+            size = 8 * len(self.values) + sum(32 for _ in self.values)
+        else:
+            size = self.values.itemsize * len(self.values)
+        if self._strings is not None:
+            offsets, strings = self._strings
+            return size + len(self.nulls) + len(strings) + 49 * (len(offsets) - 1)
+        return size + len(self.nulls) + sum(len(s) + 49 for s in self.dictionary)
+
+
+class ColumnStore:
+    """列式存储的表，接口与 HeapFile 相同，行ID为行的位置
+
+    每列保存在连续的类型化数组中（INT 为 64 位整数，FLOAT 为双精度浮点数，TEXT 为字典编码），
+    空值和已删除的行用位图标记。检查点时写出新的 .col 文件替换旧文件，文件中每个数组按 8 字节对齐存放，
+    打开时只映射文件、读取文件头，数组直接引用映射的内存（不读入、不解码），页在第一次访问时才由操作系统读入。
+    修改和写出文件由 self.lock 串行化；读者不加锁，行数 size 在各列数据写好之后才增加。
+    """
+
+    MAGIC = b'LKCOL002'
+    # 文件头: LSN、行数、已删除行数、列数；之后是删除位图的位置和每列的描述
+    HEADER = struct.Struct('<QQQQ')
+    # 文件中一段数据: (偏移, 字节数)
+    SECTION = struct.Struct('<QQ')
+    # 每列: 存储方式、空值个数，之后是空值位图、值、字符串偏移、字符串区四段（后两段只有 TEXT 列使用）
+    COLUMN = struct.Struct('<QQ')
+
+    def __init__(self, name: str, columns: List[Tuple[str, str]], path: Optional[str] = None,
+                 wal=None):
+        self.name = name
+        self.path = path
+        self.wal = wal
+        self.columns = [Column(col_type) for _, col_type in columns]
+        self.deleted = bytearray()
+        self.deleted_count = 0
+        self.size = 0
+        # 已作用到列数据上的最大日志 LSN，文件中保存写出时的值
+        self.lsn = 0
+        # 行ID -> 版本链，只包含最近被修改、还可能有事务需要旧版本的行；修改版本链时持有 versions_lock
+        self.versions: Dict[int, List[Any]] = {}
+        self.versions_lock = threading.Lock()
+        self.lock = threading.RLock()
+        # 检查点在锁外写文件，同一时间只有一个线程写
+        self._flush_lock = threading.Lock()
+        self.dirty = False
+        # 列数据每次修改都增加（在 self.lock 内），并行扫描据此判断共享内存中的副本是否还和存储一致
+        self.changes = 0
+        # 每块每列的最小值和最大值，扫描时跳过不可能满足条件的块
+        self.zones = ZoneMap()
+        self._mapping: Optional[mmap.mmap] = None
+        # 当前文件中各段的 (偏移, 字节数)，顺序同写文件时的各段数据；检查点从这里复制没有修改过的列
+        self._sections: Optional[List[Tuple[int, int]]] = None
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    @property
+    def row_count(self) -> int:
+        return self.size - self.deleted_count
+
+    @property
+    def num_pages(self) -> int:
+        """块数，按块抽样和并行扫描时使用"""
+        return (self.size + BLOCK_ROWS - 1) // BLOCK_ROWS
+
+    def _log(self, txn, kind: str, rid: int, before: Optional[Tuple[Any, ...]],
+             after: Optional[Tuple[Any, ...]], compensation: bool = False) -> int:
+        """在修改之前写日志并登记回滚信息，返回日志的 LSN（未启用日志时为0）"""
+        if txn is None:
+            return 0
+        if not compensation:
+            txn.record_write(self, rid, before, after)
+        if self.wal is None:
+            return 0
+        if txn.first_lsn is None:
+            txn.first_lsn = self.wal.next_lsn
+        return self.wal.append({'type': kind, 'txid': txn.txid, 'table': self.name,
+                                'rid': rid, 'before': before, 'after': after})
+
+    def _log_batch(self, txn, rids: List[int], rows: List[Tuple[Any, ...]]) -> int:
+        """为批量插入的一组行写一条日志，返回日志的 LSN（未启用日志时为0）"""
+        if txn is None:
+            return 0
+        txn.record_inserts(self, rids, rows)
+        if self.wal is None:
+            return 0
+        if txn.first_lsn is None:
+            txn.first_lsn = self.wal.next_lsn
+        return self.wal.append({'type': 'INSERT_BATCH', 'txid': txn.txid, 'table': self.name,
+                                'rids': rids, 'after': rows})
+
+    def _check_row(self, row: Tuple[Any, ...]) -> None:
+        if len(row) != len(self.columns):
+            raise StorageError(f"行的列数 {len(row)} 与表的列数 {len(self.columns)} 不匹配")
+
+    def _is_deleted(self, rid: int) -> bool:
+        return self.deleted_count > 0 and bit_get(self.deleted, rid)
+
+    def _own_deleted(self) -> None:
+        """增长之前把映射在文件上的删除位图复制到内存"""
+        if isinstance(self.deleted, memoryview):
+            self.deleted = bytearray(self.deleted)
+
+    def _append(self, row: Optional[Tuple[Any, ...]]) -> None:
+        self._own_deleted()
+        if self.size >> 3 >= len(self.deleted):
+            self.deleted.append(0)
+        if row is None:
+            for column in self.columns:
+                column.append(None)
+            bit_set(self.deleted, self.size, True)
+            self.deleted_count += 1
+        else:
+            for column, value in zip(self.columns, row):
+                column.append(value)
+            self.zones.note(self.size // BLOCK_ROWS, row)
+        self.size += 1
+
+    def _write(self, rid: int, row: Optional[Tuple[Any, ...]], lsn: int) -> None:
+        """把行写入位置 rid（row 为 None 表示删除）"""
+        while rid >= self.size:
+            self._append(None)
+        was_deleted = self._is_deleted(rid)
+        bit_set(self.deleted, rid, row is None)
+        self.deleted_count += (row is None) - was_deleted
+        if row is not None:
+            for column, value in zip(self.columns, row):
+                column.set(rid, value)
+            self.zones.note(rid // BLOCK_ROWS, row)
+        self.lsn = max(self.lsn, lsn)
+        self.dirty = True
+        self.changes += 1
+
+    def insert(self, row: Tuple[Any, ...], txn=None) -> int:
+        """在末尾追加一行，返回行ID"""
+        self._check_row(row)
+        with self.lock:
+            rid = self.size
+            lsn = self._log(txn, 'INSERT', rid, None, row)
+            self._append(row)
+            self.lsn = max(self.lsn, lsn)
+            self.dirty = True
+            self.changes += 1
+            return rid
+
+    def insert_many(self, rows: List[Tuple[Any, ...]], txn=None) -> List[int]:
+        """在末尾批量追加多行，返回行ID；每列整批写入，每 LOG_BATCH_ROWS 行写一条日志"""
+        for row in rows:
+            self._check_row(row)
+        with self.lock:
+            start = self.size
+            rids = list(range(start, start + len(rows)))
+            for i in range(0, len(rows), LOG_BATCH_ROWS):
+                lsn = self._log_batch(txn, rids[i:i + LOG_BATCH_ROWS], rows[i:i + LOG_BATCH_ROWS])
+                self.lsn = max(self.lsn, lsn)
+            if rows:
+                for column, values in zip(self.columns, zip(*rows)):
+                    column.extend(values)
+                if start % BLOCK_ROWS:
+                    # 只有原来的最后一块可能已有统计
+                    self.zones.note_many(start // BLOCK_ROWS, rows[:BLOCK_ROWS - start % BLOCK_ROWS])
+            end = start + len(rows)
+            self._own_deleted()
+            if (end + 7) >> 3 > len(self.deleted):
+                self.deleted.extend(bytes(((end + 7) >> 3) - len(self.deleted)))
+            self.size = end
+            self.dirty = True
+            self.changes += 1
+            return rids
+
+    def get(self, rid: int) -> Optional[Tuple[Any, ...]]:
+        """按行ID读取一行，行不存在时返回None"""
+        if rid >= self.size or self._is_deleted(rid):
+            return None
+        return tuple(column.get(rid) for column in self.columns)
+
+    def update(self, rid: int, row: Tuple[Any, ...], txn=None) -> int:
+        """原地更新一行，行ID不变"""
+        self._check_row(row)
+        with self.lock:
+            before = self.get(rid)
+            lsn = self._log(txn, 'UPDATE', rid, before, row)
+            self._write(rid, row, lsn)
+            return rid
+
+    def delete(self, rid: int, txn=None) -> None:
+        """删除一行，位置保留，其他行的ID不变"""
+        with self.lock:
+            before = self.get(rid)
+            if before is None:
+                return
+            lsn = self._log(txn, 'DELETE', rid, before, None)
+            self._write(rid, None, lsn)
+
+    def restore(self, rid: int, row: Optional[Tuple[Any, ...]], txn=None) -> None:
+        """回滚时把行恢复为旧值，并写入补偿日志"""
+        with self.lock:
+            lsn = self._log(txn, 'UNDO', rid, self.get(rid), row, compensation=True)
+            self._write(rid, row, lsn)
+
+    def redo(self, rid: int, row: Optional[Tuple[Any, ...]], lsn: int) -> None:
+        """恢复时重做一条日志记录，文件中已包含的记录跳过"""
+        if self.lsn < lsn:
+            self._write(rid, row, lsn)
+
+    def redo_batch(self, rids: List[int], rows: List[Tuple[Any, ...]], lsn: int) -> None:
+        """重做一条批量插入记录"""
+        if self.lsn < lsn:
+            for rid, row in zip(rids, rows):
+                self._write(rid, row, lsn)
+
+    def count_rows(self) -> int:
+        """行数由删除位图维护，无需重新统计"""
+        return self.row_count
+
+    def column(self, position: int) -> Column:
+        """按位置返回列"""
+        return self.columns[position]
+
+    def scan(self, start_page: int = 0, end_page: Optional[int] = None, deleted: bool = False,
+             predicates: Optional[List[Tuple[int, Any, Any]]] = None) -> Iterator[Tuple[int, Optional[Tuple[Any, ...]]]]:
+        """按行ID顺序遍历 [start_page, end_page) 块中的行，产生 (行ID, 行)
+
+        每次解码一整块的各列，再组合成行。deleted 为 True 时已删除的行也产生，行为 None。
+        """
+        return self.scan_columns(list(range(len(self.columns))), start_page, end_page, deleted, predicates)
+
+    def scan_columns(self, positions: List[int], start_page: int = 0, end_page: Optional[int] = None,
+                     deleted: bool = False, predicates: Optional[List[Tuple[int, Any, Any]]] = None
+                     ) -> Iterator[Tuple[int, Optional[Tuple[Any, ...]]]]:
+        """只解码指定位置的列，产生 (行ID, 由这些列组成的元组)
+
+        predicates 为 (表中的列位置, 比较函数, 值) 条件时跳过统计表明没有行能满足条件的块（见 may_match）。
+        """
+        end_page = self.num_pages if end_page is None else min(end_page, self.num_pages)
+        columns = [self.columns[i] for i in positions]
+        for block in range(start_page, end_page):
+            if predicates and not self.may_match(block, predicates):
+                continue
+            start = block * BLOCK_ROWS
+            end = min(start + BLOCK_ROWS, self.size)
+            rows = zip(*[column.block(start, end) for column in columns])
+            if self.deleted_count:
+                bitmap = self.deleted
+                for rid, row in enumerate(rows, start):
+                    if not bitmap[rid >> 3] & (1 << (rid & 7)):
+                        yield rid, row
+                    elif deleted:
+                        yield rid, None
+            else:
+                yield from enumerate(rows, start)
+
+    def may_match(self, block: int, predicates: List[Tuple[int, Any, Any]]) -> bool:
+        """块中是否可能有行满足条件；条件用到的列在这一块还没有统计时先计算
+
+        统计在 self.lock 下由块内所有位置的值（包括已删除的行）和这些行的版本链计算，
+        只在扫描读到这一块时计算，提前结束的扫描不会为其余的块付出代价。
+        """
+        zones = self.zones
+        missing = zones.missing(block, {position for position, _, _ in predicates})
+        if missing:
+            with self.lock:
+                start = block * BLOCK_ROWS
+                end = min(start + BLOCK_ROWS, self.size)
+                columns = {position: self.columns[position].block(start, end) for position in missing}
+                if self.versions:
+                    with self.versions_lock:
+                        old_rows = [version.row for rid, chain in self.versions.items() if start <= rid < end
+                                    for version in chain if version.row is not None]
+                    for position, values in columns.items():
+                        values.extend(row[position] for row in old_rows)
+                zones.compute(block, columns)
+        return zones.may_match(block, predicates)
+
+    def compact(self) -> List[Tuple[int, int]]:
+        """去掉已删除的行，后面的行前移，返回被移动的行 [(原行ID, 新行ID)]
+
+        TEXT 列的字典同时重建，不再使用的字符串被丢弃。行ID会改变，调用者保证没有事务在读写这张表。
+        """
+        if not self.deleted_count:
+            return []
+        with self.lock:
+            return self._compact()
+
+    def _compact(self) -> List[Tuple[int, int]]:
+        bitmap = self.deleted
+        keep = [rid for rid in range(self.size) if not bitmap[rid >> 3] & (1 << (rid & 7))]
+        columns = []
+        for column in self.columns:
+            values = column.block(0, self.size)
+            compacted = Column(column.type)
+            compacted.extend([values[rid] for rid in keep])
+            columns.append(compacted)
+        self.columns = columns
+        self.size = len(keep)
+        self.deleted = bytearray((self.size + 7) >> 3)
+        self.deleted_count = 0
+        self.zones.clear()
+        self.dirty = True
+        self.changes += 1
+        return [(old, new) for new, old in enumerate(keep) if old != new]
+
+    def memory_usage(self) -> int:
+        """估算列数据占用的字节数"""
+        return sum(column.memory_usage() for column in self.columns) + len(self.deleted)
+
+    def truncate(self) -> None:
+        """删除所有行"""
+        with self.lock:
+            self.versions.clear()
+            self.size = 0
+            for column in self.columns:
+                column.clear()
+            self.deleted = bytearray()
+            self.deleted_count = 0
+            self.zones.clear()
+            self.dirty = True
+            self.changes += 1
+
+    def _load(self) -> None:
+        """映射 .col 文件，各列直接引用文件中的数组
+
+        映射是写时复制的，原地修改只影响本进程的内存；追加时才把数组复制到内存中。
+        """
+        with open(self.path, 'rb') as f:
+            try:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            except ValueError:
+                raise StorageError(f"列存储文件 {self.path} 格式错误")
+        if not mapping[:len(self.MAGIC)] == self.MAGIC:
+            raise StorageError(f"列存储文件 {self.path} 格式错误")
+        view = memoryview(mapping)
+        offset = len(self.MAGIC)
+        self.lsn, self.size, self.deleted_count, count = self.HEADER.unpack_from(mapping, offset)
+        offset += self.HEADER.size
+        if count != len(self.columns):
+            raise StorageError(f"列存储文件 {self.path} 的列数 {count} 与表定义不符")
+
+        sections = []
+
+        def section(typecode: str = 'B') -> memoryview:
+            nonlocal offset
+            start, length = self.SECTION.unpack_from(mapping, offset)
+            offset += self.SECTION.size
+            if start + length > len(mapping):
+                raise StorageError(f"列存储文件 {self.path} 被截断")
+            sections.append((start, length))
+            return view[start:start + length].cast(typecode)
+
+        self.deleted = section()
+        for column in self.columns:
+            kind, column.null_count = self.COLUMN.unpack_from(mapping, offset)
+            offset += self.COLUMN.size
+            column.nulls = section()
+            if kind == KIND_OBJECT:
+                column.kind = KIND_OBJECT
+                column.values = json.loads(str(section(), 'utf-8'))
+                section(), section()
+                continue
+            column.values = section(Column.TYPECODES[kind])
+            offsets, strings = section('q'), section()
+            if kind == KIND_TEXT:
+                column._strings = (offsets, strings)
+                column.codes = None
+        for column in self.columns:
+            column.dirty = False
+        self._mapping = mapping
+        self._sections = sections
+
+    def flush(self) -> int:
+        """有修改时把列数据原子地写入文件，返回写出的文件数
+
+        在 self.lock 内只复制删除位图和上次写出之后修改过的列，作为一致的快照；没有修改过的列在锁外从当前文件复制，
+        编码、写文件和 fsync 也都在锁外，期间写者照常修改；快照之后的修改使表重新变脏，由下一次检查点写出。
+        """
+        if self.path is None or not self.dirty:
+            return 0
+        with self._flush_lock:
+            with self.lock:
+                if not self.dirty:
+                    return 0
+                snapshot = self._snapshot()
+                self.dirty = False
+            try:
+                return self._flush(*snapshot)
+            except BaseException:
+                # 没有写出的列不能再当作和文件一致
+                with self.lock:
+                    self.dirty = True
+                    for column in self.columns:
+                        column.dirty = True
+                raise
+
+    def _snapshot(self) -> Tuple[int, int, int, List[Any], List[Tuple[int, int]]]:
+        """复制写文件需要的数据: (LSN, 行数, 已删除行数, 各段数据, 每列的 (存储方式, 空值个数))
+
+        没有修改过的列的四段是当前文件中的 (偏移, 字节数)，由 _flush 从文件复制。
+        """
+        empty = b''
+        payloads: List[Any] = [bytes(self.deleted)]
+        for i, column in enumerate(self.columns):
+            if not column.dirty and self._sections is not None:
+                payloads.extend(self._sections[1 + 4 * i:5 + 4 * i])
+                continue
+            column.dirty = False
+            payloads.append(bytes(column.nulls))
+            if column.kind == KIND_OBJECT:
+                # 值都是不可变的标量，复制列表即可，序列化留到锁外
+                payloads.extend((list(column.values), empty, empty))
+            elif column.kind == KIND_TEXT:
+                payloads.append(bytes(column.values))
+                if column._strings is not None:
+                    payloads.extend(column._strings)
+                else:
+                    payloads.extend((list(column.dictionary), empty))
+            else:
+                payloads.extend((bytes(column.values), empty, empty))
+        return (self.lsn, self.size, self.deleted_count, payloads,
+                [(column.kind, column.null_count) for column in self.columns])
+
+    @staticmethod
+    def _strings(dictionary: List[str]) -> Tuple[Any, Any]:
+        """TEXT 列字典的 (字符串起始偏移, 字符串区)"""
+        encoded = [text.encode('utf-8') for text in dictionary]
+        offsets = array('q', [0])
+        total = 0
+        for data in encoded:
+            total += len(data)
+            offsets.append(total)
+        return offsets, b''.join(encoded)
+
+    def _flush(self, lsn: int, size: int, deleted_count: int, payloads: List[Any],
+               kinds: List[Tuple[int, int]]) -> int:
+        # 文件中包含的修改对应的日志必须先写入磁盘
+        if self.wal is not None:
+            self.wal.flush(lsn)
+
+        for i, (kind, _) in enumerate(kinds):
+            base = 1 + 4 * i
+            if isinstance(payloads[base], tuple):
+                continue
+            if kind == KIND_OBJECT:
+                payloads[base + 1] = json.dumps(payloads[base + 1]).encode('utf-8')
+            elif kind == KIND_TEXT and isinstance(payloads[base + 2], list):
+                # 快照中是字典的字符串列表时在这里编码；还没有解码的字典已经是文件中的两段
+                payloads[base + 2:base + 4] = self._strings(payloads[base + 2])
+        lengths = [payload[1] if isinstance(payload, tuple) else memoryview(payload).nbytes
+                   for payload in payloads]
+
+        # 先算出每段的位置，文件头之后各段依次写出，每段从 8 字节的倍数开始
+        position = (len(self.MAGIC) + self.HEADER.size + self.SECTION.size
+                    + len(kinds) * (self.COLUMN.size + 4 * self.SECTION.size))
+        sections = []
+        for length in lengths:
+            position = (position + 7) & ~7
+            sections.append((position, length))
+            position += length
+        packed = [self.SECTION.pack(*section) for section in sections]
+        header = [self.MAGIC, self.HEADER.pack(lsn, size, deleted_count, len(kinds)), packed[0]]
+        for i, (kind, null_count) in enumerate(kinds):
+            header.append(self.COLUMN.pack(kind, null_count))
+            header.extend(packed[1 + 4 * i:5 + 4 * i])
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f, \
+                open(self.path, 'rb') if self._sections is not None else nullcontext() as old:
+            f.write(b''.join(header))
+            position = f.tell()
+            for payload, length in zip(payloads, lengths):
+                padding = -position & 7
+                f.write(bytes(padding))
+                if isinstance(payload, tuple):
+                    old.seek(payload[0])
+                    remaining = length
+                    while remaining:
+                        chunk = old.read(min(remaining, COPY_CHUNK))
+                        if not chunk:
+                            raise StorageError(f"列存储文件 {self.path} 被截断")
+                        f.write(chunk)
+                        remaining -= len(chunk)
+                else:
+                    f.write(payload)
+                position += padding + length
+            f.flush()
+            os.fsync(f.fileno())
+        # 旧文件的映射仍被各列引用，替换后旧文件占用的空间在表关闭时才释放
+        os.replace(tmp_path, self.path)
+        self._sections = sections
+        return 1
+
+    def close(self) -> None:
+        """列数据在检查点时写出，关闭时只释放文件映射（仍被引用的部分在引用消失后解除映射）"""
+        self._mapping = None
+
+    def remove(self) -> None:
+        """删除列存储文件"""
+        with self._flush_lock:
+            if self.path is not None and os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,304 @@
+import json
+import lzma
+import struct
+import sys
+import zlib
+from array import array
+from itertools import islice
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from ..core.exceptions import StorageError
+from .page import encode_row, decode_row
+
+# 导出文件（SAVE）的格式:
+#   MAGIC，头部帧（JSON: 压缩方式），每张表一个 T 帧（JSON: 表名和列定义）加若干个 B 帧（一块行），最后一个 E 帧。
+#   帧 = 类型(1 字节) + 长度(<I) + 内容；B 帧的内容是压缩后的块，块中每列单独编码。
+MAGIC = b'LKDUMP01'
+# 每块的行数，读写时内存中最多只有一块
+BLOCK_ROWS = 16384
+
+FRAME_TABLE = b'T'
+FRAME_BLOCK = b'B'
+FRAME_END = b'E'
+
+# 块的压缩方式: (压缩, 解压)
+COMPRESSIONS: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    'none': (bytes, bytes),
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+# 列的编码
+ENC_INT = 0       # array('q')
+ENC_DELTA = 1     # 第一个值和相邻两值的差，array('q')，有序或缓慢变化的整数列差值很小，压缩后很短
+ENC_RLE = 2       # 游程编码: 值 array('q') + 重复次数 array('I')
+ENC_FLOAT = 3     # array('d')
+ENC_TEXT = 4      # 每个字符串的 UTF-8 长度 array('I') + 连在一起的字节
+ENC_DICT = 5      # 字典编码: 不同的字符串（同 ENC_TEXT）+ 每行的编号 array('H' 或 'I')
+ENC_VALUES = 6    # 混合类型、超出 64 位的整数等: 每个值为类型标记加内容，与数据页中的行编码相同
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def _pack(typecode: str, values: Iterable[Any]) -> bytes:
+    """类型化数组按小端字节序转换为字节"""
+    data = array(typecode, values)
+    if not _LITTLE_ENDIAN:
+        data.byteswap()
+    return data.tobytes()
+
+
+def _unpack(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if not _LITTLE_ENDIAN:
+        values.byteswap()
+    return values
+
+
+def _pack_strings(values: List[str]) -> bytes:
+    encoded = [value.encode('utf-8') for value in values]
+    lengths = _pack('I', map(len, encoded))
+    return struct.pack('<I', len(encoded)) + lengths + b''.join(encoded)
+
+
+def _unpack_strings(data: bytes) -> List[str]:
+    count, = struct.unpack_from('<I', data)
+    end = 4 + 4 * count
+    lengths = _unpack('I', data[4:end])
+    result = []
+    pos = end
+    for length in lengths:
+        result.append(data[pos:pos + length].decode('utf-8'))
+        pos += length
+    return result
+
+
+def _encode_ints(values: List[int]) -> Tuple[int, bytes]:
+    """在整数列的三种编码中选择较小的一种"""
+    if min(values) < INT64_MIN or max(values) > INT64_MAX:
+        return _encode_values(values)
+    starts = [0] + [i for i in range(1, len(values)) if values[i] != values[i - 1]]
+    if len(starts) * 4 <= len(values):
+        counts = [end - start for start, end in zip(starts, starts[1:] + [len(values)])]
+        return ENC_RLE, struct.pack('<I', len(starts)) + _pack('q', (values[i] for i in starts)) + _pack('I', counts)
+    deltas = [values[0]] + [b - a for a, b in zip(values, values[1:])]
+    if (min(deltas) >= INT64_MIN and max(deltas) <= INT64_MAX
+            and max(map(abs, deltas[1:]), default=0) < max(map(abs, values))):
+        return ENC_DELTA, _pack('q', deltas)
+    return ENC_INT, _pack('q', values)
+
+
+def _decode_ints(encoding: int, data: bytes) -> List[int]:
+    if encoding == ENC_INT:
+        return _unpack('q', data).tolist()
+    if encoding == ENC_DELTA:
+        total = 0
+        result = []
+        append = result.append
+        for delta in _unpack('q', data):
+            total += delta
+            append(total)
+        return result
+    count, = struct.unpack_from('<I', data)
+    values = _unpack('q', data[4:4 + 8 * count])
+    counts = _unpack('I', data[4 + 8 * count:])
+    result = []
+    for value, repeat in zip(values, counts):
+        result.extend([value] * repeat)
+    return result
+
+
+def _encode_texts(values: List[str]) -> Tuple[int, bytes]:
+    """不同的字符串不超过一半时用字典编码"""
+    distinct = dict.fromkeys(values)
+    if len(distinct) * 2 <= len(values):
+        codes = {value: i for i, value in enumerate(distinct)}
+        typecode = 'H' if len(codes) <= 0xFFFF else 'I'
+        dictionary = _pack_strings(list(distinct))
+        return ENC_DICT, (struct.pack('<cI', typecode.encode(), len(dictionary)) + dictionary
+                          + _pack(typecode, (codes[value] for value in values)))
+    return ENC_TEXT, _pack_strings(values)
+
+
+def _decode_dict(data: bytes) -> List[str]:
+    typecode, size = struct.unpack_from('<cI', data)
+    dictionary = _unpack_strings(data[5:5 + size])
+    return [dictionary[code] for code in _unpack(typecode.decode(), data[5 + size:])]
+
+
+def _encode_values(values: List[Any]) -> Tuple[int, bytes]:
+    """按值逐个编码，不能存储的类型抛出 StorageError"""
+    return ENC_VALUES, encode_row(tuple(values))
+
+
+def encode_column(col_type: str, values: List[Any]) -> Tuple[int, bytes]:
+    """按列的类型和值的分布选择编码，返回 (编码, 内容)；values 中没有 NULL"""
+    if values:
+        kinds = set(map(type, values))
+        if col_type == 'INT' and kinds == {int}:
+            return _encode_ints(values)
+        if col_type == 'FLOAT' and kinds == {float}:
+            return ENC_FLOAT, _pack('d', values)
+        if col_type == 'TEXT' and kinds == {str}:
+            return _encode_texts(values)
+    return _encode_values(values)
+
+
+def decode_column(encoding: int, data: bytes) -> List[Any]:
+    """解码一列，只接受上面的编码"""
+    if encoding in (ENC_INT, ENC_DELTA, ENC_RLE):
+        return _decode_ints(encoding, data)
+    if encoding == ENC_FLOAT:
+        return _unpack('d', data).tolist()
+    if encoding == ENC_TEXT:
+        return _unpack_strings(data)
+    if encoding == ENC_DICT:
+        return _decode_dict(data)
+    if encoding == ENC_VALUES:
+        return list(decode_row(data, 0, len(data)))
+    raise StorageError(f"导出文件损坏或版本不支持: 未知的列编码 {encoding}")
+
+
+def encode_block(col_types: List[str], rows: List[Tuple[Any, ...]]) -> bytes:
+    """一块行按列编码: 行数、列数，每列为 编码(1) + 有无空值(1) + 长度(<I) + [空值位图] + 内容"""
+    parts = [struct.pack('<IH', len(rows), len(col_types))]
+    for col_type, values in zip(col_types, zip(*rows) if rows else [()] * len(col_types)):
+        nulls = None
+        if None in values:
+            nulls = bytearray((len(values) + 7) // 8)
+            for i, value in enumerate(values):
+                if value is None:
+                    nulls[i >> 3] |= 1 << (i & 7)
+            values = [value for value in values if value is not None]
+        encoding, payload = encode_column(col_type, list(values))
+        if nulls is not None:
+            payload = bytes(nulls) + payload
+        parts.append(struct.pack('<BBI', encoding, nulls is not None, len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def decode_block(data: bytes) -> List[Tuple[Any, ...]]:
+    count, width = struct.unpack_from('<IH', data)
+    pos = 6
+    columns = []
+    for _ in range(width):
+        encoding, has_nulls, size = struct.unpack_from('<BBI', data, pos)
+        pos += 6
+        payload = data[pos:pos + size]
+        pos += size
+        if has_nulls:
+            bitmap_size = (count + 7) // 8
+            nulls, payload = payload[:bitmap_size], payload[bitmap_size:]
+            values = iter(decode_column(encoding, payload))
+            columns.append([None if nulls[i >> 3] & (1 << (i & 7)) else next(values) for i in range(count)])
+        else:
+            columns.append(decode_column(encoding, payload))
+    return list(zip(*columns)) if width else [()] * count
+
+
+class DumpWriter:
+    """逐表、逐块写出导出文件，内存中最多只有一块（BLOCK_ROWS 行）"""
+
+    def __init__(self, file: BinaryIO, compression: str = 'zlib'):
+        if compression not in COMPRESSIONS:
+            raise StorageError(f"不支持的压缩方式: {compression}")
+        self.file = file
+        self.compress = COMPRESSIONS[compression][0]
+        # 写出的字节数（包括文件头）
+        self.bytes = 0
+        self._write(MAGIC)
+        self._frame(b'H', json.dumps({'compression': compression}).encode('utf-8'))
+
+    def _write(self, data: bytes) -> None:
+        self.file.write(data)
+        self.bytes += len(data)
+
+    def _frame(self, kind: bytes, payload: bytes) -> None:
+        self._write(kind + struct.pack('<I', len(payload)))
+        self._write(payload)
+
+    def write_table(self, name: str, columns: List[Tuple[str, str]], rows: Iterable[Tuple[Any, ...]]) -> int:
+        """写出一张表，返回行数"""
+        self._frame(FRAME_TABLE, json.dumps({'name': name, 'columns': [list(col) for col in columns]}).encode('utf-8'))
+        col_types = [col_type for _, col_type in columns]
+        rows = iter(rows)
+        count = 0
+        while True:
+            block = list(islice(rows, BLOCK_ROWS))
+            if not block:
+                return count
+            self._frame(FRAME_BLOCK, self.compress(encode_block(col_types, block)))
+            count += len(block)
+
+    def close(self) -> None:
+        """写出结束帧，不关闭文件"""
+        self._frame(FRAME_END, b'')
+
+
+class DumpReader:
+    """逐表、逐块读取导出文件
+
+    tables() 依次产生 (表名, 列定义, 行的迭代器)，行的迭代器要在取下一张表之前读完（没读完的块会被跳过）。
+    """
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        # 读到的下一张表的表头（或结束帧），读取一张表的块时遇到它就停止
+        self._pending: Optional[Tuple[bytes, bytes]] = None
+        if file.read(len(MAGIC)) != MAGIC:
+            raise StorageError("不是 LikOb 导出文件")
+        kind, payload = self._read_frame()
+        if kind != b'H':
+            raise StorageError("导出文件头损坏")
+        compression = json.loads(payload.decode('utf-8'))['compression']
+        if compression not in COMPRESSIONS:
+            raise StorageError(f"不支持的压缩方式: {compression}")
+        self.decompress = COMPRESSIONS[compression][1]
+
+    @staticmethod
+    def is_dump(filename: str) -> bool:
+        """文件是否为导出文件（否则按 JSON 读取）"""
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+
+    def _read_frame(self) -> Tuple[bytes, bytes]:
+        if self._pending is not None:
+            frame, self._pending = self._pending, None
+            return frame
+        header = self.file.read(5)
+        if len(header) < 5:
+            raise StorageError("导出文件不完整")
+        kind, size = header[:1], struct.unpack('<I', header[1:])[0]
+        payload = self.file.read(size)
+        if len(payload) < size:
+            raise StorageError("导出文件不完整")
+        return kind, payload
+
+    def tables(self) -> Iterator[Tuple[str, List[Tuple[str, str]], Iterator[Tuple[Any, ...]]]]:
+        while True:
+            kind, payload = self._read_frame()
+            if kind == FRAME_END:
+                return
+            if kind != FRAME_TABLE:
+                raise StorageError("导出文件损坏: 应为表头")
+            info = json.loads(payload.decode('utf-8'))
+            rows = self._rows()
+            yield info['name'], [tuple(col) for col in info['columns']], rows
+            rows.close()
+            # 跳过调用者没有读完的块，不解压
+            while self._pending is None:
+                kind, payload = self._read_frame()
+                if kind != FRAME_BLOCK:
+                    self._pending = (kind, payload)
+
+    def _rows(self) -> Iterator[Tuple[Any, ...]]:
+        while True:
+            kind, payload = self._read_frame()
+            if kind != FRAME_BLOCK:
+                self._pending = (kind, payload)
+                return
+            yield from decode_block(self.decompress(payload))
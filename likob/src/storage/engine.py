@@ -0,0 +1,659 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Any, Optional, Iterator, Set, Callable
+from .page import Page, make_rid, split_rid, row_size, overflow_columns, SLOT_BITS, SLOT_MASK
+from .io_manager import IOManager, MemoryIOManager
+from .overflow import OverflowFile, MemoryOverflowFile
+from .buffer_pool import BufferPool
+from .wal import WriteAheadLog
+from .column_store import ColumnStore
+from .zone_map import ZoneMap
+from ..core.exceptions import StorageError
+from ..utils.config import DBConfig
+
+
+class HeapFile:
+    """由固定大小页组成的堆文件，按行ID读写一张表的行
+
+    所有页访问都经过缓冲池，访问期间页被固定，不会被置换。
+    读页内容时持有页的共享闩，修改时持有排他闩，不同页上的修改可以并发进行；
+    插入时选择页和分配新页由 self.lock 串行化。闩总是在取消固定之前释放，持有闩期间不访问缓冲池。
+    放不进一页的行把最大的几个值存到溢出文件 overflow，页内只保存它们的位置（见 Page.to_bytes），
+    缓冲池中的页仍保存完整的行。
+    """
+
+    def __init__(self, name: str, io, page_size: int, pool: BufferPool, row_count: int = 0,
+                 wal: Optional[WriteAheadLog] = None, overflow=None):
+        self.name = name
+        self.io = io
+        self.overflow = overflow if overflow is not None else MemoryOverflowFile()
+        self.page_size = page_size
+        self.max_row = Page.max_row_size(page_size)
+        # 写入过放不进页的行，页写回后它们的大值才出现在溢出文件中
+        self._oversized = False
+        self.pool = pool
+        self.wal = wal
+        self.num_pages = io.num_pages()
+        self.row_count = row_count
+        # 删除过行、可能还有空闲空间的页
+        self._free_pages: Set[int] = set()
+        # 行ID -> 版本链，只包含最近被修改、还可能有事务需要旧版本的行；修改版本链时持有 versions_lock
+        self.versions: Dict[int, List[Any]] = {}
+        self.versions_lock = threading.Lock()
+        self.lock = threading.RLock()
+        self._count_lock = threading.Lock()
+        # 检查点写回脏页期间页被固定，清空和删除文件要等写回结束
+        self._flush_lock = threading.Lock()
+        # 每页每列的最小值和最大值，扫描时跳过不可能满足条件的页
+        self.zones = ZoneMap()
+        # 存储中的行每次修改都增加，并行扫描据此判断共享内存中的副本是否还和存储一致
+        self.changes = 0
+
+    @contextmanager
+    def _page(self, page_no: int, exclusive: bool = False) -> Iterator[Page]:
+        """固定页并加闩（读为共享闩，写为排他闩），离开 with 块时先释放闩再取消固定"""
+        page = self.pool.fetch(self, page_no)
+        try:
+            with page.latch.exclusive() if exclusive else page.latch.shared():
+                yield page
+        finally:
+            self.pool.unpin(self, page_no)
+
+    def read_page(self, page_no: int) -> Page:
+        """从磁盘读取一个页（由缓冲池在未命中时调用）"""
+        if page_no >= self.io.num_pages():
+            return Page(page_no, self.page_size)
+        return Page.from_bytes(page_no, self.page_size, self.io.read_page(page_no), self.overflow)
+
+    def write_page(self, page: Page) -> None:
+        """把页写回磁盘（由缓冲池在置换或刷盘时调用）
+
+        写页之前必须先把修改该页的日志写入磁盘。
+        """
+        self.write_image(page.page_no, page.to_bytes(self.overflow), page.lsn)
+
+    def write_image(self, page_no: int, data: bytes, lsn: int) -> None:
+        """写出检查点时复制的页内容，lsn 为复制时的页 LSN；页引用的溢出值先于页写出"""
+        if self.wal is not None:
+            self.wal.flush(lsn)
+        self.overflow.flush()
+        self.io.write_page(page_no, data)
+
+    def _blocked(self, page_no: int) -> Optional[Callable[[int], bool]]:
+        """页内哪些空槽不能复用：还有版本链的行（删除未提交或旧快照仍可见）的槽要保留"""
+        if not self.versions:
+            return None
+        versions = self.versions
+        base = page_no << SLOT_BITS
+        return lambda slot: (base | slot) in versions
+
+    def _pin_page_for(self, size: int) -> Page:
+        """找到并固定能放下指定大小行的页，必要时分配新页；调用者持有 self.lock
+
+        这里不加闩读取页的空闲空间，其他线程的原地更新可能随后改变它，调用者加排他闩后要再检查一次。
+        """
+        for page_no in list(self._free_pages):
+            page = self.pool.fetch(self, page_no)
+            if page.can_insert(size, self._blocked(page_no)):
+                return page
+            self.pool.unpin(self, page_no)
+            self._free_pages.discard(page_no)
+        if self.num_pages > 0:
+            page = self.pool.fetch(self, self.num_pages - 1)
+            if page.can_insert(size, self._blocked(page.page_no)):
+                return page
+            self.pool.unpin(self, page.page_no)
+        page = self.pool.new_page(self, self.num_pages)
+        self.num_pages += 1
+        return page
+
+    def _row_size(self, row: Tuple[Any, ...]) -> int:
+        """行在页内占用的字节数，放不进页的行中移到溢出文件的值按页外指针计算"""
+        size = row_size(row)
+        if size > self.max_row:
+            size = overflow_columns(row, self.max_row)[1]
+            self._oversized = True
+        return size
+
+    def has_overflow(self) -> bool:
+        """表中是否可能有保存在溢出文件中的值"""
+        return self._oversized or self.overflow.size() > 0
+
+    def _log(self, txn, kind: str, rid: int, before: Optional[Tuple[Any, ...]],
+             after: Optional[Tuple[Any, ...]], compensation: bool = False) -> int:
+        """在修改页之前写日志并登记回滚信息，返回日志的 LSN（未启用日志时为0）"""
+        if txn is None:
+            return 0
+        if not compensation:
+            txn.record_write(self, rid, before, after)
+        if self.wal is None:
+            return 0
+        if txn.first_lsn is None:
+            txn.first_lsn = self.wal.next_lsn
+        return self.wal.append({'type': kind, 'txid': txn.txid, 'table': self.name,
+                                'rid': rid, 'before': before, 'after': after})
+
+    def _log_batch(self, txn, rids: List[int], rows: List[Tuple[Any, ...]]) -> int:
+        """为批量插入的一组行写一条日志，返回日志的 LSN（未启用日志时为0）"""
+        if txn is None:
+            return 0
+        txn.record_inserts(self, rids, rows)
+        if self.wal is None:
+            return 0
+        if txn.first_lsn is None:
+            txn.first_lsn = self.wal.next_lsn
+        return self.wal.append({'type': 'INSERT_BATCH', 'txid': txn.txid, 'table': self.name,
+                                'rids': rids, 'after': rows})
+
+    def _write_slot(self, page: Page, slot: int, row: Optional[Tuple[Any, ...]], lsn: int) -> None:
+        """把行写入槽并维护行数和页 LSN，调用者持有页的排他闩"""
+        old = page.rows[slot] if slot < len(page.rows) else None
+        page.put(slot, row, self._row_size(row) if row is not None else 0)
+        page.lsn = max(page.lsn, lsn)
+        self.changes += 1
+        if row is not None:
+            self.zones.note(page.page_no, row)
+        delta = (row is not None) - (old is not None)
+        if delta or row is None:
+            with self._count_lock:
+                self.row_count += delta
+                if row is None:
+                    self._free_pages.add(page.page_no)
+
+    def insert(self, row: Tuple[Any, ...], txn=None) -> int:
+        """插入一行，返回行ID"""
+        size = self._row_size(row)
+        with self.lock:
+            while True:
+                page = self._pin_page_for(size)
+                try:
+                    with page.latch.exclusive():
+                        blocked = self._blocked(page.page_no)
+                        if page.can_insert(size, blocked):
+                            rid = make_rid(page.page_no, page.next_slot(blocked))
+                            lsn = self._log(txn, 'INSERT', rid, None, row)
+                            self._write_slot(page, rid & SLOT_MASK, row, lsn)
+                            return rid
+                finally:
+                    self.pool.unpin(self, page.page_no)
+
+    def insert_many(self, rows: List[Tuple[Any, ...]], txn=None) -> List[int]:
+        """批量插入多行，返回行ID
+
+        依次填满页，每个页只固定一次，页内的所有行写成一条日志记录。
+        写日志之前一直持有页的排他闩，页不会被写回，所以先修改页再写日志也满足先写日志的要求。
+        """
+        sizes = [row_size(row) for row in rows]
+        if sizes and max(sizes) > self.max_row:
+            sizes = [size if size <= self.max_row else overflow_columns(row, self.max_row)[1]
+                     for row, size in zip(rows, sizes)]
+            self._oversized = True
+        rids: List[int] = []
+        i = 0
+        with self.lock:
+            while i < len(rows):
+                page = self._pin_page_for(sizes[i])
+                try:
+                    with page.latch.exclusive():
+                        start = i
+                        if page.holes:
+                            blocked = self._blocked(page.page_no)
+                            while i < len(rows) and page.can_insert(sizes[i], blocked):
+                                rids.append(make_rid(page.page_no, page.insert(rows[i], sizes[i], blocked)))
+                                i += 1
+                        else:
+                            first = make_rid(page.page_no, len(page.rows))
+                            i = page.fill(rows, sizes, i)
+                            rids.extend(range(first, first + i - start))
+                        if i > start:
+                            lsn = self._log_batch(txn, rids[start:i], rows[start:i])
+                            page.lsn = max(page.lsn, lsn)
+                            self.changes += 1
+                            self.zones.note_many(page.page_no, rows[start:i])
+                finally:
+                    self.pool.unpin(self, page.page_no)
+                with self._count_lock:
+                    self.row_count += i - start
+        return rids
+
+    def get(self, rid: int) -> Optional[Tuple[Any, ...]]:
+        """按行ID读取一行，行不存在时返回None"""
+        page_no, slot = split_rid(rid)
+        if page_no >= self.num_pages:
+            return None
+        with self._page(page_no) as page:
+            return page.rows[slot] if slot < len(page.rows) else None
+
+    def update(self, rid: int, row: Tuple[Any, ...], txn=None) -> int:
+        """更新一行，返回新的行ID（页内放不下时行会被移动）"""
+        size = self._row_size(row)
+        page_no, slot = split_rid(rid)
+        with self._page(page_no, exclusive=True) as page:
+            before = page.rows[slot]
+            if page.fits_update(slot, size):
+                lsn = self._log(txn, 'UPDATE', rid, before, row)
+                self._write_slot(page, slot, row, lsn)
+                return rid
+            lsn = self._log(txn, 'DELETE', rid, before, None)
+            self._write_slot(page, slot, None, lsn)
+        return self.insert(row, txn)
+
+    def delete(self, rid: int, txn=None) -> None:
+        """删除一行，槽号保留，其他行的ID不变"""
+        page_no, slot = split_rid(rid)
+        with self._page(page_no, exclusive=True) as page:
+            if slot >= len(page.rows) or page.rows[slot] is None:
+                return
+            lsn = self._log(txn, 'DELETE', rid, page.rows[slot], None)
+            self._write_slot(page, slot, None, lsn)
+
+    def restore(self, rid: int, row: Optional[Tuple[Any, ...]], txn=None) -> None:
+        """回滚时把槽恢复为旧值，并写入补偿日志"""
+        page_no, slot = split_rid(rid)
+        with self._page(page_no, exclusive=True) as page:
+            before = page.rows[slot] if slot < len(page.rows) else None
+            lsn = self._log(txn, 'UNDO', rid, before, row, compensation=True)
+            self._write_slot(page, slot, row, lsn)
+
+    def redo(self, rid: int, row: Optional[Tuple[Any, ...]], lsn: int) -> None:
+        """恢复时重做一条日志记录，页 LSN 不小于记录 LSN 时说明已经写入过"""
+        page_no, slot = split_rid(rid)
+        self.num_pages = max(self.num_pages, page_no + 1)
+        with self._page(page_no, exclusive=True) as page:
+            if page.lsn < lsn:
+                self._write_slot(page, slot, row, lsn)
+
+    def redo_batch(self, rids: List[int], rows: List[Tuple[Any, ...]], lsn: int) -> None:
+        """重做一条批量插入记录，记录中的行都在同一页"""
+        page_no = split_rid(rids[0])[0]
+        self.num_pages = max(self.num_pages, page_no + 1)
+        with self._page(page_no, exclusive=True) as page:
+            if page.lsn < lsn:
+                for rid, row in zip(rids, rows):
+                    self._write_slot(page, rid & SLOT_MASK, row, lsn)
+
+    def vacuum(self, shrink: bool = False) -> Dict[str, int]:
+        """回收已删除行占用的空间，返回 {'slots': 去掉的空槽数, 'pages': 截掉的页数}
+
+        删除只把槽标记为空，行ID不变。清理时去掉每页末尾的空槽，重新登记有空闲空间的页供插入复用
+        （重新打开数据库后这些页要清理一次才会被复用）；还有版本链的槽保留。
+        shrink 为 True 时截掉文件末尾的空页，调用者保证没有事务在读这张表。
+        """
+        with self.lock:
+            slots = 0
+            used_pages = 0
+            free_pages = set()
+            for page_no in range(self.num_pages):
+                with self._page(page_no, exclusive=True) as page:
+                    slots += page.trim(self._blocked(page_no))
+                    if page.rows:
+                        used_pages = page_no + 1
+                    # 有空槽或至少一成空闲空间的页值得在插入时尝试
+                    if page.holes or page.free_space() * 10 >= self.page_size:
+                        free_pages.add(page_no)
+            pages = 0
+            if shrink and used_pages < self.num_pages and self.pool.drop_pages(self, used_pages):
+                pages = self.num_pages - used_pages
+                self.io.truncate(used_pages)
+                self.num_pages = used_pages
+            self._free_pages = {page_no for page_no in free_pages if page_no < self.num_pages}
+            # 删除不收窄页的统计，清理后下次使用时重新计算
+            self.zones.clear()
+            self.changes += 1
+            return {'slots': slots, 'pages': pages}
+
+    def count_rows(self) -> int:
+        """重新统计行数"""
+        self.row_count = sum(1 for _ in self.scan())
+        return self.row_count
+
+    def scan(self, start_page: int = 0, end_page: Optional[int] = None, deleted: bool = False,
+             predicates: Optional[List[Tuple[int, Any, Any]]] = None) -> Iterator[Tuple[int, Optional[Tuple[Any, ...]]]]:
+        """按存储顺序遍历 [start_page, end_page) 中的行，产生 (行ID, 行)
+
+        每页在共享闩保护下复制行列表后立即取消固定，产生行的过程中不占用缓冲池的页框。
+        deleted 为 True 时空槽也产生，行为 None。
+        predicates 为 (列位置, 比较函数, 值) 条件时，统计表明没有行能满足条件的页不读取；
+        还没有统计的页读到时顺便计算，扫描只在读到一页时才为它付出代价，LIMIT 提前结束的扫描不会读其余的页。
+        """
+        end_page = self.num_pages if end_page is None else min(end_page, self.num_pages)
+        zones = self.zones
+        positions = sorted({position for position, _, _ in predicates}) if predicates else []
+        for page_no in range(start_page, end_page):
+            if predicates and not zones.may_match(page_no, predicates):
+                continue
+            with self._page(page_no) as page:
+                rows = list(page.rows)
+                missing = zones.missing(page_no, positions) if predicates else None
+                if missing:
+                    self._compute_zone(page_no, rows, missing)
+            if missing and not zones.may_match(page_no, predicates):
+                continue
+            base = page_no << SLOT_BITS
+            for slot, row in enumerate(rows):
+                if row is not None or deleted:
+                    yield base | slot, row
+
+    def _compute_zone(self, page_no: int, rows: List[Optional[Tuple[Any, ...]]], positions: List[int]) -> None:
+        """由页内的行和这些行的版本链计算指定列的统计，调用者持有页的闩
+
+        写者修改页时持有排他闩并放宽统计，所以计算期间的修改不会遗漏。
+        """
+        values = [row for row in rows if row is not None]
+        if self.versions:
+            base = page_no << SLOT_BITS
+            with self.versions_lock:
+                for slot in range(len(rows)):
+                    chain = self.versions.get(base | slot)
+                    if chain:
+                        values.extend(version.row for version in chain if version.row is not None)
+        self.zones.compute(page_no, {position: [row[position] for row in values] for position in positions})
+
+    def truncate(self) -> None:
+        """删除所有行和页"""
+        with self._flush_lock:
+            self.pool.drop_heap(self)
+            self._free_pages.clear()
+            self.versions.clear()
+            self.zones.clear()
+            self.io.truncate(0)
+            self.overflow.truncate()
+            self._oversized = False
+            self.num_pages = 0
+            self.row_count = 0
+            self.changes += 1
+
+    def flush(self) -> int:
+        """把脏页写回磁盘，返回写出的页数；只写上次检查点之后修改过的页，写回期间其他线程照常读写"""
+        with self._flush_lock:
+            written = self.pool.flush_heap(self)
+            if written:
+                self.overflow.sync()
+                self.io.sync()
+            return written
+
+    def copy_pages(self, allocate: Callable[[int], Any]) -> int:
+        """写回脏页后把所有页复制到 allocate(字节数) 返回的缓冲区，返回页数
+
+        并行扫描用它把页交给工作进程，调用者保证复制期间没有写者；
+        写回之后本表没有脏页，同时进行的置换写回的内容与文件相同，读文件由 io 的锁保证不与写页交错。
+        """
+        self.flush()
+        num_pages = self.io.num_pages()
+        self.io.read_into(allocate(num_pages * self.page_size), num_pages)
+        return num_pages
+
+    def close(self) -> None:
+        """关闭数据文件"""
+        self.io.close()
+        self.overflow.close()
+
+    def remove(self) -> None:
+        """丢弃缓冲池中的页并删除数据文件"""
+        with self._flush_lock:
+            self.pool.drop_heap(self)
+            self.io.remove()
+            self.overflow.remove()
+
+
+class StorageEngine:
+    """管理数据目录中的目录文件(catalog)和每张表的页文件
+
+    directory 为 None 时所有页都保存在内存中。
+    打开数据库只读取目录文件，数据页在第一次访问时才从磁盘读取。
+    目录的修改由 lock 串行化；检查点与修改数据的事务并发进行，
+    active_lsn 返回活动事务最早的日志 LSN，检查点保留从它开始的日志，崩溃后这些事务仍能撤销。
+    """
+
+    CATALOG_FILE = 'catalog.json'
+    WAL_FILE = 'wal.log'
+    DATA_RECORDS = ('INSERT', 'UPDATE', 'DELETE', 'UNDO', 'INSERT_BATCH')
+    LAYOUTS = ('row', 'columnar')
+    FORMAT_VERSION = 1
+
+    def __init__(self, directory: Optional[str] = None, config: Optional[DBConfig] = None):
+        self.config = config or DBConfig()
+        self.directory = directory
+        self.page_size = self.config.page_size
+        self.heaps: Dict[str, Any] = {}
+        self.lock = threading.RLock()
+        self._checkpoint_lock = threading.Lock()
+        self.checkpoints = 0
+        self.last_checkpoint: Dict[str, Any] = {}
+        self.active_lsn: Optional[Callable[[], Optional[int]]] = None
+        self.catalog: Dict[str, Any] = {'version': self.FORMAT_VERSION, 'page_size': self.page_size, 'tables': {}}
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            catalog_path = self._catalog_path()
+            if os.path.exists(catalog_path):
+                with open(catalog_path, 'r') as f:
+                    self.catalog = json.load(f)
+                # 已有数据库必须使用创建时的页大小
+                self.page_size = self.catalog['page_size']
+
+        if not 512 <= self.page_size <= 65535:
+            raise StorageError(f"页大小必须在 512 到 65535 之间: {self.page_size}")
+
+        # 所有表共享一个缓冲池，最多驻留 cache_size 个页
+        self.pool = BufferPool(self.config.cache_size, self.config.buffer_policy)
+
+        # 持久化数据库使用预写日志，打开时重放日志完成崩溃恢复
+        self.wal: Optional[WriteAheadLog] = None
+        if directory is not None:
+            self.wal = WriteAheadLog(os.path.join(directory, self.WAL_FILE),
+                                     sync=self.config.wal_sync,
+                                     group_commit_delay=self.config.group_commit_delay,
+                                     start_lsn=self.catalog.get('next_lsn', 1))
+            self.recover()
+
+    @property
+    def in_memory(self) -> bool:
+        """是否为内存数据库"""
+        return self.directory is None
+
+    def _catalog_path(self) -> str:
+        return os.path.join(self.directory, self.CATALOG_FILE)
+
+    def _table_path(self, name: str, layout: str = 'row') -> str:
+        return os.path.join(self.directory, f"{name}.{'col' if layout == 'columnar' else 'tbl'}")
+
+    def _save_catalog(self) -> None:
+        """原子地写入目录文件"""
+        if self.in_memory:
+            return
+        with self.lock:
+            for name, heap in self.heaps.items():
+                self.catalog['tables'][name]['row_count'] = heap.row_count
+            tmp_path = self._catalog_path() + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.catalog, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._catalog_path())
+
+    def _overflow_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.ovf")
+
+    def _make_io(self, name: str):
+        if self.in_memory:
+            return MemoryIOManager(self.page_size)
+        return IOManager(self._table_path(name), self.page_size)
+
+    def _make_overflow(self, name: str):
+        if self.in_memory:
+            return MemoryOverflowFile()
+        return OverflowFile(self._overflow_path(name))
+
+    def table_definitions(self) -> Dict[str, List[Tuple[str, str]]]:
+        """目录中记录的所有表及其列定义"""
+        return {name: [tuple(col) for col in info['columns']]
+                for name, info in self.catalog['tables'].items()}
+
+    def table_constraints(self, table: str) -> Dict[str, Any]:
+        """表的主键、UNIQUE 和 NOT NULL 约束"""
+        return dict(self.catalog['tables'][table].get('constraints', {}))
+
+    def index_definitions(self, table: str) -> Dict[str, str]:
+        """表上的索引: 索引名 -> 列名"""
+        return dict(self.catalog['tables'][table].get('indexes', {}))
+
+    def add_index_definition(self, table: str, name: str, column: str) -> None:
+        """在目录中登记索引"""
+        self.catalog['tables'][table].setdefault('indexes', {})[name] = column
+        self._save_catalog()
+
+    def drop_index_definition(self, table: str, name: str) -> None:
+        """从目录中删除索引"""
+        self.catalog['tables'][table].get('indexes', {}).pop(name, None)
+        self._save_catalog()
+
+    def table_layout(self, name: str) -> str:
+        """表的存储方式: row（页式行存储）或 columnar（列式存储）"""
+        return self.catalog['tables'][name].get('layout', 'row')
+
+    def create_heap(self, name: str, columns: List[Tuple[str, str]], layout: str = 'row',
+                    constraints: Optional[Dict[str, Any]] = None):
+        """为新表创建存储并登记到目录"""
+        if name in self.catalog['tables']:
+            raise StorageError(f"表 {name} 的存储已存在")
+        if layout not in self.LAYOUTS:
+            raise StorageError(f"不支持的存储方式: {layout}")
+        self.catalog['tables'][name] = {'columns': [list(col) for col in columns], 'row_count': 0}
+        if constraints:
+            self.catalog['tables'][name]['constraints'] = constraints
+        if layout != 'row':
+            self.catalog['tables'][name]['layout'] = layout
+            path = None if self.in_memory else self._table_path(name, layout)
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+            heap = ColumnStore(name, columns, path, self.wal)
+        else:
+            io = self._make_io(name)
+            io.truncate(0)
+            overflow = self._make_overflow(name)
+            overflow.truncate()
+            heap = HeapFile(name, io, self.page_size, self.pool, wal=self.wal, overflow=overflow)
+        self.heaps[name] = heap
+        self._save_catalog()
+        return heap
+
+    def open_heap(self, name: str):
+        """打开已存在表的存储"""
+        if name in self.heaps:
+            return self.heaps[name]
+        if name not in self.catalog['tables']:
+            raise StorageError(f"表 {name} 的存储不存在")
+        info = self.catalog['tables'][name]
+        layout = self.table_layout(name)
+        if layout == 'columnar':
+            heap = ColumnStore(name, [tuple(col) for col in info['columns']],
+                               None if self.in_memory else self._table_path(name, layout), self.wal)
+        else:
+            heap = HeapFile(name, self._make_io(name), self.page_size, self.pool,
+                            info.get('row_count', 0), self.wal, self._make_overflow(name))
+        self.heaps[name] = heap
+        return heap
+
+    def drop_heap(self, name: str) -> None:
+        """删除表的存储文件"""
+        heap = self.heaps.pop(name, None)
+        if heap is not None:
+            heap.remove()
+        elif not self.in_memory and name in self.catalog['tables']:
+            for path in (self._table_path(name, self.table_layout(name)), self._overflow_path(name)):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.catalog['tables'].pop(name, None)
+        self._save_catalog()
+
+    def recover(self) -> int:
+        """重放预写日志，返回处理的记录数
+
+        先按顺序重做所有修改（页 LSN 不小于记录 LSN 的跳过），
+        再逆序撤销没有提交或回滚记录的事务，最后做一次检查点。
+        """
+        records = [(lsn, record) for lsn, record in self.wal.records()]
+        if not records:
+            return 0
+        finished = {record['txid'] for _, record in records if record['type'] in ('COMMIT', 'ABORT')}
+        touched = {}
+        for lsn, record in records:
+            if record['type'] in self.DATA_RECORDS and record['table'] in self.catalog['tables']:
+                heap = self.open_heap(record['table'])
+                after = record['after']
+                if record['type'] == 'INSERT_BATCH':
+                    heap.redo_batch(record['rids'], [tuple(row) for row in after], lsn)
+                else:
+                    heap.redo(record['rid'], tuple(after) if after is not None else None, lsn)
+                touched[heap.name] = heap
+        for lsn, record in reversed(records):
+            if (record['type'] in self.DATA_RECORDS and record['txid'] not in finished
+                    and record['table'] in touched):
+                heap = touched[record['table']]
+                if record['type'] == 'INSERT_BATCH':
+                    for rid in reversed(record['rids']):
+                        heap.restore(rid, None)
+                    continue
+                before = record['before']
+                heap.restore(record['rid'], tuple(before) if before is not None else None)
+        for heap in touched.values():
+            heap.count_rows()
+        self.checkpoint()
+        return len(records)
+
+    def checkpoint(self) -> int:
+        """写回上次检查点之后修改过的页和列式表，再删除不再需要的日志，返回写出的页数
+
+        开始写回之前写入的记录对应的修改都已在数据文件中，可以删除；之后写入的记录和活动事务的记录保留。
+        写回不持有目录锁，也不阻塞读写数据的事务（见 HeapFile.flush 和 ColumnStore.flush），检查点之间由
+        _checkpoint_lock 串行化。崩溃恢复从数据文件开始，只重放检查点保留的日志。
+        """
+        with self._checkpoint_lock:
+            started = time.monotonic()
+            keep_lsn = None
+            if self.wal is not None:
+                # 先记下边界再取活动事务的 LSN：边界之前开始写日志的事务一定已经登记了 first_lsn
+                keep_lsn = self.wal.next_lsn
+                active = self.active_lsn() if self.active_lsn is not None else None
+                if active is not None:
+                    keep_lsn = min(keep_lsn, active)
+                self.wal.flush()
+            written = 0
+            tables = 0
+            for heap in list(self.heaps.values()):
+                count = heap.flush()
+                written += count
+                tables += count > 0
+            with self.lock:
+                if self.wal is not None:
+                    self.catalog['next_lsn'] = self.wal.next_lsn
+                self._save_catalog()
+            if self.wal is not None:
+                self.wal.truncate(keep_lsn)
+            self.checkpoints += 1
+            self.last_checkpoint = {'pages': written, 'tables': tables, 'keep_lsn': keep_lsn,
+                                    'seconds': time.monotonic() - started}
+            return written
+
+    def checkpoint_stats(self) -> Dict[str, Any]:
+        """检查点次数和最近一次检查点写出的页数（列式表每张算一页）、表数、保留日志的起始 LSN 和耗时"""
+        stats = {'checkpoints': self.checkpoints}
+        stats.update(self.last_checkpoint)
+        return stats
+
+    def flush(self) -> int:
+        """把所有脏页写回磁盘并更新目录，返回写出的页数"""
+        return self.checkpoint()
+
+    def close(self) -> None:
+        """写回脏页并关闭所有文件"""
+        self.checkpoint()
+        for heap in self.heaps.values():
+            heap.close()
+        self.heaps.clear()
+        if self.wal is not None:
+            self.wal.close()
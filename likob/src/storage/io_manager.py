@@ -0,0 +1,127 @@
+import os
+import threading
+from typing import Dict
+from ..core.exceptions import StorageError
+
+
+class IOManager:
+    """按页读写单个数据文件
+
+    缓冲池未命中、置换和检查点都在缓冲池的锁外读写页，定位和读写由 self.lock 保证不交错。
+    """
+
+    def __init__(self, path: str, page_size: int):
+        self.path = path
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        self.file = open(path, mode)
+        size = os.path.getsize(path)
+        if size % page_size != 0:
+            raise StorageError(f"数据文件 {path} 大小 {size} 不是页大小 {page_size} 的整数倍")
+
+    def num_pages(self) -> int:
+        """文件中的页数"""
+        with self.lock:
+            self.file.seek(0, os.SEEK_END)
+            return self.file.tell() // self.page_size
+
+    def read_page(self, page_no: int) -> bytes:
+        """读取一个页"""
+        with self.lock:
+            self.file.seek(page_no * self.page_size)
+            data = self.file.read(self.page_size)
+        if len(data) != self.page_size:
+            raise StorageError(f"读取页 {page_no} 失败: 文件 {self.path} 不完整")
+        return data
+
+    def write_page(self, page_no: int, data: bytes) -> None:
+        """写入一个页"""
+        if len(data) != self.page_size:
+            raise StorageError(f"页大小错误: {len(data)} != {self.page_size}")
+        with self.lock:
+            self.file.seek(page_no * self.page_size)
+            self.file.write(data)
+
+    def read_into(self, buffer, num_pages: int) -> None:
+        """把前 num_pages 个页连续读入可写的缓冲区"""
+        size = num_pages * self.page_size
+        with self.lock:
+            self.file.seek(0)
+            read = self.file.readinto(memoryview(buffer)[:size])
+        if read != size:
+            raise StorageError(f"读取前 {num_pages} 页失败: 文件 {self.path} 不完整")
+
+    def truncate(self, num_pages: int = 0) -> None:
+        """把文件截断到指定页数"""
+        with self.lock:
+            self.file.truncate(num_pages * self.page_size)
+
+    def sync(self) -> None:
+        """把缓冲写入磁盘"""
+        with self.lock:
+            self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        """关闭文件"""
+        if not self.file.closed:
+            self.file.close()
+
+    def remove(self) -> None:
+        """关闭并删除文件"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class MemoryIOManager:
+    """内存数据库使用的页存储，接口与 IOManager 相同"""
+
+    def __init__(self, page_size: int):
+        self.path = None
+        self.page_size = page_size
+        self.pages: Dict[int, bytes] = {}
+        self.page_count = 0
+        self.lock = threading.Lock()
+
+    def num_pages(self) -> int:
+        """页数"""
+        return self.page_count
+
+    def read_page(self, page_no: int) -> bytes:
+        """读取一个页"""
+        if page_no >= self.page_count:
+            raise StorageError(f"读取页 {page_no} 失败: 页不存在")
+        return self.pages.get(page_no, bytes(self.page_size))
+
+    def write_page(self, page_no: int, data: bytes) -> None:
+        """写入一个页"""
+        if len(data) != self.page_size:
+            raise StorageError(f"页大小错误: {len(data)} != {self.page_size}")
+        with self.lock:
+            self.pages[page_no] = data
+            self.page_count = max(self.page_count, page_no + 1)
+
+    def read_into(self, buffer, num_pages: int) -> None:
+        """把前 num_pages 个页连续复制到可写的缓冲区"""
+        view = memoryview(buffer)
+        for page_no in range(num_pages):
+            view[page_no * self.page_size:(page_no + 1) * self.page_size] = self.read_page(page_no)
+
+    def truncate(self, num_pages: int = 0) -> None:
+        """截断到指定页数"""
+        with self.lock:
+            for page_no in [p for p in self.pages if p >= num_pages]:
+                del self.pages[page_no]
+            self.page_count = min(self.page_count, num_pages)
+
+    def sync(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def remove(self) -> None:
+        """删除所有页"""
+        self.truncate(0)
@@ -0,0 +1,50 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class RWLatch:
+    """读写闩，保护页、索引等内存结构在一次短操作期间不被并发修改
+
+    多个读者可以同时持有共享闩，写者独占；有写者在等待时新的读者也等待，避免写者饿死。
+    闩不可重入，持有闩期间不能再去获取同一个闩，也不能等待行锁。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        """在 with 块内持有共享闩"""
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """在 with 块内持有排他闩"""
+        with self._cond:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
@@ -0,0 +1,120 @@
+import os
+import threading
+from typing import Optional
+from ..core.exceptions import StorageError
+
+
+class OverflowFile:
+    """行存储表放不进页内的大值（长文本、大整数）保存在这里，页中只记录 (偏移, 长度)
+
+    文件只追加：值写入后不再修改，页写回时才写入，同一行再次写回时复用已有的位置。
+    被更新或删除的值占用的空间在清空表时回收。文件在第一次写入大值时才创建。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.end = os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _open(self):
+        if self.file is None:
+            self.file = open(self.path, 'r+b' if os.path.exists(self.path) else 'w+b')
+        return self.file
+
+    def size(self) -> int:
+        """已写入的字节数"""
+        return self.end
+
+    def put(self, data: bytes) -> int:
+        """追加一个值的编码，返回偏移"""
+        with self.lock:
+            file = self._open()
+            offset = self.end
+            file.seek(offset)
+            file.write(data)
+            self.end += len(data)
+            return offset
+
+    def get(self, offset: int, length: int) -> bytes:
+        """读取一个值的编码"""
+        with self.lock:
+            if offset + length > self.end:
+                raise StorageError(f"溢出文件 {self.path} 不完整: 需要 {offset + length} 字节，只有 {self.end} 字节")
+            file = self._open()
+            file.seek(offset)
+            return file.read(length)
+
+    def flush(self) -> None:
+        """把缓冲交给操作系统，写页之前调用，引用这些值的页写出时值已经在文件中"""
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def sync(self) -> None:
+        """把写入的值写入磁盘"""
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def truncate(self) -> None:
+        """丢弃所有值"""
+        with self.lock:
+            if self.file is not None:
+                self.file.truncate(0)
+            elif os.path.exists(self.path):
+                os.truncate(self.path, 0)
+            self.end = 0
+
+    def close(self) -> None:
+        if self.file is not None and not self.file.closed:
+            self.file.close()
+        self.file = None
+
+    def remove(self) -> None:
+        """关闭并删除文件"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class MemoryOverflowFile:
+    """内存数据库使用的大值存储，接口与 OverflowFile 相同"""
+
+    def __init__(self):
+        self.path: Optional[str] = None
+        self.data = bytearray()
+        self.lock = threading.Lock()
+
+    def size(self) -> int:
+        return len(self.data)
+
+    def put(self, data: bytes) -> int:
+        with self.lock:
+            offset = len(self.data)
+            self.data += data
+            return offset
+
+    def get(self, offset: int, length: int) -> bytes:
+        with self.lock:
+            if offset + length > len(self.data):
+                raise StorageError(f"溢出数据不完整: 需要 {offset + length} 字节，只有 {len(self.data)} 字节")
+            return bytes(self.data[offset:offset + length])
+
+    def flush(self) -> None:
+        pass
+
+    def sync(self) -> None:
+        pass
+
+    def truncate(self) -> None:
+        with self.lock:
+            self.data = bytearray()
+
+    def close(self) -> None:
+        pass
+
+    def remove(self) -> None:
+        self.truncate()
@@ -0,0 +1,345 @@
+import struct
+from typing import Dict, List, Optional, Tuple, Any, Callable
+from ..core.exceptions import StorageError
+from .latch import RWLatch
+
+# 行ID = 页号 << 16 | 槽号，删除其他行不会改变已有行的ID
+SLOT_BITS = 16
+SLOT_MASK = (1 << SLOT_BITS) - 1
+
+# 值的类型标记
+_TAG_NULL = 0
+_TAG_INT = 1
+_TAG_FLOAT = 2
+_TAG_TEXT = 3
+_TAG_BIGINT = 4
+# 值保存在溢出文件中，页内只有 (偏移, 长度)
+_TAG_OVERFLOW = 5
+
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_LEN = struct.Struct('<I')
+_INT_MIN = -(1 << 63)
+_INT_MAX = (1 << 63) - 1
+# 类型标记和值一起打包
+_TAGGED_INT = struct.Struct('<Bq')
+_TAGGED_FLOAT = struct.Struct('<Bd')
+_TAGGED_LEN = struct.Struct('<BI')
+_POINTER = struct.Struct('<QI')
+_TAGGED_POINTER = struct.Struct('<BQI')
+# 页外值在页内占用的字节数
+POINTER_SIZE = _TAGGED_POINTER.size
+
+
+def make_rid(page_no: int, slot: int) -> int:
+    """由页号和槽号组成行ID"""
+    return (page_no << SLOT_BITS) | slot
+
+
+def split_rid(rid: int) -> Tuple[int, int]:
+    """把行ID拆分为页号和槽号"""
+    return rid >> SLOT_BITS, rid & SLOT_MASK
+
+
+def value_size(value: Any) -> int:
+    """计算单个值编码后的字节数"""
+    if value is None:
+        return 1
+    if isinstance(value, (bool, int)):
+        if _INT_MIN <= value <= _INT_MAX:
+            return 1 + _INT.size
+        return 1 + _LEN.size + len(str(value))
+    if isinstance(value, float):
+        return 1 + _FLOAT.size
+    if isinstance(value, str):
+        return 1 + _LEN.size + len(value.encode('utf-8'))
+    raise StorageError(f"不支持存储的值类型: {type(value).__name__}")
+
+
+def row_size(row: Tuple[Any, ...]) -> int:
+    """计算一行编码后的字节数"""
+    size = 0
+    for value in row:
+        # 常见类型直接按类型计算，其余交给 value_size
+        kind = type(value)
+        if kind is float:
+            size += 1 + _FLOAT.size
+        elif kind is int and _INT_MIN <= value <= _INT_MAX:
+            size += 1 + _INT.size
+        elif kind is str:
+            size += 1 + _LEN.size + len(value.encode('utf-8'))
+        else:
+            size += value_size(value)
+    return size
+
+
+def overflow_columns(row: Tuple[Any, ...], limit: int) -> Tuple[List[int], int]:
+    """编码后超过 limit 字节的行要把哪些列移到页外，返回 (列位置, 移出后页内的字节数)
+
+    从最大的值开始移出，直到行能放进 limit；结果只取决于行的内容，写回页时会重新得到相同的列。
+    只有编码比页外指针大的值才移出，全部移出仍放不下时抛出 StorageError。
+    """
+    sizes = [value_size(value) for value in row]
+    size = sum(sizes)
+    positions = []
+    for position in sorted(range(len(row)), key=sizes.__getitem__, reverse=True):
+        if size <= limit or sizes[position] <= POINTER_SIZE:
+            break
+        positions.append(position)
+        size -= sizes[position] - POINTER_SIZE
+    if size > limit:
+        raise StorageError(f"行太大: 长值移到页外后仍需 {size} 字节，超过页容量 {limit} 字节；"
+                           f"请减少列数，或在创建数据库时增大 DBConfig.page_size（最大 65535）")
+    return positions, size
+
+
+def encode_row(row: Tuple[Any, ...]) -> bytes:
+    """把一行编码为字节串"""
+    parts = []
+    for value in row:
+        kind = type(value)
+        if kind is int and _INT_MIN <= value <= _INT_MAX:
+            parts.append(_TAGGED_INT.pack(_TAG_INT, value))
+        elif kind is float:
+            parts.append(_TAGGED_FLOAT.pack(_TAG_FLOAT, value))
+        elif kind is str:
+            text = value.encode('utf-8')
+            parts.append(_TAGGED_LEN.pack(_TAG_TEXT, len(text)))
+            parts.append(text)
+        elif value is None:
+            parts.append(bytes((_TAG_NULL,)))
+        elif isinstance(value, (bool, int)):
+            if _INT_MIN <= value <= _INT_MAX:
+                parts.append(bytes((_TAG_INT,)) + _INT.pack(value))
+            else:
+                text = str(value).encode('ascii')
+                parts.append(bytes((_TAG_BIGINT,)) + _LEN.pack(len(text)) + text)
+        elif isinstance(value, float):
+            parts.append(bytes((_TAG_FLOAT,)) + _FLOAT.pack(value))
+        elif isinstance(value, str):
+            text = value.encode('utf-8')
+            parts.append(bytes((_TAG_TEXT,)) + _LEN.pack(len(text)) + text)
+        else:
+            raise StorageError(f"不支持存储的值类型: {type(value).__name__}")
+    return b''.join(parts)
+
+
+def decode_row(buf: bytes, offset: int, end: int, overflow=None,
+               pointers: Optional[Dict[int, Tuple[int, int]]] = None) -> Tuple[Any, ...]:
+    """从字节串中解码一行，页外值从 overflow 读取，位置记入 pointers（列位置 -> (偏移, 长度)）"""
+    values = []
+    while offset < end:
+        tag = buf[offset]
+        offset += 1
+        if tag == _TAG_NULL:
+            values.append(None)
+        elif tag == _TAG_INT:
+            values.append(_INT.unpack_from(buf, offset)[0])
+            offset += _INT.size
+        elif tag == _TAG_FLOAT:
+            values.append(_FLOAT.unpack_from(buf, offset)[0])
+            offset += _FLOAT.size
+        elif tag in (_TAG_TEXT, _TAG_BIGINT):
+            length = _LEN.unpack_from(buf, offset)[0]
+            offset += _LEN.size
+            text = bytes(buf[offset:offset + length]).decode('utf-8')
+            values.append(text if tag == _TAG_TEXT else int(text))
+            offset += length
+        elif tag == _TAG_OVERFLOW:
+            start, length = _POINTER.unpack_from(buf, offset)
+            offset += _POINTER.size
+            if overflow is None:
+                raise StorageError("页中有保存在溢出文件中的值，但没有提供溢出文件")
+            if pointers is not None:
+                pointers[len(values)] = (start, length)
+            data = overflow.get(start, length)
+            values.append(decode_row(data, 0, len(data))[0])
+        else:
+            raise StorageError(f"页数据损坏: 未知的类型标记 {tag}")
+    return tuple(values)
+
+
+class Page:
+    """固定大小的分槽页
+
+    磁盘格式: 页头(槽数, LSN) | 槽目录(偏移, 长度) | 行数据。
+    长度为0的槽表示已删除的行，槽号保持不变。
+    内存中保存解码后的行，只有脏页在写回时重新编码。放不进页的行在写回时把大值写到溢出文件，
+    页内只记录位置（见 overflow_columns），sizes 中是行在页内占用的字节数。
+    latch 保护页内容：读取时持有共享闩，修改和写回时分别持有排他闩和共享闩。
+    """
+
+    HEADER = struct.Struct('<HQ')
+    SLOT = struct.Struct('<HH')
+
+    def __init__(self, page_no: int, page_size: int):
+        self.page_no = page_no
+        self.page_size = page_size
+        self.rows: List[Optional[Tuple[Any, ...]]] = []
+        self.sizes: List[int] = []
+        self.used = self.HEADER.size
+        self.holes = 0
+        self.lsn = 0
+        self.dirty = False
+        # 槽 -> {列位置: (偏移, 长度)}，已经写到溢出文件的值，行不变时再次写回复用这些位置
+        self.external: Dict[int, Dict[int, Tuple[int, int]]] = {}
+        self.latch = RWLatch()
+
+    @classmethod
+    def max_row_size(cls, page_size: int) -> int:
+        """单行允许的最大字节数"""
+        return page_size - cls.HEADER.size - cls.SLOT.size
+
+    def free_space(self) -> int:
+        """剩余可用字节数"""
+        return self.page_size - self.used
+
+    def live_count(self) -> int:
+        """页内有效行数"""
+        return len(self.rows) - self.holes
+
+    def _free_slot(self, blocked: Optional[Callable[[int], bool]] = None) -> int:
+        """查找可复用的空槽，没有则返回-1；blocked(槽号) 为 True 的空槽暂时不能复用"""
+        if self.holes:
+            for slot, row in enumerate(self.rows):
+                if row is None and (blocked is None or not blocked(slot)):
+                    return slot
+        return -1
+
+    def can_insert(self, size: int, blocked: Optional[Callable[[int], bool]] = None) -> bool:
+        """判断能否放下一条指定大小的行"""
+        if self.holes and (blocked is None or self._free_slot(blocked) != -1):
+            return size <= self.free_space()
+        return len(self.rows) < SLOT_MASK and size + self.SLOT.size <= self.free_space()
+
+    def next_slot(self, blocked: Optional[Callable[[int], bool]] = None) -> int:
+        """下一次插入将使用的槽号"""
+        slot = self._free_slot(blocked)
+        return len(self.rows) if slot == -1 else slot
+
+    def insert(self, row: Tuple[Any, ...], size: int, blocked: Optional[Callable[[int], bool]] = None) -> int:
+        """插入一行，返回槽号"""
+        slot = self.next_slot(blocked)
+        self.put(slot, row, size)
+        return slot
+
+    def fill(self, rows: List[Tuple[Any, ...]], sizes: List[int], start: int) -> int:
+        """从 rows[start] 起依次把行追加到新槽，直到页放不下为止，返回第一条没有放入的行的下标
+
+        只用于没有空槽的页，批量插入时代替逐行 insert。
+        """
+        free = self.page_size - self.used
+        slot_size = self.SLOT.size
+        count = len(self.rows)
+        end = start
+        while end < len(rows) and count < SLOT_MASK and sizes[end] + slot_size <= free:
+            free -= sizes[end] + slot_size
+            count += 1
+            end += 1
+        if end > start:
+            self.rows.extend(rows[start:end])
+            self.sizes.extend(sizes[start:end])
+            self.used = self.page_size - free
+            self.dirty = True
+        return end
+
+    def put(self, slot: int, row: Optional[Tuple[Any, ...]], size: int = 0) -> None:
+        """把指定槽设置为给定行（None表示删除）"""
+        while slot >= len(self.rows):
+            self.rows.append(None)
+            self.sizes.append(0)
+            self.used += self.SLOT.size
+            self.holes += 1
+        if row is None:
+            size = 0
+        if self.external:
+            self.external.pop(slot, None)
+        self.holes += (row is None) - (self.rows[slot] is None)
+        self.used += size - self.sizes[slot]
+        self.rows[slot] = row
+        self.sizes[slot] = size
+        self.dirty = True
+
+    def trim(self, blocked: Optional[Callable[[int], bool]] = None) -> int:
+        """去掉页尾连续的空槽，返回去掉的槽数；blocked(槽号) 为 True 的空槽及其之前的槽保留"""
+        rows = self.rows
+        count = 0
+        while rows and rows[-1] is None and (blocked is None or not blocked(len(rows) - 1)):
+            rows.pop()
+            self.sizes.pop()
+            self.external.pop(len(rows), None)
+            self.holes -= 1
+            self.used -= self.SLOT.size
+            count += 1
+        if count:
+            self.dirty = True
+        return count
+
+    def fits_update(self, slot: int, size: int) -> bool:
+        """判断原地更新后是否还能放得下"""
+        return self.used - self.sizes[slot] + size <= self.page_size
+
+    def to_bytes(self, overflow=None) -> bytes:
+        """把页编码为固定大小的字节串，放不进页的行中的大值写到 overflow"""
+        directory = []
+        records = []
+        offset = self.HEADER.size + self.SLOT.size * len(self.rows)
+        limit = self.max_row_size(self.page_size)
+        for slot, row in enumerate(self.rows):
+            if row is None:
+                directory.append(self.SLOT.pack(0, 0))
+                continue
+            record = encode_row(row)
+            if len(record) > limit:
+                record = self._encode_external(slot, row, limit, overflow)
+            directory.append(self.SLOT.pack(offset, len(record)))
+            records.append(record)
+            offset += len(record)
+        if offset > self.page_size:
+            raise StorageError(f"页 {self.page_no} 溢出: {offset} > {self.page_size}")
+        data = self.HEADER.pack(len(self.rows), self.lsn) + b''.join(directory) + b''.join(records)
+        return data + bytes(self.page_size - len(data))
+
+    def _encode_external(self, slot: int, row: Tuple[Any, ...], limit: int, overflow) -> bytes:
+        """编码放不进页的行：大值写到溢出文件，页内只写位置；这一行上次写回时写出的值不再重复写入
+
+        写回时调用者持有页的共享闩，external 只在写回时修改，页的检查点写回和置换不会同时进行。
+        """
+        if overflow is None:
+            raise StorageError(f"页 {self.page_no} 中有放不进页的行，但没有提供溢出文件")
+        positions = set(overflow_columns(row, limit)[0])
+        pointers = self.external.get(slot, {})
+        parts = []
+        for position, value in enumerate(row):
+            data = encode_row((value,))
+            if position in positions:
+                pointer = pointers.get(position)
+                if pointer is None:
+                    pointer = pointers[position] = (overflow.put(data), len(data))
+                data = _TAGGED_POINTER.pack(_TAG_OVERFLOW, *pointer)
+            parts.append(data)
+        self.external[slot] = pointers
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, page_no: int, page_size: int, data: bytes, overflow=None) -> "Page":
+        """从字节串解码一个页，页外值从 overflow 读取"""
+        page = cls(page_no, page_size)
+        slot_count, page.lsn = cls.HEADER.unpack_from(data, 0)
+        position = cls.HEADER.size
+        pointers: Dict[int, Tuple[int, int]] = {}
+        for slot in range(slot_count):
+            offset, length = cls.SLOT.unpack_from(data, position)
+            position += cls.SLOT.size
+            if length == 0:
+                page.rows.append(None)
+                page.sizes.append(0)
+                page.holes += 1
+            else:
+                page.rows.append(decode_row(data, offset, offset + length, overflow, pointers))
+                page.sizes.append(length)
+                if pointers:
+                    page.external[slot] = pointers
+                    pointers = {}
+            page.used += cls.SLOT.size + length
+        return page
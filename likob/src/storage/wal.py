@@ -0,0 +1,171 @@
+import json
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+
+class WriteAheadLog:
+    """只追加的预写日志
+
+    每条记录格式: 长度(4字节) | CRC32(4字节) | JSON 内容，内容中带有单调递增的 LSN。
+    记录先追加到内存缓冲区，提交时由一个线程把缓冲区一次性写入并 fsync，
+    同时等待的其他提交共享这一次 fsync（组提交）。
+    """
+
+    HEADER = struct.Struct('<II')
+
+    def __init__(self, path: str, sync: bool = True, group_commit_delay: float = 0.0, start_lsn: int = 1):
+        self.path = path
+        self.sync = sync
+        self.group_commit_delay = group_commit_delay
+        self._cond = threading.Condition()
+        self._buffer: List[bytes] = []
+        self._flushing = False
+
+        # 找到最后一条完整记录，截掉崩溃时写了一半的尾部
+        last_lsn, valid_end = 0, 0
+        if os.path.exists(path):
+            for lsn, _, end in self._read(path):
+                last_lsn, valid_end = lsn, end
+        self.file = open(path, 'ab')
+        if self.file.tell() != valid_end:
+            self.file.truncate(valid_end)
+        self.next_lsn = max(start_lsn, last_lsn + 1)
+        self.flushed_lsn = self.next_lsn - 1
+        self.size = valid_end
+        self.commits = 0
+        self.syncs = 0
+
+    @classmethod
+    def _read(cls, path: str) -> Iterator[Tuple[int, Dict[str, Any], int]]:
+        """读取日志文件中的完整记录，产生 (LSN, 记录, 记录结束偏移)"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + cls.HEADER.size <= len(data):
+            length, crc = cls.HEADER.unpack_from(data, offset)
+            start = offset + cls.HEADER.size
+            payload = data[start:start + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                break
+            record = json.loads(payload.decode('utf-8'))
+            offset = start + length
+            yield record['lsn'], record, offset
+
+    def records(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """按顺序读取已写入磁盘的所有记录"""
+        self.flush()
+        for lsn, record, _ in self._read(self.path):
+            yield lsn, record
+
+    def append(self, record: Dict[str, Any]) -> int:
+        """追加一条记录到缓冲区，返回它的 LSN"""
+        with self._cond:
+            lsn = self.next_lsn
+            self.next_lsn += 1
+            record['lsn'] = lsn
+            payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+            self._buffer.append(self.HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            return lsn
+
+    def flush(self, lsn: int = None) -> None:
+        """保证 LSN 及之前的记录已写入磁盘
+
+        同一时刻只有一个线程负责写盘，其他线程等待它完成，一次 fsync 覆盖所有等待者。
+        """
+        with self._cond:
+            target = self.next_lsn - 1 if lsn is None else lsn
+            while self.flushed_lsn < target:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flushing = True
+                if self.group_commit_delay > 0:
+                    # 稍等片刻，让更多并发提交加入这一组
+                    self._cond.wait(self.group_commit_delay)
+                data = b''.join(self._buffer)
+                self._buffer.clear()
+                upto = self.next_lsn - 1
+                self._cond.release()
+                try:
+                    self.file.write(data)
+                    self.file.flush()
+                    if self.sync:
+                        os.fsync(self.file.fileno())
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                self.size += len(data)
+                self.flushed_lsn = upto
+                self.syncs += 1
+                self._cond.notify_all()
+
+    def commit(self, txid: int) -> int:
+        """写入提交记录并等待它持久化"""
+        lsn = self.append({'type': 'COMMIT', 'txid': txid})
+        self.flush(lsn)
+        with self._cond:
+            self.commits += 1
+        return lsn
+
+    def abort(self, txid: int) -> int:
+        """写入回滚记录（回滚的修改已作为补偿记录写入日志）"""
+        return self.append({'type': 'ABORT', 'txid': txid})
+
+    def truncate(self, keep_lsn: Optional[int] = None) -> None:
+        """删除 keep_lsn 之前的记录（检查点之后调用），keep_lsn 为 None 时清空日志，LSN 继续递增
+
+        保留的记录先写入临时文件再替换日志文件，替换之前崩溃时旧日志仍然完整。
+        """
+        self.flush()
+        with self._cond:
+            # 持有条件变量期间其他线程不能写盘，缓冲区中新追加的记录留到下次写盘
+            while self._flushing:
+                self._cond.wait()
+            if keep_lsn is None or keep_lsn > self.flushed_lsn:
+                self.file.truncate(0)
+                self.file.flush()
+                if self.sync:
+                    os.fsync(self.file.fileno())
+                self.size = 0
+                return
+            self.file.flush()
+            # 第一条要保留的记录的起始偏移
+            start = 0
+            for lsn, _, end in self._read(self.path):
+                if lsn >= keep_lsn:
+                    break
+                start = end
+            with open(self.path, 'rb') as src:
+                src.seek(start)
+                data = src.read(self.size - start)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+                f.flush()
+                if self.sync:
+                    os.fsync(f.fileno())
+            self.file.close()
+            os.replace(tmp, self.path)
+            self.file = open(self.path, 'ab')
+            self.size = len(data)
+
+    def stats(self) -> Dict[str, Any]:
+        """提交次数和 fsync 次数"""
+        with self._cond:
+            return {
+                'next_lsn': self.next_lsn,
+                'flushed_lsn': self.flushed_lsn,
+                'size': self.size,
+                'commits': self.commits,
+                'syncs': self.syncs,
+                'commits_per_sync': self.commits / self.syncs if self.syncs else 0.0,
+            }
+
+    def close(self) -> None:
+        """写盘并关闭"""
+        self.flush()
+        if not self.file.closed:
+            self.file.close()
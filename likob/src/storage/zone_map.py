@@ -0,0 +1,117 @@
+import operator
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 比较函数 -> 区内的值在 [lo, hi] 中时是否可能有值满足条件
+_MAY_MATCH: Dict[Callable[[Any, Any], bool], Callable[[Any, Any, Any], bool]] = {
+    operator.eq: lambda lo, hi, value: lo <= value <= hi,
+    operator.ne: lambda lo, hi, value: not (lo == value and hi == value),
+    operator.gt: lambda lo, hi, value: hi > value,
+    operator.ge: lambda lo, hi, value: hi >= value,
+    operator.lt: lambda lo, hi, value: lo < value,
+    operator.le: lambda lo, hi, value: lo <= value,
+}
+
+# 一个区中一列的统计: [最小值, 最大值, 空值个数]，没有非空值时最小值和最大值为 None；
+# 整个统计为 None 表示这一列的值不能互相比较，不用于跳过
+ColumnZone = Optional[List[Any]]
+
+
+def _column_zone(values: Iterable[Any]) -> ColumnZone:
+    present = []
+    nulls = 0
+    for value in values:
+        if value is None:
+            nulls += 1
+        else:
+            present.append(value)
+    if not present:
+        return [None, None, nulls]
+    try:
+        return [min(present), max(present), nulls]
+    except TypeError:
+        return None
+
+
+class ZoneMap:
+    """每个区（行存储的一页、列存储的一块）每列的最小值、最大值和空值个数，扫描时跳过不可能满足条件的区
+
+    统计只在写入时放宽（插入和更新写入的新值、回滚恢复的旧值），删除和更新不会收窄范围，
+    所以区内存储中和版本链上的值总在范围内，被跳过的区对任何快照都没有满足条件的行。
+    区的一列在扫描第一次读到该区、条件用到这一列时才由存储计算（调用者持有该区的闩或锁），
+    还没有计算的列不用于跳过；清理、清空和压缩后丢弃全部统计，之后的扫描重新计算为精确的范围。
+    """
+
+    def __init__(self):
+        # 区 -> {列位置: 统计}
+        self.zones: Dict[int, Dict[int, ColumnZone]] = {}
+
+    def missing(self, zone: int, positions: Iterable[int]) -> List[int]:
+        """区中还没有统计的列"""
+        stats = self.zones.get(zone)
+        if stats is None:
+            return list(positions)
+        return [position for position in positions if position not in stats]
+
+    def compute(self, zone: int, columns: Dict[int, Sequence[Any]]) -> None:
+        """由区内这些列的全部值（包括版本链上的旧版本）计算统计，调用者持有区的闩或锁"""
+        stats = self.zones.setdefault(zone, {})
+        for position, values in columns.items():
+            stats[position] = _column_zone(values)
+
+    def note(self, zone: int, row: Tuple[Any, ...]) -> None:
+        """写入一行时放宽区中已有统计的列，区还没有统计时忽略"""
+        stats = self.zones.get(zone)
+        if not stats:
+            return
+        for position, entry in list(stats.items()):
+            if entry is None:
+                continue
+            value = row[position]
+            if value is None:
+                entry[2] += 1
+                continue
+            lo = entry[0]
+            if lo is None:
+                entry[0] = entry[1] = value
+                continue
+            try:
+                if value < lo:
+                    entry[0] = value
+                elif value > entry[1]:
+                    entry[1] = value
+            except TypeError:
+                stats[position] = None
+
+    def note_many(self, zone: int, rows: Iterable[Tuple[Any, ...]]) -> None:
+        if self.zones.get(zone):
+            for row in rows:
+                self.note(zone, row)
+
+    def may_match(self, zone: int, predicates: List[Tuple[int, Callable[[Any, Any], bool], Any]]) -> bool:
+        """区中是否可能有行满足所有 (列位置, 比较函数, 值) 条件，没有统计的列不排除任何区"""
+        stats = self.zones.get(zone)
+        if not stats:
+            return True
+        for position, op, value in predicates:
+            test = _MAY_MATCH.get(op)
+            if test is None or value is None or position not in stats:
+                continue
+            entry = stats[position]
+            if entry is None:
+                continue
+            lo, hi, nulls = entry
+            if nulls and op is not operator.eq:
+                # NULL 与值比较时 != 为真、大小比较出错，有 NULL 的区交给逐行检查
+                continue
+            if lo is None:
+                # 区中没有行，或这一列全是 NULL
+                return False
+            try:
+                if not test(lo, hi, value):
+                    return False
+            except TypeError:
+                continue
+        return True
+
+    def clear(self) -> None:
+        self.zones = {}
@@ -8,7 +8,23 @@ class DBConfig:
     """数据库配置类"""
     data_directory: str = "data"
     page_size: int = 4096
-    cache_size: int = 1000
+    cache_size: int = 1000          # 缓冲池最多驻留的页数
+    buffer_policy: str = "clock"    # 页置换策略: clock 或 lru-k
+    wal_sync: bool = True           # 提交时是否 fsync 预写日志
+    group_commit_delay: float = 0.0 # 组提交时等待更多提交加入的秒数
+    wal_max_size: int = 16 * 1024 * 1024  # 日志超过该字节数时自动做检查点
+    checkpoint_interval: float = 300.0  # 后台检查点线程的间隔秒数，0 表示只在日志过大、执行 CHECKPOINT 和关闭时做检查点
+    hash_agg_max_groups: int = 100000  # 哈希聚合在内存中最多保存的分组数，超过时按分区写入临时文件
+    sort_memory_rows: int = 100000  # 排序在内存中最多保存的行数，超过时排好序的段写入临时文件
+    vectorized: bool = True         # 是否允许按列批量执行扫描和聚合
+    statement_cache_size: int = 256 # 按规范化语句文本缓存的解析树个数
+    result_cache_size: int = 0      # 缓存的 SELECT 结果个数，0 表示不启用结果缓存
+    result_cache_bytes: int = 64 * 1024 * 1024  # 缓存的结果最多占用的字节数（估算）
+    dump_compression: str = "zlib"  # SAVE 导出文件的块压缩方式: none、zlib 或 lzma
+    isolation_level: str = "READ COMMITTED"  # 事务的默认隔离级别
+    autovacuum_interval: float = 60.0  # 后台清理线程检查各表的间隔秒数，0 表示不启动
+    lock_timeout: float = 30.0      # 等待行锁的最长秒数，0 表示一直等待（死锁仍会被检测）
+    parallel_workers: int = 0       # 并行扫描和聚合使用的工作进程数，0 或 1 表示不并行
     log_level: str = "INFO"
     
     @classmethod
@@ -0,0 +1,377 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from likob import SimpleDB
+from likob.src.core.exceptions import DeadlockError, SerializationError
+from likob.src.core.table import BULK_INSERT_BATCH
+from likob.src.utils.config import DBConfig
+
+
+def run_in_thread(function):
+    """在另一个线程中执行，返回 (线程, 结果)；结果为返回值或抛出的异常"""
+    result = {}
+
+    def target():
+        try:
+            result['value'] = function()
+        except Exception as e:
+            result['value'] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread, result
+
+
+class TestUniqueConstraints(unittest.TestCase):
+
+    def setUp(self):
+        self.db = SimpleDB()
+        self.db.execute("CREATE TABLE t (id INT PRIMARY KEY, v TEXT)")
+        self.a = self.db.connect()
+        self.b = self.db.connect()
+
+    def test_insert_waits_for_uncommitted_key_and_succeeds_after_rollback(self):
+        self.a.execute("BEGIN")
+        self.a.execute("INSERT INTO t VALUES (1, 'a')")
+        thread, result = run_in_thread(lambda: self.b.execute("INSERT INTO t VALUES (1, 'b')"))
+        time.sleep(0.2)
+        self.assertTrue(thread.is_alive())
+        self.a.execute("ROLLBACK")
+        thread.join(5)
+        self.assertNotIsInstance(result['value'], Exception)
+        self.assertEqual(self.db.execute("SELECT * FROM t"), [{'id': 1, 'v': 'b'}])
+
+    def test_insert_fails_after_other_transaction_commits_key(self):
+        self.a.execute("BEGIN")
+        self.a.execute("INSERT INTO t VALUES (1, 'a')")
+        thread, result = run_in_thread(lambda: self.b.execute("INSERT INTO t VALUES (1, 'b')"))
+        time.sleep(0.2)
+        self.a.execute("COMMIT")
+        thread.join(5)
+        self.assertIn('违反唯一约束', str(result['value']))
+
+
+class TestTransactions(unittest.TestCase):
+
+    def setUp(self):
+        self.db = SimpleDB(config=DBConfig(lock_timeout=5.0))
+        self.db.execute("CREATE TABLE t (id INT PRIMARY KEY, v INT)")
+        self.db.execute("INSERT INTO t VALUES (1, 10), (2, 20)")
+        self.a = self.db.connect()
+        self.b = self.db.connect()
+
+    def value(self, session, key):
+        return session.execute("SELECT v FROM t WHERE id = %d" % key)[0]['v']
+
+    def test_uncommitted_changes_are_invisible(self):
+        self.a.execute("BEGIN")
+        self.a.execute("UPDATE t SET v = 11 WHERE id = 1")
+        self.a.execute("INSERT INTO t VALUES (3, 30)")
+        self.assertEqual(self.value(self.a, 1), 11)
+        self.assertEqual(self.value(self.b, 1), 10)
+        self.assertEqual(self.b.execute("SELECT COUNT(*) AS c FROM t"), [{'c': 2}])
+        self.a.execute("COMMIT")
+        self.assertEqual(self.value(self.b, 1), 11)
+        self.assertEqual(self.b.execute("SELECT COUNT(*) AS c FROM t"), [{'c': 3}])
+
+    def test_repeatable_read_keeps_snapshot(self):
+        self.a.execute("BEGIN ISOLATION LEVEL REPEATABLE READ")
+        self.assertEqual(self.value(self.a, 1), 10)
+        self.b.execute("UPDATE t SET v = 11 WHERE id = 1")
+        self.b.execute("DELETE FROM t WHERE id = 2")
+        self.assertEqual(self.value(self.a, 1), 10)
+        self.assertEqual(self.a.execute("SELECT COUNT(*) AS c FROM t"), [{'c': 2}])
+        self.a.execute("COMMIT")
+        self.assertEqual(self.value(self.a, 1), 11)
+
+    def test_read_committed_sees_new_commits(self):
+        self.a.execute("BEGIN")
+        self.assertEqual(self.value(self.a, 1), 10)
+        self.b.execute("UPDATE t SET v = 11 WHERE id = 1")
+        self.assertEqual(self.value(self.a, 1), 11)
+        self.a.execute("COMMIT")
+
+    def test_write_write_conflict_under_repeatable_read(self):
+        self.a.execute("BEGIN ISOLATION LEVEL REPEATABLE READ")
+        self.assertEqual(self.value(self.a, 1), 10)
+        self.b.execute("UPDATE t SET v = 11 WHERE id = 1")
+        with self.assertRaises(SerializationError):
+            self.a.execute("UPDATE t SET v = 12 WHERE id = 1")
+        self.a.execute("ROLLBACK")
+        self.assertEqual(self.value(self.b, 1), 11)
+
+    def test_read_committed_writer_waits_and_rechecks_condition(self):
+        self.a.execute("BEGIN")
+        self.a.execute("UPDATE t SET v = 11 WHERE id = 1")
+        thread, result = run_in_thread(lambda: self.b.execute("UPDATE t SET v = 12 WHERE v = 10"))
+        time.sleep(0.2)
+        self.assertTrue(thread.is_alive())
+        self.a.execute("COMMIT")
+        thread.join(5)
+        self.assertNotIsInstance(result['value'], Exception)
+        # 等到锁之后读取最新提交的版本，它已不满足 WHERE 条件
+        self.assertEqual(self.value(self.a, 1), 11)
+
+    def test_deadlock_is_detected(self):
+        self.a.execute("BEGIN")
+        self.b.execute("BEGIN")
+        self.a.execute("UPDATE t SET v = 0 WHERE id = 1")
+        self.b.execute("UPDATE t SET v = 0 WHERE id = 2")
+        thread, result = run_in_thread(lambda: self.a.execute("UPDATE t SET v = 1 WHERE id = 2"))
+        time.sleep(0.2)
+        try:
+            self.b.execute("UPDATE t SET v = 1 WHERE id = 1")
+            outcome = None
+        except DeadlockError as e:
+            outcome = e
+            self.b.execute("ROLLBACK")
+        thread.join(5)
+        if isinstance(result['value'], DeadlockError):
+            self.a.execute("ROLLBACK")
+            self.b.execute("COMMIT")
+        else:
+            self.a.execute("COMMIT")
+        # 恰好一个事务被选为牺牲者，另一个完成
+        self.assertEqual([isinstance(outcome, DeadlockError), isinstance(result['value'], DeadlockError)].count(True), 1)
+        self.assertEqual(self.db.lock_stats()['deadlocks'], 1)
+        self.assertEqual(self.db.execute("SELECT COUNT(*) AS c FROM t WHERE v = 1"), [{'c': 1}])
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.db = SimpleDB(config=DBConfig(result_cache_size=16))
+        self.db.execute("CREATE TABLE t (id INT, v INT)")
+        self.db.execute("CREATE TABLE u (id INT)")
+        self.db.execute("INSERT INTO t VALUES (1, 10), (2, 20)")
+        self.db.execute("INSERT INTO u VALUES (1)")
+
+    def test_repeated_query_hits(self):
+        query = "SELECT SUM(v) AS s FROM t"
+        self.assertEqual(self.db.execute(query), [{'s': 30}])
+        self.assertEqual(self.db.execute(query), [{'s': 30}])
+        stats = self.db.result_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_write_invalidates_only_results_of_that_table(self):
+        self.db.execute("SELECT SUM(v) AS s FROM t")
+        self.db.execute("SELECT COUNT(*) AS c FROM u")
+        self.db.execute("UPDATE t SET v = 0 WHERE id = 1")
+        self.assertEqual(self.db.execute("SELECT SUM(v) AS s FROM t"), [{'s': 20}])
+        self.assertEqual(self.db.execute("SELECT COUNT(*) AS c FROM u"), [{'c': 1}])
+        stats = self.db.result_cache_stats()
+        self.assertEqual((stats['hits'], stats['invalidations']), (1, 1))
+
+    def test_commit_invalidates_results(self):
+        session = self.db.connect()
+        self.assertEqual(session.execute("SELECT COUNT(*) AS c FROM t"), [{'c': 2}])
+        writer = self.db.connect()
+        writer.execute("BEGIN")
+        writer.execute("INSERT INTO t VALUES (3, 30)")
+        self.assertEqual(session.execute("SELECT COUNT(*) AS c FROM t"), [{'c': 2}])
+        writer.execute("COMMIT")
+        self.assertEqual(session.execute("SELECT COUNT(*) AS c FROM t"), [{'c': 3}])
+
+    def test_explicit_transaction_bypasses_cache(self):
+        session = self.db.connect()
+        session.execute("BEGIN")
+        session.execute("INSERT INTO t VALUES (3, 30)")
+        self.assertEqual(session.execute("SELECT COUNT(*) AS c FROM t"), [{'c': 3}])
+        self.assertEqual(self.db.execute("SELECT COUNT(*) AS c FROM t"), [{'c': 2}])
+        session.execute("ROLLBACK")
+        self.assertEqual(self.db.execute("SELECT COUNT(*) AS c FROM t"), [{'c': 2}])
+
+
+class TestNullValues(unittest.TestCase):
+
+    def setUp(self):
+        self.db = SimpleDB()
+        self.db.execute("CREATE TABLE t (id INT, v FLOAT NOT NULL, s TEXT)")
+
+    def test_null_literal_is_rejected(self):
+        with self.assertRaisesRegex(Exception, 'NULL'):
+            self.db.execute("INSERT INTO t VALUES (1, NULL, 'a')")
+
+    def test_none_is_rejected_with_the_column_name(self):
+        with self.assertRaisesRegex(Exception, '列 v 不能为 NULL'):
+            self.db.insert_many('t', [(1, 2.0, 'a'), (2, None, 'b')])
+        with self.assertRaisesRegex(Exception, '列 s .*NULL'):
+            self.db.insert_many('t', [(1, 2.0, None)])
+        with self.assertRaisesRegex(Exception, '列 s .*NULL'):
+            self.db.prepare("INSERT INTO t VALUES (?, ?, ?)").execute([1, 1.0, None])
+        self.assertEqual(self.db.execute("SELECT * FROM t"), [])
+
+    def test_unconvertible_value_is_reported(self):
+        with self.assertRaisesRegex(Exception, '不能转换为 FLOAT'):
+            self.db.insert_many('t', [(1, [1], 'x')])
+
+
+
+class TestCursor(unittest.TestCase):
+    """游标逐行产生 SELECT 的结果，只读取已经取走的行所在的页"""
+
+    ROWS = 20000
+
+    def open(self, vectorized: bool = False) -> SimpleDB:
+        db = SimpleDB(config=DBConfig(autovacuum_interval=0, vectorized=vectorized))
+        self.addCleanup(db.close)
+        db.execute("CREATE TABLE t (id INT, v TEXT)")
+        db.insert_many('t', [(i, 'v%d' % i) for i in range(self.ROWS)])
+        # 先收集统计，规划时抽样读取的页不计入扫描读取的页
+        db.execute("ANALYZE t")
+        return db
+
+    def page_requests(self, db: SimpleDB) -> int:
+        stats = db.buffer_pool_stats()
+        return stats['hits'] + stats['misses']
+
+    def test_fetch_methods(self):
+        db = self.open()
+        cursor = db.cursor().execute("SELECT id, v FROM t WHERE id < 300")
+        self.assertEqual(cursor.columns, ['id', 'v'])
+        self.assertEqual(cursor.fetchone(), {'id': 0, 'v': 'v0'})
+        self.assertEqual([row['id'] for row in cursor.fetchmany(3)], [1, 2, 3])
+        self.assertEqual(len(cursor.fetchmany()), cursor.arraysize)
+        self.assertEqual(cursor.fetchmany(0), [])
+        self.assertEqual([row['id'] for _, row in zip(range(5), cursor)], list(range(104, 109)))
+        # 迭代与 fetch 方法共用同一个结果流
+        self.assertEqual(cursor.fetchone()['id'], 109)
+        self.assertEqual([row['id'] for row in cursor.fetchall()], list(range(110, 300)))
+        self.assertIsNone(cursor.fetchone())
+        self.assertEqual(cursor.fetchmany(5), [])
+
+        cursor.execute("SELECT id FROM t WHERE id >= ? AND id < ?", (10, 13))
+        self.assertEqual([row['id'] for row in cursor], [10, 11, 12])
+        with db.cursor() as cursor:
+            cursor.execute("SELECT id FROM t")
+            cursor.fetchone()
+        self.assertIsNone(cursor.fetchone())
+        self.assertEqual(db.buffer_pool_stats()['pinned'], 0)
+
+    def test_cursor_reads_only_needed_pages(self):
+        for vectorized in (False, True):
+            with self.subTest(vectorized=vectorized):
+                db = self.open(vectorized)
+                pages = db.get_table('t').heap.num_pages
+                cursor = db.cursor().execute("SELECT id, v FROM t")
+                before = self.page_requests(db)
+                cursor.fetchone()
+                cursor.fetchmany(10)
+                self.assertLessEqual(self.page_requests(db) - before, 2)
+                cursor.close()
+                before = self.page_requests(db)
+                self.assertEqual(len(db.cursor().execute("SELECT id, v FROM t").fetchall()), self.ROWS)
+                self.assertGreaterEqual(self.page_requests(db) - before, pages)
+
+    def test_limit_stops_scan(self):
+        for vectorized in (False, True):
+            with self.subTest(vectorized=vectorized):
+                db = self.open(vectorized)
+                for sql, expected in (("SELECT id FROM t LIMIT 3", [0, 1, 2]),
+                                      ("SELECT id FROM t LIMIT 2 OFFSET 5", [5, 6]),
+                                      ("SELECT id FROM t WHERE id > 100 LIMIT 3", [101, 102, 103]),
+                                      ("SELECT id FROM t LIMIT 0", [])):
+                    before = self.page_requests(db)
+                    self.assertEqual([row['id'] for row in db.execute(sql)], expected)
+                    self.assertLessEqual(self.page_requests(db) - before, 2, sql)
+
+                plan = [row['QUERY PLAN'] for row in db.execute("EXPLAIN ANALYZE SELECT id FROM t LIMIT 2 OFFSET 5")]
+                self.assertIn('actual rows=2 ', plan[0])
+                self.assertIn('actual rows=7 ', plan[1])
+
+
+
+class TestBulkInsert(unittest.TestCase):
+    """多行 INSERT、insert_many 和 COPY 在一个事务中写入，中途失败时一行也不留下"""
+
+    LAYOUTS = ('', ' USING COLUMNAR')
+
+    def open(self, layout: str) -> SimpleDB:
+        db = SimpleDB(config=DBConfig(autovacuum_interval=0))
+        self.addCleanup(db.close)
+        db.execute(f"CREATE TABLE t (id INT PRIMARY KEY, v TEXT, x FLOAT){layout}")
+        db.execute("CREATE INDEX idx_x ON t (x)")
+        db.execute("INSERT INTO t VALUES (1, 'a', 1.5), (2, 'b', 2)")
+        return db
+
+    def csv_file(self, text: str) -> str:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        filename = os.path.join(directory.name, 'rows.csv')
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return filename
+
+    def assertUnchanged(self, db: SimpleDB):
+        self.assertEqual(db.execute("SELECT * FROM t"), [{'id': 1, 'v': 'a', 'x': 1.5}, {'id': 2, 'v': 'b', 'x': 2.0}])
+        # 失败批次的键也没有留在索引中
+        self.assertEqual(db.execute("SELECT id FROM t WHERE x = 7.0"), [])
+        db.execute("INSERT INTO t VALUES (3, 'c', 7.0)")
+        self.assertEqual(db.execute("SELECT id FROM t WHERE x = 7.0"), [{'id': 3}])
+        db.execute("DELETE FROM t WHERE id = 3")
+
+    def test_multi_row_insert(self):
+        for layout in self.LAYOUTS:
+            with self.subTest(layout=layout):
+                db = self.open(layout)
+                self.assertEqual(db.execute("INSERT INTO t VALUES (3, 'c', 3.5), (4, 'd', 4)"),
+                                 [{'message': '2 rows inserted'}])
+                self.assertEqual(db.execute("SELECT id, x FROM t WHERE id >= 3"), [{'id': 3, 'x': 3.5}, {'id': 4, 'x': 4.0}])
+                db.execute("DELETE FROM t WHERE id >= 3")
+                for sql in ("INSERT INTO t VALUES (5, 'e', 7.0), (1, 'dup', 7.0)",
+                            "INSERT INTO t VALUES (5, 'e', 7.0), (6, 'f', 7.0), (5, 'dup', 7.0)",
+                            "INSERT INTO t VALUES (5, 'e', 7.0), (6, 'f', 'x')",
+                            "INSERT INTO t VALUES (5, 'e', 7.0), (6, 'f')"):
+                    with self.assertRaises(Exception):
+                        db.execute(sql)
+                    self.assertUnchanged(db)
+
+    def test_insert_many_fails_in_a_later_batch(self):
+        rows = [(10 + i, 'n', 7.0) for i in range(2 * BULK_INSERT_BATCH + 5)]
+        for layout in self.LAYOUTS:
+            with self.subTest(layout=layout):
+                db = self.open(layout)
+                # 前两批已经写入存储之后第三批违反约束
+                with self.assertRaisesRegex(Exception, '违反唯一约束'):
+                    db.insert_many('t', rows + [(2, 'dup', 7.0)])
+                self.assertUnchanged(db)
+                with self.assertRaisesRegex(Exception, '不能转换为 FLOAT'):
+                    db.insert_many('t', rows + [(5, 'e', 'x')])
+                self.assertUnchanged(db)
+
+                self.assertEqual(db.insert_many('t', iter(rows)), len(rows))
+                self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM t"), [{'c': len(rows) + 2}])
+                self.assertEqual(db.execute(f"SELECT v FROM t WHERE id = {BULK_INSERT_BATCH + 20}"), [{'v': 'n'}])
+
+    def test_copy_with_options(self):
+        for layout in self.LAYOUTS:
+            with self.subTest(layout=layout):
+                db = self.open(layout)
+                filename = self.csv_file('id;v;x\n10;hello, world;1.5\n11;"q;x";2\n\n12;;3\n')
+                self.assertEqual(db.execute(f"COPY t FROM '{filename}' WITH CSV HEADER DELIMITER ';'"),
+                                 [{'message': '3 rows copied'}])
+                self.assertEqual(db.execute("SELECT * FROM t WHERE id >= 10"),
+                                 [{'id': 10, 'v': 'hello, world', 'x': 1.5}, {'id': 11, 'v': 'q;x', 'x': 2.0},
+                                  {'id': 12, 'v': '', 'x': 3.0}])
+                db.execute("DELETE FROM t WHERE id >= 10")
+
+                filename = self.csv_file('20,a,7\n21,b,7\n1,dup,7\n')
+                with self.assertRaisesRegex(Exception, '违反唯一约束'):
+                    db.execute(f"COPY t FROM '{filename}' CSV")
+                self.assertUnchanged(db)
+                with self.assertRaises(Exception):
+                    db.execute(f"COPY t FROM '{filename}' WITH CSV QUOTE")
+
+                session = db.connect()
+                session.execute("BEGIN")
+                session.execute(f"COPY t FROM '{self.csv_file('30,a,7')}'")
+                self.assertEqual(db.execute("SELECT id FROM t WHERE id = 30"), [])
+                session.execute("ROLLBACK")
+                self.assertUnchanged(db)
+
+
+if __name__ == '__main__':
+    unittest.main()
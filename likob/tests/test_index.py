@@ -0,0 +1,241 @@
+import random
+import unittest
+
+from likob import SimpleDB
+from likob.src.core.index import BTreeIndex, _Leaf
+from likob.src.utils.config import DBConfig
+
+OPERATORS = ('=', '<', '<=', '>', '>=')
+# 测试表的行数，k 列是 0 到 ROWS - 1 的一个排列
+ROWS = 20000
+
+
+def brute_force(entries, start, end, include_start, include_end):
+    """按定义过滤 (键, 行ID)，作为索引范围查询的参照"""
+    result = {}
+    for key, rid in entries:
+        if start is not None and (key < start or (key == start and not include_start)):
+            continue
+        if end is not None and (key > end or (key == end and not include_end)):
+            continue
+        result.setdefault(key, set()).add(rid)
+    return sorted((key, tuple(sorted(rids))) for key, rids in result.items())
+
+
+def check_structure(test: unittest.TestCase, index: BTreeIndex) -> None:
+    """检查 B+ 树的结构：叶子深度相同，节点的键有序且不超过 order，分隔键与子树一致，叶子链表按顺序连接所有叶子"""
+    leaves, depths = [], set()
+
+    def walk(node, low, high, depth):
+        test.assertLessEqual(len(node.keys), index.order)
+        test.assertEqual(node.keys, sorted(set(node.keys)))
+        test.assertTrue(all((low is None or low <= key) and (high is None or key < high) for key in node.keys))
+        if isinstance(node, _Leaf):
+            test.assertEqual(len(node.values), len(node.keys))
+            test.assertTrue(all(node.values))
+            leaves.append(node)
+            depths.add(depth)
+            return
+        test.assertEqual(len(node.children), len(node.keys) + 1)
+        bounds = [low] + node.keys + [high]
+        for i, child in enumerate(node.children):
+            walk(child, bounds[i], bounds[i + 1], depth + 1)
+
+    walk(index.root, None, None, 0)
+    test.assertEqual(len(depths), 1)
+    chain, leaf = [], leaves[0]
+    while leaf is not None:
+        chain.append(leaf)
+        leaf = leaf.next
+    test.assertEqual([id(leaf) for leaf in chain], [id(leaf) for leaf in leaves])
+    test.assertEqual(len(index), sum(len(rids) for leaf in leaves for rids in leaf.values))
+
+
+class TestBTreeIndex(unittest.TestCase):
+
+    def check_ranges(self, index, entries):
+        keys = sorted({key for key, _ in entries})
+        bounds = [None, -1, 10 ** 6] + keys[::max(1, len(keys) // 15)] + [keys[0] + 0.5 if keys else 0]
+        for start in bounds:
+            for end in bounds:
+                for include_start in (True, False):
+                    for include_end in (True, False):
+                        items = [(key, tuple(sorted(rids)))
+                                 for key, rids in index.items(start, end, include_start, include_end)]
+                        self.assertEqual(items, brute_force(entries, start, end, include_start, include_end),
+                                         (start, end, include_start, include_end))
+
+    def test_range_scans_after_splits_and_removes(self):
+        rng = random.Random(4)
+        index = BTreeIndex('t', 'k', order=4)
+        entries = set()
+        for rid in range(2000):
+            key = rng.randrange(500)
+            index.add(key, rid)
+            entries.add((key, rid))
+        for key, rid in rng.sample(sorted(entries), 700):
+            index.remove(key, rid)
+            entries.discard((key, rid))
+        index.add(None, 9999)
+        self.assertEqual(len(index), len(entries))
+        check_structure(self, index)
+        self.check_ranges(index, entries)
+        self.assertEqual(index.find(None), set())
+        self.assertEqual(sorted(index.find_range(100, 102)),
+                         sorted(rid for _, rids in brute_force(entries, 100, 102, True, True) for rid in rids))
+
+    def test_bulk_load_matches_inserts(self):
+        rng = random.Random(5)
+        entries = [(rng.randrange(300), rid) for rid in range(3000)] + [(None, 3000)]
+        loaded = BTreeIndex('t', 'k', order=8)
+        loaded._load(entries)
+        inserted = BTreeIndex('t', 'k', order=8)
+        for key, rid in entries:
+            inserted.add(key, rid)
+        entries = entries[:-1]
+        self.assertEqual(len(loaded), len(entries))
+        self.assertEqual(list(loaded.items()), list(inserted.items()))
+        check_structure(self, loaded)
+        check_structure(self, inserted)
+        self.check_ranges(loaded, entries)
+
+    def test_scan_survives_concurrent_splits(self):
+        index = BTreeIndex('t', 'k', order=4)
+        for key in range(0, 200, 2):
+            index.add(key, key)
+        seen = []
+        for key, _ in index.items(10, 150):
+            seen.append(key)
+            if key == 20:
+                # 扫描中途插入使叶子分裂，扫描开始时就在索引中的键既不漏掉也不重复，按顺序产生
+                for odd in range(1, 200, 2):
+                    index.add(odd, odd)
+        self.assertEqual(seen, sorted(set(seen)))
+        self.assertTrue(set(range(10, 151, 2)) <= set(seen))
+        self.assertTrue(all(10 <= key <= 150 for key in seen))
+        self.assertGreater(len(seen), 71)
+
+
+class TestIndexScan(unittest.TestCase):
+    """WHERE 条件通过 B+ 树索引查找，结果与全表扫描相同"""
+
+    def open(self, layout: str) -> SimpleDB:
+        db = SimpleDB(config=DBConfig(autovacuum_interval=0))
+        self.addCleanup(db.close)
+        db.create_table('t', [('id', 'INT'), ('k', 'INT'), ('v', 'TEXT')], layout)
+        db.insert_many('t', [(i, (i * 7919) % ROWS, 'v%d' % i) for i in range(ROWS)])
+        return db
+
+    def queries(self, selective: bool = True):
+        """selective 为 True 时产生规划器一定选择索引的条件，否则产生由代价决定扫描方式的宽范围"""
+        if not selective:
+            yield from ("SELECT id, k FROM t WHERE k < 3000", "SELECT id, k FROM t WHERE k >= 10000",
+                        "SELECT id FROM t WHERE k > 100 AND k <= 1600")
+            return
+        probes = {'=': (-1, 0, 77, ROWS - 1, ROWS), '<': (-1, 0, 3), '<=': (0, 3),
+                  '>': (ROWS - 4, ROWS - 1), '>=': (ROWS - 4, ROWS)}
+        for op in OPERATORS:
+            for value in probes[op]:
+                yield f"SELECT id, k, v FROM t WHERE k {op} {value}"
+        yield "SELECT id, k FROM t WHERE k > 10 AND k <= 13 AND id > 1000"
+        yield f"SELECT id FROM t WHERE k >= {ROWS - 10} AND v = 'v2001'"
+
+    def results(self, db: SimpleDB):
+        return [sorted(db.execute(sql), key=lambda row: row['id'])
+                for selective in (True, False) for sql in self.queries(selective)]
+
+    def test_comparisons_use_index(self):
+        for layout in ('row', 'columnar'):
+            with self.subTest(layout=layout):
+                db = self.open(layout)
+                db.execute(f"UPDATE t SET k = {ROWS - 2} WHERE id = 3")
+                db.execute("DELETE FROM t WHERE id >= 4000 AND id < 4500")
+                expected = self.results(db)
+                self.assertTrue(any(expected))
+                db.execute("CREATE INDEX idx_k ON t (k)")
+                db.execute("ANALYZE t")
+                for sql in self.queries():
+                    plan = db.execute("EXPLAIN " + sql)[0]['QUERY PLAN']
+                    self.assertTrue(plan.startswith('Index Scan using k'), (sql, plan))
+                self.assertEqual(self.results(db), expected)
+
+                # 建索引之后的修改同样反映在索引查找中
+                db.execute("UPDATE t SET k = 20 WHERE id = 5")
+                db.execute("DELETE FROM t WHERE k = 77")
+                db.insert_many('t', [(6000 + i, i, 'n') for i in range(10)])
+                expected = self.results(db)
+                db.execute("DROP INDEX idx_k")
+                self.assertNotIn('Index Scan', db.execute("EXPLAIN SELECT id FROM t WHERE k = 77")[0]['QUERY PLAN'])
+                self.assertEqual(self.results(db), expected)
+
+    def test_drop_index_on_table(self):
+        db = self.open('row')
+        db.execute("CREATE INDEX idx_k ON t (k)")
+        with self.assertRaises(Exception):
+            db.execute("CREATE INDEX idx_k ON t (v)")
+        with self.assertRaises(Exception):
+            db.execute("CREATE INDEX idx_x ON t (missing)")
+        db.execute("DROP INDEX idx_k ON t")
+        with self.assertRaises(Exception):
+            db.execute("DROP INDEX idx_k")
+        db.execute("CREATE INDEX idx_k ON t (k)")
+        self.assertEqual(db.execute("SELECT id FROM t WHERE k = 77"),
+                         [{'id': i} for i in range(ROWS) if i * 7919 % ROWS == 77])
+
+
+
+class TestIndexBuild(unittest.TestCase):
+    """在已有数据的表上 CREATE INDEX 批量建树，之后的插入、修改和删除都正确维护这棵树"""
+
+    def check(self, db: SimpleDB, model: dict):
+        index = db.get_table('t').indexes['k']
+        check_structure(self, index)
+        for key in (-5, 0, 1, 77, 150, 299, 300, 10 ** 6):
+            rows = db.execute(f"SELECT id FROM t WHERE k = {key}")
+            self.assertEqual(sorted(row['id'] for row in rows), sorted(i for i, k in model.items() if k == key), key)
+        rows = db.execute("SELECT id, k FROM t WHERE k >= 100 AND k < 103")
+        self.assertEqual(sorted((row['id'], row['k']) for row in rows),
+                         sorted((i, k) for i, k in model.items() if 100 <= k < 103))
+        self.assertIn('Index Scan', db.execute("EXPLAIN SELECT id FROM t WHERE k = 77")[0]['QUERY PLAN'])
+
+    def test_bulk_build_then_modify(self):
+        rng = random.Random(12)
+        for layout in ('row', 'columnar'):
+            with self.subTest(layout=layout):
+                db = SimpleDB(config=DBConfig(autovacuum_interval=0))
+                self.addCleanup(db.close)
+                db.create_table('t', [('id', 'INT'), ('k', 'INT')], layout)
+                original = {i: rng.randrange(300) for i in range(ROWS)}
+                db.insert_many('t', list(original.items()))
+                # 建索引前的修改留下旧版本，旧版本的键同样进入索引，旧快照通过索引仍能找到它们
+                reader = db.connect()
+                reader.execute("BEGIN ISOLATION LEVEL REPEATABLE READ")
+                reader.execute("SELECT COUNT(*) FROM t")
+                db.execute("UPDATE t SET k = 150 WHERE id < 100")
+                db.execute("DELETE FROM t WHERE id >= 100 AND id < 200")
+                model = {i: 150 if i < 100 else k for i, k in original.items() if not 100 <= i < 200}
+
+                db.execute("CREATE INDEX idx_k ON t (k)")
+                db.execute("ANALYZE t")
+                self.check(db, model)
+                for key in (77, 150):
+                    self.assertEqual(sorted(row['id'] for row in reader.execute(f"SELECT id FROM t WHERE k = {key}")),
+                                     sorted(i for i, k in original.items() if k == key))
+                reader.execute("COMMIT")
+
+                added = {ROWS + i: rng.randrange(-5, 305) for i in range(5000)}
+                db.insert_many('t', list(added.items()))
+                model.update(added)
+                db.execute("UPDATE t SET k = 299 WHERE k = 0")
+                model = {i: 299 if k == 0 else k for i, k in model.items()}
+                db.execute("UPDATE t SET k = 0 WHERE id >= 500 AND id < 520")
+                model.update({i: 0 for i in range(500, 520)})
+                db.execute("DELETE FROM t WHERE k = 1")
+                model = {i: k for i, k in model.items() if k != 1}
+                self.check(db, model)
+                db.vacuum('t')
+                self.check(db, model)
+
+
+if __name__ == '__main__':
+    unittest.main()
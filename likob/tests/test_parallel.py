@@ -0,0 +1,87 @@
+import random
+import unittest
+from unittest import mock
+
+from likob import SimpleDB
+from likob.src.sql import parallel
+from likob.src.sql.planner import Planner
+from likob.src.utils.config import DBConfig
+
+QUERIES = [
+    "SELECT COUNT(*), SUM(v), AVG(f), MIN(s), MAX(v) FROM t",
+    "SELECT g, COUNT(*), SUM(v), AVG(f), MIN(s), MAX(f) FROM t GROUP BY g",
+    "SELECT id, COUNT(*) FROM t WHERE v < 800 GROUP BY id",
+    "SELECT id, v, s FROM t WHERE v = 7",
+    "SELECT id, v FROM t WHERE v < 30 ORDER BY v DESC, id",
+]
+
+
+def rounded(rows):
+    return [{key: round(value, 6) if isinstance(value, float) else value for key, value in row.items()}
+            for row in rows]
+
+
+@unittest.skipIf(parallel.shared_memory is None, "没有共享内存")
+class TestParallelScan(unittest.TestCase):
+    """强制使用并行计划，与串行执行的结果比较"""
+
+    def setUp(self):
+        patcher = mock.patch.object(Planner, 'PARALLEL_SETUP_COST', -1e9)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def open(self, layout: str, workers: int, **config) -> SimpleDB:
+        rng = random.Random(1)
+        db = SimpleDB(config=DBConfig(autovacuum_interval=0, parallel_workers=workers, **config))
+        self.addCleanup(db.close)
+        db.create_table('t', [('id', 'INT'), ('v', 'INT'), ('f', 'FLOAT'), ('s', 'TEXT'), ('g', 'INT')], layout)
+        db.insert_many('t', [(i, rng.randrange(1000), rng.random() * 1000, 's%d' % rng.randrange(50),
+                              rng.randrange(20)) for i in range(20000)])
+        db.execute("DELETE FROM t WHERE id < 100")
+        return db
+
+    def results(self, db: SimpleDB):
+        """在旧快照和最新数据上各执行一遍查询"""
+        snapshot = db.connect()
+        snapshot.execute("BEGIN ISOLATION LEVEL REPEATABLE READ")
+        snapshot.execute("SELECT COUNT(*) FROM t")
+        db.execute("UPDATE t SET v = 5000 WHERE id > 10000 AND id < 10300")
+        db.execute("DELETE FROM t WHERE id >= 1000 AND id < 1100")
+        results = [rounded(snapshot.execute(sql)) for sql in QUERIES] + [rounded(db.execute(sql)) for sql in QUERIES]
+        snapshot.execute("COMMIT")
+        return results
+
+    def test_parallel_plans_match_serial(self):
+        for layout in ('row', 'columnar'):
+            with self.subTest(layout=layout):
+                db = self.open(layout, 3)
+                self.assertIn('Parallel Aggregate', db.execute("EXPLAIN " + QUERIES[1])[0]['QUERY PLAN'])
+                self.assertIn('Gather Merge', db.execute("EXPLAIN " + QUERIES[4])[0]['QUERY PLAN'])
+                self.assertEqual(self.results(db), self.results(self.open(layout, 0)))
+
+    def test_segment_is_reused_until_table_changes(self):
+        for layout in ('row', 'columnar'):
+            with self.subTest(layout=layout):
+                db = self.open(layout, 2)
+                heap = db.get_table('t').heap
+                db.execute(QUERIES[0])
+                segment = parallel._segments[heap]
+                db.execute(QUERIES[1])
+                self.assertIs(parallel._segments[heap], segment)
+                db.execute("UPDATE t SET v = 1 WHERE id = 200")
+                self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM t WHERE v = 1 AND id = 200"), [{'c': 1}])
+                self.assertIsNot(parallel._segments[heap], segment)
+                # 被替换的副本没有使用者，已经释放
+                self.assertFalse(segment._finalizer.alive)
+
+    def test_group_spill_limit_in_workers(self):
+        sql = "SELECT id, COUNT(*), SUM(v) FROM t GROUP BY id"
+        expected = self.open('columnar', 0).execute(sql)
+        db = self.open('columnar', 2, hash_agg_max_groups=500)
+        self.assertIn('Parallel Aggregate', db.execute("EXPLAIN " + sql)[0]['QUERY PLAN'])
+        self.assertEqual(sorted(db.execute(sql), key=lambda row: row['id']),
+                         sorted(expected, key=lambda row: row['id']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+
+from likob import SimpleDB
+from likob.src.sql import SQLParser, Parameter, tokenize
+from likob.src.sql.lexer import normalize, KEYWORD, NAME, NUMBER, STRING, OPERATOR, PARAM, EOF
+
+
+class TestLexer(unittest.TestCase):
+
+    def test_token_types_and_values(self):
+        tokens = tokenize("select a, 'it''s' FROM t -- 注释\n WHERE x <> -1.5 AND y = ?")
+        self.assertEqual([(token.type, token.value) for token in tokens], [
+            (KEYWORD, 'SELECT'), (NAME, 'a'), ('PUNCT', ','), (STRING, "it's"), (KEYWORD, 'FROM'), (NAME, 't'),
+            (KEYWORD, 'WHERE'), (NAME, 'x'), (OPERATOR, '!='), (NUMBER, -1.5), (KEYWORD, 'AND'), (NAME, 'y'),
+            (OPERATOR, '='), (PARAM, '?'), (EOF, None)])
+
+    def test_unknown_character_is_rejected(self):
+        with self.assertRaisesRegex(Exception, '无法识别的字符'):
+            tokenize("SELECT a + 1 FROM t")
+
+    def test_normalize_replaces_literals_but_keeps_limit(self):
+        key, slots = normalize(tokenize("select *  from t where id = 5 and name = 'x' limit 10 offset ?"))
+        self.assertEqual(key, "SELECT * FROM t WHERE id = ? AND name = ? LIMIT 10 OFFSET ?")
+        self.assertEqual(slots, [(True, 5), (True, 'x'), (False, None)])
+
+
+class TestParser(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = SQLParser()
+
+    def test_select(self):
+        parsed = self.parser.parse("SELECT id, name FROM users WHERE id >= 3 ORDER BY name DESC LIMIT 5 OFFSET 2")
+        self.assertEqual(parsed['columns'], ['id', 'name'])
+        self.assertEqual(parsed['where'], {'operator': 'AND', 'conditions': [
+            {'type': 'simple', 'column': 'id', 'operator': '>=', 'value': 3}]})
+        self.assertEqual(parsed['order_by'], [('name', 'DESC')])
+        self.assertEqual((parsed['limit'], parsed['offset']), (5, 2))
+
+    def test_statements_differing_in_literals_share_parse(self):
+        first = self.parser.parse("SELECT * FROM t WHERE id = 1")
+        second = self.parser.parse("select * from t where id = 2")
+        self.assertEqual(len(self.parser.cache), 1)
+        self.assertEqual((first['where']['conditions'][0]['value'], second['where']['conditions'][0]['value']),
+                         (1, 2))
+
+    def test_prepared_parameters_are_numbered(self):
+        parsed, count, _, _ = self.parser.parse_prepared("SELECT * FROM t WHERE a = ? AND b = 'x' LIMIT ? OFFSET ?")
+        self.assertEqual(count, 3)
+        conditions = parsed['where']['conditions']
+        self.assertEqual(conditions[0]['value'].index, 0)
+        self.assertEqual(conditions[1]['value'], 'x')
+        self.assertIsInstance(parsed['limit'], Parameter)
+        self.assertEqual((parsed['limit'].index, parsed['offset'].index), (1, 2))
+
+    def test_invalid_limit_is_rejected(self):
+        for sql in ("SELECT * FROM t LIMIT -1", "SELECT * FROM t LIMIT 1.5", "SELECT * FROM t LIMIT 'a'"):
+            with self.assertRaisesRegex(Exception, 'LIMIT 需要非负整数'):
+                self.parser.parse(sql)
+
+    def test_parameters_require_prepare(self):
+        with self.assertRaisesRegex(Exception, 'prepare'):
+            self.parser.parse("SELECT * FROM t WHERE id = ?")
+
+    def test_syntax_errors(self):
+        for sql in ("SELECT * FROM t WHERE a = 1 OR b = 2", "SELECT * FROM t LEFT JOIN u ON t.a = u.a",
+                    "INSERT INTO t VALUES (NULL)"):
+            with self.assertRaises(Exception):
+                self.parser.parse(sql)
+
+
+class TestLimitParameters(unittest.TestCase):
+
+    def setUp(self):
+        self.db = SimpleDB()
+        self.db.execute("CREATE TABLE t (id INT, v TEXT)")
+        self.db.insert_many('t', [(i, 'v%d' % i) for i in range(20)])
+
+    def test_limit_and_offset_are_bound_at_execute(self):
+        statement = self.db.prepare("SELECT id FROM t ORDER BY id DESC LIMIT ? OFFSET ?")
+        self.assertEqual(statement.execute([3, 0]), [{'id': 19}, {'id': 18}, {'id': 17}])
+        self.assertEqual(statement.execute([2, 5]), [{'id': 14}, {'id': 13}])
+        self.assertEqual(statement.execute([0, 0]), [])
+        cursor = self.db.cursor().execute("SELECT id FROM t WHERE id > ? ORDER BY id LIMIT ?", (15, 2))
+        self.assertEqual(cursor.fetchall(), [{'id': 16}, {'id': 17}])
+
+    def test_invalid_bound_values_are_rejected(self):
+        statement = self.db.prepare("SELECT id FROM t ORDER BY id LIMIT ? OFFSET ?")
+        statement.execute([1, 0])
+        for params in ([-1, 0], [1.0, 0], [True, 0], ['2', 0]):
+            with self.assertRaisesRegex(Exception, 'LIMIT 需要非负整数'):
+                statement.execute(params)
+        with self.assertRaisesRegex(Exception, 'OFFSET 需要非负整数'):
+            statement.execute([1, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
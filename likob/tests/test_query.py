@@ -0,0 +1,374 @@
+import random
+import re
+import unittest
+from unittest import mock
+
+from likob import SimpleDB
+from likob.src.sql import planner, sorting, vectorized
+from likob.src.utils.config import DBConfig
+
+VECTOR_QUERIES = [
+    "SELECT id, v, s FROM t WHERE v < 100 AND f >= 500.5",
+    "SELECT id, s FROM t WHERE s = 's7' AND g > 2",
+    "SELECT id FROM t WHERE s >= 's40' AND v != 3",
+    "SELECT COUNT(*), SUM(v), AVG(f), MIN(s), MAX(v), MIN(f) FROM t",
+    "SELECT COUNT(*), SUM(f), MAX(s) FROM t WHERE v > 900",
+    "SELECT g, COUNT(*), SUM(v), AVG(f), MIN(s), MAX(f) FROM t GROUP BY g",
+    "SELECT g, s, COUNT(*), MIN(v) FROM t WHERE v < 500 GROUP BY g, s",
+    "SELECT s, SUM(v) FROM t GROUP BY s HAVING COUNT(*) > 20",
+    "SELECT g, COUNT(*) FROM t WHERE v > 5000 GROUP BY g",
+]
+
+
+def plan(db: SimpleDB, sql: str) -> str:
+    return '\n'.join(row['QUERY PLAN'] for row in db.execute("EXPLAIN " + sql))
+
+
+def normalized(rows):
+    """浮点数求和的顺序不同，比较时舍入；行的顺序不影响结果"""
+    return sorted((tuple((key, round(value, 6) if isinstance(value, float) else value)
+                         for key, value in sorted(row.items())) for row in rows), key=repr)
+
+
+class TestPlanner(unittest.TestCase):
+    """规划器按统计信息和代价选择访问路径和聚合方式"""
+
+    def setUp(self):
+        self.db = SimpleDB(config=DBConfig(autovacuum_interval=0, vectorized=False))
+        self.addCleanup(self.db.close)
+        self.db.create_table('t', [('id', 'INT'), ('g', 'INT'), ('k', 'INT')], 'row')
+        self.db.insert_many('t', [(i, i % 10, i) for i in range(20000)])
+        self.db.execute("CREATE INDEX idx_id ON t (id)")
+        self.db.execute("CREATE INDEX idx_g ON t (g)")
+        self.db.execute("ANALYZE t")
+
+    def test_seq_scan_or_index_scan(self):
+        db = self.db
+        self.assertTrue(plan(db, "SELECT * FROM t WHERE id = 77").startswith('Index Scan using id'))
+        self.assertTrue(plan(db, "SELECT * FROM t WHERE id < 20").startswith('Index Scan using id'))
+        # 选择率高的条件读索引再随机读页比顺序扫描更贵
+        self.assertTrue(plan(db, "SELECT * FROM t WHERE id >= 100").startswith('Seq Scan'))
+        self.assertTrue(plan(db, "SELECT * FROM t WHERE g = 3").startswith('Seq Scan'))
+        # 两个条件都能用索引时选择选择率低的那个
+        self.assertTrue(plan(db, "SELECT * FROM t WHERE g = 3 AND id < 20").startswith('Index Scan using id'))
+        self.assertEqual(db.execute("SELECT id FROM t WHERE g = 3 AND id < 20"), [{'id': 3}, {'id': 13}])
+
+    def test_hash_or_sort_aggregation(self):
+        db = self.db
+        self.assertTrue(plan(db, "SELECT g, COUNT(*) FROM t GROUP BY g").startswith('HashAggregate'))
+        # 输入已按分组列有序（有序的索引扫描）时逐组聚合，不需要哈希表
+        sql = "SELECT id, COUNT(*) AS c FROM t WHERE id < 50 GROUP BY id"
+        self.assertRegex(plan(db, sql), r'^GroupAggregate \[group by: id\].*\n.*Index Scan using id .*\[ordered\]')
+        self.assertEqual(db.execute(sql), [{'id': i, 'c': 1} for i in range(50)])
+        self.assertEqual(db.execute("SELECT g, COUNT(*) AS c FROM t GROUP BY g ORDER BY g"),
+                         [{'g': g, 'c': 2000} for g in range(10)])
+
+    def test_analyze_refreshes_statistics(self):
+        db = self.db
+        table = db.get_table('t')
+        stats = table.statistics()
+        self.assertFalse(stats.sampled)
+        self.assertEqual(stats.row_count, 20000)
+        k = stats.columns['k']
+        self.assertEqual((k.distinct, k.min, k.max), (20000, 0, 19999))
+        self.assertEqual(stats.columns['g'].distinct, 10)
+
+        # 一行修改不会触发自动重新收集，按旧的最大值估算 k > 19999 只有一行
+        db.execute("CREATE INDEX idx_k ON t (k)")
+        db.execute("INSERT INTO t VALUES (20000, 0, 1000000)")
+        sql = "SELECT id FROM t WHERE k > 19999"
+        statement = db.prepare(sql)
+        self.assertTrue(plan(db, sql).startswith('Index Scan using k'))
+        self.assertEqual(statement.execute(), [{'id': 20000}])
+        self.assertEqual(db.execute("ANALYZE t"), [{'message': '1 tables analyzed'}])
+        self.assertEqual(table.statistics().columns['k'].max, 1000000)
+        self.assertNotIn('Index Scan', plan(db, sql))
+        # 缓存的计划也重新生成
+        self.assertEqual(statement.execute(), [{'id': 20000}])
+        self.assertNotIn('Index Scan', statement.plan().explain()[0])
+
+    def test_explain_analyze_reports_actual_rows(self):
+        db = self.db
+        sql = "SELECT g, COUNT(*) FROM t WHERE k < 100 GROUP BY g"
+        lines = [row['QUERY PLAN'] for row in db.execute("EXPLAIN ANALYZE " + sql)]
+        self.assertEqual(len(lines), 2)
+        actual = [re.search(r'\(actual rows=(\d+) time=(\d+\.\d+) ms\)$', line) for line in lines]
+        self.assertTrue(all(actual), lines)
+        self.assertEqual([int(match.group(1)) for match in actual], [10, 100])
+        self.assertTrue(lines[1].startswith('  ->  '))
+        # EXPLAIN 不执行查询
+        self.assertNotIn('actual', plan(db, sql))
+
+        db.config.vectorized = True
+        lines = [row['QUERY PLAN'] for row in db.execute("EXPLAIN ANALYZE SELECT g, SUM(k) FROM t GROUP BY g")]
+        self.assertTrue(lines[0].startswith('Vector Aggregate'), lines)
+        self.assertEqual([int(re.search(r'actual rows=(\d+)', line).group(1)) for line in lines], [10, 20000])
+
+
+class TestVectorized(unittest.TestCase):
+    """按批执行（有 NumPy 和没有 NumPy 两种实现）与逐行执行的结果相同"""
+
+    def open(self, layout: str, vectorize: bool) -> SimpleDB:
+        rng = random.Random(7)
+        db = SimpleDB(config=DBConfig(autovacuum_interval=0, vectorized=vectorize))
+        self.addCleanup(db.close)
+        db.create_table('t', [('id', 'INT'), ('v', 'INT'), ('f', 'FLOAT'), ('s', 'TEXT'), ('g', 'INT')], layout)
+        db.insert_many('t', [(i, rng.randrange(1000), rng.random() * 1000, 's%d' % rng.randrange(60), i % 7)
+                             for i in range(10000)])
+        db.execute("DELETE FROM t WHERE id >= 2000 AND id < 2500")
+        db.execute("UPDATE t SET v = 3 WHERE id >= 5000 AND id < 5100")
+        return db
+
+    def results(self, db: SimpleDB):
+        """在旧快照和最新数据上各执行一遍，旧快照要读版本链中的旧版本"""
+        snapshot = db.connect()
+        snapshot.execute("BEGIN ISOLATION LEVEL REPEATABLE READ")
+        snapshot.execute("SELECT COUNT(*) FROM t")
+        db.execute("UPDATE t SET s = 's7' WHERE id >= 100 AND id < 300")
+        db.execute("DELETE FROM t WHERE v < 10")
+        results = [normalized(snapshot.execute(sql)) for sql in VECTOR_QUERIES]
+        results += [normalized(db.execute(sql)) for sql in VECTOR_QUERIES]
+        snapshot.execute("COMMIT")
+        return results
+
+    def test_batches_match_rows(self):
+        for layout in ('row', 'columnar'):
+            expected = self.results(self.open(layout, False))
+            for numpy in (True, False):
+                with self.subTest(layout=layout, numpy=numpy), \
+                        mock.patch.object(vectorized, 'np', vectorized.np if numpy else None), \
+                        mock.patch.object(planner, 'np', vectorized.np if numpy else None):
+                    if numpy and vectorized.np is None:
+                        self.skipTest("没有 NumPy")
+                    db = self.open(layout, True)
+                    if layout == 'columnar':
+                        self.assertIn('Vector Scan', plan(db, VECTOR_QUERIES[0]))
+                    self.assertTrue(plan(db, VECTOR_QUERIES[5]).startswith('Vector Aggregate'))
+                    self.assertEqual(self.results(db), expected)
+
+
+JOINS = ('Hash Join', 'Merge Join', 'Index Nested Loop')
+
+
+def penalized(cls):
+    """代价加上一个很大的常数的算子子类，用来排除这种连接算法"""
+
+    class Penalized(cls):
+        @property
+        def cost(self):
+            return self._cost + 1e9
+
+        @cost.setter
+        def cost(self, value):
+            self._cost = value
+
+    return Penalized
+
+
+class TestJoins(unittest.TestCase):
+    """分别强制使用哈希、排序合并和索引嵌套循环连接，结果都与按定义计算的结果相同"""
+
+    def setUp(self):
+        rng = random.Random(3)
+        self.users = [(i, 'u%d' % i, i % 5) for i in range(300)]
+        # 有的用户没有订单，有的订单的用户不存在，多数用户有多个订单
+        self.orders = [(i, rng.randrange(-20, 320), rng.randrange(100)) for i in range(2000)]
+        self.depts = [(d, 'd%d' % d) for d in range(4)]
+        self.db = SimpleDB(config=DBConfig(autovacuum_interval=0))
+        self.addCleanup(self.db.close)
+        self.db.create_table('users', [('id', 'INT'), ('name', 'TEXT'), ('dept', 'INT')])
+        self.db.create_table('orders', [('oid', 'INT'), ('uid', 'INT'), ('amount', 'INT')], 'columnar')
+        self.db.create_table('depts', [('did', 'INT'), ('dname', 'TEXT')])
+        self.db.insert_many('users', self.users)
+        self.db.insert_many('orders', self.orders)
+        self.db.insert_many('depts', self.depts)
+        for sql in ("CREATE INDEX idx_users_id ON users (id)", "CREATE INDEX idx_orders_uid ON orders (uid)",
+                    "CREATE INDEX idx_users_dept ON users (dept)", "CREATE INDEX idx_depts_did ON depts (did)"):
+            self.db.execute(sql)
+
+    def forcing(self, algorithm: str):
+        return mock.patch.multiple(planner, **{cls.__name__: penalized(cls) for cls in (
+            planner.HashJoin, planner.MergeJoin, planner.IndexNestedLoopJoin) if cls.label != algorithm})
+
+    def check(self, sql: str, expected):
+        for algorithm in JOINS:
+            with self.subTest(sql=sql, algorithm=algorithm), self.forcing(algorithm):
+                explained = plan(self.db, sql)
+                self.assertIn(algorithm, explained)
+                self.assertEqual(set(re.findall('|'.join(JOINS), explained)), {algorithm})
+                self.assertEqual(normalized(self.db.execute(sql)), normalized(expected))
+
+    def test_aliases(self):
+        expected = [{'u.name': name, 'o.amount': amount} for uid, name, _ in self.users
+                    for _, o_uid, amount in self.orders if o_uid == uid and amount > 50]
+        self.check("SELECT u.name, o.amount FROM users u JOIN orders o ON u.id = o.uid WHERE o.amount > 50", expected)
+        # ON 条件两侧的顺序无关，没有歧义的列名不必限定
+        self.check("SELECT name, amount FROM orders o JOIN users u ON u.id = o.uid WHERE amount > 50",
+                   [{'name': row['u.name'], 'amount': row['o.amount']} for row in expected])
+
+    def test_qualified_names(self):
+        expected = [{'users.id': uid, 'orders.oid': oid} for uid, _, _ in self.users
+                    for oid, o_uid, _ in self.orders if o_uid == uid and uid < 30]
+        self.check("SELECT users.id, orders.oid FROM users JOIN orders ON users.id = orders.uid WHERE users.id < 30",
+                   expected)
+        with self.assertRaises(Exception):
+            self.db.execute("SELECT id FROM users a JOIN users b ON a.id = b.id")
+        with self.assertRaises(Exception):
+            self.db.execute("SELECT users.missing FROM users JOIN orders ON users.id = orders.uid")
+
+    def test_self_join_with_duplicate_keys(self):
+        expected = [{'a.id': a, 'b.id': b} for a, _, a_dept in self.users
+                    for b, _, b_dept in self.users if a_dept == b_dept and a < 7]
+        self.check("SELECT a.id, b.id FROM users a JOIN users b ON a.dept = b.dept WHERE a.id < 7", expected)
+
+    def test_three_tables_with_group_by(self):
+        names = dict(self.depts)
+        counts = {}
+        for uid, _, dept in self.users:
+            for _, o_uid, amount in self.orders:
+                if o_uid == uid and dept in names:
+                    key = names[dept]
+                    count, total = counts.get(key, (0, 0))
+                    counts[key] = (count + 1, total + amount)
+        expected = [{'d.dname': key, 'count_*': count, 'sum_o.amount': total}
+                    for key, (count, total) in counts.items()]
+        self.check("SELECT d.dname, COUNT(*), SUM(o.amount) FROM users u JOIN orders o ON o.uid = u.id "
+                   "JOIN depts d ON d.did = u.dept GROUP BY d.dname", expected)
+
+
+
+class TestSorting(unittest.TestCase):
+    """Top-N 堆、按索引顺序读取和外部归并排序的结果都与完整的内存排序相同"""
+
+    def setUp(self):
+        rng = random.Random(8)
+        self.rows = [(i, rng.randrange(500), 's%d' % rng.randrange(30), rng.random()) for i in range(5000)]
+        self.db = SimpleDB(config=DBConfig(autovacuum_interval=0, sort_memory_rows=1000))
+        self.addCleanup(self.db.close)
+        self.db.create_table('t', [('id', 'INT'), ('k', 'INT'), ('s', 'TEXT'), ('f', 'FLOAT')])
+        self.db.insert_many('t', self.rows)
+        self.db.execute("CREATE INDEX idx_k ON t (k)")
+        self.db.execute("ANALYZE t")
+
+    def explain(self, sql: str) -> str:
+        return '\n'.join(row['QUERY PLAN'] for row in self.db.execute("EXPLAIN ANALYZE " + sql))
+
+    def test_external_sort_merges_runs(self):
+        rng = random.Random(9)
+        rows = [(rng.randrange(20), rng.randrange(20), i) for i in range(500)]
+        for keys in ([(0, False)], [(0, True)], [(0, True), (1, False)]):
+            expected = list(rows)
+            for position, descending in reversed(keys):
+                expected.sort(key=lambda row: row[position], reverse=descending)
+            with self.subTest(keys=keys), mock.patch.object(sorting, 'MERGE_FAN_IN', 3):
+                sort = sorting.ExternalSort(keys, 7)
+                # 键相同的行保持输入顺序，与稳定的内存排序逐行相同
+                self.assertEqual(list(sort.sort(iter(rows))), expected)
+                # 71 段写入临时文件，每层三段归并为一段，直到少于三段
+                self.assertGreater(sort.runs, len(rows) // 7)
+                self.assertEqual(sorting.top_n(rows, keys, 25), expected[:25])
+        self.assertEqual(list(sorting.ExternalSort([(0, False)], 7).sort(iter(rows[:7]))),
+                         sorted(rows[:7], key=lambda row: row[0]))
+        self.assertEqual(sorting.top_n(rows[:3], [(2, True)], 10), rows[2::-1])
+
+    def test_external_sort_in_queries(self):
+        sql = "SELECT id, s FROM t ORDER BY s DESC, id"
+        self.assertRegex(self.explain(sql), r'Sort \[keys: s DESC, id ASC\] \[external: [0-9]+ runs\]')
+        expected = sorted(self.rows, key=lambda row: row[0])
+        expected.sort(key=lambda row: row[2], reverse=True)
+        self.assertEqual(self.db.execute(sql), [{'id': row[0], 's': row[2]} for row in expected])
+
+        # 行数超过内存限制的 LIMIT 不能用 Top-N 堆
+        sql = "SELECT id FROM t ORDER BY f LIMIT 2000 OFFSET 10"
+        self.assertIn('external', self.explain(sql))
+        self.assertEqual(self.db.execute(sql), [{'id': row[0]} for row in sorted(self.rows, key=lambda row: row[3])[10:2010]])
+
+    def test_top_n(self):
+        sql = "SELECT id, s FROM t ORDER BY s, f DESC LIMIT 10 OFFSET 5"
+        explained = self.explain(sql)
+        self.assertIn('[top-N: 15]', explained)
+        self.assertNotIn('external', explained)
+        expected = sorted(self.rows, key=lambda row: row[3], reverse=True)
+        expected.sort(key=lambda row: row[2])
+        self.assertEqual(self.db.execute(sql), [{'id': row[0], 's': row[2]} for row in expected[5:15]])
+        self.assertEqual(len(self.db.execute("SELECT id FROM t ORDER BY s LIMIT 9000")), len(self.rows))
+
+    def test_order_by_index(self):
+        sql = "SELECT id, k FROM t ORDER BY k LIMIT 30"
+        explained = self.explain(sql)
+        self.assertIn('Index Scan using k on t [range: full] [ordered]', explained)
+        self.assertNotIn('Sort', explained)
+        result = self.db.execute(sql)
+        # k 相同的行之间顺序不定，只比较 k 的序列和行本身
+        self.assertEqual([row['k'] for row in result], sorted(row[1] for row in self.rows)[:30])
+        self.assertTrue({(row['id'], row['k']) for row in result} <= {row[:2] for row in self.rows})
+
+        self.db.execute("UPDATE t SET k = -1 WHERE id = 4999")
+        self.db.execute("DELETE FROM t WHERE k = 0")
+        self.assertEqual(self.db.execute("SELECT id, k FROM t ORDER BY k LIMIT 1"), [{'id': 4999, 'k': -1}])
+        self.assertNotIn(0, [row['k'] for row in self.db.execute(sql)])
+
+
+
+class TestAggregation(unittest.TestCase):
+    """组数超过 hash_agg_max_groups 时哈希聚合按分区写入临时文件，结果不变"""
+
+    def setUp(self):
+        rng = random.Random(10)
+        self.rows = [(i, rng.randrange(2000), 's%d' % rng.randrange(40), rng.random()) for i in range(10000)]
+
+    def open(self, vectorized: bool, layout: str) -> SimpleDB:
+        db = SimpleDB(config=DBConfig(autovacuum_interval=0, vectorized=vectorized, hash_agg_max_groups=100))
+        self.addCleanup(db.close)
+        db.create_table('t', [('id', 'INT'), ('g', 'INT'), ('s', 'TEXT'), ('f', 'FLOAT')], layout)
+        db.insert_many('t', self.rows)
+        db.execute("ANALYZE t")
+        return db
+
+    def expected(self):
+        groups = {}
+        for i, g, s, f in self.rows:
+            groups.setdefault(g, []).append((i, s, f))
+        by_group = [{'g': g, 'count_*': len(rows), 'sum_f': sum(f for _, _, f in rows),
+                     'avg_id': sum(i for i, _, _ in rows) / len(rows),
+                     'min_s': min(s for _, s, _ in rows), 'max_s': max(s for _, s, _ in rows)}
+                    for g, rows in groups.items()]
+        counts = {}
+        for _, g, s, f in self.rows:
+            if f < 0.5:
+                counts[g, s] = counts.get((g, s), 0) + 1
+        with_having = [{'g': g, 's': s, 'count_*': count} for (g, s), count in counts.items() if count > 1]
+        return by_group, with_having
+
+    def test_spilled_hash_aggregation(self):
+        queries = ("SELECT g, COUNT(*), SUM(f), AVG(id), MIN(s), MAX(s) FROM t GROUP BY g",
+                   "SELECT g, s, COUNT(*) FROM t WHERE f < 0.5 GROUP BY g, s HAVING COUNT(*) > 1")
+        expected = self.expected()
+        for vectorized in (False, True):
+            for layout in ('row', 'columnar'):
+                db = self.open(vectorized, layout)
+                for sql, rows in zip(queries, expected):
+                    with self.subTest(vectorized=vectorized, layout=layout, sql=sql):
+                        # 排序分组不受组数限制，排除它才能让哈希聚合写出分区
+                        with mock.patch.object(planner, 'SortAggregate', penalized(planner.SortAggregate)):
+                            explained = '\n'.join(row['QUERY PLAN'] for row in db.execute("EXPLAIN ANALYZE " + sql))
+                            self.assertRegex(explained.splitlines()[0],
+                                             r'^(HashAggregate|Vector Aggregate) .*\[spilled: [0-9]+\]')
+                            self.assertEqual(normalized(db.execute(sql)), normalized(rows))
+                        self.assertEqual(normalized(db.execute(sql)), normalized(rows))
+
+    def test_sum_and_avg_require_numeric_columns(self):
+        db = self.open(False, 'row')
+        db.create_table('u', [('id', 'INT'), ('name', 'TEXT')])
+        for sql in ("SELECT SUM(s) FROM t", "SELECT g, AVG(s) FROM t GROUP BY g",
+                    "SELECT SUM(u.name) FROM t JOIN u ON t.id = u.id", "EXPLAIN SELECT AVG(s) FROM t"):
+            with self.subTest(sql=sql), self.assertRaisesRegex(Exception, '(SUM|AVG) 不能用于 TEXT 类型的列'):
+                db.execute(sql)
+        with self.assertRaisesRegex(Exception, 'SUM 不能用于 TEXT 类型的列 s'):
+            db.prepare("SELECT SUM(s) FROM t WHERE id > ?").execute([5])
+        self.assertEqual(db.execute("SELECT COUNT(s), MIN(s), MAX(s) FROM t WHERE id < 0"),
+                         [{'count_s': 0, 'min_s': None, 'max_s': None}])
+
+
+if __name__ == '__main__':
+    unittest.main()
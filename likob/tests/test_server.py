@@ -0,0 +1,152 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from likob import SimpleDB
+from likob.src.net import Client, Server, protocol
+from likob.src.net.server import _Connection
+from likob.src.utils.config import DBConfig
+
+
+class ServerTestCase(unittest.TestCase):
+    """在后台线程的事件循环中运行服务器"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db = SimpleDB(config=DBConfig(autovacuum_interval=0))
+        self.db.execute("CREATE TABLE t (id INT, v TEXT)")
+        self.db.execute("INSERT INTO t VALUES (1, 'a'), (2, 'b')")
+        self.loop = asyncio.new_event_loop()
+        self.server = Server(self.db, port=0, file_directory=self.directory(), **self.options())
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result(5)
+        self.client = Client(port=self.server.port, timeout=5)
+
+    def tearDown(self):
+        self.client.close()
+        asyncio.run_coroutine_threadsafe(self.server.close(), self.loop).result(5)
+        # 等连接处理完客户端的断开再停止事件循环
+        deadline = time.monotonic() + 5
+        while self.server.connections and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.loop.close()
+        self.db.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def directory(self):
+        return None
+
+    def options(self):
+        return {}
+
+
+class TestFileStatementsBlocked(ServerTestCase):
+
+    def test_file_statements_are_rejected_by_default(self):
+        target = os.path.join(self.path, 'out.lkd')
+        for sql in ("SAVE '%s'" % target, "LOAD '%s'" % target, "COPY t FROM '%s'" % target):
+            with self.assertRaisesRegex(Exception, 'SAVE/LOAD/COPY'):
+                self.client.execute(sql)
+        self.assertFalse(os.path.exists(target))
+        self.assertEqual(len(self.client.execute("SELECT * FROM t")), 2)
+
+    def test_local_sessions_are_not_restricted(self):
+        target = os.path.join(self.path, 'local.lkd')
+        self.db.execute("SAVE '%s'" % target)
+        self.assertTrue(os.path.exists(target))
+
+
+class TestFileDirectory(ServerTestCase):
+
+    def directory(self):
+        self.files = os.path.join(self.path, 'files')
+        os.mkdir(self.files)
+        return self.files
+
+    def test_relative_paths_resolve_inside_directory(self):
+        self.client.execute("SAVE 'backup.lkd'")
+        self.assertTrue(os.path.exists(os.path.join(self.files, 'backup.lkd')))
+        with open(os.path.join(self.files, 'rows.csv'), 'w') as f:
+            f.write("3,c\n")
+        self.client.execute("COPY t FROM 'rows.csv'")
+        self.assertEqual(self.client.execute("SELECT v FROM t WHERE id = 3"), [{'v': 'c'}])
+
+    def test_paths_outside_directory_are_rejected(self):
+        os.symlink(self.path, os.path.join(self.files, 'link'))
+        for name in ('../out.lkd', os.path.join(self.path, 'out.lkd'), 'link/out.lkd'):
+            with self.assertRaisesRegex(Exception, '不在允许访问的目录中'):
+                self.client.execute("SAVE '%s'" % name)
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'out.lkd')))
+
+
+class TestBackpressure(ServerTestCase):
+    """请求队列满时服务器暂停读取连接，客户端流水线发送不会与服务器互相等待"""
+
+    def options(self):
+        return {'max_pending': 2}
+
+    def test_reading_pauses_while_queue_is_full(self):
+        connections = []
+        init = _Connection.__init__
+
+        def record(connection, *args):
+            init(connection, *args)
+            connections.append(connection)
+
+        # setUp 中的连接已经建立，之后建立的只有新客户端的连接
+        self.client.execute("SELECT id FROM t WHERE id = 1")
+        self.client.close()
+        with mock.patch.object(_Connection, '__init__', record):
+            self.client = client = Client(port=self.server.port, timeout=5)
+            client.execute("SELECT id FROM t WHERE id = 1")
+        self.assertEqual(len(connections), 1)
+        locker = self.db.connect()
+        locker.execute("BEGIN")
+        locker.execute("UPDATE t SET v = 'x' WHERE id = 1")
+        # 第一条语句等待行锁，后面的请求先填满队列，其余的留在连接中没有读取
+        client._send([("UPDATE t SET v = 'y' WHERE id = 1", None)] + [("SELECT id FROM t", None)] * 20)
+        time.sleep(0.3)
+        self.assertTrue(connections[0].requests.full())
+        self.assertEqual(connections[0].requests.qsize(), 2)
+        locker.execute("COMMIT")
+        self.assertEqual(list(client._results()), [{'message': '1 rows updated'}])
+        for _ in range(20):
+            self.assertEqual(list(client._results()), [{'id': 1}, {'id': 2}])
+        self.assertEqual(client.execute("SELECT v FROM t WHERE id = 1"), [{'v': 'y'}])
+
+    def test_client_disconnects_while_queue_is_full(self):
+        locker = self.db.connect()
+        locker.execute("BEGIN")
+        locker.execute("UPDATE t SET v = 'x' WHERE id = 1")
+        self.client._send([("UPDATE t SET v = 'y' WHERE id = 1", None)] + [("SELECT id FROM t", None)] * 20)
+        time.sleep(0.3)
+        self.client.close()
+        locker.execute("COMMIT")
+        # 读取任务停在已满的队列上，执行任务写回复失败后连接仍然关闭
+        deadline = time.monotonic() + 5
+        while self.server.connections and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.server.connections, 0)
+        self.assertEqual(self.db.lock_stats()['locks'], 0)
+
+    def test_pipeline_with_large_requests_and_results(self):
+        self.db.insert_many('t', [(i, 'x' * 500) for i in range(3, 3000)])
+        # 请求和结果都大到填满套接字缓冲区：客户端一次发送全部请求时，服务器队列满后不再读取，
+        # 执行任务又等客户端读取结果，双方互相等待
+        statements = [("SELECT id, v FROM t WHERE v != ?", ['p' * 1000000])] * 30
+        with mock.patch.object(protocol, 'MAX_PENDING', 2):
+            results = self.client.pipeline(statements)
+        self.assertEqual([len(result) for result in results], [2999] * 30)
+        self.assertEqual(len(self.client.execute("SELECT id FROM t")), 2999)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,723 @@
+import io
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import unittest
+from unittest import mock
+
+from likob import SimpleDB
+from likob.src.core.exceptions import StorageError
+from likob.src.storage import dump
+from likob.src.storage.buffer_pool import BufferPool
+from likob.src.storage.column_store import KIND_TEXT, ColumnStore, bit_get
+from likob.src.storage.page import Page, split_rid
+from likob.src.utils.config import DBConfig
+
+
+class StorageTestCase(unittest.TestCase):
+    """每个测试使用一个临时数据目录"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db = None
+
+    def tearDown(self):
+        if self.db is not None:
+            self.db.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def open(self, **config) -> SimpleDB:
+        if self.db is not None:
+            self.db.close()
+        config.setdefault('checkpoint_interval', 0)
+        self.db = SimpleDB(self.path, DBConfig(**config))
+        return self.db
+
+    def crash(self, script: str) -> None:
+        """在子进程中打开数据库执行 script（可用变量 db），然后不关闭数据库直接退出，模拟崩溃"""
+        code = textwrap.dedent('''
+            import os
+            from likob import SimpleDB
+            from likob.src.utils.config import DBConfig
+            db = SimpleDB(%r, DBConfig(checkpoint_interval=0, cache_size=4))
+        ''') % self.path + textwrap.dedent(script) + "\ndb.storage.wal.flush()\nos._exit(0)\n"
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        subprocess.run([sys.executable, '-c', code], check=True, cwd=root)
+
+
+class TestRecovery(StorageTestCase):
+
+    def test_committed_changes_are_redone(self):
+        db = self.open()
+        db.execute("CREATE TABLE t (id INT, v TEXT)")
+        db.execute("INSERT INTO t VALUES (1, 'a')")
+        db.close()
+        self.db = None
+        self.crash("""
+            db.execute("INSERT INTO t VALUES (2, 'b')")
+            db.execute("UPDATE t SET v = 'c' WHERE id = 1")
+            db.insert_many('t', [(i, 'x') for i in range(3, 300)])
+            db.execute("DELETE FROM t WHERE id >= 100")
+        """)
+        db = self.open()
+        self.assertEqual(db.execute("SELECT * FROM t WHERE id <= 2 ORDER BY id"),
+                         [{'id': 1, 'v': 'c'}, {'id': 2, 'v': 'b'}])
+        self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM t"), [{'c': 99}])
+
+    def test_uncommitted_changes_are_undone(self):
+        db = self.open()
+        db.execute("CREATE TABLE t (id INT, v TEXT)")
+        db.insert_many('t', [(i, 'a') for i in range(200)])
+        db.close()
+        self.db = None
+        # 检查点把未提交事务修改过的页写入数据文件，恢复时必须撤销
+        self.crash("""
+            session = db.connect()
+            session.execute("BEGIN")
+            session.execute("INSERT INTO t VALUES (1000, 'new')")
+            session.execute("UPDATE t SET v = 'b' WHERE id < 100")
+            session.execute("DELETE FROM t WHERE id >= 150")
+            db.checkpoint()
+            db.execute("INSERT INTO t VALUES (2000, 'committed')")
+        """)
+        db = self.open()
+        self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM t"), [{'c': 201}])
+        self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM t WHERE v = 'a'"), [{'c': 200}])
+        self.assertEqual(db.execute("SELECT v FROM t WHERE id >= 1000 ORDER BY id"), [{'v': 'committed'}])
+        self.assertEqual(db.wal_stats()['size'], 0)
+
+
+class TestCheckpoint(StorageTestCase):
+
+    def test_checkpoint_truncates_log(self):
+        db = self.open()
+        db.execute("CREATE TABLE t (id INT, v TEXT)")
+        db.insert_many('t', [(i, 'a') for i in range(100)])
+        self.assertGreater(db.wal_stats()['size'], 0)
+        stats = db.checkpoint()
+        self.assertGreater(stats['pages'], 0)
+        self.assertEqual(db.wal_stats()['size'], 0)
+
+    def test_checkpoint_keeps_log_of_active_transaction(self):
+        db = self.open()
+        db.execute("CREATE TABLE t (id INT, v TEXT)")
+        db.execute("INSERT INTO t VALUES (1, 'a')")
+        session = db.connect()
+        session.execute("BEGIN")
+        session.execute("UPDATE t SET v = 'b' WHERE id = 1")
+        db.execute("CHECKPOINT")
+        self.assertGreater(db.wal_stats()['size'], 0)
+        session.execute("COMMIT")
+        db.checkpoint()
+        self.assertEqual(db.wal_stats()['size'], 0)
+        db = self.open()
+        self.assertEqual(db.execute("SELECT * FROM t"), [{'id': 1, 'v': 'b'}])
+
+    def test_checkpoint_copies_only_changed_columns(self):
+        db = self.open()
+        db.execute("CREATE TABLE c (id INT, v TEXT, f FLOAT) USING COLUMNAR")
+        db.insert_many('c', [(i, 'v%d' % (i % 7), i / 2) for i in range(5000)])
+        db.execute("CHECKPOINT")
+        self.assertEqual(db.storage.checkpoint_stats()['tables'], 1)
+        path = os.path.join(self.path, 'c.col')
+        written = os.stat(path)
+        # 没有修改的列式表不重写文件
+        self.assertEqual(db.checkpoint()['tables'], 0)
+        self.assertEqual(os.stat(path).st_ino, written.st_ino)
+
+        db.execute("UPDATE c SET f = 1.5 WHERE id < 10")
+        heap = db.get_table('c').heap
+        self.assertEqual([column.dirty for column in heap.columns], [False, False, True])
+        self.assertEqual(db.checkpoint()['tables'], 1)
+        self.assertEqual([column.dirty for column in heap.columns], [False, False, False])
+        db = self.open()
+        self.assertEqual(db.execute("SELECT id, v, f FROM c WHERE id = 3"), [{'id': 3, 'v': 'v3', 'f': 1.5}])
+        self.assertEqual(db.execute("SELECT id, v, f FROM c WHERE id = 4000"), [{'id': 4000, 'v': 'v3', 'f': 2000.0}])
+        self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM c WHERE f = 1.5"), [{'c': 10}])
+
+    def test_background_checkpoint_writes_columnar_table(self):
+        db = self.open(checkpoint_interval=0.05)
+        db.execute("CREATE TABLE c (id INT, v TEXT) USING COLUMNAR")
+        db.insert_many('c', [(i, 'a') for i in range(1000)])
+        db.execute("DELETE FROM c WHERE id >= 900")
+        deadline = time.monotonic() + 10
+        while db.wal_stats()['size'] and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(db.wal_stats()['size'], 0)
+        self.assertGreater(db.storage.checkpoint_stats()['checkpoints'], 0)
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'c.col')))
+        db = self.open()
+        self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM c"), [{'c': 900}])
+
+    def test_log_tail_is_replayed_on_columnar_table(self):
+        db = self.open()
+        db.execute("CREATE TABLE c (id INT, v TEXT) USING COLUMNAR")
+        db.insert_many('c', [(i, 'a') for i in range(300)])
+        db.close()
+        self.db = None
+        # 检查点之后的修改只在日志中，未提交事务的修改被检查点写进了文件
+        self.crash("""
+            db.execute("UPDATE c SET v = 'b' WHERE id < 10")
+            session = db.connect()
+            session.execute("BEGIN")
+            session.execute("UPDATE c SET v = 'x' WHERE id >= 290")
+            session.execute("INSERT INTO c VALUES (1000, 'x')")
+            db.execute("CHECKPOINT")
+            db.execute("DELETE FROM c WHERE id >= 200 AND id < 250")
+            db.execute("UPDATE c SET v = 'c' WHERE id = 5")
+            db.insert_many('c', [(i, 'd') for i in range(500, 520)])
+        """)
+        db = self.open()
+        self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM c"), [{'c': 270}])
+        self.assertEqual(db.execute("SELECT v, COUNT(*) AS c FROM c GROUP BY v ORDER BY v"),
+                         [{'v': 'a', 'c': 240}, {'v': 'b', 'c': 9}, {'v': 'c', 'c': 1}, {'v': 'd', 'c': 20}])
+
+
+class TestColumnStore(StorageTestCase):
+
+    def test_reopen_maps_file(self):
+        db = self.open()
+        db.execute("CREATE TABLE c (id INT, v TEXT, f FLOAT) USING COLUMNAR")
+        db.insert_many('c', [(i, 'v%d' % (i % 5), i / 4) for i in range(10000)])
+        db.execute("DELETE FROM c WHERE id < 10")
+        db = self.open()
+        heap = db.get_table('c').heap
+        self.assertIsNotNone(heap._mapping)
+        # 各列和删除位图直接引用文件映射，TEXT 列的字典还没有解码
+        self.assertIsInstance(heap.deleted, memoryview)
+        for column in heap.columns:
+            self.assertIsInstance(column.values, memoryview)
+            self.assertIsInstance(column.nulls, memoryview)
+        self.assertIsNotNone(heap.columns[1]._strings)
+        self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM c WHERE v = 'v3'"), [{'c': 1998}])
+        self.assertEqual(db.execute("SELECT * FROM c WHERE id = 9999"), [{'id': 9999, 'v': 'v4', 'f': 2499.75}])
+        # 追加时才复制到内存
+        db.execute("INSERT INTO c VALUES (10000, 'new', 0.5)")
+        self.assertNotIsInstance(heap.columns[0].values, memoryview)
+        self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM c"), [{'c': 9991}])
+
+    def test_unknown_file_format_is_rejected(self):
+        db = self.open()
+        db.execute("CREATE TABLE c (id INT) USING COLUMNAR")
+        db.execute("INSERT INTO c VALUES (1)")
+        db.close()
+        self.db = None
+        path = os.path.join(self.path, 'c.col')
+        with open(path, 'r+b') as f:
+            f.write(b'LKCOL001')
+        with self.assertRaises(StorageError):
+            self.open()
+
+    def test_writes_match_row_table(self):
+        db = self.open()
+        for layout in ('row', 'columnar'):
+            db.create_table(layout, [('id', 'INT'), ('v', 'TEXT'), ('f', 'FLOAT')], layout)
+            db.insert_many(layout, [(i, 'v%d' % (i % 9), i / 8) for i in range(6000)])
+            db.execute("INSERT INTO %s VALUES (6000, 'new', 0.5), (6001, 'v1', 1.5)" % layout)
+            db.execute("UPDATE %s SET v = 'upd', f = 2.5 WHERE id >= 4090 AND id < 4100" % layout)
+            db.execute("UPDATE %s SET v = 'v2' WHERE v = 'v1'" % layout)
+            db.execute("DELETE FROM %s WHERE id < 100" % layout)
+            db.execute("DELETE FROM %s WHERE v = 'v5'" % layout)
+        self.assertEqual(db.execute("SELECT * FROM columnar ORDER BY id"), db.execute("SELECT * FROM row ORDER BY id"))
+        self.assertEqual(db.execute("SELECT v, COUNT(*) AS c FROM columnar GROUP BY v ORDER BY v"),
+                         db.execute("SELECT v, COUNT(*) AS c FROM row GROUP BY v ORDER BY v"))
+        self.assertEqual(db.get_table('columnar').heap.row_count, db.get_table('row').heap.row_count)
+
+    def test_null_bitmap(self):
+        # 表层还不接受 NULL，直接在列存储上检查空值位图
+        path = os.path.join(self.path, 'n.col')
+        store = ColumnStore('n', [('id', 'INT'), ('v', 'TEXT'), ('n', 'INT')], path)
+        store.insert_many([(i, None if i % 3 == 0 else 'x', None if i % 4 == 0 else i) for i in range(100)])
+        v, n = store.columns[1], store.columns[2]
+        self.assertEqual((v.null_count, n.null_count), (34, 25))
+        self.assertEqual([bit_get(v.nulls, i) for i in range(7)], [True, False, False, True, False, False, True])
+        self.assertEqual(store.get(12), (12, None, None))
+        store.update(3, (3, 'y', None))
+        store.update(4, (4, 'x', 4))
+        self.assertEqual((v.null_count, n.null_count, bit_get(v.nulls, 3), bit_get(n.nulls, 4)), (33, 25, False, False))
+        # 删除的行在各列中占位为空值
+        store.delete(5)
+        self.assertEqual(store.get(5), None)
+        store.flush()
+        store = ColumnStore('n', [('id', 'INT'), ('v', 'TEXT'), ('n', 'INT')], path)
+        self.assertEqual((store.columns[1].null_count, store.columns[2].null_count), (33, 25))
+        self.assertEqual([store.get(rid) for rid in (3, 4, 5, 12)],
+                         [(3, 'y', None), (4, 'x', 4), None, (12, None, None)])
+        store.close()
+
+    def test_delete_bitmap(self):
+        db = self.open()
+        db.execute("CREATE TABLE c (id INT, v TEXT) USING COLUMNAR")
+        db.insert_many('c', [(i, 'x') for i in range(100)])
+        heap = db.get_table('c').heap
+        db.execute("DELETE FROM c WHERE id >= 90")
+        self.assertEqual((heap.deleted_count, heap.row_count, heap.size), (10, 90, 100))
+        self.assertTrue(all(bit_get(heap.deleted, rid) for rid in range(90, 100)))
+        session = db.connect()
+        session.execute("BEGIN")
+        session.execute("DELETE FROM c WHERE id < 10")
+        self.assertEqual(heap.deleted_count, 20)
+        session.execute("ROLLBACK")
+        self.assertEqual(heap.deleted_count, 10)
+        self.assertFalse(any(bit_get(heap.deleted, rid) for rid in range(10)))
+
+        db = self.open()
+        heap = db.get_table('c').heap
+        self.assertEqual(heap.deleted_count, 10)
+        self.assertTrue(all(bit_get(heap.deleted, rid) for rid in range(90, 100)))
+        self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM c"), [{'c': 90}])
+
+    def test_text_is_dictionary_encoded(self):
+        db = self.open()
+        db.execute("CREATE TABLE c (id INT, v TEXT) USING COLUMNAR")
+        db.insert_many('c', [(i, ['red', 'green', 'blue'][i % 3]) for i in range(3000)])
+        column = db.get_table('c').heap.columns[1]
+        self.assertEqual(column.kind, KIND_TEXT)
+        self.assertEqual(column.dictionary, ['red', 'green', 'blue'])
+        self.assertEqual(column.values[:4].tolist(), [0, 1, 2, 0])
+        db.execute("UPDATE c SET v = 'blue' WHERE id = 0")
+        db.execute("INSERT INTO c VALUES (3000, '黄')")
+        self.assertEqual(column.dictionary, ['red', 'green', 'blue', '黄'])
+        self.assertEqual((column.values[0], column.values[3000]), (2, 3))
+
+        db = self.open()
+        column = db.get_table('c').heap.columns[1]
+        db.execute("INSERT INTO c VALUES (3001, 'green'), (3002, 'white')")
+        self.assertEqual(column.dictionary, ['red', 'green', 'blue', '黄', 'white'])
+        self.assertEqual(column.values[3001:].tolist(), [1, 4])
+        self.assertEqual(db.execute("SELECT v, COUNT(*) AS c FROM c GROUP BY v ORDER BY v"),
+                         [{'v': 'blue', 'c': 1001}, {'v': 'green', 'c': 1001}, {'v': 'red', 'c': 999},
+                          {'v': 'white', 'c': 1}, {'v': '黄', 'c': 1}])
+
+    def test_persistence_across_reopen(self):
+        rows = [(i, 'v%d' % (i % 11), i / 3, 2 ** 70 + i if i % 500 == 0 else i) for i in range(9000)]
+        db = self.open()
+        db.execute("CREATE TABLE c (id INT, v TEXT, f FLOAT, big INT) USING COLUMNAR")
+        db.insert_many('c', rows)
+        db.execute("DELETE FROM c WHERE id >= 8000")
+        expected = db.execute("SELECT * FROM c ORDER BY id")
+        self.assertEqual(len(expected), 8000)
+        for _ in range(2):
+            db = self.open()
+            self.assertEqual(db.execute("SELECT * FROM c ORDER BY id"), expected)
+        self.assertEqual(db.execute("SELECT big FROM c WHERE id = 500"), [{'big': 2 ** 70 + 500}])
+        db.execute("UPDATE c SET f = 0.25 WHERE id = 1")
+        db.execute("INSERT INTO c VALUES (9000, 'z', 1.0, 9000)")
+        expected = db.execute("SELECT * FROM c ORDER BY id")
+        db = self.open()
+        self.assertEqual(db.execute("SELECT * FROM c ORDER BY id"), expected)
+        self.assertEqual(db.storage.table_layout('c'), 'columnar')
+
+
+class TestOverflow(StorageTestCase):
+
+    def test_large_values_survive_checkpoint_and_reopen(self):
+        db = self.open(cache_size=4)
+        db.execute("CREATE TABLE t (id INT, s TEXT, b TEXT)")
+        db.execute("INSERT INTO t VALUES (1, '%s', 'a')" % ('x' * 5000))
+        db.execute("INSERT INTO t VALUES (2, '%s', '%s')" % ('y' * 3000, 'z' * 3000))
+        for i in range(3, 200):
+            db.execute("INSERT INTO t VALUES (%d, 'v%d', 'w')" % (i, i))
+        db.execute("UPDATE t SET s = '%s' WHERE id = 3" % ('k' * 9000))
+        db.checkpoint()
+        self.assertGreater(os.path.getsize(os.path.join(self.path, 't.ovf')), 0)
+
+        db = self.open(cache_size=4)
+        rows = db.execute("SELECT * FROM t WHERE id <= 3")
+        self.assertEqual([(row['id'], len(row['s']), row['b']) for row in rows],
+                         [(1, 5000, 'a'), (2, 3000, 'z' * 3000), (3, 9000, 'w')])
+
+    def test_row_too_wide_is_rejected(self):
+        db = self.open()
+        db.execute("CREATE TABLE w (" + ", ".join("c%d TEXT" % i for i in range(400)) + ")")
+        with self.assertRaises(StorageError):
+            db.execute("INSERT INTO w VALUES (" + ", ".join("'aaaaaaaaaa'" for _ in range(400)) + ")")
+        self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM w"), [{'c': 0}])
+
+
+class TestVacuum(StorageTestCase):
+
+    def test_row_table_reuses_slots_and_truncates_file(self):
+        db = self.open(autovacuum_interval=0)
+        db.execute("CREATE TABLE r (id INT, v TEXT)")
+        db.insert_many('r', [(i, 'v%d' % i) for i in range(20000)])
+        heap = db.get_table('r').heap
+        vacated = {split_rid(rid)[0] for rid, row in heap.scan() if 2000 <= row[0] < 6000}
+        db.execute("DELETE FROM r WHERE id >= 2000 AND id < 6000")
+        db.execute("DELETE FROM r WHERE id >= 12000")
+        stats = db.vacuum('r')
+        self.assertGreater(stats['slots'], 0)
+        self.assertGreater(stats['pages'], 0)
+        pages = heap.num_pages
+        db.execute("CHECKPOINT")
+        self.assertEqual(os.path.getsize(os.path.join(self.path, 'r.tbl')), pages * heap.page_size)
+
+        # 新行写入清理出的空槽，文件不增长
+        db.insert_many('r', [(20000 + i, 'n%d' % i) for i in range(3000)])
+        self.assertEqual(heap.num_pages, pages)
+        self.assertTrue({split_rid(rid)[0] for rid, row in heap.scan() if row[0] >= 20000} <= vacated)
+        expected = list(range(2000)) + list(range(6000, 12000)) + list(range(20000, 23000))
+        self.assertEqual(sorted(row['id'] for row in db.execute("SELECT id FROM r")), expected)
+        db = self.open(autovacuum_interval=0)
+        self.assertEqual(sorted(row['id'] for row in db.execute("SELECT id FROM r")), expected)
+
+    def test_columnar_compaction_updates_indexes_of_moved_rows(self):
+        db = self.open(autovacuum_interval=0)
+        db.execute("CREATE TABLE c (id INT, k INT, v TEXT) USING COLUMNAR")
+        db.execute("CREATE INDEX idx_id ON c (id)")
+        db.execute("CREATE INDEX idx_k ON c (k)")
+        db.insert_many('c', [(i, i % 97, 'v%d' % i) for i in range(10000)])
+        db.execute("DELETE FROM c WHERE id < 1000")
+        db.execute("DELETE FROM c WHERE id >= 5000 AND id < 5500")
+        db.execute("DELETE FROM c WHERE k = 3")
+        expected = {i: (i % 97, 'v%d' % i) for i in range(1000, 10000) if not 5000 <= i < 5500 and i % 97 != 3}
+        self.assertEqual(db.vacuum('c')['rows'], 10000 - len(expected))
+        self.assertEqual(db.get_table('c').heap.size, len(expected))
+
+        def check():
+            for k in (0, 3, 50, 96):
+                rows = db.execute(f"SELECT id, v FROM c WHERE k = {k}")
+                self.assertEqual(sorted((row['id'], row['v']) for row in rows),
+                                 sorted((i, v) for i, (key, v) in expected.items() if key == k))
+            for i in (0, 1000, 1001, 4999, 5500, 9999):
+                self.assertEqual(db.execute(f"SELECT k FROM c WHERE id = {i}"),
+                                 [{'k': expected[i][0]}] if i in expected else [])
+
+        check()
+        self.assertIn('Index Scan', db.execute("EXPLAIN SELECT k FROM c WHERE id = 9999")[0]['QUERY PLAN'])
+        # 移动后的行ID同样能修改和删除
+        db.execute("UPDATE c SET k = 50 WHERE id = 9999")
+        db.execute("DELETE FROM c WHERE id = 1001")
+        expected[9999] = (50, 'v9999')
+        del expected[1001]
+        check()
+        db = self.open(autovacuum_interval=0)
+        check()
+
+    def test_active_transaction_prevents_moving_rows(self):
+        db = self.open(autovacuum_interval=0)
+        db.execute("CREATE TABLE r (id INT, v TEXT)")
+        db.execute("CREATE TABLE c (id INT, v TEXT) USING COLUMNAR")
+        for table in ('r', 'c'):
+            db.insert_many(table, [(i, 'v%d' % i) for i in range(5000)])
+        reader = db.connect()
+        reader.execute("BEGIN ISOLATION LEVEL REPEATABLE READ")
+        self.assertEqual(reader.execute("SELECT COUNT(*) AS n FROM c"), [{'n': 5000}])
+        db.execute("UPDATE r SET v = 'x' WHERE id < 10")
+        db.execute("DELETE FROM r WHERE id >= 1000")
+        db.execute("DELETE FROM c WHERE id >= 1000")
+        pages = db.get_table('r').heap.num_pages
+
+        stats = db.vacuum()
+        self.assertEqual((stats['rows'], stats['pages']), (0, 0))
+        self.assertEqual(db.get_table('r').heap.num_pages, pages)
+        self.assertEqual(db.get_table('c').heap.size, 5000)
+        # 旧快照仍然看到删除和修改之前的行
+        for table in ('r', 'c'):
+            self.assertEqual(reader.execute(f"SELECT COUNT(*) AS n FROM {table}"), [{'n': 5000}])
+        self.assertEqual(reader.execute("SELECT v FROM r WHERE id = 3"), [{'v': 'v3'}])
+
+        reader.execute("COMMIT")
+        stats = db.vacuum()
+        self.assertEqual(stats['rows'], 4000)
+        self.assertGreater(stats['pages'], 0)
+        self.assertEqual(db.get_table('c').heap.size, 1000)
+        for table in ('r', 'c'):
+            self.assertEqual(db.execute(f"SELECT COUNT(*) AS n FROM {table}"), [{'n': 1000}])
+        self.assertEqual(db.execute("SELECT v FROM r WHERE id = 3"), [{'v': 'x'}])
+        self.assertRegex(db.execute("VACUUM r")[0]['message'], '^1 tables vacuumed')
+
+        session = db.connect()
+        session.execute("BEGIN")
+        with self.assertRaisesRegex(Exception, 'VACUUM 不能在事务中执行'):
+            session.execute("VACUUM")
+        session.execute("ROLLBACK")
+
+
+class TestZoneMap(unittest.TestCase):
+    """按区的最小值和最大值跳过页或块，跳过的区对任何快照都没有满足条件的行"""
+
+    LAYOUTS = ('row', 'columnar')
+
+    def open(self, layout: str, outliers=None) -> SimpleDB:
+        """k 等于 id，outliers 中的行改为给定的 k"""
+        outliers = outliers or {}
+        db = SimpleDB(config=DBConfig(autovacuum_interval=0))
+        self.addCleanup(db.close)
+        db.create_table('t', [('id', 'INT'), ('k', 'INT')], layout)
+        db.insert_many('t', [(i, outliers.get(i, i)) for i in range(20000)])
+        return db
+
+    def skipped(self, db: SimpleDB, sql: str, session=None):
+        """执行查询，返回 (结果中的 id, 被跳过的区数, 区数)"""
+        zones = db.get_table('t').heap.zones
+        results = []
+
+        def may_match(*args):
+            results.append(may_match.original(*args))
+            return results[-1]
+
+        may_match.original = zones.may_match
+        with mock.patch.object(zones, 'may_match', side_effect=may_match):
+            rows = (session or db).execute(sql)
+        return sorted(row['id'] for row in rows), results.count(False), len(zones.zones)
+
+    def test_zones_outside_range_are_skipped(self):
+        for layout in self.LAYOUTS:
+            with self.subTest(layout=layout):
+                db = self.open(layout)
+                for sql, expected in (("SELECT id FROM t WHERE k = 5", [5]),
+                                      ("SELECT id FROM t WHERE k >= 19995", list(range(19995, 20000))),
+                                      ("SELECT id FROM t WHERE k < 3 AND id >= 1", [1, 2]),
+                                      ("SELECT id FROM t WHERE k > 30000", [])):
+                    self.assertEqual(self.skipped(db, sql)[0], expected)
+                    ids, skipped, zones = self.skipped(db, sql)
+                    self.assertEqual(ids, expected)
+                    self.assertGreater(zones, 1)
+                    self.assertGreaterEqual(skipped, zones - 1, sql)
+                self.assertEqual(len(db.execute("SELECT id FROM t WHERE k != 5")), 19999)
+
+    def test_uncommitted_and_old_versions_are_not_missed(self):
+        for layout in self.LAYOUTS:
+            with self.subTest(layout=layout):
+                # 旧值只在被修改、删除的行中出现（两行在不同的区），只有版本链上的旧版本能让区不被跳过
+                db = self.open(layout, {5: -100, 15000: -200})
+                reader = db.connect()
+                reader.execute("BEGIN ISOLATION LEVEL REPEATABLE READ")
+                reader.execute("SELECT COUNT(*) FROM t")
+                writer = db.connect()
+                writer.execute("BEGIN")
+                writer.execute("UPDATE t SET k = 999999 WHERE id = 5")
+                writer.execute("INSERT INTO t VALUES (20000, -7)")
+                # 统计在修改之后第一次计算，包含未提交的新值和版本链上的旧值
+                for session, expected in ((writer, ([5], [20000], [])), (db, ([], [], [5])), (reader, ([], [], [5]))):
+                    self.assertEqual([self.skipped(db, f"SELECT id FROM t WHERE k = {key}", session)[0]
+                                      for key in (999999, -7, -100)], list(expected))
+                writer.execute("COMMIT")
+                self.assertEqual(self.skipped(db, "SELECT id FROM t WHERE k = 999999")[0], [5])
+                self.assertEqual(self.skipped(db, "SELECT id FROM t WHERE k = -100")[0], [])
+                self.assertEqual(self.skipped(db, "SELECT id FROM t WHERE k = -100", reader)[0], [5])
+                self.assertEqual(self.skipped(db, "SELECT id FROM t WHERE k = -7", reader)[0], [])
+
+                # 回滚恢复的旧值仍在范围内
+                writer.execute("BEGIN")
+                writer.execute("UPDATE t SET k = 888888 WHERE id = 6")
+                self.assertEqual(self.skipped(db, "SELECT id FROM t WHERE k = 888888", writer)[0], [6])
+                writer.execute("ROLLBACK")
+                self.assertEqual(self.skipped(db, "SELECT id FROM t WHERE k = 6")[0], [6])
+                self.assertEqual(self.skipped(db, "SELECT id FROM t WHERE k = 888888")[0], [])
+
+                # 有活动事务时清理不移动行，行存储丢弃统计；重新计算时旧快照需要的版本仍计入
+                db.execute("DELETE FROM t WHERE id = 15000")
+                db.vacuum('t')
+                self.assertEqual(self.skipped(db, "SELECT id FROM t WHERE k = -200")[0], [])
+                for key, expected in ((-100, [5]), (-200, [15000])):
+                    self.assertEqual(self.skipped(db, f"SELECT id FROM t WHERE k = {key}", reader)[0], expected)
+                reader.execute("COMMIT")
+
+    def test_zones_are_recomputed_after_vacuum_and_clear(self):
+        for layout in self.LAYOUTS:
+            with self.subTest(layout=layout):
+                db = self.open(layout)
+                table = db.get_table('t')
+                self.skipped(db, "SELECT id FROM t WHERE k = 5")
+                # 修改放宽了第一个区的范围，删除不会收窄它
+                db.execute("UPDATE t SET k = 500000 WHERE id = 3")
+                db.execute("DELETE FROM t WHERE id = 3")
+                _, skipped, zones = self.skipped(db, "SELECT id FROM t WHERE k = 500000")
+                self.assertEqual(skipped, zones - 1)
+                db.vacuum('t')
+                self.assertEqual(len(table.heap.zones.zones), 0)
+                self.skipped(db, "SELECT id FROM t WHERE k = 500000")
+                ids, skipped, zones = self.skipped(db, "SELECT id FROM t WHERE k = 500000")
+                self.assertEqual((ids, skipped), ([], zones))
+
+                table.delete()
+                self.assertEqual(len(table.heap.zones.zones), 0)
+                db.insert_many('t', [(i, -i) for i in range(5000)])
+                for _ in range(2):
+                    ids, skipped, zones = self.skipped(db, "SELECT id FROM t WHERE k = -4999")
+                    self.assertEqual(ids, [4999])
+                self.assertGreaterEqual(skipped, zones - 1)
+                self.assertEqual(self.skipped(db, "SELECT id FROM t WHERE k = 5")[0], [])
+
+
+class FakeHeap:
+    """只记录读写的堆文件，write_gate 未打开时写页阻塞"""
+
+    def __init__(self, name='h', page_size=256):
+        self.name = name
+        self.page_size = page_size
+        self.reads = []
+        self.writes = []
+        self.write_gate = threading.Event()
+        self.write_gate.set()
+
+    def read_page(self, page_no):
+        self.reads.append(page_no)
+        return Page(page_no, self.page_size)
+
+    def write_page(self, page):
+        self.write_gate.wait()
+        self.writes.append(page.page_no)
+
+
+class TestBufferPool(unittest.TestCase):
+
+    def load(self, pool, heap, *page_nos):
+        for page_no in page_nos:
+            pool.fetch(heap, page_no)
+            pool.unpin(heap, page_no)
+
+    def resident(self, pool):
+        return sorted(page_no for _, page_no in pool.frames)
+
+    def test_clock_gives_referenced_pages_a_second_chance(self):
+        pool, heap = BufferPool(3, 'clock'), FakeHeap()
+        self.load(pool, heap, 0, 1, 2, 3)
+        # 第一圈清除了所有访问位，第二圈置换最早进入的页
+        self.assertEqual(self.resident(pool), [1, 2, 3])
+        self.load(pool, heap, 1, 4)
+        # 页 1 刚被访问，跳过它置换页 2
+        self.assertEqual(self.resident(pool), [1, 3, 4])
+
+    def test_lru_k_evicts_by_kth_most_recent_access(self):
+        pool, heap = BufferPool(3, 'lru-k', k=2), FakeHeap()
+        self.load(pool, heap, 0, 1, 2, 0, 2)
+        # 页 1 只被访问过一次，优先置换
+        self.load(pool, heap, 3)
+        self.assertEqual(self.resident(pool), [0, 2, 3])
+        self.load(pool, heap, 3, 2, 4)
+        # 页 0 倒数第二次访问最早
+        self.assertEqual(self.resident(pool), [2, 3, 4])
+
+    def test_pinned_pages_are_not_evicted(self):
+        pool, heap = BufferPool(2, 'clock'), FakeHeap()
+        pool.fetch(heap, 0)
+        self.load(pool, heap, 1, 2)
+        self.assertEqual(self.resident(pool), [0, 2])
+        pool.fetch(heap, 2)
+        with self.assertRaises(StorageError):
+            pool.fetch(heap, 3)
+        pool.unpin(heap, 0)
+        self.load(pool, heap, 3)
+        self.assertEqual(self.resident(pool), [2, 3])
+        with self.assertRaises(StorageError):
+            pool.unpin(heap, 3)
+
+    def test_stats_count_hits_misses_evictions_and_writebacks(self):
+        pool, heap = BufferPool(2, 'clock'), FakeHeap()
+        pool.new_page(heap, 0)
+        pool.unpin(heap, 0)
+        self.load(pool, heap, 0, 1, 1, 2, 3)
+        stats = pool.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['writebacks']), (2, 3, 2, 1))
+        self.assertEqual(heap.writes, [0])
+        self.assertEqual((stats['resident'], stats['dirty'], stats['pinned']), (2, 0, 0))
+        self.assertEqual(stats['hit_rate'], 0.4)
+        pool.reset_stats()
+        self.assertEqual(pool.stats()['hits'], 0)
+
+    def test_write_back_does_not_block_other_fetches(self):
+        pool, heap = BufferPool(2, 'clock'), FakeHeap()
+        pool.new_page(heap, 0)
+        pool.unpin(heap, 0)
+        self.load(pool, heap, 1)
+        heap.write_gate.clear()
+        loader = threading.Thread(target=self.load, args=(pool, heap, 2))
+        loader.start()
+        try:
+            # 置换页 0 的写回阻塞在锁外，页 1 和正在写回的页 0 都能命中
+            for page_no in (1, 0):
+                done = threading.Event()
+                fetcher = threading.Thread(target=lambda page_no=page_no: (self.load(pool, heap, page_no), done.set()))
+                fetcher.start()
+                self.assertTrue(done.wait(5))
+                fetcher.join()
+        finally:
+            heap.write_gate.set()
+            loader.join()
+        # 写回之后页 0 没有再被固定或修改，照常被置换
+        self.assertEqual(self.resident(pool), [1, 2])
+        self.assertEqual(heap.writes, [0])
+
+    def test_database_reports_pool_stats(self):
+        path = tempfile.mkdtemp()
+        try:
+            for policy in ('clock', 'lru-k'):
+                db = SimpleDB(os.path.join(path, policy),
+                              DBConfig(checkpoint_interval=0, cache_size=4, buffer_policy=policy))
+                db.execute("CREATE TABLE t (id INT, v TEXT)")
+                db.insert_many('t', [(i, 'x' * 50) for i in range(500)])
+                db.execute("SELECT COUNT(*) AS c FROM t")
+                stats = db.buffer_pool_stats()
+                self.assertEqual(stats['policy'], policy)
+                self.assertLessEqual(stats['resident'], 4)
+                self.assertGreater(stats['evictions'], 0)
+                self.assertGreater(stats['writebacks'], 0)
+                self.assertEqual(stats['pinned'], 0)
+                self.assertEqual(db.execute("SELECT COUNT(*) AS c FROM t"), [{'c': 500}])
+                db.close()
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class TestDump(unittest.TestCase):
+
+    def test_mixed_and_big_values_round_trip(self):
+        rows = [(1, 10 ** 30, 'a', 1.5), (2, 5, None, 2), (3, -10 ** 25, 'c', None)]
+        columns = [('id', 'INT'), ('big', 'INT'), ('name', 'TEXT'), ('score', 'FLOAT')]
+        buffer = io.BytesIO()
+        writer = dump.DumpWriter(buffer)
+        writer.write_table('t', columns, rows)
+        writer.close()
+        buffer.seek(0)
+        tables = [(name, cols, list(it)) for name, cols, it in dump.DumpReader(buffer).tables()]
+        self.assertEqual(tables, [('t', columns, rows)])
+
+    def test_unknown_encoding_is_rejected(self):
+        block = struct.pack('<IH', 1, 1) + struct.pack('<BBI', 7, 0, 4) + b'\x00\x00\x00\x00'
+        with self.assertRaises(StorageError):
+            dump.decode_block(block)
+
+    def test_unsupported_value_type_is_rejected(self):
+        with self.assertRaises(StorageError):
+            dump.encode_block(['TEXT'], [(object(),)])
+
+    def test_json_round_trip_reads_snapshot(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        filename = os.path.join(directory, 'backup.json')
+        databases = []
+        for _ in range(2):
+            db = SimpleDB(config=DBConfig(autovacuum_interval=0))
+            self.addCleanup(db.close)
+            db.execute("CREATE TABLE r (id INT, v TEXT)")
+            db.execute("CREATE TABLE c (id INT, f FLOAT, v TEXT) USING COLUMNAR")
+            databases.append(db)
+        source, target = databases
+        source.insert_many('r', [(i, 'r%d' % i) for i in range(300)])
+        source.insert_many('c', [(i, i / 4, 'c%d' % (i % 5)) for i in range(300)])
+        source.execute("DELETE FROM r WHERE id >= 200")
+        # 其他会话未提交的修改不在导出的快照中
+        writer = source.connect()
+        writer.execute("BEGIN")
+        writer.execute("UPDATE c SET v = 'new' WHERE id < 10")
+        writer.execute("INSERT INTO r VALUES (1000, 'x')")
+        source.save(filename)
+        writer.execute("ROLLBACK")
+
+        target.load(filename)
+        for table in ('r', 'c'):
+            self.assertEqual(target.execute(f"SELECT * FROM {table}"), source.execute(f"SELECT * FROM {table}"))
+        self.assertEqual(target.execute("SELECT COUNT(*) AS n FROM r"), [{'n': 200}])
+
+
+if __name__ == '__main__':
+    unittest.main()
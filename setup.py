@@ -12,9 +12,14 @@ setup(
     install_requires=[
         # 
     ],
+    extras_require={
+        # 向量化执行使用 NumPy，未安装时退回纯 Python 实现
+        'fast': ['numpy>=1.20'],
+    },
     entry_points={
         'console_scripts': [
             'likob=likob.cli:main',
+            'likob-server=likob.server:main',
         ],
     },
     author="lik639259",